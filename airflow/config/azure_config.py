@@ -14,6 +14,8 @@ AZURE_STORAGE_ACCOUNTS = [
         "env_type": os.getenv("AZURE_ENV_TYPE", "production"),
         "data_source_type": os.getenv("AZURE_DATA_SOURCE_TYPE", "credit_card"),
         "file_extensions": None,  # None = discover all files
+        "max_concurrency_per_container": int(os.getenv("AZURE_MAX_CONCURRENCY_PER_CONTAINER", "8")),  # In-flight blobs per container
+        "partitions_per_folder": int(os.getenv("AZURE_PARTITIONS_PER_FOLDER", "1")),  # >1 splits each folder into hash-partitioned shards
     }
 ]
 
@@ -24,6 +26,37 @@ DISCOVERY_CONFIG = {
     "smtp_port": int(os.getenv("SMTP_PORT", "587")),
     "smtp_user": os.getenv("SMTP_USER", ""),
     "smtp_password": os.getenv("SMTP_PASSWORD", ""),
+    "max_workers": int(os.getenv("DISCOVERY_MAX_WORKERS", "8")),  # Thread pool size for blob sampling + DLP calls
+    "max_active_shards": int(os.getenv("DISCOVERY_MAX_ACTIVE_SHARDS", "4")),  # Mapped discovery tasks running at once
+    "dedup_index_max_entries": int(os.getenv("DEDUP_INDEX_MAX_ENTRIES", "500000")),  # Above this, fall back to chunked IN lookups
+    "dedup_lookup_chunk_size": int(os.getenv("DEDUP_LOOKUP_CHUNK_SIZE", "500")),
+    "sample_initial_bytes": int(os.getenv("DISCOVERY_SAMPLE_INITIAL_BYTES", "1024")),  # First head read for CSV/JSON samples...
+    "sample_max_bytes": int(os.getenv("DISCOVERY_SAMPLE_MAX_BYTES", str(64 * 1024))),  # ...grown in doubling ranges up to this for long headers
+    "parquet_footer_initial_bytes": int(os.getenv("PARQUET_FOOTER_INITIAL_BYTES", "8192")),  # First suffix read (Parquet/ORC); larger footers get one more read
+    "parquet_footer_max_bytes": int(os.getenv("PARQUET_FOOTER_MAX_BYTES", str(16 * 1024 * 1024))),  # Refuse footers larger than this
+    "group_delta_tables": os.getenv("DISCOVERY_GROUP_DELTA_TABLES", "true").lower() == "true",  # One dataset per Delta table instead of per part file
+    "group_partitioned_datasets": os.getenv("DISCOVERY_GROUP_PARTITIONED_DATASETS", "true").lower() == "true",  # One dataset per Hive-partitioned folder (key=value/...)
+    "delta_log_max_bytes": int(os.getenv("DELTA_LOG_MAX_BYTES", str(4 * 1024 * 1024))),  # Most read from one Delta commit or checkpoint
+    "write_batch_rows": int(os.getenv("DISCOVERY_WRITE_BATCH_ROWS", "200")),  # Flush buffered DB writes every N rows...
+    "write_batch_seconds": float(os.getenv("DISCOVERY_WRITE_BATCH_SECONDS", "5")),  # ...or every T seconds
+    "scan_mode": os.getenv("DISCOVERY_SCAN_MODE", "incremental"),  # "incremental" (last_modified watermark) or "full"
+    "full_reconcile_hours": float(os.getenv("DISCOVERY_FULL_RECONCILE_HOURS", "24")),  # Full pass at least this often
+    "watermark_skew_seconds": int(os.getenv("DISCOVERY_WATERMARK_SKEW_SECONDS", "300")),  # Clock-skew margin below walk start
+    "sweep_deleted": os.getenv("DISCOVERY_SWEEP_DELETED", "true").lower() == "true",  # Mark rows of blobs missing from a complete walk as deleted
+    "sweep_batch_rows": int(os.getenv("DISCOVERY_SWEEP_BATCH_ROWS", "1000")),  # Ids per deletion UPDATE
+}
+
+# Event-driven discovery: blob-created/deleted events instead of full listings
+EVENT_DISCOVERY_CONFIG = {
+    "source": os.getenv("EVENT_DISCOVERY_SOURCE", "queue"),  # "queue" (Event Grid -> Storage Queue), "changefeed" or "file"
+    "queue_connection_string": os.getenv("EVENT_QUEUE_CONNECTION_STRING") or os.getenv("AZURE_STORAGE_CONNECTION_STRING", ""),
+    "queue_name": os.getenv("EVENT_QUEUE_NAME", "blob-discovery-events"),
+    "file_path": os.getenv("EVENT_FILE_PATH", "/tmp/blob_events.jsonl"),  # Local stand-in: one Event Grid event per line
+    "batch_size": int(os.getenv("EVENT_BATCH_SIZE", "32")),  # Storage queues return at most 32 messages per receive
+    "visibility_timeout": int(os.getenv("EVENT_VISIBILITY_TIMEOUT", "300")),  # Seconds before an unacked message is redelivered
+    "max_deliveries": int(os.getenv("EVENT_MAX_DELIVERIES", "5")),  # Attempts at an event whose discovery fails before it is dropped
+    "poll_interval_seconds": float(os.getenv("EVENT_POLL_INTERVAL_SECONDS", "2")),
+    "run_seconds": float(os.getenv("EVENT_RUN_SECONDS", "55")),  # Consume for this long per DAG run
 }
 
 DB_CONFIG = {
@@ -34,6 +67,16 @@ DB_CONFIG = {
     "database": os.getenv("MYSQL_DATABASE", "torro_discovery"),
 }
 
+# Process-wide pool behind utils.deduplication.get_db_connection (one per Airflow task process)
+DB_POOL_CONFIG = {
+    "enabled": os.getenv("DB_POOL_ENABLED", "true").lower() == "true",  # false = new connection per operation
+    # Open connections per process, idle and in use: one per worker thread plus the writer and the task's main thread
+    "max_size": int(os.getenv("DB_POOL_MAX") or DISCOVERY_CONFIG["max_workers"] + 2),
+    "max_age_seconds": float(os.getenv("DB_POOL_RECYCLE", "1800")),  # Replace connections older than this (0 = never)
+    "ping": os.getenv("DB_POOL_PING", "true").lower() == "true",  # Ping on checkout, replacing dead connections
+    "wait_timeout": float(os.getenv("DB_POOL_WAIT_TIMEOUT", "30")),  # Seconds to wait for a free connection
+}
+
 # Azure AI Language (DLP) Configuration
 AZURE_AI_LANGUAGE_CONFIG = {
     "endpoint": os.getenv("AZURE_AI_LANGUAGE_ENDPOINT", ""),
@@ -41,6 +84,14 @@ AZURE_AI_LANGUAGE_CONFIG = {
     "enabled": bool(os.getenv("AZURE_AI_LANGUAGE_ENDPOINT") and os.getenv("AZURE_AI_LANGUAGE_KEY"))
 }
 
+# Two-tier cache of column-name PII classifications (in-process LRU + pii_classification_cache table)
+PII_CACHE_CONFIG = {
+    "enabled": os.getenv("PII_CACHE_ENABLED", "true").lower() == "true",
+    "persistent": os.getenv("PII_CACHE_PERSISTENT", "true").lower() == "true",  # false = in-process tier only
+    "max_entries": int(os.getenv("PII_CACHE_MAX_ENTRIES", "10000")),  # In-process LRU size
+    "ttl_hours": float(os.getenv("PII_CACHE_TTL_HOURS", "720")),  # Re-classify a name after this long
+}
+
 def get_storage_location_json(account_name: str, container: str, blob_path: str) -> Dict:
     return {
         "type": "azure_blob",
@@ -1,13 +1,10 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from airflow import DAG
 from airflow.operators.python import PythonOperator
 import logging
-import json
-import pymysql
 import sys
 import os
-import time
-from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
 
 # Add airflow directory to path for imports
 airflow_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -19,418 +16,294 @@ if os.getcwd() not in sys.path:
 
 from config.azure_config import (
     AZURE_STORAGE_ACCOUNTS,
-    DB_CONFIG,
-    get_storage_location_json,
+    DISCOVERY_CONFIG,
 )
 from utils.azure_blob_client import AzureBlobClient
-from utils.metadata_extractor import extract_file_metadata, generate_file_hash, generate_schema_hash
-from utils.deduplication import check_file_exists, should_update_or_insert, get_db_connection
+from utils.db_pool import db_pool_stats
+from utils.deduplication import DedupIndex
+from utils.discovery_pipeline import (
+    DeltaTableGrouper,
+    PartitionedDatasetGrouper,
+    bounded_ordered_map,
+    build_discovery_info,
+    in_partition,
+    partition_key,
+    sample_and_extract,
+    select_changed_blobs,
+    queue_discovery_write,
+    shard_scope,
+)
+from utils.azure_dlp_client import get_dlp_metrics_snapshot
+from utils.deletion_sweep import DeletionSweep
+from utils.discovery_writer import DiscoveryBatchWriter
+from utils.scan_checkpoint import complete_checkpoint, get_resume_token, save_checkpoint
+from utils.scan_watermark import finish_incremental_scan, start_incremental_scan
 from utils.email_notifier import notify_new_discoveries
+from utils.pii_cache import get_pii_cache
 
 logger = logging.getLogger(__name__)
 
 
-def retry_db_operation(max_retries: int = None, base_delay: float = 1.0, max_delay: float = 60.0, max_total_time: float = 3600.0):
+def plan_discovery_shards(**context):
     """
-    Retry decorator for database operations with exponential backoff.
-    Handles connection errors, timeouts, and rate limiting.
-    
-    Args:
-        max_retries: Maximum number of retries (None = unlimited, but limited by max_total_time)
-        base_delay: Initial delay in seconds (exponential backoff: 1s, 2s, 4s, 8s...)
-        max_delay: Maximum delay between retries (caps exponential backoff)
-        max_total_time: Maximum total time to spend retrying (safety timeout in seconds)
+    One shard per (account, container, folder), or per hash partition of a folder when
+    partitions_per_folder > 1. Returned as op_kwargs for the mapped discovery task.
     """
-    # Get retry config from environment or use defaults
-    if max_retries is None:
-        env_value = os.getenv("DB_RETRY_MAX_ATTEMPTS", "20")
-        max_retries = int(env_value) if env_value else 20
-        # 0 means unlimited retries (only limited by max_total_time)
-        if max_retries == 0:
-            max_retries = -1  # Use -1 internally to represent unlimited
-    
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            last_exception = None
-            start_time = time.time()
-            attempt = 0
-            
-            while True:
-                # Check total time limit (safety timeout)
-                elapsed_time = time.time() - start_time
-                if elapsed_time >= max_total_time:
-                    logger.error('FN:retry_db_operation max_total_time:{} attempt:{}'.format(max_total_time, attempt))
-                    if last_exception:
-                        raise last_exception
-                    raise TimeoutError(f"Operation timed out after {max_total_time}s")
-                
-                # Check retry limit (if set, -1 means unlimited)
-                if max_retries > 0 and attempt >= max_retries:
-                    logger.error('FN:retry_db_operation max_retries:{} attempt:{} error:{}'.format(max_retries, attempt, str(last_exception) if last_exception else 'unknown error'))
-                    if last_exception:
-                        raise last_exception
-                    raise Exception("Max retries exceeded")
-                
-                try:
-                    return func(*args, **kwargs)
-                except (pymysql.Error, ConnectionError, TimeoutError) as e:
-                    last_exception = e
-                    error_code = getattr(e, 'args', [0])[0] if hasattr(e, 'args') and e.args else None
-                    
-                    # Check if it's a retryable error
-                    retryable_errors = [
-                        2006,  # MySQL server has gone away
-                        2013,  # Lost connection to MySQL server
-                        1205,  # Lock wait timeout
-                        1213,  # Deadlock found
-                        1040,  # Too many connections
-                    ]
-                    
-                    # Only retry if it's a retryable error
-                    if error_code not in retryable_errors:
-                        logger.error('FN:retry_db_operation error_code:{} error:{}'.format(error_code, str(e)))
-                        raise
-                    
-                    # Calculate delay with exponential backoff (capped at max_delay)
-                    delay = min(base_delay * (2 ** min(attempt, 10)), max_delay)  # Cap exponential at 2^10
-                    
-                    # Check if we have time for another retry
-                    if elapsed_time + delay >= max_total_time:
-                        logger.error('FN:retry_db_operation max_total_time:{} elapsed_time:{} delay:{}'.format(max_total_time, elapsed_time, delay))
-                        raise
-                    
-                    retry_info = f"attempt {attempt + 1}"
-                    if max_retries > 0:
-                        retry_info += f"/{max_retries}"
-                    else:
-                        retry_info += " (unlimited, max 1h timeout)"
-                    
-                    logger.warning('FN:retry_db_operation retry_info:{} error:{} delay:{} elapsed_time:{}'.format(retry_info, str(e), delay, elapsed_time))
-                    time.sleep(delay)
-                    attempt += 1
-                    
-                except Exception as e:
-                    # Non-retryable errors (syntax errors, etc.)
-                    logger.error('FN:retry_db_operation error:{}'.format(str(e)))
-                    raise
-            
-            if last_exception:
-                raise last_exception
-        return wrapper
-    return decorator
+    shards = []
+    for storage_config in AZURE_STORAGE_ACCOUNTS:
+        folders = storage_config.get("folders", [""])
+        if not folders or folders == [""]:
+            folders = [""]  # Scan root if no folders specified
+        partition_count = max(1, storage_config.get("partitions_per_folder", 1))
+        for container_name in storage_config["containers"]:
+            for folder_path in folders:
+                for partition in range(partition_count):
+                    shards.append({"shard": {
+                        "account_name": storage_config["name"],
+                        "container_name": container_name,
+                        "folder_path": folder_path,
+                        "partition": partition,
+                        "partition_count": partition_count,
+                    }})
+    logger.info('FN:plan_discovery_shards shard_count:{}'.format(len(shards)))
+    return shards
 
 
-def discover_azure_blobs(**context):
+def discover_azure_blobs(shard, **context):
     dag_run = context['dag_run']
     run_id = dag_run.run_id
-    discovery_batch_id = f"batch-{datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}"
+    # All shards of a run share one batch id, derived from the DAG run start
+    run_started_at = dag_run.start_date.astimezone(timezone.utc).replace(tzinfo=None) if dag_run.start_date else datetime.utcnow()
+    discovery_batch_id = f"batch-{run_started_at.strftime('%Y-%m-%d-%H-%M-%S')}"
     batch_start_time = datetime.utcnow()
+    max_workers = DISCOVERY_CONFIG.get("max_workers", 8)
+    # Trigger with conf {"full_rescan": true} to discard in-progress checkpoints and re-walk from the start
+    full_rescan = bool((dag_run.conf or {}).get("full_rescan", False))
     
-    logger.info('FN:discover_azure_blobs discovery_batch_id:{} run_id:{}'.format(discovery_batch_id, run_id))
+    account_name = shard["account_name"]
+    container_name = shard["container_name"]
+    folder_path = shard["folder_path"]
+    partition = shard.get("partition", 0)
+    partition_count = shard.get("partition_count", 1)
+    # Checkpoints and watermarks are kept per shard, so partitions of one folder don't overwrite each other
+    scope_folder = shard_scope(folder_path, partition, partition_count)
+    storage_config = next(config for config in AZURE_STORAGE_ACCOUNTS if config["name"] == account_name)
+    file_extensions = storage_config.get("file_extensions")  # None = all files
+    # Per-container limit on blobs in flight (never more than the pool itself)
+    container_concurrency = min(storage_config.get("max_concurrency_per_container", max_workers), max_workers)
     
-    all_new_discoveries = []
+    logger.info('FN:discover_azure_blobs discovery_batch_id:{} run_id:{} account_name:{} container_name:{} folder_path:{} partition:{}/{} container_concurrency:{} full_rescan:{}'.format(
+        discovery_batch_id, run_id, account_name, container_name, folder_path, partition, partition_count, container_concurrency, full_rescan))
     
-    for storage_config in AZURE_STORAGE_ACCOUNTS:
-        account_name = storage_config["name"]
-        connection_string = storage_config["connection_string"]
-        containers = storage_config["containers"]
-        folders = storage_config.get("folders", [""])
-        if not folders or folders == [""]:
-            folders = [""]  # Scan root if no folders specified
-        environment = storage_config.get("environment", "prod")
-        env_type = storage_config.get("env_type", "production")
-        data_source_type = storage_config.get("data_source_type", "unknown")
-        file_extensions = storage_config.get("file_extensions")  # None = all files
-        
-        logger.info('FN:discover_azure_blobs account_name:{}'.format(account_name))
-        
+    new_discovery_count = 0
+    total_processed = 0
+    total_skipped = 0
+    total_new = 0
+    total_refreshed = 0
+    total_listed = 0
+    total_failed = 0
+    total_deleted = 0
+    error_message = None
+    groupers = []
+    checkpoint_held = False
+    
+    # DB writes go through one batching writer: dozens of multi-row transactions instead of one commit per blob.
+    writer = DiscoveryBatchWriter(created_by='airflow')
+    
+    # Blob sampling, schema extraction and DLP calls are I/O-bound and run on worker threads,
+    # while every DB write below stays on this thread (single writer).
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='blob-discovery') as executor:
         try:
-            blob_client = AzureBlobClient(connection_string)
+            blob_client = AzureBlobClient(storage_config["connection_string"])
             
-            for container_name in containers:
-                logger.info('FN:discover_azure_blobs container_name:{}'.format(container_name))
+            # One streamed query per prefix instead of one SELECT per blob.
+            # Loaded on first use, so a walk with no changed blobs never queries it.
+            dedup_index = DedupIndex("azure_blob", account_name, container_name, folder_path, partition=partition, partition_count=partition_count)
+            
+            def _prepare(fingerprinted):
+                return sample_and_extract(blob_client, container_name, fingerprinted, storage_config.get("data_source_type"))
+            
+            discovery_info = build_discovery_info(discovery_batch_id, run_started_at, "airflow_dag", "azure_blob_discovery_dag",
+                                                  run_id, container_name, folder_path)
+            
+            # Resume an interrupted walk from its last committed page unless a full re-walk was requested
+            checkpoint = get_resume_token(account_name, container_name, scope_folder, full_rescan=full_rescan)
+            start_token = checkpoint["continuation_token"] if checkpoint else None
+            pages_completed = checkpoint["pages_completed"] if checkpoint else 0
+            if checkpoint:
+                total_listed = checkpoint["blobs_listed"]
+                logger.info('FN:discover_azure_blobs container_name:{} folder_path:{} resume_from_batch_id:{} pages_completed:{} blobs_listed:{}'.format(container_name, scope_folder, checkpoint["batch_id"], pages_completed, total_listed))
+            
+            # Incremental mode: only blobs newer than the prefix's last_modified watermark are sampled
+            walk_started_at = checkpoint["walk_started_at"] if checkpoint and checkpoint.get("walk_started_at") else datetime.utcnow()
+            scan_filter = start_incremental_scan(account_name, container_name, scope_folder, walk_started_at, full_rescan=full_rescan,
+                                                 checkpoint=checkpoint)
+            
+            # Deleted-blob reconciliation needs every path of the prefix, so only a walk that starts from blob zero can sweep
+            deletion_sweep = None
+            if DISCOVERY_CONFIG.get("sweep_deleted", True) and checkpoint is None:
+                deletion_sweep = DeletionSweep("azure_blob", account_name, container_name, folder_path, partition, partition_count)
+                deletion_sweep.begin()
+            
+            # Delta tables and Hive-partitioned folders are discovered as one dataset each,
+            # not one row (and one schema read + DLP pass) per part file
+            if DISCOVERY_CONFIG.get("group_delta_tables", True):
+                groupers.append(DeltaTableGrouper(blob_client, container_name))
+            if DISCOVERY_CONFIG.get("group_partitioned_datasets", True):
+                groupers.append(PartitionedDatasetGrouper())
+            
+            # Stream the listing page by page - no blob cap, memory bounded by one page
+            for page, next_token in blob_client.iter_blob_pages(
+                container_name=container_name,
+                folder_path=folder_path,
+                file_extensions=file_extensions,
+                continuation_token=start_token
+            ):
+                if partition_count > 1:
+                    page = [blob_info for blob_info in page if in_partition(partition_key(blob_info["full_path"]), partition, partition_count)]
+                total_listed += len(page)
+                listed_through = page[-1]["full_path"] if page else None
+                for grouper in groupers:
+                    page = grouper.group(page, listed_through)
+                    if next_token is None:
+                        page.extend(grouper.flush())
+                logger.info('FN:discover_azure_blobs container_name:{} folder_path:{} page_blob_count:{} listed_blob_count:{}'.format(container_name, scope_folder, len(page), total_listed))
+                if deletion_sweep is not None:
+                    deletion_sweep.mark(blob_info["full_path"] for blob_info in page)
                 
-                for folder_path in folders:
-                    logger.info('FN:discover_azure_blobs folder_path:{}'.format(folder_path))
+                # Unchanged since the watermark: no sample, no extraction, no DB write
+                candidates = [blob_info for blob_info in page if scan_filter.is_candidate(blob_info)]
+                total_skipped += len(page) - len(candidates)
+                
+                # Phase one, on this thread: listing fingerprints against the dedup index.
+                # Unchanged blobs never reach the pool - no sample read, no DLP call, no DB write.
+                changed, unchanged_count = select_changed_blobs(dedup_index, candidates)
+                total_skipped += unchanged_count
+                
+                # Phase two: sample and extract only new/changed blobs.
+                # Results come back in listing order, so progress logs stay ordered
+                queued = {}
+                for index, (fingerprinted, prepared, error) in enumerate(bounded_ordered_map(executor, _prepare, changed, container_concurrency)):
+                    blob_info = fingerprinted["blob_info"]
+                    queued[blob_info["full_path"]] = blob_info
+                    if index % 100 == 0:
+                        logger.info('FN:discover_azure_blobs processing_batch:{}-{} of {} unchanged:{}'.format(index, min(index + 100, len(changed)), len(changed), unchanged_count))
+                    
+                    if error is not None:
+                        logger.error('FN:discover_azure_blobs blob_name:{} error:{}'.format(blob_info.get('name', 'unknown'), str(error)))
+                        scan_filter.mark_failed(blob_info)
+                        total_processed += 1
+                        total_failed += 1
+                        continue
                     
-                    try:
-                        blobs = blob_client.list_blobs(
-                            container_name=container_name,
-                            folder_path=folder_path,
-                            file_extensions=file_extensions
-                        )
-                        
-                        logger.info('FN:discover_azure_blobs container_name:{} folder_path:{} blob_count:{}'.format(container_name, folder_path, len(blobs)))
-                        
-                        # OPTIMIZATION: Process files in batches to avoid memory issues and timeouts
-                        batch_size = 100  # Process 100 files at a time
-                        total_processed = 0
-                        total_skipped = 0
-                        total_new = 0
-                        
-                        for batch_start in range(0, len(blobs), batch_size):
-                            batch_end = min(batch_start + batch_size, len(blobs))
-                            batch = blobs[batch_start:batch_end]
-                            
-                            logger.info('FN:discover_azure_blobs processing_batch:{}-{} of {}'.format(batch_start, batch_end, len(blobs)))
-                            
-                            for blob_info in batch:
-                                try:
-                                    blob_path = blob_info["full_path"]
-                                    
-                                    # Use retry wrapper for database read operations
-                                    existing_record = retry_db_operation(max_retries=None, base_delay=1.0, max_delay=60.0, max_total_time=3600.0)(
-                                        check_file_exists
-                                    )(
-                                        storage_type="azure_blob",
-                                        storage_identifier=account_name,
-                                        storage_path=blob_path
-                                    )
-                                    
-                                    # Use ETag for all files - no need to download for hash
-                                    file_size = blob_info.get("size", 0)
-                                    etag = blob_info.get("etag", "").strip('"')
-                                    last_modified = blob_info.get("last_modified")
-                                    
-                                    # Create composite hash from ETag + size + last_modified (no download needed)
-                                    composite_string = f"{etag}_{file_size}_{last_modified.isoformat() if last_modified else ''}"
-                                    file_hash = generate_file_hash(composite_string.encode('utf-8'))
-                                    
-                                    # Get ONLY headers/column names - NO data rows (banking compliance)
-                                    # CSV/JSON: First 1KB (just headers/keys - NO data)
-                                    # Parquet: Last 8KB (schema metadata is at the end - column names only)
-                                    file_sample = None
-                                    file_extension = blob_info["name"].split(".")[-1].lower() if "." in blob_info["name"] else ""
-                                    
-                                    try:
-                                        if file_extension == "parquet":
-                                            # Parquet metadata is at the end - get tail (column names only)
-                                            file_sample = blob_client.get_blob_tail(container_name, blob_path, max_bytes=8192)
-                                            logger.info('FN:discover_azure_blobs blob_path:{} file_extension:{} sample_bytes:{}'.format(blob_path, file_extension, len(file_sample)))
-                                        else:
-                                            # CSV/JSON: Just need headers/keys from the beginning - NO data rows
-                                            file_sample = blob_client.get_blob_sample(container_name, blob_path, max_bytes=1024)
-                                            logger.info('FN:discover_azure_blobs blob_path:{} file_extension:{} sample_bytes:{}'.format(blob_path, file_extension, len(file_sample)))
-                                    except Exception as e:
-                                        logger.warning('FN:discover_azure_blobs blob_path:{} error:{}'.format(blob_path, str(e)))
-                                    
-                                    # Use ETag-based hash for all files (no full download)
-                                    # Extract schema from sample if available
-                                    if file_sample:
-                                        metadata = extract_file_metadata(blob_info, file_sample)
-                                        schema_hash = metadata.get("schema_hash", generate_schema_hash({}))
-                                    else:
-                                        # No sample available, create minimal metadata
-                                        schema_hash = generate_schema_hash({})
-                                        metadata = {
-                                            "file_metadata": {
-                                                "basic": {
-                                                    "name": blob_info["name"],
-                                                    "extension": "." + blob_info["name"].split(".")[-1] if "." in blob_info["name"] else "",
-                                                    "format": blob_info["name"].split(".")[-1].lower() if "." in blob_info["name"] else "unknown",
-                                                    "size_bytes": file_size,
-                                                    "content_type": blob_info.get("content_type", "application/octet-stream"),
-                                                    "mime_type": blob_info.get("content_type", "application/octet-stream")
-                                                },
-                                                "hash": {
-                                                    "algorithm": "shake128_etag_composite",
-                                                    "value": file_hash,
-                                                    "computed_at": datetime.utcnow().isoformat() + "Z",
-                                                    "source": "etag_composite"
-                                                },
-                                                "timestamps": {
-                                                    "created_at": blob_info["created_at"].isoformat() if blob_info.get("created_at") else None,
-                                                    "last_modified": blob_info["last_modified"].isoformat() if blob_info.get("last_modified") else None
-                                                }
-                                            },
-                                            "schema_json": {},
-                                            "schema_hash": schema_hash,
-                                            "file_hash": file_hash,
-                                            "storage_metadata": {
-                                                "azure": {
-                                                    "type": blob_info.get("blob_type", "Block blob"),
-                                                    "etag": etag,
-                                                    "access_tier": blob_info.get("access_tier"),
-                                                    "creation_time": blob_info["created_at"].isoformat() if blob_info.get("created_at") else None,
-                                                    "last_modified": blob_info["last_modified"].isoformat() if blob_info.get("last_modified") else None,
-                                                    "lease_status": blob_info.get("lease_status"),
-                                                    "content_encoding": blob_info.get("content_encoding"),
-                                                    "content_language": blob_info.get("content_language"),
-                                                    "cache_control": blob_info.get("cache_control"),
-                                                    "metadata": blob_info.get("metadata", {})
-                                                }
-                                            }
-                                        }
-                                    
-                                    # Ensure file_hash is set
-                                    if "file_hash" not in metadata:
-                                        metadata["file_hash"] = file_hash
-                                    
-                                    file_metadata = metadata.get("file_metadata")
-                                    
-                                    should_update, schema_changed = should_update_or_insert(existing_record, file_hash, schema_hash)
-                                    
-                                    if not should_update and not existing_record:
-                                        # This shouldn't happen, but handle it
-                                        logger.warning('FN:discover_azure_blobs blob_path:{} should_update:{} existing_record:{}'.format(blob_path, should_update, bool(existing_record)))
-                                        continue
-                                    
-                                    # Skip if nothing changed (both file_hash and schema_hash are same)
-                                    if not should_update and existing_record:
-                                        total_skipped += 1
-                                        if total_skipped % 50 == 0:  # Log every 50 skipped files
-                                            logger.info('FN:discover_azure_blobs skipped_count:{}'.format(total_skipped))
-                                        continue
-                                    
-                                    storage_location = get_storage_location_json(
-                                        account_name=account_name,
-                                        container=container_name,
-                                        blob_path=blob_path
-                                    )
-                                    
-                                    discovery_info = {
-                                        "batch": {
-                                            "id": discovery_batch_id,
-                                            "started_at": batch_start_time.isoformat() + "Z"
-                                        },
-                                        "source": {
-                                            "type": "airflow_dag",
-                                            "name": "azure_blob_discovery_dag",
-                                            "run_id": run_id
-                                        },
-                                        "scan": {
-                                            "container": container_name,
-                                            "folder": folder_path
-                                        }
-                                    }
-                                    
-                                    # Execute database write with retry logic
-                                    def _execute_db_write():
-                                        conn = None
-                                        try:
-                                            conn = get_db_connection()
-                                            with conn.cursor() as cursor:
-                                                if existing_record:
-                                                    if schema_changed:
-                                                        # Schema changed - update full record
-                                                        update_sql = """
-                                                            UPDATE data_discovery
-                                                            SET file_metadata = %s,
-                                                                schema_json = %s,
-                                                                schema_hash = %s,
-                                                                storage_metadata = %s,
-                                                                discovery_info = %s,
-                                                                last_checked_at = NOW(),
-                                                                updated_at = NOW()
-                                                            WHERE id = %s
-                                                        """
-                                                        cursor.execute(update_sql, (
-                                                            json.dumps(file_metadata),
-                                                            json.dumps(metadata.get("schema_json", {})),
-                                                            schema_hash,
-                                                            json.dumps(metadata.get("storage_metadata", {})),
-                                                            json.dumps(discovery_info),
-                                                            existing_record["id"]
-                                                        ))
-                                                        logger.info('FN:_execute_db_write discovery_id:{} blob_path:{} schema_changed:{}'.format(existing_record['id'], blob_path, schema_changed))
-                                                    else:
-                                                        # Only file hash changed, not schema - just update last_checked_at
-                                                        update_sql = """
-                                                            UPDATE data_discovery
-                                                            SET last_checked_at = NOW()
-                                                            WHERE id = %s
-                                                        """
-                                                        cursor.execute(update_sql, (existing_record["id"],))
-                                                        logger.info('FN:_execute_db_write discovery_id:{} blob_path:{} schema_changed:{}'.format(existing_record['id'], blob_path, schema_changed))
-                                                    
-                                                    discovery_id = existing_record["id"]
-                                                else:
-                                                    # New record - insert
-                                                    insert_sql = """
-                                                        INSERT INTO data_discovery (
-                                                            storage_location, file_metadata, schema_json, schema_hash,
-                                                            discovered_at, status, approval_status, is_visible, is_active,
-                                                            environment, env_type, data_source_type, folder_path,
-                                                            storage_metadata, storage_data_metadata, discovery_info,
-                                                            created_by
-                                                        ) VALUES (
-                                                            %s, %s, %s, %s,
-                                                            NOW(), 'pending', 'pending_review', TRUE, TRUE,
-                                                            %s, %s, %s, %s, %s, %s, %s, 'airflow'
-                                                        )
-                                                    """
-                                                    
-                                                    cursor.execute(insert_sql, (
-                                                        json.dumps(storage_location),
-                                                        json.dumps(file_metadata),
-                                                        json.dumps(metadata.get("schema_json", {})),
-                                                        schema_hash,
-                                                        environment,
-                                                        env_type,
-                                                        data_source_type,
-                                                        folder_path,
-                                                        json.dumps(metadata.get("storage_metadata", {})),
-                                                        json.dumps({}),
-                                                        json.dumps(discovery_info),
-                                                    ))
-                                                    
-                                                    discovery_id = cursor.lastrowid
-                                                    logger.info('FN:_execute_db_write discovery_id:{} blob_path:{} action:insert'.format(discovery_id, blob_path))
-                                                
-                                                conn.commit()
-                                                
-                                                # Only add to new discoveries if schema changed or it's a new record
-                                                if schema_changed or not existing_record:
-                                                    total_new += 1
-                                                    all_new_discoveries.append({
-                                                        "id": discovery_id,
-                                                        "file_name": file_metadata["basic"]["name"],
-                                                        "storage_path": blob_path,
-                                                    })
-                                                
-                                                total_processed += 1
-                                                
-                                                # Log progress every 50 files
-                                                if total_processed % 50 == 0:
-                                                    logger.info('FN:discover_azure_blobs progress: processed={} new={} skipped={}'.format(total_processed, total_new, total_skipped))
-                                                
-                                                return discovery_id
-                                                
-                                        except Exception as e:
-                                            if conn:
-                                                conn.rollback()
-                                            logger.error('FN:_execute_db_write blob_path:{} error:{}'.format(blob_path, str(e)))
-                                            raise
-                                        finally:
-                                            if conn:
-                                                conn.close()
-                                    
-                                    # Execute with retry logic
-                                    retry_db_operation(max_retries=None, base_delay=1.0, max_delay=60.0, max_total_time=3600.0)(_execute_db_write)()
-                                    
-                                except Exception as e:
-                                    logger.error('FN:discover_azure_blobs blob_name:{} error:{}'.format(blob_info.get('name', 'unknown'), str(e)))
-                                    total_processed += 1
-                                    continue
-                            
-                            # Log batch completion
-                            logger.info('FN:discover_azure_blobs batch_complete: processed={} new={} skipped={}'.format(total_processed, total_new, total_skipped))
+                    action, written = queue_discovery_write(writer, prepared, storage_config, container_name, folder_path, discovery_info)
+                    new_discovery_count += len(written)
                     
-                    except Exception as e:
-                        logger.error('FN:discover_azure_blobs folder_path:{} error:{}'.format(folder_path, str(e)))
+                    # Skip if nothing changed (same change fingerprint: no sample was read)
+                    if action == "skip":
+                        total_skipped += 1
+                        if total_skipped % 50 == 0:  # Log every 50 skipped files
+                            logger.info('FN:discover_azure_blobs skipped_count:{}'.format(total_skipped))
                         continue
+                    
+                    # Only new records and schema changes count as new discoveries
+                    if action in ("insert", "update"):
+                        total_new += 1
+                    elif action in ("refresh", "reactivate"):
+                        total_refreshed += 1
+                    
+                    total_processed += 1
+                    
+                    # Log progress every 50 files
+                    if total_processed % 50 == 0:
+                        logger.info('FN:discover_azure_blobs progress: processed={} new={} skipped={}'.format(total_processed, total_new, total_skipped))
+                
+                # Commit this page's writes, then move the checkpoint past it
+                new_discovery_count += len(writer.flush())
+                pages_completed += 1
+                
+                # Rows the writer gave up on are retried by the next run: the watermark stays
+                # below them and no checkpoint moves past them
+                for row in writer.take_failed():
+                    blob_info = queued.get(row.get("storage_path"))
+                    if blob_info is not None:
+                        scan_filter.mark_failed(blob_info)
+                    total_failed += 1
+                    checkpoint_held = True
+                # A dataset still open in a grouper would be emitted partially by a resumed walk, so the
+                # checkpoint only moves at page boundaries that close every dataset (a resume re-lists it)
+                if next_token and not checkpoint_held and not any(grouper.pending for grouper in groupers):
+                    save_checkpoint(account_name, container_name, scope_folder, next_token,
+                                    discovery_batch_id, run_id, pages_completed, total_listed, scan_filter.checkpoint_state())
             
+            complete_checkpoint(account_name, container_name, scope_folder,
+                                discovery_batch_id, run_id, pages_completed, total_listed)
+            finish_incremental_scan(account_name, container_name, scope_folder, scan_filter)
+            if deletion_sweep is not None:
+                total_deleted = deletion_sweep.sweep()
+            else:
+                logger.info('FN:discover_azure_blobs container_name:{} folder_path:{} deletion_sweep:skipped resumed:{}'.format(container_name, scope_folder, checkpoint is not None))
+        
         except Exception as e:
-            logger.error('FN:discover_azure_blobs account_name:{} error:{}'.format(account_name, str(e)))
-            continue
+            logger.error('FN:discover_azure_blobs account_name:{} container_name:{} folder_path:{} error:{}'.format(account_name, container_name, scope_folder, str(e)))
+            error_message = str(e)[:500]
+    
+    new_discovery_count += len(writer.flush())
+    for grouper in groupers:
+        if isinstance(grouper, DeltaTableGrouper):
+            logger.info('FN:discover_azure_blobs delta_members_skipped:{} delta_root_probes:{}'.format(grouper.members_skipped, grouper.probes))
+        else:
+            logger.info('FN:discover_azure_blobs partitioned_files_grouped:{}'.format(grouper.files_grouped))
+    logger.info('FN:discover_azure_blobs writer_flushes:{} rows_written:{}'.format(writer.flush_count, writer.rows_written))
+    logger.info('FN:discover_azure_blobs db_pool_stats:{}'.format(db_pool_stats()))
+    pii_cache = get_pii_cache()
+    pii_cache_stats = pii_cache.stats() if pii_cache else {}
+    logger.info('FN:discover_azure_blobs pii_cache_stats:{}'.format(pii_cache_stats))
+    dlp_metrics = get_dlp_metrics_snapshot()
+    logger.info('FN:discover_azure_blobs dlp_metrics:{}'.format(dlp_metrics))
     
     batch_end_time = datetime.utcnow()
     duration_ms = int((batch_end_time - batch_start_time).total_seconds() * 1000)
     duration_sec = duration_ms / 1000.0
     
-    logger.info('FN:discover_azure_blobs COMPLETE: new_discoveries={} duration={:.1f}s ({:.1f}ms)'.format(len(all_new_discoveries), duration_sec, duration_ms))
-    return len(all_new_discoveries)
+    logger.info('FN:discover_azure_blobs COMPLETE: listed={} processed={} new={} refreshed={} skipped={} deleted={} new_discoveries={} duration={:.1f}s ({:.1f}ms)'.format(
+        total_listed, total_processed, total_new, total_refreshed, total_skipped, total_deleted, new_discovery_count, duration_sec, duration_ms))
+    
+    # Compact per-shard summary for the notification task; the discoveries themselves stay in the database
+    return {
+        "account": account_name,
+        "container": container_name,
+        "folder": scope_folder,
+        "listed": total_listed,
+        "processed": total_processed,
+        "new": total_new,
+        "refreshed": total_refreshed,
+        "skipped": total_skipped,
+        "deleted": total_deleted,
+        "failed": total_failed,
+        "new_discoveries": new_discovery_count,
+        "duration_ms": duration_ms,
+        "pii_cache_hits": pii_cache_stats.get("memory_hits", 0) + pii_cache_stats.get("persistent_hits", 0),
+        "pii_cache_misses": pii_cache_stats.get("misses", 0),
+        "dlp_calls": dlp_metrics.get("calls", 0),
+        "dlp_throttles": dlp_metrics.get("throttles", 0),
+        "dlp_latency_p95_ms": dlp_metrics.get("latency_p95_ms"),
+        "error": error_message,
+    }
+
+
+def notify_data_governors(**context):
+    summaries = [s for s in (context['ti'].xcom_pull(task_ids='discover_azure_blobs') or []) if s]
+    new_discoveries = sum(s.get("new_discoveries", 0) for s in summaries)
+    failed_shards = [s for s in summaries if s.get("error")]
+    logger.info('FN:notify_data_governors shards:{} listed:{} processed:{} deleted:{} new_discoveries:{} failed_shards:{} pii_cache_hits:{} pii_cache_misses:{} dlp_calls:{} dlp_throttles:{}'.format(
+        len(summaries), sum(s.get("listed", 0) for s in summaries), sum(s.get("processed", 0) for s in summaries),
+        sum(s.get("deleted", 0) for s in summaries), new_discoveries, len(failed_shards), sum(s.get("pii_cache_hits", 0) for s in summaries), sum(s.get("pii_cache_misses", 0) for s in summaries),
+        sum(s.get("dlp_calls", 0) for s in summaries), sum(s.get("dlp_throttles", 0) for s in summaries)))
+    for summary in failed_shards:
+        logger.warning('FN:notify_data_governors account:{} container:{} folder:{} error:{}'.format(summary["account"], summary["container"], summary["folder"], summary["error"]))
+    # Pending notifications are read from data_discovery, which also covers rows written outside this run
+    return notify_new_discoveries()
 
 
 default_args = {
@@ -453,23 +326,30 @@ dag = DAG(
     start_date=datetime(2024, 1, 1),
     catchup=False,
     max_active_runs=1,  # Prevent overlapping runs (memory + stability)
-    max_active_tasks=1,  # Process one task at a time to avoid memory exhaustion
+    max_active_tasks=DISCOVERY_CONFIG.get("max_active_shards", 4),  # Shards scanned at once across workers
     tags=['data-discovery', 'azure-blob'],
 )
 
-discovery_task = PythonOperator(
+plan_task = PythonOperator(
+    task_id='plan_discovery_shards',
+    python_callable=plan_discovery_shards,
+    dag=dag,
+)
+
+# One mapped task instance per shard, spread over the executor's workers
+discovery_task = PythonOperator.partial(
     task_id='discover_azure_blobs',
     python_callable=discover_azure_blobs,
     dag=dag,
     pool='default_pool',  # Use default pool
-    pool_slots=1,  # Use 1 slot to prevent resource conflicts
-    executor_config={'max_active_tis_per_dag': 1},  # Limit concurrent executions
-)
+    pool_slots=1,
+).expand(op_kwargs=plan_task.output)
 
 notification_task = PythonOperator(
     task_id='notify_data_governors',
-    python_callable=notify_new_discoveries,
+    python_callable=notify_data_governors,
+    trigger_rule='all_done',  # Notify about the shards that succeeded even if one failed
     dag=dag,
 )
 
-discovery_task >> notification_task
+plan_task >> discovery_task >> notification_task
@@ -0,0 +1,277 @@
+from datetime import datetime, timedelta
+from airflow import DAG
+from airflow.operators.python import PythonOperator
+import logging
+import sys
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Add airflow directory to path for imports
+airflow_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if airflow_dir not in sys.path:
+    sys.path.insert(0, airflow_dir)
+# Also ensure current directory is in path
+if os.getcwd() not in sys.path:
+    sys.path.insert(0, os.getcwd())
+
+from config.azure_config import (
+    AZURE_STORAGE_ACCOUNTS,
+    DISCOVERY_CONFIG,
+    EVENT_DISCOVERY_CONFIG,
+)
+from utils.azure_blob_client import AzureBlobClient
+from utils.blob_event_source import BLOB_DELETED, match_event_scope, open_event_source
+from utils.db_pool import db_pool_stats
+from utils.deduplication import DedupIndex
+from utils.discovery_pipeline import (
+    DeltaTableGrouper,
+    bounded_ordered_map,
+    build_delta_dataset,
+    build_discovery_info,
+    delta_table_root,
+    hive_partitioning,
+    list_partitioned_dataset,
+    prepare_blob,
+    queue_discovery_write,
+)
+from utils.discovery_writer import DiscoveryBatchWriter
+from utils.azure_dlp_client import get_dlp_metrics_snapshot
+from utils.email_notifier import notify_new_discoveries
+
+logger = logging.getLogger(__name__)
+
+
+def process_blob_events(events, executor, writer, blob_clients, dedup_indexes, discovery_info_for, max_in_flight):
+    """
+    Run one received batch of events through the same sample/extract/upsert path as
+    the listing DAG. Events for the same blob are coalesced (the last one wins), blobs
+    outside the configured scopes are ignored, and created events for blobs that are
+    already gone are treated as deletions. Events inside a dataset (a Delta table's
+    _delta_log/ commits, files of a Hive-partitioned folder) refresh the dataset's
+    record once per batch; the files themselves are not discovered one by one.
+    The batch's writes are flushed before returning. Returns (counts, new_discoveries,
+    retry_events) for the batch; retry_events are the events whose discovery or
+    database write failed and must not be acknowledged.
+    """
+    counts = {"created": 0, "deleted": 0, "new": 0, "skipped": 0, "ignored": 0, "failed": 0}
+    new_discoveries = []
+    retry_events = []
+    # (container, storage path) -> events, to map rows the writer gave up on back to their events. Touch and
+    # refresh rows carry no account, so a failed row holds back every account's events for that container and path
+    written_for = {}
+    group_delta_tables = DISCOVERY_CONFIG.get("group_delta_tables", True)
+    group_partitioned = DISCOVERY_CONFIG.get("group_partitioned_datasets", True)
+    delta_groupers = {}
+
+    latest = {}
+    for event in events:
+        scope = match_event_scope(event, AZURE_STORAGE_ACCOUNTS)
+        if scope is None:
+            counts["ignored"] += 1
+            continue
+        latest[(event.account_name, event.container_name, event.blob_path)] = (event, scope)
+
+    if group_delta_tables:
+        # Delta root probes for the whole batch run concurrently up front; table_root_of() below hits the cache
+        paths_by_grouper = {}
+        for event, (storage_config, folder_path) in latest.values():
+            grouper_key = (storage_config["name"], event.container_name)
+            if grouper_key not in delta_groupers:
+                delta_groupers[grouper_key] = DeltaTableGrouper(blob_clients[storage_config["name"]], event.container_name)
+            if delta_table_root(event.blob_path) is None:
+                paths_by_grouper.setdefault(grouper_key, []).append(event.blob_path)
+        for grouper_key, blob_paths in paths_by_grouper.items():
+            delta_groupers[grouper_key].prime(blob_paths, executor, max_in_flight)
+
+    created = []
+    # (account, container, dataset root) -> (event, storage_config, folder_path, kind): one refresh per dataset
+    datasets = {}
+    for event, (storage_config, folder_path) in latest.values():
+        dataset_key = None
+        if group_delta_tables:
+            grouper_key = (storage_config["name"], event.container_name)
+            root = delta_table_root(event.blob_path)
+            if root is not None:
+                # Log files never become rows themselves; a new commit re-reads the table
+                if event.event_type == BLOB_DELETED or not event.blob_path.endswith(".json"):
+                    counts["ignored"] += 1
+                    continue
+                dataset_key = (storage_config["name"], event.container_name, root, "delta")
+            elif delta_groupers[grouper_key].table_root_of(event.blob_path) is not None:
+                counts["ignored"] += 1
+                continue
+        if dataset_key is None and group_partitioned:
+            partitioning = hive_partitioning(event.blob_path)
+            if partitioning is not None:
+                # Added or removed partition files: re-list the dataset (deletes included)
+                dataset_key = (storage_config["name"], event.container_name, partitioning[0], "hive")
+        if dataset_key is not None:
+            previous = datasets.get(dataset_key)
+            if previous is None or event.blob_path > previous[0].blob_path:
+                datasets[dataset_key] = (event, storage_config, folder_path)
+            continue
+        if event.event_type == BLOB_DELETED:
+            counts["deleted"] += 1
+            written_for.setdefault((event.container_name, event.blob_path), []).append(event)
+            new_discoveries.extend(writer.add_delete("azure_blob", storage_config["name"], event.container_name, event.blob_path))
+            continue
+        created.append((event, storage_config, folder_path, event.blob_path, None))
+
+    for (account_name, container_name, root, kind), (event, storage_config, folder_path) in datasets.items():
+        created.append((event, storage_config, folder_path, root, kind))
+
+    for event, storage_config, folder_path, dataset_path, kind in created:
+        key = (storage_config["name"], event.container_name, folder_path)
+        if key not in dedup_indexes:
+            # Events touch a handful of paths: resolve them with IN lookups instead of loading the prefix
+            dedup_indexes[key] = DedupIndex.for_lookups("azure_blob", storage_config["name"], event.container_name, folder_path)
+
+    for (account_name, container_name, folder_path), dedup_index in dedup_indexes.items():
+        dedup_index.prefetch([dataset_path for event, storage_config, f, dataset_path, kind in created
+                              if (storage_config["name"], event.container_name, f) == (account_name, container_name, folder_path)])
+
+    def _prepare(item):
+        event, storage_config, folder_path, dataset_path, kind = item
+        blob_client = blob_clients[storage_config["name"]]
+        if kind == "hive":
+            blob_info = list_partitioned_dataset(blob_client, event.container_name, dataset_path)
+        else:
+            blob_info = blob_client.get_blob_record(event.container_name, event.blob_path)
+            if blob_info is not None and kind == "delta":
+                blob_info = build_delta_dataset(dataset_path, blob_info)
+        if blob_info is None:
+            return None
+        return prepare_blob(blob_client, dedup_indexes[(storage_config["name"], event.container_name, folder_path)], event.container_name, blob_info,
+                            storage_config.get("data_source_type"))
+
+    for (event, storage_config, folder_path, dataset_path, kind), prepared, error in bounded_ordered_map(executor, _prepare, created, max_in_flight):
+        if error is not None:
+            # Left unacknowledged so the source delivers it again
+            counts["failed"] += 1
+            retry_events.append(event)
+            logger.error('FN:process_blob_events container_name:{} blob_path:{} error:{}'.format(event.container_name, event.blob_path, str(error)))
+            continue
+        if prepared is None:
+            if kind == "delta":
+                # The commit is gone (log cleanup); the table itself is not
+                counts["ignored"] += 1
+                continue
+            # Deleted again before we got to it (or every file of the dataset is gone)
+            counts["deleted"] += 1
+            written_for.setdefault((event.container_name, dataset_path), []).append(event)
+            new_discoveries.extend(writer.add_delete("azure_blob", storage_config["name"], event.container_name, dataset_path))
+            continue
+
+        counts["created"] += 1
+        written_for.setdefault((event.container_name, dataset_path), []).append(event)
+        discovery_info = discovery_info_for(event.container_name, folder_path)
+        action, written = queue_discovery_write(writer, prepared, storage_config, event.container_name, folder_path, discovery_info)
+        new_discoveries.extend(written)
+        if action == "skip":
+            counts["skipped"] += 1
+        elif action in ("insert", "update"):
+            counts["new"] += 1
+
+    new_discoveries.extend(writer.flush())
+    for row in writer.take_failed():
+        for event in written_for.get((row.get("container_name"), row.get("storage_path")), ()):
+            counts["failed"] += 1
+            retry_events.append(event)
+
+    return counts, new_discoveries, retry_events
+
+
+def consume_blob_events(**context):
+    dag_run = context['dag_run']
+    run_id = dag_run.run_id
+    discovery_batch_id = f"events-{datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}"
+    batch_start_time = datetime.utcnow()
+    max_workers = DISCOVERY_CONFIG.get("max_workers", 8)
+    batch_size = EVENT_DISCOVERY_CONFIG.get("batch_size", 32)
+    poll_interval = EVENT_DISCOVERY_CONFIG.get("poll_interval_seconds", 2.0)
+    deadline = time.monotonic() + EVENT_DISCOVERY_CONFIG.get("run_seconds", 55.0)
+
+    source = open_event_source(EVENT_DISCOVERY_CONFIG, AZURE_STORAGE_ACCOUNTS, discovery_batch_id, run_id)
+    logger.info('FN:consume_blob_events discovery_batch_id:{} run_id:{} source:{} batch_size:{}'.format(discovery_batch_id, run_id, source.name, batch_size))
+
+    def _discovery_info(container_name, folder_path):
+        return build_discovery_info(discovery_batch_id, batch_start_time, "airflow_dag", "azure_blob_event_discovery_dag",
+                                    run_id, container_name, folder_path)
+
+    blob_clients = {
+        storage_config["name"]: AzureBlobClient(storage_config["connection_string"])
+        for storage_config in AZURE_STORAGE_ACCOUNTS
+    }
+    dedup_indexes = {}
+    totals = {"events": 0, "created": 0, "deleted": 0, "new": 0, "skipped": 0, "ignored": 0, "failed": 0}
+    all_new_discoveries = []
+    writer = DiscoveryBatchWriter(created_by='airflow')
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='blob-events') as executor:
+            while time.monotonic() < deadline:
+                events = source.receive(batch_size)
+                if not events:
+                    # Nothing received (or only events discovery ignores): ack and wait for more
+                    source.commit()
+                    time.sleep(poll_interval)
+                    continue
+
+                counts, written, retry_events = process_blob_events(events, executor, writer, blob_clients, dedup_indexes, _discovery_info, max_workers)
+                all_new_discoveries.extend(written)
+                # Events are acknowledged only after their writes are committed (a crash before commit()
+                # redelivers the batch); failed events are held back for another attempt
+                source.commit(retry_events)
+
+                totals["events"] += len(events)
+                for key, value in counts.items():
+                    totals[key] += value
+                logger.info('FN:consume_blob_events events:{} created:{} deleted:{} new:{} skipped:{} ignored:{} failed:{}'.format(
+                    len(events), counts["created"], counts["deleted"], counts["new"], counts["skipped"], counts["ignored"], counts["failed"]))
+    finally:
+        source.close()
+
+    duration_sec = (datetime.utcnow() - batch_start_time).total_seconds()
+    logger.info('FN:consume_blob_events COMPLETE: events={} created={} deleted={} new_discoveries={} writer_flushes={} duration={:.1f}s'.format(
+        totals["events"], totals["created"], totals["deleted"], len(all_new_discoveries), writer.flush_count, duration_sec))
+    logger.info('FN:consume_blob_events dlp_metrics:{}'.format(get_dlp_metrics_snapshot()))
+    logger.info('FN:consume_blob_events db_pool_stats:{}'.format(db_pool_stats()))
+    return len(all_new_discoveries)
+
+
+default_args = {
+    'owner': 'data-team',
+    'depends_on_past': False,
+    'email_on_failure': True,
+    'email_on_retry': False,
+    'retries': 1,
+    'retry_delay': timedelta(seconds=30),
+    'execution_timeout': timedelta(minutes=10),
+}
+
+dag = DAG(
+    'azure_blob_event_discovery',
+    default_args=default_args,
+    description='Discover Azure Blob Storage files from blob-created/deleted events',
+    # Each run consumes events for ~EVENT_RUN_SECONDS, so back-to-back runs keep latency in seconds
+    schedule_interval='*/1 * * * *',
+    start_date=datetime(2024, 1, 1),
+    catchup=False,
+    max_active_runs=1,  # One consumer at a time keeps event order and acks simple
+    tags=['data-discovery', 'azure-blob', 'events'],
+)
+
+consume_task = PythonOperator(
+    task_id='consume_blob_events',
+    python_callable=consume_blob_events,
+    dag=dag,
+)
+
+notification_task = PythonOperator(
+    task_id='notify_data_governors',
+    python_callable=notify_new_discoveries,
+    dag=dag,
+)
+
+consume_task >> notification_task
@@ -0,0 +1,104 @@
+"""
+Measure DAG-parse and task-startup import cost in fresh interpreters.
+
+Each target runs --runs times in a new Python process (what the scheduler's DAG
+processor and execute_tasks_new_python_interpreter pay), and the min/median wall
+time is reported. --importtime N also prints the N slowest imports of one run.
+
+    cd airflow && python scripts/benchmark_startup.py --runs 10 --importtime 15
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+AIRFLOW_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Loads a DAG file the way DagBag does (spec_from_file_location + exec_module)
+_PARSE_DAG = """
+import importlib.util, sys, time
+{untimed}
+started = time.perf_counter()
+{timed}
+spec = importlib.util.spec_from_file_location("benchmark_dag", {path!r})
+module = importlib.util.module_from_spec(spec)
+sys.modules[spec.name] = module
+spec.loader.exec_module(module)
+print((time.perf_counter() - started) * 1000)
+"""
+
+_IMPORT_MODULE = """
+import importlib, time
+started = time.perf_counter()
+importlib.import_module({module!r})
+print((time.perf_counter() - started) * 1000)
+"""
+
+UTILS_MODULES = [
+    "utils.metadata_extractor",
+    "utils.azure_dlp_client",
+    "utils.azure_blob_client",
+    "utils.discovery_pipeline",
+]
+
+
+def build_targets(dag_files):
+    targets = []
+    for dag_file in dag_files:
+        name = os.path.basename(dag_file)
+        # Scheduler parse loop: airflow is already imported in the DAG processor
+        targets.append(("parse " + name, _PARSE_DAG.format(untimed="import airflow.models", timed="", path=dag_file)))
+        # Task start in a new interpreter: import airflow, then parse the DAG file
+        targets.append(("task start " + name, _PARSE_DAG.format(untimed="", timed="import airflow.models", path=dag_file)))
+    for module in UTILS_MODULES:
+        targets.append(("import " + module, _IMPORT_MODULE.format(module=module)))
+    return targets
+
+
+def run_once(python, code, extra_args=()):
+    result = subprocess.run([python, *extra_args, "-c", code], cwd=AIRFLOW_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "exit {}".format(result.returncode))
+    return float(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def slowest_imports(stderr, top):
+    # -X importtime lines: "import time: self [us] | cumulative | imported package"
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, package = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), package.rstrip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--python", default=sys.executable)
+    parser.add_argument("--importtime", type=int, default=0, metavar="N", help="show the N slowest imports of each target")
+    parser.add_argument("dag_files", nargs="*", help="DAG files (default: every file in dags/)")
+    args = parser.parse_args()
+
+    dag_dir = os.path.join(AIRFLOW_DIR, "dags")
+    dag_files = args.dag_files or sorted(
+        os.path.join(dag_dir, f) for f in os.listdir(dag_dir) if f.endswith(".py") and not f.startswith("__"))
+
+    print("{:<55} {:>10} {:>10}".format("target", "min ms", "median ms"))
+    for name, code in build_targets(dag_files):
+        try:
+            timings = [run_once(args.python, code)[0] for _ in range(args.runs)]
+        except RuntimeError as e:
+            print("{:<55} skipped: {}".format(name, e))
+            continue
+        print("{:<55} {:>10.1f} {:>10.1f}".format(name, min(timings), statistics.median(timings)))
+        if args.importtime:
+            _, stderr = run_once(args.python, code, ("-X", "importtime"))
+            for cumulative, package in slowest_imports(stderr, args.importtime):
+                print("    {:>8.1f} ms  {}".format(cumulative / 1000.0, package))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import io
+from types import SimpleNamespace
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from utils.azure_blob_client import AzureBlobClient
+from utils.metadata_extractor import parse_parquet_schema
+
+
+class FakeDownload:
+    def __init__(self, data):
+        self.data = data
+
+    def readall(self):
+        return self.data
+
+
+class FakeBlob:
+    """Ranged reads over an in-memory blob; fails every read from fail_after on."""
+
+    def __init__(self, data, fail_after=None):
+        self.data = data
+        self.fail_after = fail_after
+        self.reads = []
+
+    def download_blob(self, offset=0, length=None):
+        if self.fail_after is not None and len(self.reads) >= self.fail_after:
+            raise ConnectionError("connection reset")
+        self.reads.append((offset, length))
+        end = len(self.data) if length is None else offset + length
+        return FakeDownload(self.data[offset:end])
+
+    def get_blob_properties(self):
+        class Properties:
+            size = len(self.data)
+        return Properties()
+
+
+class FakePages:
+    """ItemPaged.by_page(): continuation_token is the token of the page after the one just yielded."""
+
+    def __init__(self, pages, start):
+        self.pages = pages
+        self.index = int(start) if start else 0
+        self.continuation_token = start
+
+    def __iter__(self):
+        while self.index < len(self.pages):
+            page = self.pages[self.index]
+            self.index += 1
+            self.continuation_token = str(self.index) if self.index < len(self.pages) else None
+            yield iter(page)
+
+
+class FakeContainerClient:
+    def __init__(self, names, page_size):
+        self.names = sorted(names)
+        self.page_size = page_size
+        self.calls = []
+
+    def list_blobs(self, name_starts_with="", results_per_page=None):
+        self.calls.append(name_starts_with)
+        listed = [SimpleNamespace(name=name, size=1, etag='"e"') for name in self.names if name.startswith(name_starts_with)]
+        size = min(self.page_size, results_per_page or self.page_size)
+        pages = [listed[i:i + size] for i in range(0, len(listed), size)]
+        return SimpleNamespace(by_page=lambda continuation_token=None: FakePages(pages, continuation_token))
+
+
+class FakeServiceClient:
+    def __init__(self, blob=None, container=None):
+        self.blob = blob
+        self.container = container
+
+    def get_blob_client(self, container, blob):
+        return self.blob
+
+    def get_container_client(self, container):
+        return self.container
+
+
+def client_for(blob=None, container=None):
+    client = AzureBlobClient.__new__(AzureBlobClient)
+    client.blob_service_client = FakeServiceClient(blob, container)
+    return client
+
+
+def test_sample_grows_until_complete():
+    data = b"a" * 3000 + b"\n" + b"b" * 5000
+    blob = FakeBlob(data)
+    sample = client_for(blob).get_blob_sample("c", "x.csv", max_bytes=1024, is_complete=lambda s: b"\n" in s,
+                                              max_total_bytes=64 * 1024, file_size=len(data))
+    assert sample == data[:4096]
+    assert blob.reads == [(0, 1024), (1024, 1024), (2048, 2048)]
+
+
+def test_failed_sample_read_raises_instead_of_returning_partial_header():
+    blob = FakeBlob(b"a" * 8000, fail_after=1)
+    with pytest.raises(ConnectionError):
+        client_for(blob).get_blob_sample("c", "x.csv", max_bytes=1024, is_complete=lambda s: False,
+                                         max_total_bytes=64 * 1024, file_size=8000)
+
+
+def test_empty_blob_samples_to_empty_bytes():
+    assert client_for(FakeBlob(b"")).get_blob_sample("c", "x.csv", file_size=0) == b""
+
+
+def test_failed_tail_read_raises():
+    with pytest.raises(ConnectionError):
+        client_for(FakeBlob(b"a" * 100, fail_after=0)).get_blob_tail("c", "x", file_size=100)
+
+
+def test_failed_parquet_footer_read_raises():
+    with pytest.raises(ConnectionError):
+        client_for(FakeBlob(b"a" * 100, fail_after=0)).get_parquet_footer("c", "x.parquet", file_size=100)
+
+
+def test_non_parquet_tail_is_returned_not_raised():
+    data = b"a" * 100
+    assert client_for(FakeBlob(data)).get_parquet_footer("c", "x.parquet", file_size=100) == data
+
+
+def test_failed_suffix_read_raises():
+    with pytest.raises(ConnectionError):
+        client_for(FakeBlob(b"a" * 100, fail_after=0)).get_blob_suffix("c", "x.orc", lambda tail: 10, file_size=100)
+
+
+def test_listing_is_not_capped_and_pages_carry_the_next_token():
+    names = ["raw/{:05d}.csv".format(i) for i in range(12005)]
+    pages = list(client_for(container=FakeContainerClient(names, 5000)).iter_blob_pages("c", "raw"))
+    assert [len(records) for records, _ in pages] == [5000, 5000, 2005]
+    assert [token for _, token in pages] == ["1", "2", None]
+    assert sum(len(records) for records, _ in pages) == 12005
+
+
+def test_listing_resumes_from_a_saved_token():
+    names = ["raw/{}.csv".format(i) for i in range(10)]
+    pages = list(client_for(container=FakeContainerClient(names, 4)).iter_blob_pages("c", "raw", continuation_token="1"))
+    assert [record["full_path"] for record in pages[0][0]] == sorted(names)[4:8]
+    assert len(pages) == 2 and pages[-1][1] is None
+
+
+def test_listing_skips_folders_and_filters_extensions():
+    container = FakeContainerClient(["raw/", "raw/a.CSV", "raw/b.json", "raw/sub/", "rawx/c.csv"], 100)
+    records = list(client_for(container=container).list_blobs("c", "raw/", file_extensions=[".csv"]))
+    assert [record.full_path for record in records] == ["raw/a.CSV"]
+    assert container.calls == ["raw/"]
+
+
+def parquet_bytes(num_columns):
+    table = pa.table({"col_{:04d}".format(i): list(range(500)) for i in range(num_columns)})
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer)
+    return buffer.getvalue()
+
+
+def test_narrow_parquet_footer_is_one_ranged_read():
+    data = parquet_bytes(3)
+    blob = FakeBlob(data)
+    footer = client_for(blob).get_parquet_footer("c", "x.parquet", file_size=len(data))
+    footer_size = int.from_bytes(data[-8:-4], "little") + 8
+    assert footer == data[-footer_size:]
+    assert blob.reads == [(len(data) - 8192, 8192)]
+    assert [column["name"] for column in parse_parquet_schema(footer).columns] == ["col_0000", "col_0001", "col_0002"]
+
+
+def test_wide_parquet_footer_fetches_only_the_missing_front():
+    data = parquet_bytes(400)
+    footer_size = int.from_bytes(data[-8:-4], "little") + 8
+    assert footer_size > 8192
+    blob = FakeBlob(data)
+    footer = client_for(blob).get_parquet_footer("c", "x.parquet", file_size=len(data))
+    assert footer == data[-footer_size:]
+    assert blob.reads == [(len(data) - 8192, 8192), (len(data) - footer_size, footer_size - 8192)]
+
+
+def test_parquet_footer_over_the_limit_is_not_read():
+    data = parquet_bytes(400)
+    blob = FakeBlob(data)
+    assert client_for(blob).get_parquet_footer("c", "x.parquet", file_size=len(data), max_footer_bytes=4096) == b""
+    assert len(blob.reads) == 1
@@ -0,0 +1,137 @@
+import asyncio
+import email.utils
+import time
+
+import pytest
+
+pytest.importorskip("aiohttp")
+pytest.importorskip("azure.ai.textanalytics")
+
+from aiohttp import web
+
+from utils.azure_dlp_async import MAX_RETRY_AFTER_SECONDS, AsyncAzureDLPClient, parse_retry_after
+from utils.azure_dlp_client import DLPMetrics
+
+
+class StandInLanguageService:
+    """Local stand-in for Azure AI Language: answers :analyze-text after replaying the queued failures."""
+
+    def __init__(self, failures=()):
+        self.failures = list(failures)  # (status, headers) returned before any success
+        self.requests = 0
+
+    async def handle(self, request):
+        self.requests += 1
+        body = await request.json()
+        if self.failures:
+            status, headers = self.failures.pop(0)
+            return web.json_response({"error": {"code": str(status), "message": "stand-in failure"}}, status=status, headers=headers)
+        documents = []
+        for document in body["analysisInput"]["documents"]:
+            entities = []
+            if "email" in document["text"]:
+                entities.append({"text": document["text"], "category": "Email", "offset": 0,
+                                 "length": len(document["text"]), "confidenceScore": 0.9})
+            documents.append({"id": document["id"], "redactedText": "*", "entities": entities, "warnings": []})
+        return web.json_response({"kind": "PiiEntityRecognitionResults",
+                                  "results": {"documents": documents, "errors": [], "modelVersion": "2023-01-01"}})
+
+
+def detect(service, texts, **client_kwargs):
+    async def _run():
+        app = web.Application()
+        app.router.add_route("POST", "/{tail:.*}", service.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        metrics = DLPMetrics()
+        client = AsyncAzureDLPClient(endpoint="http://127.0.0.1:{}".format(port), key="stand-in", rate_per_second=100,
+                                     burst=10, metrics=metrics, backoff_base=0.01, backoff_max=0.05, **client_kwargs)
+        started = time.monotonic()
+        try:
+            results = await client.detect_pii_in_texts(texts)
+        finally:
+            await client.close()
+            await runner.cleanup()
+        return results, metrics.snapshot(), time.monotonic() - started
+
+    return asyncio.run(_run())
+
+
+def test_throttled_request_waits_for_retry_after():
+    service = StandInLanguageService(failures=[(429, {"Retry-After": "0.3"})])
+    results, metrics, elapsed = detect(service, ["email", "city_id"], max_retries=3)
+
+    assert [result["pii_detected"] for result in results] == [True, False]
+    assert results[0]["pii_types"] == ["Email"]
+    assert not any(result.get("error") for result in results)
+    assert service.requests == 2
+    assert metrics["throttles"] == 1
+    assert metrics["retries"] == 1
+    assert elapsed >= 0.3
+
+
+def test_retry_after_ms_header_takes_precedence():
+    service = StandInLanguageService(failures=[(429, {"retry-after-ms": "50", "Retry-After": "30"})])
+    results, metrics, elapsed = detect(service, ["email"], max_retries=3)
+
+    assert results[0]["pii_detected"] is True
+    assert elapsed < 5
+
+
+def test_server_errors_are_retried_with_backoff():
+    service = StandInLanguageService(failures=[(503, {}), (500, {})])
+    results, metrics, _ = detect(service, ["email"], max_retries=3)
+
+    assert results[0]["pii_detected"] is True
+    assert service.requests == 3
+    assert metrics["retries"] == 2
+    assert metrics["throttles"] == 0
+
+
+def test_exhausted_retries_return_error_results():
+    service = StandInLanguageService(failures=[(429, {"Retry-After": "0"})] * 3)
+    results, metrics, _ = detect(service, ["email", "city_id"], max_retries=2)
+
+    assert all(result.get("error") for result in results)
+    assert not any(result["pii_detected"] for result in results)
+    assert service.requests == 3
+
+
+def test_retry_after_beyond_limit_is_not_waited_for():
+    service = StandInLanguageService(failures=[(429, {"Retry-After": str(int(MAX_RETRY_AFTER_SECONDS) + 60)})])
+    results, _, elapsed = detect(service, ["email"], max_retries=3)
+
+    assert results[0].get("error") is True
+    assert service.requests == 1
+    assert elapsed < 5
+
+
+def test_non_retryable_status_fails_immediately():
+    service = StandInLanguageService(failures=[(400, {})])
+    results, metrics, _ = detect(service, ["email"], max_retries=3)
+
+    assert results[0].get("error") is True
+    assert service.requests == 1
+    assert metrics["retries"] == 0
+
+
+@pytest.mark.parametrize("headers, expected", [
+    (None, None),
+    ({}, None),
+    ({"retry-after-ms": "1500"}, 1.5),
+    ({"x-ms-retry-after-ms": "250"}, 0.25),
+    ({"Retry-After": "7"}, 7.0),
+    ({"retry-after": "2.5"}, 2.5),
+    ({"Retry-After": "-3"}, 0.0),
+    ({"Retry-After": "soon"}, None),
+])
+def test_parse_retry_after(headers, expected):
+    assert parse_retry_after(headers) == expected
+
+
+def test_parse_retry_after_http_date():
+    retry_at = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert 25 <= parse_retry_after({"Retry-After": retry_at}) <= 30
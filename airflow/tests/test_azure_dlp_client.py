@@ -0,0 +1,74 @@
+from types import SimpleNamespace
+
+import pytest
+
+import utils.azure_dlp_client as azure_dlp_client
+from utils.azure_dlp_client import AzureDLPClient
+
+
+class FakeTextAnalytics:
+    """recognize_pii_entities over column names: anything containing "email" is an Email entity."""
+
+    def __init__(self, fail_calls=(), error_texts=()):
+        self.calls = []
+        self.fail_calls = set(fail_calls)
+        self.error_texts = set(error_texts)
+
+    def recognize_pii_entities(self, documents, model_version=None):
+        self.calls.append([document["text"] for document in documents])
+        if len(self.calls) - 1 in self.fail_calls:
+            raise RuntimeError("service unavailable")
+        results = []
+        for document in documents:
+            if document["text"] in self.error_texts:
+                results.append(SimpleNamespace(id=document["id"], is_error=True, error="InvalidDocument"))
+                continue
+            entities = [SimpleNamespace(text=document["text"], category="Email", subcategory=None, confidence_score=0.9,
+                                        offset=0, length=len(document["text"]))] if "email" in document["text"] else []
+            results.append(SimpleNamespace(id=document["id"], is_error=False, entities=entities))
+        return results
+
+
+def client_with(fake):
+    client = AzureDLPClient.__new__(AzureDLPClient)
+    client.endpoint, client.key, client.client = "https://stand-in", "key", fake
+    return client
+
+
+def test_texts_are_packed_into_multi_document_requests():
+    fake = FakeTextAnalytics()
+    texts = ["col_{}".format(i) for i in range(11)] + ["email"]
+    results = client_with(fake).detect_pii_in_texts(texts, batch_size=5)
+    assert [len(call) for call in fake.calls] == [5, 5, 2]
+    assert [result["pii_detected"] for result in results] == [False] * 11 + [True]
+    assert results[-1]["pii_types"] == ["Email"]
+
+
+def test_duplicate_texts_are_sent_once_and_answered_in_order():
+    fake = FakeTextAnalytics()
+    results = client_with(fake).detect_pii_in_texts(["email", "id", "email", "", "id"], batch_size=5)
+    assert fake.calls == [["email", "id"]]
+    assert [result["pii_detected"] for result in results] == [True, False, True, False, False]
+
+
+def test_a_failed_request_marks_only_its_documents():
+    fake = FakeTextAnalytics(fail_calls={0})
+    results = client_with(fake).detect_pii_in_texts(["a", "b", "email"], batch_size=2)
+    assert [result.get("error", False) for result in results] == [True, True, False]
+    assert results[2]["pii_detected"] is True
+
+
+def test_a_failed_document_is_flagged():
+    fake = FakeTextAnalytics(error_texts={"b"})
+    results = client_with(fake).detect_pii_in_texts(["a", "b"])
+    assert [result.get("error", False) for result in results] == [False, True]
+
+
+@pytest.mark.parametrize("batch_size, calls", [(1, 3), (25, 1)])
+def test_column_names_use_the_batch_path(batch_size, calls, monkeypatch):
+    monkeypatch.setattr(azure_dlp_client, "AZURE_AI_LANGUAGE_MAX_BATCH_DOCS", batch_size)
+    fake = FakeTextAnalytics()
+    results = client_with(fake).detect_pii_in_column_names(["email", "id", "amount"])
+    assert len(fake.calls) == calls
+    assert results == [{"pii_detected": True, "pii_types": ["Email"]}, {"pii_detected": False, "pii_types": []},
+                       {"pii_detected": False, "pii_types": []}]
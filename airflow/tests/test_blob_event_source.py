@@ -0,0 +1,133 @@
+import base64
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from utils.blob_event_source import (BLOB_CREATED, BLOB_DELETED, FileEventSource, QueueEventSource, decode_queue_message,
+                                     match_event_scope, parse_event_grid_event)
+
+TOPIC = "/subscriptions/s/resourceGroups/g/providers/Microsoft.Storage/storageAccounts/acc"
+
+
+def created(path, container="raw", event_id="1"):
+    return {"id": event_id, "eventType": "Microsoft.Storage.BlobCreated", "topic": TOPIC,
+            "subject": "/blobServices/default/containers/{}/blobs/{}".format(container, path),
+            "data": {"eTag": '"0x1"', "contentLength": 42, "contentType": "text/csv"}}
+
+
+def test_created_event():
+    event, = parse_event_grid_event(created("sales/a b.csv"))
+    assert (event.event_type, event.account_name, event.container_name, event.blob_path) == (BLOB_CREATED, "acc", "raw", "sales/a b.csv")
+    assert (event.etag, event.size) == ("0x1", 42)
+
+
+def test_cloud_event_delete_from_url():
+    event, = parse_event_grid_event({"type": "Microsoft.Storage.BlobDeleted", "source": TOPIC,
+                                     "data": {"url": "https://acc.blob.core.windows.net/raw/sales/a%20b.csv"}})
+    assert (event.event_type, event.container_name, event.blob_path) == (BLOB_DELETED, "raw", "sales/a b.csv")
+
+
+def test_rename_is_a_delete_and_a_create():
+    events = parse_event_grid_event({"eventType": "Microsoft.Storage.BlobRenamed", "data": {
+        "sourceUrl": "https://acc.dfs.core.windows.net/raw/tmp/a.csv",
+        "destinationUrl": "https://acc.dfs.core.windows.net/raw/sales/a.csv"}})
+    assert [(e.event_type, e.blob_path) for e in events] == [(BLOB_DELETED, "tmp/a.csv"), (BLOB_CREATED, "sales/a.csv")]
+
+
+@pytest.mark.parametrize("event", [
+    dict(created("sales/a.csv"), eventType="Microsoft.Storage.BlobTierChanged"),
+    created("sales/folder/"),
+    dict(created("x"), subject="/blobServices/default"),
+])
+def test_ignored_events(event):
+    assert parse_event_grid_event(event) == []
+
+
+def test_queue_messages_may_be_base64_encoded():
+    payload = json.dumps([created("a.csv"), created("b.csv")])
+    assert len(decode_queue_message(base64.b64encode(payload.encode()))) == 2
+    assert decode_queue_message(json.dumps(created("a.csv")))[0]["id"] == "1"
+
+
+ACCOUNTS = [{"name": "acc", "containers": ["raw"], "folders": ["sales", "sales/eu"], "file_extensions": [".csv"]}]
+
+
+@pytest.mark.parametrize("path, container, folder", [
+    ("sales/eu/a.csv", "raw", "sales/eu"),
+    ("sales/us/a.csv", "raw", "sales"),
+    ("salesx/a.csv", "raw", None),
+    ("sales/a.json", "raw", None),
+    ("sales/a.csv", "curated", None),
+])
+def test_event_scope_is_the_longest_configured_folder(path, container, folder):
+    event, = parse_event_grid_event(created(path, container))
+    match = match_event_scope(event, ACCOUNTS)
+    assert (match[1] if match else None) == folder
+
+
+def write_events(path, count):
+    with open(path, "w") as f:
+        for i in range(count):
+            f.write(json.dumps(created("sales/{}.csv".format(i), event_id=str(i))) + "\n")
+
+
+def test_file_source_commits_the_offset(tmp_path):
+    path = str(tmp_path / "events.jsonl")
+    write_events(path, 3)
+    source = FileEventSource(path)
+    assert len(source.receive(2)) == 2
+    source.commit()
+    # A new source (next run) starts after the committed events
+    assert [e.event_id for e in FileEventSource(path).receive(10)] == ["2"]
+
+
+def test_file_source_holds_a_failed_batch_then_drops_it(tmp_path):
+    path = str(tmp_path / "events.jsonl")
+    write_events(path, 2)
+    source = FileEventSource(path, max_deliveries=3)
+    for _ in range(2):
+        events = source.receive(10)
+        assert [e.event_id for e in events] == ["0", "1"]
+        source.commit(retry_events=events[:1])
+    events = source.receive(10)
+    source.commit(retry_events=events[:1])
+    assert source.receive(10) == []
+
+
+def test_file_source_waits_for_a_partial_last_line(tmp_path):
+    path = tmp_path / "events.jsonl"
+    path.write_text(json.dumps(created("a.csv")) + "\n" + '{"id": "2"')
+    source = FileEventSource(str(path))
+    assert len(source.receive(10)) == 1
+    assert source.receive(10) == []
+
+
+class FakeQueueClient:
+    def __init__(self, messages):
+        self.messages = messages
+        self.deleted = []
+
+    def receive_messages(self, **kwargs):
+        return list(self.messages)
+
+    def delete_message(self, message):
+        self.deleted.append(message.id)
+
+
+def test_queue_source_keeps_messages_with_events_to_retry():
+    messages = [SimpleNamespace(id="m1", dequeue_count=1, content=json.dumps(created("a.csv"))),
+                SimpleNamespace(id="m2", dequeue_count=1, content=json.dumps(created("b.csv"))),
+                SimpleNamespace(id="m3", dequeue_count=5, content=json.dumps(created("c.csv"))),
+                SimpleNamespace(id="m4", dequeue_count=1, content="not json")]
+    source = QueueEventSource.__new__(QueueEventSource)
+    source.queue_client = FakeQueueClient(messages)
+    source.visibility_timeout = 300
+    source.max_deliveries = 5
+    source._received = []
+
+    events = source.receive(32)
+    assert [e.blob_path for e in events] == ["a.csv", "b.csv", "c.csv"]
+    source.commit(retry_events=[events[1], events[2]])
+    # m2 is redelivered; m3 has been delivered max_deliveries times; m4 can never be parsed
+    assert source.queue_client.deleted == ["m1", "m3", "m4"]
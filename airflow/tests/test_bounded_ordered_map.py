@@ -0,0 +1,66 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from utils.discovery_pipeline import bounded_ordered_map
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        yield pool
+
+
+def test_results_come_back_in_submission_order(executor):
+    def slow_square(x):
+        time.sleep(random.random() / 200)
+        return x * x
+
+    results = list(bounded_ordered_map(executor, slow_square, range(50), max_in_flight=8))
+    assert results == [(x, x * x, None) for x in range(50)]
+
+
+def test_errors_are_yielded_in_place(executor):
+    def fail_on_odd(x):
+        if x % 2:
+            raise ValueError(x)
+        return x
+
+    results = list(bounded_ordered_map(executor, fail_on_odd, range(4), max_in_flight=2))
+    assert [(item, result) for item, result, _ in results] == [(0, 0), (1, None), (2, 2), (3, None)]
+    assert [type(error) for _, _, error in results] == [type(None), ValueError, type(None), ValueError]
+
+
+@pytest.mark.parametrize("max_in_flight, expected", [(3, 3), (1, 1), (0, 1)])
+def test_in_flight_calls_are_bounded(executor, max_in_flight, expected):
+    lock = threading.Lock()
+    running = [0]
+    peak = [0]
+
+    def track(x):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.005)
+        with lock:
+            running[0] -= 1
+        return x
+
+    assert [item for item, _, _ in bounded_ordered_map(executor, track, range(20), max_in_flight)] == list(range(20))
+    assert peak[0] <= expected
+
+
+def test_items_are_pulled_lazily(executor):
+    pulled = []
+
+    def items():
+        for x in range(100):
+            pulled.append(x)
+            yield x
+
+    results = bounded_ordered_map(executor, lambda x: x, items(), max_in_flight=4)
+    assert next(results) == (0, 0, None)
+    assert len(pulled) == 4
@@ -0,0 +1,116 @@
+import codecs
+import gzip
+import os
+
+import pytest
+
+from utils.content_sniffer import (decompress_head, detect_text_encoding, first_record_end, sniff_csv_dialect, sniff_format,
+                                   split_extension)
+
+
+@pytest.mark.parametrize("file_name, expected", [
+    ("data.csv", ("csv", None)),
+    ("dir.v2/data.CSV.GZ", ("csv", "gzip")),
+    ("events.jsonl.zst", ("jsonl", "zstd")),
+    ("data.gz", ("", "gzip")),
+    ("README", ("", None)),
+])
+def test_split_extension(file_name, expected):
+    assert split_extension(file_name) == expected
+
+
+@pytest.mark.parametrize("data, file_name, expected_format", [
+    (b"PAR1\x15\x04", "part-0.bin", "parquet"),
+    (b"...footer...PAR1", "", "parquet"),
+    (b"Obj\x01\x04\x16avro.schema", "data.csv", "avro"),
+    (b"ORC\x0a\x03", "", "orc"),
+    (b"\x08\x03\x10\x00ORC\x18", "", "orc"),
+])
+def test_magic_wins_over_the_extension(data, file_name, expected_format):
+    result = sniff_format(data, file_name)
+    assert result.format == expected_format
+    assert result.detected_by == "magic"
+
+
+@pytest.mark.parametrize("text, file_name, expected_format", [
+    ('[{"a": 1}, {"a": 2}]', "data.txt", "json"),
+    ('{"a": 1}\n{"a": 2}\n', "data.json", "ndjson"),
+    ('{"a": 1,\n "b": 2}', "data.json", "json"),
+    ('{"a": 1}', "data.jsonl", "ndjson"),
+    ("id,name\n1,a\n2,b\n", "data.txt", "csv"),
+    ("id;name\n1;a\n", "export", "csv"),
+])
+def test_text_content(text, file_name, expected_format):
+    result = sniff_format(text.encode("utf-8"), file_name)
+    assert result.format == expected_format
+    assert result.detected_by == "content"
+
+
+def test_csv_details_carry_delimiter_and_encoding():
+    result = sniff_format(codecs.BOM_UTF8 + "id|name|city\n1|a|x\n2|b|y\n".encode("utf-8"), "data.csv")
+    assert result.format == "csv"
+    assert result.details == {"delimiter": "|", "quotechar": '"', "encoding": "utf-8", "has_bom": True}
+
+
+def test_gzip_sample_is_inflated_and_sniffed():
+    result = sniff_format(gzip.compress(b"id,name\n1,a\n" * 1000)[:200], "data.csv.gz")
+    assert result.compression == "gzip"
+    assert result.format == "csv"
+    assert result.content.startswith(b"id,name\n1,a\n")
+
+
+def test_decompress_head_is_bounded():
+    data = gzip.compress(os.urandom(10) + b"x" * 1_000_000)
+    assert len(decompress_head(data, "gzip", max_output=1000)) == 1000
+
+
+def test_zstd_sample_is_inflated_and_bounded():
+    zstandard = pytest.importorskip("zstandard")
+    compressed = zstandard.ZstdCompressor().compress(b"id,name\n1,a\n" * 100000)
+    assert len(decompress_head(compressed, "zstd", max_output=4096)) == 4096
+    # A truncated frame yields what could be decoded so far
+    assert decompress_head(compressed[:len(compressed) // 2], "zstd").startswith(b"id,name\n")
+    assert sniff_format(compressed[:500], "data.csv.zst").format == "csv"
+
+
+def test_corrupt_gzip_is_unknown():
+    result = sniff_format(b"\x1f\x8b" + b"\x00" * 50, "data.csv.gz")
+    assert result.format is None
+    assert result.compression == "gzip"
+
+
+def test_unknown_binary_falls_back_to_binary_extensions_only():
+    binary = bytes(range(256)) * 4
+    assert sniff_format(binary, "data.avro").format == "avro"
+    assert sniff_format(binary, "data.csv").format is None
+
+
+@pytest.mark.parametrize("data, expected", [
+    (codecs.BOM_UTF8 + b"a,b", ("utf-8", True)),
+    (codecs.BOM_UTF16_LE + "a,b".encode("utf-16-le"), ("utf-16-le", True)),
+    ("id,name\n1,a\n".encode("utf-16-le"), ("utf-16-le", False)),
+    ("id,name\n1,a\n".encode("utf-16-be"), ("utf-16-be", False)),
+    ("name\ncafé".encode("utf-8")[:-1], ("utf-8", False)),
+    ("name\ncafé\n".encode("cp1252"), ("cp1252", False)),
+    (b"\x00\x01\x02\x00\xff\x00\x10\x00", (None, False)),
+])
+def test_detect_text_encoding(data, expected):
+    assert detect_text_encoding(data) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("a,b\n1,2", 3),
+    ('"multi\nline",b\r\n1,2', 14),
+    ('"unterminated,b', -1),
+])
+def test_first_record_end(text, expected):
+    assert first_record_end(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("a\tb\tc\n1\t2\t3\n", {"delimiter": "\t", "quotechar": '"'}),
+    ('"x,y,z";b;c', {"delimiter": ";", "quotechar": '"'}),
+    ("just one column", None),
+])
+def test_sniff_csv_dialect(text, expected):
+    assert sniff_csv_dialect(text) == expected
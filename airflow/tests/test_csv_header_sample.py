@@ -0,0 +1,90 @@
+import codecs
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+import utils.metadata_extractor as metadata_extractor
+from utils.azure_blob_client import AzureBlobClient
+from utils.metadata_extractor import extract_file_metadata, header_sample_complete, parse_csv_schema
+
+WIDE_HEADER = ",".join("column_name_{}".format(i) for i in range(400)) + "\n" + (",".join("1" * 400) + "\n") * 20
+
+
+@pytest.mark.parametrize("sample, complete", [
+    (b"id,name,email", False),
+    (b"id,name,email\n", True),
+    (b"id,name,email\r\n1,a", True),
+    (b'id,"customer\nname",email', False),
+    (b'id,"customer\nname",email\n', True),
+    (codecs.BOM_UTF8 + b"id;name;email", False),
+    (codecs.BOM_UTF8 + b"id;name;email\n", True),
+    (codecs.BOM_UTF16_LE + "id,name,email\n".encode("utf-16-le"), True),
+])
+def test_csv_header_is_complete_after_the_first_record_end(sample, complete):
+    assert header_sample_complete(sample, "a.csv") is complete
+
+
+def test_json_header_is_complete_once_the_first_object_closes():
+    assert header_sample_complete(b'{"id": 1, "name": {"first": "a"', "a.json") is False
+    assert header_sample_complete(b'{"id": 1, "name": {"first": "a"}}', "a.json") is True
+
+
+def names(parsed):
+    return [column["name"] for column in parsed.columns]
+
+
+def test_quoted_header_spanning_lines_is_one_record():
+    parsed = parse_csv_schema(b'id,"customer\nname","a,b"\n1,x,y\n')
+    assert names(parsed) == ["id", "customer\nname", "a,b"]
+
+
+def test_sniffed_dialect_and_bom_are_applied():
+    parsed = parse_csv_schema(codecs.BOM_UTF8 + b"id;'full;name';\n", delimiter=";", quotechar="'", has_bom=True)
+    assert names(parsed) == ["id", "full;name", "column_3"]
+    assert parsed.format_details["bom"] is True and parsed.attributes["delimiter"] == ";"
+
+
+def test_utf16_header():
+    parsed = parse_csv_schema(codecs.BOM_UTF16_LE + "id,näme\n1,x\n".encode("utf-16-le"), encoding="utf-16-le", has_bom=True)
+    assert names(parsed) == ["id", "näme"]
+
+
+class FakeBlob:
+    def __init__(self, data):
+        self.data = data
+        self.reads = []
+
+    def download_blob(self, offset=0, length=None):
+        self.reads.append((offset, length))
+        return SimpleNamespace(readall=lambda: self.data[offset:offset + length])
+
+
+def client_for(blob):
+    client = AzureBlobClient.__new__(AzureBlobClient)
+    client.blob_service_client = SimpleNamespace(get_blob_client=lambda **kwargs: blob)
+    return client
+
+
+def test_sample_grows_until_a_wide_header_is_complete(monkeypatch):
+    monkeypatch.setattr(metadata_extractor, "detect_pii_in_columns",
+                        lambda names: [{"pii_detected": False, "pii_types": [], "source": "azure_dlp"} for _ in names])
+    monkeypatch.setattr(metadata_extractor, "get_rule_classifier", lambda data_source_type=None: None)
+    blob = FakeBlob(WIDE_HEADER.encode())
+    sample = client_for(blob).get_blob_sample("raw", "a.csv", max_bytes=1024, max_total_bytes=65536,
+                                              is_complete=lambda sample: header_sample_complete(sample, "a.csv"))
+    # 1 KB, then only the new bytes of 2 KB, 4 KB, 8 KB
+    assert blob.reads == [(0, 1024), (1024, 1024), (2048, 2048), (4096, 4096)]
+    assert len(sample) == 8192 and header_sample_complete(sample, "a.csv")
+
+    metadata = extract_file_metadata({"name": "a.csv", "full_path": "raw/a.csv", "size": len(blob.data), "etag": '"0x1"',
+                                      "last_modified": datetime(2024, 6, 1), "created_at": datetime(2024, 6, 1)}, sample)
+    columns = metadata["schema_json"]["columns"]
+    assert len(columns) == 400 and columns[-1]["name"] == "column_name_399"
+
+
+def test_sample_stops_at_the_cap_for_a_header_that_never_ends():
+    blob = FakeBlob(b"x," * 10000)
+    sample = client_for(blob).get_blob_sample("raw", "a.csv", max_bytes=1024, max_total_bytes=4096,
+                                              is_complete=lambda sample: header_sample_complete(sample, "a.csv"))
+    assert len(sample) == 4096 and len(blob.reads) == 3
@@ -0,0 +1,153 @@
+from datetime import datetime
+
+import pytest
+
+from utils.discovery_pipeline import DeltaTableGrouper, PartitionedDatasetGrouper, hive_partitioning, list_partitioned_dataset
+
+
+def blob(path, size=10, hour=12, etag=None):
+    return {"name": path.rsplit("/", 1)[-1], "full_path": path, "size": size, "etag": etag or '"{}"'.format(path),
+            "last_modified": datetime(2024, 6, 1, hour, 0, 0), "created_at": datetime(2024, 6, 1, 0, 0, 0)}
+
+
+class FakeBlobClient:
+    """prefix_exists over a fixed set of blob paths, counting the listing calls."""
+
+    def __init__(self, paths):
+        self.paths = list(paths)
+        self.probed = []
+
+    def prefix_exists(self, container_name, prefix):
+        self.probed.append(prefix)
+        return any(path.startswith(prefix) for path in self.paths)
+
+
+LOG = ["sales/orders/_delta_log/00000000000000000000.json",
+       "sales/orders/_delta_log/00000000000000000001.checkpoint.parquet",
+       "sales/orders/_delta_log/00000000000000000001.json",
+       "sales/orders/_delta_log/_last_checkpoint"]
+
+
+def test_delta_log_collapses_into_one_table_record():
+    paths = LOG + ["sales/orders/part-00000.snappy.parquet", "sales/z.csv"]
+    client = FakeBlobClient(paths)
+    grouper = DeltaTableGrouper(client, "raw")
+    grouped = grouper.group([blob(path) for path in paths])
+    assert [record["full_path"] for record in grouped] == ["sales/z.csv", "sales/orders"]
+    table = grouped[1]
+    # The newest commit fingerprints the table, not the checkpoint or _last_checkpoint
+    assert table["metadata"] == {"delta_log_latest": "00000000000000000001.json"}
+    assert table["etag"] == '"{}"'.format(LOG[2]) and table["dataset_format"] == "delta"
+    # The data file was under a known root: dropped without a probe
+    assert grouper.members_skipped == 1 and client.probed == []
+
+
+def test_table_stays_pending_until_the_listing_leaves_its_log():
+    grouper = DeltaTableGrouper(FakeBlobClient(LOG), "raw")
+    assert grouper.group([blob(path) for path in LOG[:2]]) == []
+    assert grouper.pending == 1
+    grouped = grouper.group([blob(path) for path in LOG[2:]])
+    assert grouped == [] and grouper.pending == 1
+    table, = grouper.flush()
+    assert table["metadata"]["delta_log_latest"] == "00000000000000000001.json"
+    assert grouper.pending == 0
+
+
+def test_listed_through_emits_a_table_whose_last_page_was_filtered_out():
+    grouper = DeltaTableGrouper(FakeBlobClient(LOG), "raw")
+    grouped = grouper.group([blob(LOG[0])], listed_through="sales/z.csv")
+    assert [record["full_path"] for record in grouped] == ["sales/orders"]
+
+
+def test_part_files_listed_before_the_log_are_resolved_by_a_cached_probe():
+    # An upper-case partition folder sorts ahead of _delta_log
+    parts = ["sales/orders/Region=EU/part-00000.parquet", "sales/orders/Region=EU/part-00001.parquet"]
+    client = FakeBlobClient(parts + LOG)
+    grouper = DeltaTableGrouper(client, "raw")
+    assert grouper.group([blob(path) for path in parts]) == []
+    assert client.probed == ["sales/orders/Region=EU/_delta_log/", "sales/orders/_delta_log/"]
+    assert grouper.members_skipped == 2 and grouper.probes == 2
+    assert grouper.table_root_of("sales/orders/Region=US/part-00000.parquet") == "sales/orders"
+    assert grouper.probes == 2
+
+
+@pytest.mark.parametrize("path", ["sales/readme.csv", "sales/2024/part-00000.parquet"])
+def test_plain_files_pass_through(path):
+    client = FakeBlobClient([path])
+    grouped = DeltaTableGrouper(client, "raw").group([blob(path)])
+    assert [record["full_path"] for record in grouped] == [path]
+    # Only Spark part files are worth a probe
+    assert client.probed == ([] if "part-" not in path else ["sales/2024/_delta_log/", "sales/_delta_log/"])
+
+
+@pytest.mark.parametrize("path, expected", [
+    ("sales/orders/dt=2024-01-01/region=eu/part-0.parquet", ("sales/orders", [("dt", "2024-01-01"), ("region", "eu")])),
+    ("sales/orders/dt=2024-01-01/late/part-0.parquet", ("sales/orders", [("dt", "2024-01-01")])),
+    ("dt=2024-01-01/part-0.parquet", None),
+    ("sales/_tmp=1/part-0.parquet", None),
+    ("sales/orders/part-0.parquet", None),
+])
+def test_hive_partitioning(path, expected):
+    assert hive_partitioning(path) == expected
+
+
+ORDERS = ["sales/orders/dt=2024-01-01/_SUCCESS",
+          "sales/orders/dt=2024-01-01/part-0.parquet",
+          "sales/orders/dt=2024-01-01/part-1.parquet",
+          "sales/orders/dt=2024-01-02/part-0.parquet"]
+
+
+def orders_page():
+    return [blob(path, size=100, hour=hour) for hour, path in zip((1, 1, 2, 3), ORDERS)]
+
+
+def test_partitioned_folder_collapses_into_one_dataset():
+    grouper = PartitionedDatasetGrouper()
+    grouped = grouper.group([blob("sales/a.csv")] + orders_page() + [blob("sales/z.csv")])
+    assert [record["full_path"] for record in grouped] == ["sales/a.csv", "sales/z.csv", "sales/orders"]
+    dataset = grouped[2]
+    # The newest file is the one whose schema is read; _SUCCESS is not a data file
+    assert dataset["representative"]["full_path"] == ORDERS[3]
+    assert (dataset["size"], dataset["etag"], dataset["last_modified"]) == (300, '"{}"'.format(ORDERS[3]), datetime(2024, 6, 1, 3, 0, 0))
+    assert dataset["partitioning"] == {
+        "style": "hive", "keys": ["dt"], "partition_count": 2, "file_count": 3, "total_bytes": 300,
+        "formats": {"parquet": 3}, "values": {"dt": {"distinct": 2, "min": "2024-01-01", "max": "2024-01-02"}},
+        "representative": ORDERS[3],
+    }
+    assert grouper.files_grouped == 3 and grouper.pending == 0
+
+
+def test_dataset_stays_pending_across_pages():
+    grouper = PartitionedDatasetGrouper()
+    page = orders_page()
+    assert grouper.group(page[:2]) == [] and grouper.pending == 1
+    assert grouper.group(page[2:]) == [] and grouper.pending == 1
+    dataset, = grouper.flush()
+    assert dataset["partitioning"]["file_count"] == 3
+
+
+def test_folder_of_hidden_files_only_is_not_a_dataset():
+    grouper = PartitionedDatasetGrouper()
+    assert grouper.group([blob(ORDERS[0])], listed_through="sales/z.csv") == []
+    assert grouper.pending == 0
+
+
+def test_delta_tables_are_not_regrouped():
+    table = dict(blob("sales/orders/dt=2024-01-01"), dataset_format="delta")
+    assert PartitionedDatasetGrouper().group([table]) == [table]
+
+
+class FakeListingClient:
+    def __init__(self, pages):
+        self.pages = pages
+
+    def iter_blob_pages(self, container_name, folder_path):
+        for page in self.pages:
+            yield [record for record in page if record["full_path"].startswith(folder_path)], None
+
+
+def test_event_driven_path_lists_just_the_dataset():
+    page = orders_page()
+    client = FakeListingClient([page[:2], page[2:]])
+    assert list_partitioned_dataset(client, "raw", "sales/orders")["partitioning"]["file_count"] == 3
+    assert list_partitioned_dataset(client, "raw", "sales/returns") is None
@@ -0,0 +1,137 @@
+import threading
+import time
+
+import pymysql
+import pytest
+
+from utils.db_pool import ConnectionPool
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.rollbacks = 0
+        self.alive = True
+
+    def ping(self, reconnect=False):
+        if not self.alive:
+            raise pymysql.err.OperationalError(2006, "MySQL server has gone away")
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def created():
+    return []
+
+
+@pytest.fixture
+def make_pool(created):
+    def creator():
+        conn = FakeConnection()
+        created.append(conn)
+        return conn
+
+    def make(**kwargs):
+        return ConnectionPool(creator=creator, **kwargs)
+    return make
+
+
+def test_connections_are_reused_and_rolled_back_on_return(make_pool, created):
+    pool = make_pool(max_size=2)
+    with pool.connection() as conn:
+        assert conn.rollbacks == 0
+    with pool.connection() as conn:
+        assert conn.rollbacks == 1
+    assert len(created) == 1
+    assert pool.stats()["checkouts"] == 2 and pool.stats()["creates"] == 1
+
+
+def test_returned_connection_cannot_be_used(make_pool):
+    conn = make_pool().connection()
+    conn.close()
+    with pytest.raises(pymysql.err.InterfaceError):
+        conn.ping()
+
+
+def test_exhausted_pool_raises_1040_after_wait_timeout(make_pool):
+    pool = make_pool(max_size=1, wait_timeout=0.05)
+    held = pool.connection()
+    with pytest.raises(pymysql.err.OperationalError) as excinfo:
+        pool.connection()
+    assert excinfo.value.args[0] == 1040
+    assert pool.stats()["timeouts"] == 1
+    held.close()
+
+
+def test_waiter_gets_the_returned_connection(make_pool, created):
+    pool = make_pool(max_size=1, wait_timeout=5)
+    held = pool.connection()
+    threading.Timer(0.05, held.close).start()
+    with pool.connection():
+        pass
+    assert len(created) == 1
+    assert pool.stats()["waits"] == 1
+
+
+def test_dead_connection_is_replaced_on_checkout(make_pool, created):
+    pool = make_pool()
+    with pool.connection():
+        pass
+    created[0].alive = False
+    with pool.connection():
+        pass
+    assert len(created) == 2 and created[0].closed
+    assert pool.stats()["ping_failures"] == 1
+
+
+def test_old_connection_is_recycled(make_pool, created):
+    pool = make_pool(max_age_seconds=0.01)
+    with pool.connection():
+        pass
+    time.sleep(0.02)
+    with pool.connection():
+        pass
+    assert len(created) == 2 and created[0].closed
+    assert pool.stats()["recycled"] >= 1
+
+
+def test_failed_connect_releases_its_slot(make_pool):
+    attempts = []
+
+    def failing_creator():
+        attempts.append(1)
+        raise pymysql.err.OperationalError(2003, "Can't connect")
+
+    pool = ConnectionPool(creator=failing_creator, max_size=1, wait_timeout=0.05)
+    for _ in range(2):
+        with pytest.raises(pymysql.err.OperationalError) as excinfo:
+            pool.connection()
+        assert excinfo.value.args[0] == 2003
+    assert len(attempts) == 2 and pool.stats()["size"] == 0
+
+
+def test_leaked_connection_frees_its_slot(make_pool):
+    pool = make_pool(max_size=1, wait_timeout=0.05)
+    pool.connection()  # dropped without close()
+    with pool.connection():
+        pass
+    assert pool.stats()["leaked"] == 1
+
+
+def test_close_closes_idle_connections_and_refuses_checkouts(make_pool, created):
+    pool = make_pool()
+    held = pool.connection()
+    with pool.connection():
+        pass
+    pool.close()
+    assert created[1].closed and not created[0].closed
+    held.close()
+    assert created[0].closed
+    with pytest.raises(pymysql.err.InterfaceError):
+        pool.connection()
+    assert pool.stats()["size"] == 0
@@ -0,0 +1,118 @@
+import hashlib
+
+import pytest
+
+import utils.deduplication as deduplication
+from utils.deduplication import DedupIndex, needs_reclassification, storage_location_hash
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=()):
+        self.db.statements.append((" ".join(sql.split()), list(params)))
+        if "COUNT(*)" in sql:
+            storage_type, account, container, _ = params
+            self._rows = [{"total": sum(1 for row in self.db.rows if row[:3] == (storage_type, account, container))}]
+        elif "storage_location_hash IN" in sql:
+            self._rows = [(row[3],) + row[4:] for row in self.db.rows if storage_location_hash(*row[:4]) in params]
+        else:
+            storage_type, account, container, _ = params
+            self._rows = [(row[3],) + row[4:] for row in self.db.rows if row[:3] == (storage_type, account, container)]
+
+    def fetchone(self):
+        return self._rows[0]
+
+    def fetchall(self):
+        return self._rows
+
+    def __iter__(self):
+        return iter(self._rows)
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self, *args):
+        return FakeCursor(self.db)
+
+    def close(self):
+        pass
+
+
+class FakeDB:
+    def __init__(self, rows):
+        # (storage_type, account, container, path, id, file_hash, schema_hash, is_active, has_unclassified_columns)
+        self.rows = rows
+        self.statements = []
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDB([
+        ("azure_blob", "acc", "a", "sales/x.csv", 1, "fa", "sa", 1, 0),
+        ("azure_blob", "acc", "b", "sales/x.csv", 2, "fb", "sb", 1, 1),
+    ])
+    monkeypatch.setattr(deduplication, "get_db_connection", lambda: FakeConnection(fake))
+    return fake
+
+
+def test_storage_location_hash_matches_the_generated_column():
+    expected = hashlib.sha256("azure_blob\0acc\0raw\0sales/x.csv".encode("utf-8")).hexdigest()
+    assert storage_location_hash("azure_blob", "acc", "raw", "sales/x.csv") == expected
+    assert storage_location_hash("azure_blob", "acc", None, "x") == hashlib.sha256(b"azure_blob\0acc\0\0x").hexdigest()
+
+
+def test_same_path_in_two_containers_has_two_keys():
+    assert storage_location_hash("azure_blob", "acc", "a", "sales/x.csv") != storage_location_hash("azure_blob", "acc", "b", "sales/x.csv")
+
+
+@pytest.mark.parametrize("container, expected_id", [("a", 1), ("b", 2)])
+def test_loaded_index_only_holds_its_container(db, container, expected_id):
+    index = DedupIndex("azure_blob", "acc", container, "sales").load()
+    assert index.in_memory
+    assert index.get("sales/x.csv")["id"] == expected_id
+    assert all(params[2] == container for _, params in db.statements)
+
+
+@pytest.mark.parametrize("container, expected_id", [("a", 1), ("b", 2), ("c", None)])
+def test_lookups_key_on_the_container(db, container, expected_id):
+    index = DedupIndex.for_lookups("azure_blob", "acc", container, "sales")
+    index.prefetch(["sales/x.csv"])
+    found = index.get("sales/x.csv")
+    assert (found["id"] if found else None) == expected_id
+
+
+def test_index_carries_the_unclassified_flag(db):
+    index = DedupIndex("azure_blob", "acc", "b", "sales").load()
+    assert index.get("sales/x.csv")["has_unclassified_columns"] is True
+
+
+@pytest.mark.parametrize("record, dlp_configured, expected", [
+    ({"has_unclassified_columns": True}, True, True),
+    ({"has_unclassified_columns": True}, False, False),
+    ({"has_unclassified_columns": False}, True, False),
+    (None, True, False),
+])
+def test_needs_reclassification_only_with_dlp_configured(record, dlp_configured, expected):
+    assert needs_reclassification(record, dlp_configured) is expected
+
+
+def test_partitioned_index_only_holds_its_shards_rows(monkeypatch):
+    from utils.discovery_pipeline import in_partition, partition_key
+    paths = ["sales/{}.csv".format(i) for i in range(20)] + ["sales/t/_delta_log/0000{}.json".format(i) for i in range(3)]
+    fake = FakeDB([("azure_blob", "acc", "a", path, i, "f", "s", 1, 0) for i, path in enumerate(paths)])
+    monkeypatch.setattr(deduplication, "get_db_connection", lambda: FakeConnection(fake))
+    indexes = [DedupIndex("azure_blob", "acc", "a", "sales", partition=p, partition_count=3).load() for p in range(3)]
+    assert sum(len(index) for index in indexes) == len(paths)
+    for p, index in enumerate(indexes):
+        assert all((index.get(path) is not None) == in_partition(partition_key(path), p, 3) for path in paths)
@@ -0,0 +1,146 @@
+from datetime import datetime
+
+import pytest
+
+import utils.deletion_sweep as deletion_sweep
+from utils.deletion_sweep import DeletionSweep
+from utils.discovery_pipeline import in_partition, partition_key
+
+WALK_STARTED_AT = datetime(2024, 6, 1, 12, 0, 0)
+BEFORE = datetime(2024, 6, 1, 11, 0, 0)
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=()):
+        if "SELECT NOW()" in sql:
+            self._rows = [{"walk_started_at": WALK_STARTED_AT}]
+        elif sql.lstrip().startswith("SELECT"):
+            storage_type, account, container, like, discovered_before, checked_before = params
+            prefix = like[:-1].replace("\\_", "_")
+            self._rows = [(row["id"], row["path"]) for row in self.db.rows
+                          if (row["type"], row["account"], row["container"]) == (storage_type, account, container)
+                          and row["path"].startswith(prefix) and row["active"]
+                          and row["discovered_at"] < discovered_before
+                          and (row["checked_at"] is None or row["checked_at"] < checked_before)]
+        else:
+            ids = set(params)
+            self.rowcount = 0
+            for row in self.db.rows:
+                if row["id"] in ids and row["active"]:
+                    row["active"] = False
+                    self.rowcount += 1
+            self.db.updates += 1
+
+    def fetchone(self):
+        return self._rows[0]
+
+    def __iter__(self):
+        return iter(self._rows)
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self, *args):
+        return FakeCursor(self.db)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeDB:
+    def __init__(self):
+        self.rows = []
+        self.updates = 0
+
+    def add(self, path, container="a", discovered_at=BEFORE, checked_at=None, active=True):
+        self.rows.append({"id": len(self.rows) + 1, "type": "azure_blob", "account": "acc", "container": container,
+                          "path": path, "discovered_at": discovered_at, "checked_at": checked_at, "active": active})
+
+    def active(self):
+        return sorted((row["container"], row["path"]) for row in self.rows if row["active"])
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDB()
+    monkeypatch.setattr(deletion_sweep, "get_db_connection", lambda: FakeConnection(fake))
+    return fake
+
+
+def sweep(paths, container="a", folder_path="sales", **kwargs):
+    deletion = DeletionSweep("azure_blob", "acc", container, folder_path, **kwargs)
+    deletion.begin()
+    deletion.mark(paths)
+    return deletion, deletion.sweep()
+
+
+def test_unlisted_rows_are_marked_deleted(db):
+    db.add("sales/kept.csv")
+    db.add("sales/gone.csv")
+    db.add("other/outside_prefix.csv")
+    deletion, deleted = sweep(["sales/kept.csv"])
+    assert deleted == 1 and deletion.rows_checked == 2
+    assert db.active() == [("a", "other/outside_prefix.csv"), ("a", "sales/kept.csv")]
+
+
+def test_other_containers_are_left_alone(db):
+    db.add("sales/x.csv", container="a")
+    db.add("sales/x.csv", container="b")
+    db.add("sales/only_in_b.csv", container="b")
+    _, deleted = sweep(["sales/x.csv"], container="a")
+    assert deleted == 0
+    assert db.active() == [("a", "sales/x.csv"), ("b", "sales/only_in_b.csv"), ("b", "sales/x.csv")]
+
+
+def test_rows_written_after_the_walk_started_are_kept(db):
+    db.add("sales/listed.csv")
+    db.add("sales/new_during_walk.csv", discovered_at=datetime(2024, 6, 1, 12, 5))
+    db.add("sales/checked_during_walk.csv", checked_at=datetime(2024, 6, 1, 12, 0, 0))
+    _, deleted = sweep(["sales/listed.csv"])
+    assert deleted == 0
+
+
+def test_empty_listing_sweeps_nothing(db):
+    db.add("sales/x.csv")
+    _, deleted = sweep([])
+    assert deleted == 0 and db.updates == 0
+
+
+def test_partitions_only_sweep_their_own_rows(db):
+    paths = ["sales/f{}.csv".format(i) for i in range(40)]
+    for path in paths:
+        db.add(path)
+    _, deleted = sweep(["sales/unrelated.csv"], partition=1, partition_count=3)
+    own = [path for path in paths if in_partition(partition_key(path), 1, 3)]
+    assert deleted == len(own)
+    assert db.active() == sorted(("a", path) for path in paths if path not in own)
+
+
+def test_batches_updates(db):
+    for i in range(5):
+        db.add("sales/f{}.csv".format(i))
+    _, deleted = sweep(["sales/listed.csv"], batch_rows=2)
+    assert deleted == 5 and db.updates == 3
+
+
+def test_sweep_requires_begin(db):
+    with pytest.raises(RuntimeError):
+        DeletionSweep("azure_blob", "acc", "a", "sales").sweep()
@@ -0,0 +1,221 @@
+import zlib
+from datetime import datetime
+
+import pytest
+
+import utils.deduplication as deduplication
+import utils.discovery_pipeline as discovery_pipeline
+import utils.metadata_extractor as metadata_extractor
+from utils.discovery_pipeline import (fingerprint_blob, in_partition, partition_key, sample_and_extract, select_changed_blobs,
+                                      shard_scope)
+from utils.metadata_extractor import compute_change_fingerprint, generate_schema_hash, has_unclassified_columns
+
+
+def blob(name, size=100, etag='"0x1"'):
+    return {"name": name.rsplit("/", 1)[-1], "full_path": name, "size": size, "etag": etag,
+            "last_modified": datetime(2024, 6, 1, 12, 0, 0), "created_at": datetime(2024, 6, 1, 12, 0, 0)}
+
+
+def fingerprinted(blob_info, existing_record=None):
+    return {"blob_info": blob_info, "blob_path": blob_info["full_path"], "existing_record": existing_record,
+            "file_hash": "fingerprint", "unchanged": False, "reactivate": False}
+
+
+class FailingBlobClient:
+    def get_blob_sample(self, *args, **kwargs):
+        raise ConnectionError("connection reset")
+
+    get_parquet_footer = get_blob_suffix = get_blob_sample
+
+
+class EmptyBlobClient:
+    def get_blob_sample(self, *args, **kwargs):
+        return b""
+
+
+@pytest.mark.parametrize("name", ["data/a.csv", "data/a.parquet", "data/a.orc"])
+def test_failed_sample_read_raises_instead_of_writing_an_empty_schema(name):
+    with pytest.raises(ConnectionError):
+        sample_and_extract(FailingBlobClient(), "c", fingerprinted(blob(name)))
+
+
+def test_empty_blob_still_gets_the_minimal_record():
+    prepared = sample_and_extract(EmptyBlobClient(), "c", fingerprinted(blob("data/a.csv", size=0)))
+    assert prepared["metadata"]["schema_json"] == {}
+    assert prepared["schema_hash"] == generate_schema_hash({})
+    assert prepared["should_update"] is True
+
+
+class CsvBlobClient:
+    def get_blob_sample(self, *args, **kwargs):
+        return b"ledger_code,memo_text\n1,2\n"
+
+
+class FakeIndex:
+    """The stored rows as DedupIndex.get returns them, has_unclassified_columns as the generated column computes it."""
+
+    def __init__(self):
+        self.records = {}
+        self.schemas = {}
+
+    def get(self, path):
+        return self.records.get(path)
+
+    def store(self, prepared, is_active=True):
+        schema_json = prepared["metadata"]["schema_json"]
+        self.schemas[1] = schema_json
+        self.records[prepared["blob_path"]] = {"id": 1, "file_hash": prepared["file_hash"], "schema_hash": prepared["schema_hash"],
+                                              "is_active": is_active, "has_unclassified_columns": has_unclassified_columns(schema_json)}
+
+
+@pytest.fixture
+def dlp(monkeypatch):
+    state = {"up": False}
+
+    def detect(names):
+        if not state["up"]:
+            return [{"pii_detected": False, "pii_types": [], "source": "unclassified"} for _ in names]
+        return [{"pii_detected": name == "memo_text", "pii_types": ["Person"] if name == "memo_text" else [], "source": "azure_dlp"}
+                for name in names]
+
+    monkeypatch.setattr(metadata_extractor, "detect_pii_in_columns", detect)
+    monkeypatch.setitem(deduplication.AZURE_AI_LANGUAGE_CONFIG, "enabled", True)
+    return state
+
+
+def run_once(index, blob_info):
+    fingerprinted = fingerprint_blob(index, blob_info)
+    if fingerprinted["unchanged"]:
+        return fingerprinted, None
+    return fingerprinted, sample_and_extract(CsvBlobClient(), "c", fingerprinted)
+
+
+def test_new_file_seen_during_dlp_outage_is_classified_after_recovery(dlp, monkeypatch):
+    index = FakeIndex()
+    monkeypatch.setattr(discovery_pipeline, "load_schema_json", lambda record_id: index.schemas.get(record_id))
+    blob_info = blob("data/a.csv")
+
+    _, prepared = run_once(index, blob_info)
+    assert prepared["should_update"] is True
+    index.store(prepared)
+    assert index.get("data/a.csv")["has_unclassified_columns"] is True
+
+    # Still down: sampled again, nothing new to write
+    fingerprinted, prepared = run_once(index, blob_info)
+    assert fingerprinted["reclassify"] is True
+    assert prepared["should_update"] is False
+
+    # Recovered: same fingerprint, but the classification is now a schema change
+    dlp["up"] = True
+    _, prepared = run_once(index, blob_info)
+    assert (prepared["should_update"], prepared["schema_changed"]) == (True, True)
+    columns = {column["name"]: column for column in prepared["metadata"]["schema_json"]["columns"]}
+    assert columns["memo_text"]["pii_detected"] is True
+    assert columns["memo_text"]["pii_source"] == "azure_dlp"
+    index.store(prepared)
+
+    fingerprinted, prepared = run_once(index, blob_info)
+    assert fingerprinted["unchanged"] is True
+
+
+def test_unclassified_rows_are_left_alone_without_a_dlp_endpoint(dlp, monkeypatch):
+    monkeypatch.setitem(deduplication.AZURE_AI_LANGUAGE_CONFIG, "enabled", False)
+    index = FakeIndex()
+    blob_info = blob("data/a.csv")
+    index.store(run_once(index, blob_info)[1])
+    assert run_once(index, blob_info)[0]["unchanged"] is True
+
+
+def test_deleted_unclassified_row_is_reactivated_when_dlp_is_still_down(dlp, monkeypatch):
+    index = FakeIndex()
+    monkeypatch.setattr(discovery_pipeline, "load_schema_json", lambda record_id: index.schemas.get(record_id))
+    blob_info = blob("data/a.csv")
+    index.store(run_once(index, blob_info)[1], is_active=False)
+
+    fingerprinted, prepared = run_once(index, blob_info)
+    assert fingerprinted["reclassify"] and fingerprinted["reactivate"]
+    assert prepared["should_update"] is False
+    assert prepared["reactivate"] is True
+
+
+def test_shard_scope_keeps_unsharded_folders_unchanged():
+    assert shard_scope("sales") == "sales"
+    assert shard_scope("sales", 0, 1) == "sales"
+    assert shard_scope("sales", 2, 4) == "sales#2/4"
+    assert shard_scope("", 0, 2) == "#0/2"
+
+
+def test_every_path_is_in_exactly_one_partition():
+    paths = ["sales/{}.csv".format(i) for i in range(200)]
+    assert all(sum(in_partition(path, p, 4) for p in range(4)) == 1 for path in paths)
+    assert {p for path in paths for p in range(4) if in_partition(path, p, 4)} == {0, 1, 2, 3}
+    # Not hash(): the same shard in every worker process
+    assert in_partition("sales/0.csv", zlib.crc32(b"sales/0.csv") % 4, 4)
+
+
+@pytest.mark.parametrize("path, key", [
+    ("sales/orders/_delta_log/00000000000000000001.json", "sales/orders"),
+    ("sales/orders/dt=2024-01-01/region=eu/part-0.parquet", "sales/orders"),
+    ("sales/orders/part-0.parquet", "sales/orders/part-0.parquet"),
+    ("dt=2024-01-01/part-0.parquet", "dt=2024-01-01/part-0.parquet"),
+])
+def test_partition_key_is_the_dataset_root(path, key):
+    assert partition_key(path) == key
+
+
+def test_a_dataset_lands_in_one_shard():
+    members = ["sales/orders/_delta_log/00000000000000000001.json", "sales/orders/_delta_log/00000000000000000002.json",
+               "sales/orders/dt=2024-01-01/part-0.parquet", "sales/orders/dt=2024-01-02/part-0.parquet"]
+    assert len({next(p for p in range(8) if in_partition(partition_key(path), p, 8)) for path in members}) == 1
+
+
+def test_change_fingerprint_comes_from_the_listing_only():
+    fingerprint = compute_change_fingerprint(blob("data/a.csv"))
+    # Quoted or bare ETags (listing vs event payload) give the same fingerprint
+    assert compute_change_fingerprint(blob("data/a.csv", etag="0x1")) == fingerprint
+    assert compute_change_fingerprint(blob("data/a.csv", etag='"0x2"')) != fingerprint
+    assert compute_change_fingerprint(blob("data/a.csv", size=101)) != fingerprint
+    assert compute_change_fingerprint(dict(blob("data/a.csv"), last_modified=datetime(2024, 6, 2))) != fingerprint
+
+
+def test_stored_fingerprint_round_trips_to_unchanged(dlp):
+    dlp["up"] = True
+    index = FakeIndex()
+    first, prepared = run_once(index, blob("data/a.csv"))
+    assert first["existing_record"] is None and prepared["should_update"] is True
+    assert prepared["metadata"]["file_metadata"]["hash"]["value"] == first["file_hash"]
+    index.store(prepared)
+
+    again, prepared = run_once(index, blob("data/a.csv"))
+    assert again["unchanged"] is True and prepared is None
+
+    # Rewritten with the same header: the fingerprint is refreshed, the schema is kept
+    changed, prepared = run_once(index, blob("data/a.csv", etag='"0x2"'))
+    assert changed["unchanged"] is False
+    assert (prepared["should_update"], prepared["schema_changed"]) == (True, False)
+
+
+class PrefetchingIndex(FakeIndex):
+    lookup_chunk_size = 2
+
+    def __init__(self):
+        super().__init__()
+        self.prefetched = []
+
+    def prefetch(self, paths):
+        self.prefetched.append(list(paths))
+
+
+def test_only_new_and_changed_blobs_reach_the_sampling_phase(dlp):
+    dlp["up"] = True
+    index = PrefetchingIndex()
+    for name in ("data/a.csv", "data/b.csv", "data/c.csv"):
+        index.store(run_once(index, blob(name))[1])
+    index.prefetched.clear()
+
+    listing = [blob("data/a.csv"), blob("data/b.csv", etag='"0x2"'), blob("data/c.csv"), blob("data/d.csv")]
+    changed, unchanged_count = select_changed_blobs(index, listing)
+    assert [item["blob_path"] for item in changed] == ["data/b.csv", "data/d.csv"]
+    assert unchanged_count == 2
+    # Dedup rows are looked up a chunk at a time, before the chunk is fingerprinted
+    assert index.prefetched == [["data/a.csv", "data/b.csv"], ["data/c.csv", "data/d.csv"]]
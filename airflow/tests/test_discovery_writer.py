@@ -0,0 +1,182 @@
+import json
+
+import pytest
+
+import utils.discovery_writer as discovery_writer
+from utils.deduplication import storage_location_hash
+from utils.discovery_writer import DiscoveryBatchWriter
+
+ACCOUNT = "account"
+CONTAINER = "raw"
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=()):
+        params = list(params)
+        # Every builder must bind exactly one parameter per placeholder
+        assert sql.count("%s") == len(params), sql
+        self.db.statements.append((" ".join(sql.split()), params))
+        if self.db.fail_on and any(self.db.fail_on in str(p) for p in params):
+            raise ValueError("rejected row")
+        if sql.lstrip().startswith("INSERT") and "storage_location_hash" not in sql:
+            self.db.insert(sql, params)
+        elif sql.lstrip().startswith("SELECT"):
+            self._rows = [{"id": self.db.ids[h], "storage_location_hash": h} for h in params if h in self.db.ids]
+
+    def fetchall(self):
+        return self._rows
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self, *args):
+        return FakeCursor(self.db)
+
+    def commit(self):
+        self.db.commits += 1
+
+    def rollback(self):
+        self.db.rollbacks += 1
+
+    def close(self):
+        pass
+
+
+class FakeDB:
+    def __init__(self):
+        self.statements = []
+        self.ids = {}
+        self.commits = 0
+        self.rollbacks = 0
+        self.fail_on = None
+
+    def insert(self, sql, params):
+        if " id," in sql.split("VALUES")[0]:
+            return
+        # storage_location JSON is the first value of each 12-value row
+        for location in map(json.loads, params[::12]):
+            key = storage_location_hash(location["type"], location["connection"]["account_name"], location["container"]["name"], location["path"])
+            self.ids.setdefault(key, max(self.ids.values(), default=0) + 1)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDB()
+    monkeypatch.setattr(discovery_writer, "get_db_connection", lambda: FakeConnection(fake))
+    return fake
+
+
+def location(path, container=CONTAINER):
+    return {"type": "azure_blob", "path": path, "connection": {"account_name": ACCOUNT}, "container": {"name": container}}
+
+
+def metadata(name):
+    return {"file_metadata": {"basic": {"name": name}}, "schema_json": {"columns": []}, "storage_metadata": {}}
+
+
+def add_insert(writer, path, container=CONTAINER):
+    return writer.add_insert(location(path, container), metadata(path), "hash", {}, "prod", "prod", None, "")
+
+
+def statements(db, verb):
+    return [(sql, params) for sql, params in db.statements if sql.startswith(verb)]
+
+
+def test_rows_are_buffered_until_flush(db):
+    writer = DiscoveryBatchWriter(flush_rows=10, flush_interval=3600)
+    assert add_insert(writer, "a.csv") == []
+    assert writer.pending == 1 and db.statements == []
+
+
+def test_one_transaction_per_flush(db):
+    writer = DiscoveryBatchWriter(flush_rows=100, flush_interval=3600)
+    add_insert(writer, "a.csv")
+    add_insert(writer, "b.csv")
+    writer.add_update(7, location("c.csv"), metadata("c.csv"), "hash2", {}, "prod", "prod", None, "")
+    writer.add_refresh(8, metadata("d.csv"), "d.csv")
+    writer.add_touch(9, "e.csv")
+    writer.add_touch(10, "f.csv")
+    writer.add_delete("azure_blob", ACCOUNT, CONTAINER, "g.csv")
+
+    written = writer.flush()
+
+    assert db.commits == 1 and writer.pending == 0 and writer.rows_written == 7
+    assert [row["storage_path"] for row in written] == ["a.csv", "b.csv", "c.csv"]
+    insert_sql, insert_params = statements(db, "INSERT")[0]
+    assert insert_sql.count("NOW(), 'pending'") == 2 and len(insert_params) == 24
+    assert "AS new ON DUPLICATE KEY UPDATE file_metadata = new.file_metadata" in " ".join(insert_sql.split())
+    assert "VALUES(" not in insert_sql
+    upsert_sql, upsert_params = statements(db, "INSERT")[1]
+    assert upsert_params[0] == 7 and len(upsert_params) == 13
+    refresh_sql, refresh_params = [s for s in statements(db, "UPDATE") if "CASE id" in s[0]][0]
+    assert refresh_params[-1] == 8
+    touch_sql, touch_params = [s for s in statements(db, "UPDATE") if "last_checked_at = NOW(), is_active = TRUE" in s[0] and "CASE" not in s[0]][0]
+    assert touch_params == [9, 10]
+    delete_sql, delete_params = [s for s in statements(db, "UPDATE") if "is_active = FALSE" in s[0]][0]
+    assert delete_params == [storage_location_hash("azure_blob", ACCOUNT, CONTAINER, "g.csv")]
+
+
+def test_flushes_when_the_batch_is_full(db):
+    writer = DiscoveryBatchWriter(flush_rows=2, flush_interval=3600)
+    add_insert(writer, "a.csv")
+    written = add_insert(writer, "b.csv")
+    assert [row["id"] for row in written] == [1, 2]
+    assert writer.flush_count == 1
+
+
+def test_existing_rows_are_not_new_discoveries(db):
+    db.ids[storage_location_hash("azure_blob", ACCOUNT, CONTAINER, "old.csv")] = 42
+    writer = DiscoveryBatchWriter(flush_rows=100, flush_interval=3600)
+    add_insert(writer, "old.csv")
+    add_insert(writer, "new.csv")
+    assert [(row["id"], row["storage_path"]) for row in writer.flush()] == [(43, "new.csv")]
+
+
+def test_a_bad_row_falls_back_to_per_row_writes(db):
+    writer = DiscoveryBatchWriter(flush_rows=100, flush_interval=3600)
+    add_insert(writer, "a.csv")
+    add_insert(writer, "bad.csv")
+    writer.add_touch(5, "c.csv")
+    db.fail_on = "bad.csv"
+
+    written = writer.flush()
+
+    assert [row["storage_path"] for row in written] == ["a.csv"]
+    assert [row["storage_path"] for row in writer.take_failed()] == ["bad.csv"]
+    assert writer.take_failed() == []
+    # Batch attempt, then a.csv, bad.csv and the touch one by one
+    assert db.rollbacks == 2 and db.commits == 2
+    assert writer.rows_written == 2
+
+
+def test_same_path_in_two_containers_is_two_rows(db):
+    writer = DiscoveryBatchWriter(flush_rows=100, flush_interval=3600)
+    add_insert(writer, "x.csv", container="a")
+    add_insert(writer, "x.csv", container="b")
+    written = writer.flush()
+    assert len({row["id"] for row in written}) == 2
+
+    writer.add_delete("azure_blob", ACCOUNT, "a", "x.csv")
+    writer.flush()
+    assert statements(db, "UPDATE")[-1][1] == [storage_location_hash("azure_blob", ACCOUNT, "a", "x.csv")]
+
+
+def test_failed_rows_carry_their_container(db):
+    writer = DiscoveryBatchWriter(flush_rows=100, flush_interval=3600)
+    writer.add_touch(987654321, "bad.csv", "b")
+    writer.add_delete("azure_blob", ACCOUNT, "a", "bad.csv")
+    db.fail_on = "987654321"
+    writer.flush()
+    assert [(row["container_name"], row["storage_path"]) for row in writer.take_failed()] == [("b", "bad.csv")]
@@ -0,0 +1,134 @@
+import io
+import json
+from decimal import Decimal
+
+import pytest
+
+from utils.format_headers import (AVRO_MAGIC, avro_type_name, delta_commit_scanned, find_delta_metadata, orc_tail_length,
+                                  parse_avro_header, parse_orc_tail, snappy_decompress)
+
+
+def zigzag(value):
+    value = (value << 1) ^ (value >> 63)
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def avro_bytes(value):
+    return zigzag(len(value)) + value
+
+
+def avro_header(metadata, sync=b"S" * 16, negative_block=False):
+    entries = b"".join(avro_bytes(key.encode()) + avro_bytes(value) for key, value in metadata.items())
+    count = zigzag(-len(metadata)) + zigzag(len(entries)) if negative_block else zigzag(len(metadata))
+    return AVRO_MAGIC + count + entries + zigzag(0) + sync
+
+
+SCHEMA = json.dumps({"type": "record", "name": "r", "fields": [{"name": "id", "type": "long"}]}).encode()
+
+
+@pytest.mark.parametrize("negative_block", [False, True])
+def test_avro_header(negative_block):
+    header = avro_header({"avro.schema": SCHEMA, "avro.codec": b"deflate"}, negative_block=negative_block)
+    parsed = parse_avro_header(header + b"first block")
+    assert parsed == {"metadata": {"avro.schema": SCHEMA, "avro.codec": b"deflate"}, "header_length": len(header)}
+
+
+def test_avro_header_truncated_anywhere_returns_none():
+    header = avro_header({"avro.schema": SCHEMA})
+    for end in range(1, len(header)):
+        assert parse_avro_header(header[:end]) is None
+
+
+def test_not_avro_raises():
+    with pytest.raises(ValueError):
+        parse_avro_header(b"PAR1....")
+
+
+@pytest.mark.parametrize("avro_type, expected", [
+    ("long", ("long", False)),
+    (["null", "string"], ("string", True)),
+    (["null", "int", "string"], ("union<int,string>", True)),
+    ({"type": "bytes", "logicalType": "decimal", "precision": 10, "scale": 2}, ("decimal(10,2)", False)),
+    ({"type": "int", "logicalType": "date"}, ("date", False)),
+    ({"type": "array", "items": "string"}, ("array<string>", False)),
+    ({"type": "map", "values": "long"}, ("map<string,long>", False)),
+    ({"type": "record", "name": "n", "fields": [{"name": "a", "type": "int"}]}, ("struct<a:int>", False)),
+    ({"type": "enum", "name": "e", "symbols": ["A"]}, ("enum", False)),
+])
+def test_avro_type_name(avro_type, expected):
+    assert avro_type_name(avro_type) == expected
+
+
+@pytest.fixture(scope="module")
+def orc_table():
+    pa = pytest.importorskip("pyarrow")
+    pytest.importorskip("pyarrow.orc")
+    return pa.table({
+        "id": pa.array([1, 2], pa.int64()),
+        "name": ["a", "b"],
+        "price": pa.array([Decimal("1.50"), Decimal("2.25")], pa.decimal128(10, 2)),
+        "tags": pa.array([["x"], []], pa.list_(pa.string())),
+    })
+
+
+@pytest.mark.parametrize("compression, expected", [("uncompressed", "none"), ("zlib", "zlib"), ("snappy", "snappy")])
+def test_orc_tail(orc_table, compression, expected):
+    from pyarrow import orc
+    buffer = io.BytesIO()
+    orc.write_table(orc_table, buffer, compression=compression)
+    data = buffer.getvalue()
+
+    tail_length = orc_tail_length(data[-64:])
+    tail = parse_orc_tail(data[-tail_length:])
+    assert tail["compression"] == expected
+    assert tail["num_rows"] == 2
+    assert tail["stripes"] == 1
+    assert tail["columns"] == [
+        {"name": "id", "type": "bigint", "nullable": True},
+        {"name": "name", "type": "string", "nullable": True},
+        {"name": "price", "type": "decimal(10,2)", "nullable": True},
+        {"name": "tags", "type": "array<string>", "nullable": True},
+    ]
+
+
+@pytest.mark.parametrize("tail", [b"", b"\x05", b"not an orc file at all\x04"])
+def test_orc_tail_length_rejects_non_orc_or_short_tails(tail):
+    assert orc_tail_length(tail) is None
+
+
+@pytest.mark.parametrize("compressed, expected", [
+    (b"\x05\x10hello", b"hello"),
+    # "ab" literal, then a 1-byte-offset copy of 6 bytes overlapping its own output
+    (b"\x08\x04ab\x09\x02", b"abababab"),
+])
+def test_snappy_decompress(compressed, expected):
+    assert snappy_decompress(compressed) == expected
+
+
+def test_snappy_length_mismatch_raises():
+    with pytest.raises(ValueError):
+        snappy_decompress(b"\x09\x10hello")
+
+
+def test_delta_metadata_and_commit_scan():
+    metadata = {"id": "t", "schemaString": "{}", "partitionColumns": []}
+    commit = b"\n".join([
+        json.dumps({"commitInfo": {}}).encode(),
+        json.dumps({"metaData": metadata}).encode(),
+        json.dumps({"add": {"path": "part-0.parquet"}}).encode(),
+    ])
+    assert find_delta_metadata(commit) == metadata
+    assert delta_commit_scanned(commit)
+
+    truncated = commit[:commit.index(b'"metaData"') + 20]
+    assert find_delta_metadata(truncated) is None
+    assert not delta_commit_scanned(truncated)
+    assert delta_commit_scanned(b'{"commitInfo": {}}\n{"add": {"path": "p"}}\n{"add"')
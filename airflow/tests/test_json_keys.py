@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+from utils.json_keys import TopLevelKeyScanner, scan_top_level_keys
+
+
+@pytest.mark.parametrize("document, keys, structure", [
+    ('{"id": 1, "name": "a", "tags": ["x", "y"], "nested": {"inner": true}}', ["id", "name", "tags", "nested"], "object"),
+    ('[{"a": null, "b": -1.5e3}, {"c": 2}]', ["a", "b"], "array"),
+    ('{"id": 1}\n{"other": 2}\n', ["id"], "object"),
+    ('\ufeff  {"k": "v"}', ["k"], "object"),
+    ('{"quote\\"d": "a } ] ,", "esc\\u00e9": 1}', ['quote"d', "escé"], "object"),
+    ('{}', [], "object"),
+])
+def test_complete_documents(document, keys, structure):
+    scanner = scan_top_level_keys(document.encode("utf-8"))
+    assert scanner.complete and scanner.error is None
+    assert scanner.keys == keys
+    assert scanner.structure == structure
+
+
+@pytest.mark.parametrize("document, scalar_items", [("[]", False), ("[1, 2, 3]", True), ('["a"]', True)])
+def test_arrays_without_objects(document, scalar_items):
+    scanner = scan_top_level_keys(document.encode("utf-8"))
+    assert scanner.complete and scanner.keys == []
+    assert scanner.scalar_items is scalar_items
+
+
+def test_truncated_sample_keeps_keys_seen_so_far():
+    scanner = scan_top_level_keys(b'{"id": 1, "payload": {"deep": [1, 2, {"x": "unfinished')
+    assert not scanner.complete
+    assert scanner.keys == ["id", "payload"]
+
+
+def test_feeding_byte_by_byte_matches_a_single_feed():
+    document = json.dumps({"café": 1, "list": [{"a": 1}], "text": "multi\nline ☃"}).encode("utf-8")
+    scanner = TopLevelKeyScanner()
+    for offset in range(len(document)):
+        scanner.feed(document[offset:offset + 1])
+    assert scanner.complete
+    assert scanner.keys == scan_top_level_keys(document).keys == ["café", "list", "text"]
+
+
+def test_stops_at_the_end_of_the_first_object():
+    scanner = TopLevelKeyScanner()
+    assert scanner.feed(b'{"a": 1}') is True
+    assert scanner.feed(b'{"ignored": 2}') is True
+    assert scanner.keys == ["a"]
+
+
+@pytest.mark.parametrize("document", ["plain text", '{"a" 1}', '{a: 1}', '{"a": 1 "b": 2}'])
+def test_malformed_documents_finish_with_an_error(document):
+    scanner = scan_top_level_keys(document.encode("utf-8"))
+    assert scanner.complete
+    assert scanner.error
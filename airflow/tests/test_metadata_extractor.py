@@ -0,0 +1,74 @@
+import io
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import utils.metadata_extractor as metadata_extractor
+from utils.metadata_extractor import ParsedSchema, extract_file_metadata, generate_schema_hash
+
+
+def blob(name, size=100):
+    return {"name": name, "full_path": "data/" + name, "size": size, "etag": '"0x1"',
+            "last_modified": datetime(2024, 6, 1, 12, 0, 0), "created_at": datetime(2024, 6, 1, 12, 0, 0)}
+
+
+@pytest.fixture
+def dlp_calls(monkeypatch):
+    calls = []
+
+    def detect(names):
+        calls.append(list(names))
+        return [{"pii_detected": name == "email", "pii_types": ["Email"] if name == "email" else [], "source": "azure_dlp"}
+                for name in names]
+
+    monkeypatch.setattr(metadata_extractor, "detect_pii_in_columns", detect)
+    monkeypatch.setattr(metadata_extractor, "get_rule_classifier", lambda data_source_type=None: None)
+    return calls
+
+
+@pytest.fixture
+def parse_calls(monkeypatch):
+    calls = []
+    for file_format, parser in list(metadata_extractor._SCHEMA_PARSERS.items()):
+        def counted(*args, _parser=parser, _format=file_format, **kwargs):
+            calls.append(_format)
+            return _parser(*args, **kwargs)
+        monkeypatch.setitem(metadata_extractor._SCHEMA_PARSERS, file_format, counted)
+    return calls
+
+
+def test_csv_sample_is_parsed_once_and_each_column_classified_once(dlp_calls, parse_calls):
+    metadata = extract_file_metadata(blob("a.csv"), b"id;email;amount\n1;a@b.c;2\n")
+    assert parse_calls == ["csv"]
+    assert dlp_calls == [["id", "email", "amount"]]
+    schema_json = metadata["schema_json"]
+    assert [column["name"] for column in schema_json["columns"]] == ["id", "email", "amount"]
+    assert metadata["schema_hash"] == generate_schema_hash(schema_json)
+    assert metadata["file_metadata"]["format_specific"]["csv"]["delimiter"] == ";"
+
+
+def test_parquet_footer_is_parsed_once(dlp_calls, parse_calls):
+    buffer = io.BytesIO()
+    pq.write_table(pa.table({"email": ["a@b.c"], "amount": [1.5]}), buffer)
+    metadata = extract_file_metadata(blob("a.parquet"), buffer.getvalue())
+    assert parse_calls == ["parquet"]
+    assert dlp_calls == [["email", "amount"]]
+    assert metadata["schema_json"]["num_rows"] == 1
+    assert metadata["file_metadata"]["format_specific"]["parquet"]["row_groups"] == 1
+    assert metadata["schema_json"]["columns"][0]["pii_types"] == ["Email"]
+
+
+def test_schema_json_is_built_once_per_parse(dlp_calls):
+    parsed = ParsedSchema(columns=[{"name": "email", "type": "string", "nullable": True}], attributes={"delimiter": ","})
+    first = parsed.to_schema_json()
+    assert parsed.to_schema_json() is first
+    assert first["num_columns"] == 1 and first["delimiter"] == ","
+    assert len(dlp_calls) == 1
+
+
+def test_untagged_schema_skips_classification(dlp_calls):
+    parsed = ParsedSchema(columns=[{"name": "email", "type": "string", "nullable": True}], tag_pii=False)
+    assert parsed.to_schema_json()["columns"][0]["pii_detected"] is False
+    assert dlp_calls == []
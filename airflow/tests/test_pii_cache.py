@@ -0,0 +1,158 @@
+import pytest
+
+import utils.azure_dlp_client as azure_dlp_client
+import utils.pii_cache as pii_cache
+from utils.pii_cache import PIIClassificationCache, get_cache_key
+
+EMAIL = {"pii_detected": True, "pii_types": ["Email"]}
+NO_PII = {"pii_detected": False, "pii_types": []}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = Clock()
+    monkeypatch.setattr(pii_cache.time, "time", fake.time)
+    return fake
+
+
+def test_normalized_names_share_an_entry(clock):
+    cache = PIIClassificationCache(max_entries=10, ttl_seconds=60, persistent=False)
+    cache.put_many({"customer_email": EMAIL}, "en", "latest")
+    assert cache.get_many(["customerEmail", "CUSTOMER-EMAIL", "phone"], "en", "latest") == {"customerEmail": EMAIL, "CUSTOMER-EMAIL": EMAIL}
+    assert get_cache_key("customerEmail", "en", "latest") != get_cache_key("customerEmail", "en", "2024-01-01")
+    assert cache.stats()["memory_hits"] == 2 and cache.stats()["misses"] == 1
+
+
+def test_memory_tier_is_a_bounded_lru(clock):
+    cache = PIIClassificationCache(max_entries=2, ttl_seconds=60, persistent=False)
+    cache.put_many({"a": NO_PII, "b": NO_PII}, "en", "latest")
+    cache.get_many(["a"], "en", "latest")
+    cache.put_many({"c": NO_PII}, "en", "latest")
+    assert set(cache.get_many(["a", "b", "c"], "en", "latest")) == {"a", "c"}
+
+
+def test_entries_expire(clock):
+    cache = PIIClassificationCache(max_entries=10, ttl_seconds=60, persistent=False)
+    cache.put_many({"email": EMAIL}, "en", "latest")
+    clock.now += 61
+    assert cache.get_many(["email"], "en", "latest") == {}
+    assert cache.stats()["expired"] == 1
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=()):
+        if self.db.down:
+            raise ConnectionError("MySQL unavailable")
+        if sql.lstrip().startswith("SELECT"):
+            self._rows = [dict(self.db.rows[key], cache_key=key) for key in params if key in self.db.rows]
+        elif sql.lstrip().startswith("INSERT"):
+            for i in range(0, len(params), 7):
+                key, _, _, _, detected, types, ttl = params[i:i + 7]
+                self.db.rows[key] = {"pii_detected": detected, "pii_types": types, "ttl_remaining": ttl}
+
+    def fetchall(self):
+        return self._rows
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self, *args):
+        return FakeCursor(self.db)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeDB:
+    def __init__(self):
+        self.rows = {}
+        self.down = False
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDB()
+    monkeypatch.setattr(pii_cache, "get_db_connection", lambda: FakeConnection(fake))
+    return fake
+
+
+def test_shared_tier_answers_other_workers(clock, db):
+    PIIClassificationCache(ttl_seconds=60, persistent=True).put_many({"email": EMAIL}, "en", "latest")
+    other_worker = PIIClassificationCache(ttl_seconds=60, persistent=True)
+    assert other_worker.get_many(["email"], "en", "latest") == {"email": EMAIL}
+    assert other_worker.get_many(["email"], "en", "latest") == {"email": EMAIL}
+    assert (other_worker.persistent_hits, other_worker.memory_hits) == (1, 1)
+
+
+def test_shared_tier_failures_are_misses(clock, db):
+    db.down = True
+    cache = PIIClassificationCache(ttl_seconds=60, persistent=True)
+    cache.put_many({"email": EMAIL}, "en", "latest")
+    assert cache.get_many(["email", "phone"], "en", "latest") == {"email": EMAIL}
+
+
+class CountingClient:
+    client = object()
+
+    def __init__(self, fail=()):
+        self.sent = []
+        self.fail = set(fail)
+
+    def detect_pii_in_texts(self, texts, language=None):
+        self.sent.append(list(texts))
+        return [dict(EMAIL if "email" in text else NO_PII, **({"error": True} if text in self.fail else {})) for text in texts]
+
+
+@pytest.fixture
+def service(monkeypatch, clock):
+    cache = PIIClassificationCache(max_entries=100, ttl_seconds=60, persistent=False)
+    monkeypatch.setattr(azure_dlp_client, "get_pii_cache", lambda: cache)
+    monkeypatch.setattr(azure_dlp_client, "AZURE_AI_LANGUAGE_ASYNC", False)
+
+    def use(client):
+        monkeypatch.setattr(azure_dlp_client, "get_dlp_client", lambda: client)
+        return client
+    return use
+
+
+def test_only_uncached_names_go_to_the_service(service):
+    client = service(CountingClient())
+    azure_dlp_client.detect_pii_in_columns(["email", "customer_id"])
+    results = azure_dlp_client.detect_pii_in_columns(["Email", "customerId", "amount", "customer_id"])
+    assert client.sent == [["email", "customer_id"], ["amount"]]
+    assert [result["pii_detected"] for result in results] == [True, False, False, False]
+    assert {result["source"] for result in results} == {"azure_dlp"}
+
+
+def test_failed_lookups_are_unclassified_and_not_cached(service):
+    client = service(CountingClient(fail={"email"}))
+    assert azure_dlp_client.detect_pii_in_columns(["email"])[0]["source"] == "unclassified"
+    client.fail.clear()
+    assert azure_dlp_client.detect_pii_in_columns(["email"])[0] == {"pii_detected": True, "pii_types": ["Email"], "source": "azure_dlp"}
+    assert client.sent == [["email"], ["email"]]
@@ -0,0 +1,92 @@
+import pytest
+
+from utils.pii_rules import (DEFAULT_NON_PII_TOKENS, DEFAULT_PII_PHRASES, PIIRuleClassifier, RULES_SOURCE,
+                             _merge_rules, get_rule_classifier, normalize_column_name)
+
+
+@pytest.fixture
+def rules(monkeypatch):
+    monkeypatch.delenv("PII_RULES_FILE", raising=False)
+    monkeypatch.setenv("PII_RULES_ENABLED", "true")
+    return get_rule_classifier()
+
+
+@pytest.mark.parametrize("name, normalized", [
+    ("customerEmail", "customer_email"),
+    ("Customer-ID", "customer_id"),
+    ("CUSTOMER_EMAIL", "customer_email"),
+    ("  first name ", "first_name"),
+])
+def test_normalize_column_name(name, normalized):
+    assert normalize_column_name(name) == normalized
+
+
+@pytest.mark.parametrize("name, pii_types", [
+    ("email", ["Email"]),
+    ("customerEmail", ["Email"]),
+    ("date_of_birth", ["DateOfBirth"]),
+    ("ip_address", ["IPAddress"]),
+    ("firstname", ["Person"]),
+    ("home_phone_number", ["PhoneNumber"]),
+    ("birth_date", ["DateOfBirth"]),
+    ("tax_id", ["TaxIdentificationNumber"]),
+])
+def test_phrase_match_is_pii(rules, name, pii_types):
+    assert rules.classify(name) == {"pii_detected": True, "pii_types": pii_types, "source": RULES_SOURCE}
+
+
+@pytest.mark.parametrize("name", [
+    "is_email_verified",
+    "address_type",
+    "phone_type",
+    "email_count",
+    "has_passport",
+    "ssn_flag",
+    "mobile_app_version",
+    "email_sent_at",
+    "email_template_id",
+    "address_updated_at",
+    "phone_created_date",
+    "email_ts",
+])
+def test_phrase_with_modifier_is_ambiguous(rules, name):
+    assert rules.classify(name) is None
+
+
+@pytest.mark.parametrize("name", ["created_at", "order_id", "amount", "is_deleted", "item_count_2"])
+def test_non_pii_tokens_are_not_pii(rules, name):
+    assert rules.classify(name) == {"pii_detected": False, "pii_types": [], "source": RULES_SOURCE}
+
+
+@pytest.mark.parametrize("name", ["notes", "customer_segment", "payload"])
+def test_unknown_names_are_ambiguous(rules, name):
+    assert rules.classify(name) is None
+
+
+@pytest.mark.parametrize("data_source_type, name, expected", [
+    ("credit_card", "masked_pan", ["CreditCardNumber"]),
+    ("credit_card", "cvv", ["CreditCardSecurityCode"]),
+    ("credit_card", "merchant_id", False),
+    (None, "cvv", None),
+])
+def test_source_rules(monkeypatch, data_source_type, name, expected):
+    monkeypatch.delenv("PII_RULES_FILE", raising=False)
+    monkeypatch.setenv("PII_RULES_ENABLED", "true")
+    result = get_rule_classifier(data_source_type).classify(name)
+    if expected is None:
+        assert result is None
+    elif expected is False:
+        assert result["pii_detected"] is False
+    else:
+        assert result["pii_types"] == expected
+
+
+def test_custom_modifiers_are_merged():
+    classifier = PIIRuleClassifier(*_merge_rules(DEFAULT_PII_PHRASES, DEFAULT_NON_PII_TOKENS, [], {"modifiers": ["masked"]}))
+    assert classifier.classify("masked_email") is None
+    assert classifier.classify("email_type")["pii_types"] == ["Email"]
+
+
+def test_rules_disabled(monkeypatch):
+    monkeypatch.setenv("PII_RULES_ENABLED", "false")
+    assert get_rule_classifier() is None
@@ -0,0 +1,97 @@
+from datetime import datetime
+
+import pytest
+
+import utils.scan_checkpoint as scan_checkpoint
+from utils.scan_checkpoint import complete_checkpoint, get_resume_token, get_scope_key, save_checkpoint
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=()):
+        if self.conn.fail:
+            raise RuntimeError("syntax error")
+        self.conn.statements.append((" ".join(sql.split()), params))
+
+
+class FakeConnection:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.statements = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.closed = False
+
+    def cursor(self, *args):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    fake = FakeConnection()
+    monkeypatch.setattr(scan_checkpoint, "get_db_connection", lambda: fake)
+    return fake
+
+
+def test_scope_key_is_per_account_container_and_folder():
+    key = get_scope_key("acc", "raw", "sales")
+    assert len(key) == 64 and key == get_scope_key("acc", "raw", "sales")
+    assert len({key, get_scope_key("acc", "curated", "sales"), get_scope_key("acc", "raw", "sales/eu"),
+                get_scope_key("other", "raw", "sales"), get_scope_key("acc", "raw", "")}) == 5
+    assert get_scope_key("acc", "raw", None) == get_scope_key("acc", "raw", "")
+
+
+def test_save_records_the_token_and_scan_state(conn):
+    state = {"min_failed_last_modified": datetime(2024, 6, 1), "max_seen_last_modified": datetime(2024, 6, 2), "max_seen_etag": "e9"}
+    save_checkpoint("acc", "raw", "sales", "token-3", "batch-1", "run-1", 3, 15000, state)
+
+    sql, params = conn.statements[0]
+    assert "ON DUPLICATE KEY UPDATE" in sql and "status = 'in_progress'" in sql
+    assert params == (get_scope_key("acc", "raw", "sales"), "acc", "raw", "sales", "token-3", "batch-1", "run-1", 3, 15000,
+                      datetime(2024, 6, 1), datetime(2024, 6, 2), "e9")
+    assert conn.commits == 1 and conn.closed
+
+
+def test_save_rolls_back_and_raises_on_error(monkeypatch):
+    failing = FakeConnection(fail=True)
+    monkeypatch.setattr(scan_checkpoint, "get_db_connection", lambda: failing)
+    with pytest.raises(RuntimeError):
+        save_checkpoint("acc", "raw", "sales", "token-3", "batch-1", "run-1", 3, 15000)
+    assert failing.rollbacks == 1 and failing.commits == 0 and failing.closed
+
+
+def test_complete_clears_the_token_and_scan_state(conn):
+    complete_checkpoint("acc", "raw", "sales", "batch-1", "run-1", 4, 18000)
+    sql, params = conn.statements[0]
+    assert "continuation_token = NULL" in sql and "status = 'completed'" in sql
+    assert "min_failed_last_modified = NULL" in sql
+    assert params[0] == get_scope_key("acc", "raw", "sales") and params[-2:] == (4, 18000)
+
+
+@pytest.mark.parametrize("checkpoint, full_rescan, resumes", [
+    (None, False, False),
+    ({"status": "completed", "continuation_token": None}, False, False),
+    ({"status": "in_progress", "continuation_token": None}, False, False),
+    ({"status": "in_progress", "continuation_token": "token-3", "batch_id": "batch-1"}, False, True),
+    ({"status": "in_progress", "continuation_token": "token-3", "batch_id": "batch-1"}, True, False),
+])
+def test_only_an_interrupted_walk_resumes(monkeypatch, checkpoint, full_rescan, resumes):
+    monkeypatch.setattr(scan_checkpoint, "load_checkpoint", lambda *args: checkpoint)
+    assert get_resume_token("acc", "raw", "sales", full_rescan=full_rescan) == (checkpoint if resumes else None)
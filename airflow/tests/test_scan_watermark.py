@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import utils.scan_watermark as scan_watermark
+from utils.scan_watermark import IncrementalScanFilter, start_incremental_scan
+
+WALK_STARTED_AT = datetime(2024, 6, 1, 12, 0, 0, tzinfo=timezone.utc)
+WATERMARK = {"watermark_last_modified": datetime(2024, 6, 1, 8, 0, 0), "watermark_etag": "w"}
+
+
+def blob(hour, etag="e", minute=0, **extra):
+    return dict({"full_path": "sales/{}-{}.csv".format(hour, minute), "etag": '"{}"'.format(etag),
+                 "last_modified": datetime(2024, 6, 1, hour, minute, 0, tzinfo=timezone.utc)}, **extra)
+
+
+@pytest.fixture(autouse=True)
+def skew(monkeypatch):
+    monkeypatch.setitem(scan_watermark.DISCOVERY_CONFIG, "watermark_skew_seconds", 300)
+
+
+def test_blobs_at_or_below_the_watermark_are_skipped():
+    scan_filter = IncrementalScanFilter(WATERMARK, False, WALK_STARTED_AT)
+    assert scan_filter.is_candidate(blob(7)) is False
+    assert scan_filter.is_candidate(blob(8, etag="w")) is False
+    # Same second, different blob: the ETag tells them apart
+    assert scan_filter.is_candidate(blob(8, etag="other")) is True
+    assert scan_filter.is_candidate(blob(9)) is True
+    assert (scan_filter.candidates, scan_filter.skipped) == (2, 2)
+
+
+def test_full_pass_and_missing_watermark_take_everything():
+    assert IncrementalScanFilter(WATERMARK, True, WALK_STARTED_AT).is_candidate(blob(7)) is True
+    assert IncrementalScanFilter(None, False, WALK_STARTED_AT).is_candidate(blob(7)) is True
+
+
+@pytest.mark.parametrize("extra", [{"dataset_format": "delta"}, {"partitioning": {"keys": ["dt"]}}])
+def test_grouped_datasets_are_exempt_from_the_watermark(extra):
+    assert IncrementalScanFilter(WATERMARK, False, WALK_STARTED_AT).is_candidate(blob(7, **extra)) is True
+
+
+def test_next_watermark_is_the_newest_blob_seen():
+    scan_filter = IncrementalScanFilter(WATERMARK, False, WALK_STARTED_AT)
+    for item in (blob(9), blob(10, etag="newest"), blob(7)):
+        scan_filter.is_candidate(item)
+    assert scan_filter.next_watermark() == (datetime(2024, 6, 1, 10, 0, 0, tzinfo=timezone.utc), "newest")
+
+
+def test_next_watermark_stops_short_of_the_walk_start():
+    scan_filter = IncrementalScanFilter(WATERMARK, False, WALK_STARTED_AT)
+    scan_filter.is_candidate(blob(11, minute=58))
+    assert scan_filter.next_watermark() == (WALK_STARTED_AT - timedelta(seconds=300), None)
+
+
+def test_next_watermark_stays_below_a_failed_blob():
+    scan_filter = IncrementalScanFilter(WATERMARK, False, WALK_STARTED_AT)
+    failed = blob(9)
+    for item in (failed, blob(10)):
+        scan_filter.is_candidate(item)
+    scan_filter.mark_failed(failed)
+    last_modified, etag = scan_filter.next_watermark()
+    assert last_modified < failed["last_modified"] and etag is None
+    assert IncrementalScanFilter({"watermark_last_modified": last_modified}, False, WALK_STARTED_AT).is_candidate(failed)
+
+
+def test_resumed_walk_keeps_the_failure_and_newest_blob_from_the_checkpoint():
+    first = IncrementalScanFilter(WATERMARK, False, WALK_STARTED_AT)
+    failed = blob(9)
+    for item in (failed, blob(10, etag="newest")):
+        first.is_candidate(item)
+    first.mark_failed(failed)
+    state = first.checkpoint_state()
+    assert state["min_failed_last_modified"] == datetime(2024, 6, 1, 9, 0, 0)
+    assert state["max_seen_last_modified"].tzinfo is None
+
+    # The resumed walk lists only the pages after the checkpoint
+    resumed = IncrementalScanFilter(WATERMARK, False, WALK_STARTED_AT, resume_state=state)
+    resumed.is_candidate(blob(9, minute=30))
+    assert resumed.next_watermark() == first.next_watermark()
+
+
+@pytest.mark.parametrize("watermark, scan_mode, full_rescan, full_pass", [
+    (None, "incremental", False, True),
+    ({"last_full_scan_at": datetime.utcnow() - timedelta(hours=1)}, "incremental", False, False),
+    ({"last_full_scan_at": datetime.utcnow() - timedelta(hours=1)}, "incremental", True, True),
+    ({"last_full_scan_at": datetime.utcnow() - timedelta(hours=1)}, "full", False, True),
+    ({"last_full_scan_at": datetime.utcnow() - timedelta(hours=30)}, "incremental", False, True),
+])
+def test_full_pass_decision(monkeypatch, watermark, scan_mode, full_rescan, full_pass):
+    monkeypatch.setattr(scan_watermark, "load_watermark", lambda *args: watermark)
+    monkeypatch.setitem(scan_watermark.DISCOVERY_CONFIG, "scan_mode", scan_mode)
+    monkeypatch.setitem(scan_watermark.DISCOVERY_CONFIG, "full_reconcile_hours", 24)
+    scan_filter = start_incremental_scan("acc", "raw", "sales", WALK_STARTED_AT, full_rescan=full_rescan)
+    assert scan_filter.full_pass is full_pass
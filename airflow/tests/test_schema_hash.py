@@ -0,0 +1,61 @@
+from utils.metadata_extractor import carry_forward_classification, generate_schema_hash, has_unclassified_columns
+
+
+def column(name, pii_detected=False, pii_types=None, source="azure_dlp", column_type="string"):
+    return {"name": name, "type": column_type, "nullable": True, "pii_detected": pii_detected,
+            "pii_types": pii_types, "pii_source": source}
+
+
+def schema(*columns):
+    return {"columns": list(columns), "num_columns": len(columns)}
+
+
+def test_pii_source_is_not_hashed():
+    assert generate_schema_hash(schema(column("email", True, ["Email"], "rules"))) == \
+        generate_schema_hash(schema(column("email", True, ["Email"], "azure_dlp")))
+
+
+def test_classification_changes_the_hash():
+    assert generate_schema_hash(schema(column("email", True, ["Email"]))) != \
+        generate_schema_hash(schema(column("email", False)))
+
+
+def test_unclassified_columns_hash_without_their_pii_answer():
+    unclassified = schema(column("email", False, None, "unclassified"), column("id", column_type="int64"))
+    no_answer = schema({"name": "email", "type": "string", "nullable": True}, column("id", column_type="int64"))
+    assert generate_schema_hash(unclassified) == generate_schema_hash(no_answer)
+
+
+def test_unclassified_columns_still_hash_their_structure():
+    assert generate_schema_hash(schema(column("email", source="unclassified"))) != \
+        generate_schema_hash(schema(column("email", source="unclassified", column_type="int64")))
+
+
+def test_carry_forward_fills_unclassified_columns_from_previous_schema():
+    previous = schema(column("email", True, ["Email"], "azure_dlp"), column("city", False, None, "rules"))
+    current = schema(column("email", False, None, "unclassified"), column("city", False, None, "unclassified"),
+                     column("new_col", False, None, "unclassified"))
+
+    assert carry_forward_classification(current, previous) is True
+    email, city, new_col = current["columns"]
+    assert (email["pii_detected"], email["pii_types"], email["pii_source"]) == (True, ["Email"], "azure_dlp")
+    assert (city["pii_detected"], city["pii_source"]) == (False, "rules")
+    assert new_col["pii_source"] == "unclassified"
+    assert has_unclassified_columns(current)
+    assert generate_schema_hash(current) == generate_schema_hash(
+        schema(column("email", True, ["Email"]), column("city"), column("new_col", source="unclassified")))
+
+
+def test_carry_forward_ignores_previous_unclassified_and_classified_current_columns():
+    previous = schema(column("email", False, None, "unclassified"), column("phone", True, ["PhoneNumber"]))
+    current = schema(column("email", False, None, "unclassified"), column("phone", False, None, "azure_dlp"))
+
+    assert carry_forward_classification(current, previous) is False
+    assert current["columns"][1]["pii_detected"] is False
+
+
+def test_carry_forward_without_previous_schema():
+    current = schema(column("email", source="unclassified"))
+    assert carry_forward_classification(current, None) is False
+    assert carry_forward_classification(current, {}) is False
+    assert not has_unclassified_columns(schema(column("email")))
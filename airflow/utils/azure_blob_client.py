@@ -1,103 +1,120 @@
-from azure.storage.blob import BlobServiceClient, ContentSettings
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Iterator, Optional, Tuple
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+class BlobRecord:
+    """
+    Lightweight listing record for one blob. Supports the read-only dict access
+    (record["name"], record.get("size")) used throughout discovery.
+    """
+    
+    __slots__ = (
+        "name", "full_path", "size", "content_type", "created_at", "last_modified", "etag",
+        "blob_type", "access_tier", "lease_status", "content_encoding", "content_language",
+        "cache_control", "metadata",
+    )
+    
+    def __init__(self, full_path: str, size: int = 0, etag: str = "", created_at=None, last_modified=None,
+                 content_type: str = "application/octet-stream", blob_type: str = "Block blob", access_tier=None,
+                 lease_status=None, content_encoding=None, content_language=None, cache_control=None, metadata=None):
+        self.name = full_path.split("/")[-1]
+        self.full_path = full_path
+        self.size = size
+        self.content_type = content_type
+        self.created_at = created_at
+        self.last_modified = last_modified
+        self.etag = etag
+        self.blob_type = blob_type
+        self.access_tier = access_tier
+        self.lease_status = lease_status
+        self.content_encoding = content_encoding
+        self.content_language = content_language
+        self.cache_control = cache_control
+        self.metadata = metadata if metadata is not None else {}
+    
+    @classmethod
+    def from_blob_properties(cls, blob) -> "BlobRecord":
+        content_settings = getattr(blob, 'content_settings', None)
+        lease = getattr(blob, 'lease', None)
+        return cls(
+            full_path=blob.name,
+            size=getattr(blob, 'size', 0) or 0,
+            etag=(getattr(blob, 'etag', '') or '').strip('"'),
+            created_at=getattr(blob, 'creation_time', None),
+            last_modified=getattr(blob, 'last_modified', None),
+            content_type=getattr(content_settings, 'content_type', None) or 'application/octet-stream',
+            access_tier=getattr(blob, 'blob_tier', None),
+            lease_status=getattr(lease, 'status', None),
+            content_encoding=getattr(content_settings, 'content_encoding', None),
+            content_language=getattr(content_settings, 'content_language', None),
+            cache_control=getattr(content_settings, 'cache_control', None),
+            metadata=getattr(blob, 'metadata', None) or {},
+        )
+    
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+    
+    def __contains__(self, key: str) -> bool:
+        return key in self.__slots__
+    
+    def get(self, key: str, default=None):
+        return getattr(self, key) if key in self.__slots__ else default
+    
+    def to_dict(self) -> Dict:
+        return {key: getattr(self, key) for key in self.__slots__}
+
+
 class AzureBlobClient:
     def __init__(self, connection_string: str):
+        # Imported here rather than at module load: DAG files import this module at parse time
+        from azure.storage.blob import BlobServiceClient
+        
         self.connection_string = connection_string
         self.blob_service_client = BlobServiceClient.from_connection_string(connection_string)
     
-    def list_blobs(self, container_name: str, folder_path: str = "", file_extensions: List[str] = None) -> List[Dict]:
+    def iter_blob_pages(self, container_name: str, folder_path: str = "", file_extensions: List[str] = None,
+                        continuation_token: Optional[str] = None, results_per_page: int = 5000) -> Iterator[Tuple[List["BlobRecord"], Optional[str]]]:
+        """
+        Stream a container listing page by page with no cap on the number of blobs.
+        Yields (records, next_continuation_token); the token is None after the last page.
+        Pass a saved token back in as continuation_token to resume a listing.
+        """
+        container_client = self.blob_service_client.get_container_client(container_name)
+        prefix = folder_path.rstrip("/") + "/" if folder_path else ""
+        extensions = [ext.lower() for ext in file_extensions] if file_extensions else None
+        
         try:
-            container_client = self.blob_service_client.get_container_client(container_name)
-            blobs = []
-            
-            prefix = folder_path.rstrip("/") + "/" if folder_path else ""
-            # CRITICAL FIX: Convert lazy iterator to list immediately to avoid hanging
-            # The iterator can hang on pagination if there are many blobs
-            # Convert to list immediately - this will fetch all pages in one go
-            blob_list = []
-            count = 0
-            try:
-                blob_iterator = container_client.list_blobs(name_starts_with=prefix)
-                for blob in blob_iterator:
-                    blob_list.append(blob)
-                    count += 1
-                    # Safety limit: prevent infinite loops or memory issues
-                    if count > 10000:
-                        logger.warning('FN:list_blobs container_name:{} folder_path:{} hit_safety_limit:10000'.format(container_name, folder_path))
-                        break
-                logger.info('FN:list_blobs container_name:{} folder_path:{} fetched_blob_count:{}'.format(container_name, folder_path, len(blob_list)))
-            except Exception as e:
-                logger.error('FN:list_blobs container_name:{} folder_path:{} list_error:{}'.format(container_name, folder_path, str(e)))
-                raise
-            
-            for blob in blob_list:
-                if file_extensions:
-                    if not any(blob.name.lower().endswith(ext.lower()) for ext in file_extensions):
+            # Properties come straight from the listing - NO extra API calls per blob
+            pages = container_client.list_blobs(name_starts_with=prefix, results_per_page=results_per_page).by_page(continuation_token=continuation_token)
+            page_count = 0
+            blob_count = 0
+            for page in pages:
+                records = []
+                for blob in page:
+                    # Skip directories (blobs ending with /)
+                    if blob.name.endswith('/'):
                         continue
-                # Skip directories (blobs ending with /)
-                if blob.name.endswith('/'):
-                    continue
-                
-                # CRITICAL FIX: Use properties directly from list_blobs() - NO extra API calls!
-                # This was causing tasks to hang/timeout. list_blobs() already has all properties we need.
-                class BlobPropertiesProxy:
-                    def __init__(self, blob_item):
-                        self.size = getattr(blob_item, 'size', 0)
-                        self.etag = getattr(blob_item, 'etag', '').strip('"') if hasattr(blob_item, 'etag') else ''
-                        self.creation_time = getattr(blob_item, 'creation_time', None)
-                        self.last_modified = getattr(blob_item, 'last_modified', None)
-                        # Content settings from blob properties
-                        content_type = getattr(blob_item, 'content_type', 'application/octet-stream')
-                        self.content_settings = type('ContentSettings', (), {
-                            'content_type': content_type,
-                            'content_encoding': getattr(blob_item, 'content_encoding', None),
-                            'content_language': getattr(blob_item, 'content_language', None),
-                            'cache_control': getattr(blob_item, 'cache_control', None),
-                        })()
-                        self.blob_tier = getattr(blob_item, 'blob_tier', None)
-                        self.lease = type('Lease', (), {'status': getattr(blob_item, 'lease_status', None)})()
-                        self.metadata = getattr(blob_item, 'metadata', {}) if hasattr(blob_item, 'metadata') else {}
-                blob_properties = BlobPropertiesProxy(blob)
-                
-                blob_type = None
-                if hasattr(blob_properties, 'blob_type'):
-                    blob_type = blob_properties.blob_type
-                elif hasattr(blob_properties, 'blob_tier'):
-                    blob_type = "Block blob"
-                else:
-                    blob_type = "Block blob"
-                
-                blob_info = {
-                    "name": blob.name.split("/")[-1],
-                    "full_path": blob.name,
-                    "size": blob_properties.size,
-                    "content_type": blob_properties.content_settings.content_type,
-                    "created_at": blob_properties.creation_time,
-                    "last_modified": blob_properties.last_modified,
-                    "etag": blob_properties.etag,
-                    "blob_type": blob_type,
-                    "access_tier": blob_properties.blob_tier if hasattr(blob_properties, 'blob_tier') else None,
-                    "lease_status": blob_properties.lease.status if hasattr(blob_properties, 'lease') else None,
-                    "content_encoding": blob_properties.content_settings.content_encoding,
-                    "content_language": blob_properties.content_settings.content_language,
-                    "cache_control": blob_properties.content_settings.cache_control,
-                    "metadata": blob_properties.metadata,
-                }
-                
-                blobs.append(blob_info)
-            
-            logger.info('FN:list_blobs container_name:{} folder_path:{} blob_count:{}'.format(container_name, folder_path, len(blobs)))
-            return blobs
-            
+                    if extensions and not any(blob.name.lower().endswith(ext) for ext in extensions):
+                        continue
+                    records.append(BlobRecord.from_blob_properties(blob))
+                page_count += 1
+                blob_count += len(records)
+                logger.info('FN:iter_blob_pages container_name:{} folder_path:{} page:{} page_blob_count:{} blob_count:{}'.format(container_name, folder_path, page_count, len(records), blob_count))
+                yield records, pages.continuation_token
         except Exception as e:
-            logger.error('FN:list_blobs container_name:{} folder_path:{} error:{}'.format(container_name, folder_path, str(e)))
+            logger.error('FN:iter_blob_pages container_name:{} folder_path:{} error:{}'.format(container_name, folder_path, str(e)))
             raise
     
+    def list_blobs(self, container_name: str, folder_path: str = "", file_extensions: List[str] = None) -> Iterator["BlobRecord"]:
+        # Generator over every blob under the prefix; memory stays flat regardless of container size
+        for records, _ in self.iter_blob_pages(container_name, folder_path, file_extensions):
+            yield from records
+    
     def get_blob_content(self, container_name: str, blob_path: str) -> bytes:
         try:
             blob_client = self.blob_service_client.get_blob_client(
@@ -109,40 +126,154 @@ class AzureBlobClient:
             logger.error('FN:get_blob_content container_name:{} blob_path:{} error:{}'.format(container_name, blob_path, str(e)))
             raise
     
-    def get_blob_sample(self, container_name: str, blob_path: str, max_bytes: int = 1024) -> bytes:
+    def get_blob_sample(self, container_name: str, blob_path: str, max_bytes: int = 1024,
+                        is_complete: Optional[Callable[[bytes], bool]] = None, max_total_bytes: Optional[int] = None,
+                        file_size: Optional[int] = None) -> bytes:
         # Get only headers/column names (first N bytes) - NO data rows
         # For banking/financial compliance: We only extract column names, never actual data
         # CSV: First line only (headers)
         # JSON: First object keys only
+        # With is_complete, a sample that does not yet hold the whole header grows in
+        # doubling ranged reads (1 KB, 2 KB, 4 KB...), each fetching only the new bytes,
+        # until is_complete(sample) or max_total_bytes
+        # A failed read raises rather than returning the partial sample: a truncated header
+        # would otherwise be stored as the blob's schema under its current fingerprint
+        sample = b""
         try:
             blob_client = self.blob_service_client.get_blob_client(
                 container=container_name,
                 blob=blob_path
             )
-            # Download only first max_bytes (just enough for headers/keys - NO data)
-            return blob_client.download_blob(offset=0, length=max_bytes).readall()
+            limit = max_bytes if is_complete is None else max(max_bytes, max_total_bytes or max_bytes)
+            if file_size is not None:
+                limit = min(limit, file_size)
+            target = min(max_bytes, limit)
+            while target > len(sample):
+                length = target - len(sample)
+                # Download only the next range (just enough for headers/keys - NO data)
+                chunk = blob_client.download_blob(offset=len(sample), length=length).readall()
+                sample += chunk
+                if len(chunk) < length or is_complete is None or is_complete(sample):
+                    break
+                target = min(target * 2, limit)
+            return sample
         except Exception as e:
-            logger.warning('FN:get_blob_sample container_name:{} blob_path:{} max_bytes:{} error:{}'.format(container_name, blob_path, max_bytes, str(e)))
-            return b""
+            logger.warning('FN:get_blob_sample container_name:{} blob_path:{} max_bytes:{} sample_bytes:{} error:{}'.format(container_name, blob_path, max_bytes, len(sample), str(e)))
+            raise
     
-    def get_blob_tail(self, container_name: str, blob_path: str, max_bytes: int = 8192) -> bytes:
+    def get_blob_tail(self, container_name: str, blob_path: str, max_bytes: int = 8192, file_size: Optional[int] = None) -> bytes:
         # Get the tail (last N bytes) of a blob. Useful for Parquet files where metadata is at the end
+        # Pass file_size from the listing to skip the properties round-trip
         try:
             blob_client = self.blob_service_client.get_blob_client(
                 container=container_name,
                 blob=blob_path
             )
-            # Get file size first
-            properties = blob_client.get_blob_properties()
-            file_size = properties.size
+            if file_size is None:
+                properties = blob_client.get_blob_properties()
+                file_size = properties.size
             
             # Read from the end
             offset = max(0, file_size - max_bytes)
             length = min(max_bytes, file_size)
+            if length <= 0:
+                return b""
             return blob_client.download_blob(offset=offset, length=length).readall()
         except Exception as e:
             logger.warning('FN:get_blob_tail container_name:{} blob_path:{} max_bytes:{} error:{}'.format(container_name, blob_path, max_bytes, str(e)))
-            return b""
+            raise
+    
+    def get_parquet_footer(self, container_name: str, blob_path: str, file_size: Optional[int] = None,
+                           initial_bytes: int = 8192, max_footer_bytes: int = 16 * 1024 * 1024) -> bytes:
+        """
+        Return the Parquet footer (FileMetaData + 4-byte length + "PAR1") and nothing else.
+        One ranged read of initial_bytes from the end covers most files; wider footers
+        get exactly one more read for the missing part. Returns b"" when the blob is too
+        small or the footer too large, the raw tail when it is not Parquet; a failed
+        read raises, so a transient error is never mistaken for a schemaless file.
+        """
+        try:
+            blob_client = self.blob_service_client.get_blob_client(
+                container=container_name,
+                blob=blob_path
+            )
+            if file_size is None:
+                file_size = blob_client.get_blob_properties().size
+            if file_size < 12:
+                return b""
+            
+            length = min(initial_bytes, file_size)
+            tail = blob_client.download_blob(offset=file_size - length, length=length).readall()
+            if len(tail) < 8 or tail[-4:] != b"PAR1":
+                logger.warning('FN:get_parquet_footer container_name:{} blob_path:{} file_size:{} magic:{}'.format(container_name, blob_path, file_size, tail[-4:]))
+                return tail
+            
+            footer_size = int.from_bytes(tail[-8:-4], "little") + 8
+            if footer_size > file_size - 4 or footer_size > max_footer_bytes:
+                logger.warning('FN:get_parquet_footer container_name:{} blob_path:{} file_size:{} footer_size:{} max_footer_bytes:{}'.format(container_name, blob_path, file_size, footer_size, max_footer_bytes))
+                return b""
+            
+            if footer_size > len(tail):
+                # Footer larger than the first read: fetch only the part in front of what we have
+                missing = footer_size - len(tail)
+                head = blob_client.download_blob(offset=file_size - footer_size, length=missing).readall()
+                tail = head + tail
+                logger.info('FN:get_parquet_footer container_name:{} blob_path:{} footer_size:{} reads:{}'.format(container_name, blob_path, footer_size, 2))
+            
+            # Drop trailing data-page bytes: only the footer leaves this method
+            return tail[-footer_size:]
+        except Exception as e:
+            logger.warning('FN:get_parquet_footer container_name:{} blob_path:{} file_size:{} error:{}'.format(container_name, blob_path, file_size, str(e)))
+            raise
+    
+    def get_blob_suffix(self, container_name: str, blob_path: str, tail_length: Callable[[bytes], Optional[int]],
+                        file_size: Optional[int] = None, initial_bytes: int = 8192, max_bytes: int = 16 * 1024 * 1024) -> bytes:
+        """
+        Return the trailing structure of a footer-based format (e.g. the ORC footer and
+        postscript) and nothing else. tail_length(tail) gives the number of bytes from the
+        end that the structure spans, or None if the tail is not in that format. Same read
+        pattern as get_parquet_footer: one suffix read, plus one read for a missing front part.
+        A failed read raises, as in get_parquet_footer.
+        """
+        try:
+            blob_client = self.blob_service_client.get_blob_client(
+                container=container_name,
+                blob=blob_path
+            )
+            if file_size is None:
+                file_size = blob_client.get_blob_properties().size
+            if file_size <= 0:
+                return b""
+            
+            length = min(initial_bytes, file_size)
+            tail = blob_client.download_blob(offset=file_size - length, length=length).readall()
+            needed = tail_length(tail)
+            if needed is None:
+                logger.warning('FN:get_blob_suffix container_name:{} blob_path:{} file_size:{} tail_bytes:{} recognised:{}'.format(container_name, blob_path, file_size, len(tail), False))
+                return tail
+            if needed > file_size or needed > max_bytes:
+                logger.warning('FN:get_blob_suffix container_name:{} blob_path:{} file_size:{} suffix_size:{} max_bytes:{}'.format(container_name, blob_path, file_size, needed, max_bytes))
+                return b""
+            
+            if needed > len(tail):
+                missing = needed - len(tail)
+                head = blob_client.download_blob(offset=file_size - needed, length=missing).readall()
+                tail = head + tail
+                logger.info('FN:get_blob_suffix container_name:{} blob_path:{} suffix_size:{} reads:{}'.format(container_name, blob_path, needed, 2))
+            
+            return tail[-needed:]
+        except Exception as e:
+            logger.warning('FN:get_blob_suffix container_name:{} blob_path:{} file_size:{} error:{}'.format(container_name, blob_path, file_size, str(e)))
+            raise
+    
+    def prefix_exists(self, container_name: str, prefix: str) -> bool:
+        # One single-result listing call: is there any blob under this prefix?
+        container_client = self.blob_service_client.get_container_client(container_name)
+        for page in container_client.list_blobs(name_starts_with=prefix, results_per_page=1).by_page():
+            for _ in page:
+                return True
+            break
+        return False
     
     def get_blob_properties(self, container_name: str, blob_path: str) -> Dict:
         try:
@@ -169,12 +300,34 @@ class AzureBlobClient:
             logger.error('FN:get_blob_properties container_name:{} blob_path:{} error:{}'.format(container_name, blob_path, str(e)))
             raise
     
+    def get_blob_record(self, container_name: str, blob_path: str) -> Optional[BlobRecord]:
+        """Listing-shaped record for a single blob, or None if it no longer exists."""
+        from azure.core.exceptions import ResourceNotFoundError
+        
+        try:
+            blob_client = self.blob_service_client.get_blob_client(
+                container=container_name,
+                blob=blob_path
+            )
+            record = BlobRecord.from_blob_properties(blob_client.get_blob_properties())
+            record.full_path = blob_path
+            record.name = blob_path.split("/")[-1]
+            return record
+        except ResourceNotFoundError:
+            logger.info('FN:get_blob_record container_name:{} blob_path:{} not_found:True'.format(container_name, blob_path))
+            return None
+        except Exception as e:
+            logger.error('FN:get_blob_record container_name:{} blob_path:{} error:{}'.format(container_name, blob_path, str(e)))
+            raise
+    
     def upload_blob(self, container_name: str, blob_path: str, content: bytes, content_type: str = "text/plain"):
         try:
             blob_client = self.blob_service_client.get_blob_client(
                 container=container_name,
                 blob=blob_path
             )
+            from azure.storage.blob import ContentSettings
+            
             content_settings = ContentSettings(content_type=content_type)
             blob_client.upload_blob(content, overwrite=True, content_settings=content_settings)
             logger.info('FN:upload_blob container_name:{} blob_path:{} content_type:{}'.format(container_name, blob_path, content_type))
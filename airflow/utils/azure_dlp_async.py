@@ -0,0 +1,263 @@
+import asyncio
+import atexit
+import email.utils
+import logging
+import os
+import random
+import threading
+import time
+from typing import Dict, List, Optional
+import sys
+
+from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import HttpResponseError, ServiceRequestError, ServiceResponseError
+# Needs aiohttp (airflow/requirements.txt); without it this import fails and callers fall back to the sync client
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.ai.textanalytics.aio import TextAnalyticsClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.azure_dlp_client import (
+    AZURE_AI_LANGUAGE_ENDPOINT,
+    AZURE_AI_LANGUAGE_KEY,
+    AZURE_AI_LANGUAGE_MAX_BATCH_DOCS,
+    AZURE_AI_LANGUAGE_MODEL_VERSION,
+    DEFAULT_LANGUAGE,
+    MAX_DOCUMENT_CHARS,
+    DLPMetrics,
+    _document_to_result,
+    _empty_result,
+    _error_result,
+    get_dlp_metrics,
+)
+
+logger = logging.getLogger(__name__)
+
+# Per-process limits; every discovery worker thread shares them through the runner below
+AZURE_AI_LANGUAGE_MAX_CONCURRENCY = int(os.getenv("AZURE_AI_LANGUAGE_MAX_CONCURRENCY", "4"))
+AZURE_AI_LANGUAGE_RATE_PER_SECOND = float(os.getenv("AZURE_AI_LANGUAGE_RATE_PER_SECOND", "10"))
+AZURE_AI_LANGUAGE_BURST = int(os.getenv("AZURE_AI_LANGUAGE_BURST", "10"))
+AZURE_AI_LANGUAGE_MAX_RETRIES = int(os.getenv("AZURE_AI_LANGUAGE_MAX_RETRIES", "5"))
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+# Longest server-requested wait we honour before giving up on a request
+MAX_RETRY_AFTER_SECONDS = 60.0
+
+
+def parse_retry_after(headers) -> Optional[float]:
+    """Seconds to wait from retry-after-ms / x-ms-retry-after-ms / Retry-After (seconds or HTTP date)."""
+    if not headers:
+        return None
+    for name in ("retry-after-ms", "x-ms-retry-after-ms"):
+        value = headers.get(name)
+        if value:
+            try:
+                return max(0.0, float(value) / 1000.0)
+            except ValueError:
+                pass
+    value = headers.get("Retry-After") or headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class TokenBucket:
+    """
+    asyncio token bucket: rate tokens per second, at most capacity banked for bursts.
+    pause() holds every caller back until a throttling window has passed.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[int] = None):
+        self.rate = max(rate, 0.001)
+        self.capacity = max(1, capacity or int(rate) or 1)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = None
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        # A throttled service has no spare capacity to burst into once the pause ends
+        self._tokens = 0.0
+
+    async def acquire(self):
+        if self._lock is None:
+            # Created on first use so it binds to the loop that runs the requests
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class AsyncAzureDLPClient:
+    """
+    Async Azure AI Language PII client (azure.ai.textanalytics.aio) with a token-bucket
+    rate limit, bounded concurrency and its own retry loop: 429/5xx responses are
+    retried after the server's Retry-After (or exponential backoff with jitter), and a
+    429 pauses the whole bucket so concurrent requests back off together. The SDK's
+    built-in retries are disabled so every throttle shows up in the metrics.
+
+    Requests that still fail come back with error=True instead of "no PII".
+    The endpoint may be a plain http:// URL, e.g. a local stand-in for testing.
+    Use from a single event loop.
+    """
+
+    def __init__(self, endpoint: Optional[str] = None, key: Optional[str] = None, max_concurrency: Optional[int] = None,
+                 rate_per_second: Optional[float] = None, burst: Optional[int] = None, max_retries: Optional[int] = None,
+                 metrics: Optional[DLPMetrics] = None, backoff_base: float = 0.5, backoff_max: float = 30.0):
+        self.endpoint = (endpoint or AZURE_AI_LANGUAGE_ENDPOINT).rstrip('/')
+        self.key = key or AZURE_AI_LANGUAGE_KEY
+        self.max_concurrency = max(1, max_concurrency or AZURE_AI_LANGUAGE_MAX_CONCURRENCY)
+        self.max_retries = AZURE_AI_LANGUAGE_MAX_RETRIES if max_retries is None else max_retries
+        self.metrics = metrics or get_dlp_metrics()
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.bucket = TokenBucket(rate_per_second or AZURE_AI_LANGUAGE_RATE_PER_SECOND, burst or AZURE_AI_LANGUAGE_BURST)
+        self._semaphore = None
+        self._client = None
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.endpoint and self.key)
+
+    def _get_client(self) -> TextAnalyticsClient:
+        if self._client is None:
+            self._client = TextAnalyticsClient(endpoint=self.endpoint, credential=AzureKeyCredential(self.key), retry_total=0,
+                                               transport=AioHttpTransport())
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            logger.info('FN:AsyncAzureDLPClient._get_client endpoint:{} max_concurrency:{} rate_per_second:{}'.format(
+                self.endpoint, self.max_concurrency, self.bucket.rate))
+        return self._client
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def _recognize(self, documents: List[Dict]):
+        client = self._get_client()
+        attempt = 0
+        while True:
+            await self.bucket.acquire()
+            async with self._semaphore:
+                started = time.perf_counter()
+                try:
+                    result = await client.recognize_pii_entities(documents, model_version=AZURE_AI_LANGUAGE_MODEL_VERSION)
+                    self.metrics.record_call(time.perf_counter() - started, len(documents))
+                    return result
+                except HttpResponseError as e:
+                    self.metrics.record_call(time.perf_counter() - started, len(documents), error=True)
+                    if e.status_code not in RETRYABLE_STATUS_CODES or attempt >= self.max_retries:
+                        raise
+                    retry_after = parse_retry_after(e.response.headers if e.response is not None else None)
+                    if retry_after is not None and retry_after > MAX_RETRY_AFTER_SECONDS:
+                        raise
+                    delay = retry_after if retry_after is not None else self._backoff(attempt)
+                    if e.status_code == 429:
+                        self.metrics.record_throttle()
+                        self.bucket.pause(delay)
+                except (ServiceRequestError, ServiceResponseError):
+                    self.metrics.record_call(time.perf_counter() - started, len(documents), error=True)
+                    if attempt >= self.max_retries:
+                        raise
+                    delay = self._backoff(attempt)
+            # Wait outside the semaphore so other requests can use the slot
+            attempt += 1
+            self.metrics.record_retry()
+            logger.warning('FN:AsyncAzureDLPClient._recognize document_count:{} attempt:{} retry_in:{:.2f}s'.format(len(documents), attempt, delay))
+            await asyncio.sleep(delay)
+
+    async def _detect_chunk(self, chunk: List[str], language: str) -> Dict[str, Dict]:
+        documents = [{"id": str(i), "text": text, "language": language} for i, text in enumerate(chunk)]
+        try:
+            result = await self._recognize(documents)
+        except Exception as e:
+            logger.error('FN:AsyncAzureDLPClient._detect_chunk document_count:{} language:{} error:{}'.format(len(chunk), language, str(e)))
+            return {text: _error_result() for text in chunk}
+
+        results = {}
+        for document_result in result or []:
+            text = chunk[int(document_result.id)]
+            if document_result.is_error:
+                logger.warning('FN:AsyncAzureDLPClient._detect_chunk text_length:{} language:{} error:{}'.format(len(text), language, document_result.error))
+                results[text] = _error_result()
+                continue
+            results[text] = _document_to_result(document_result)
+        return results
+
+    async def detect_pii_in_texts(self, texts: List[str], language: str = DEFAULT_LANGUAGE, batch_size: Optional[int] = None) -> List[Dict]:
+        """Async counterpart of AzureDLPClient.detect_pii_in_texts; the requests for the chunks run concurrently."""
+        if not self.configured:
+            return [_empty_result() for _ in texts]
+
+        batch_size = max(1, batch_size or AZURE_AI_LANGUAGE_MAX_BATCH_DOCS)
+        unique_texts = list(dict.fromkeys(text[:MAX_DOCUMENT_CHARS] for text in texts if text))
+        chunks = [unique_texts[start:start + batch_size] for start in range(0, len(unique_texts), batch_size)]
+        results_by_text = {}
+        for chunk_results in await asyncio.gather(*[self._detect_chunk(chunk, language) for chunk in chunks]):
+            results_by_text.update(chunk_results)
+
+        return [results_by_text.get(text[:MAX_DOCUMENT_CHARS], _empty_result()) if text else _empty_result() for text in texts]
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+
+class AsyncDLPRunner:
+    """
+    Runs one AsyncAzureDLPClient on a background event loop so synchronous callers
+    (the discovery worker threads) share its rate limit and concurrency budget.
+    """
+
+    def __init__(self, client: Optional[AsyncAzureDLPClient] = None):
+        self.client = client or AsyncAzureDLPClient()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='dlp-async', daemon=True)
+        self._thread.start()
+
+    def detect_pii_in_texts(self, texts: List[str], language: str = DEFAULT_LANGUAGE, batch_size: Optional[int] = None) -> List[Dict]:
+        future = asyncio.run_coroutine_threadsafe(self.client.detect_pii_in_texts(texts, language, batch_size), self._loop)
+        return future.result()
+
+    def close(self):
+        if self._loop.is_closed():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.client.close(), self._loop).result(timeout=10)
+        except Exception as e:
+            logger.warning('FN:AsyncDLPRunner.close error:{}'.format(str(e)))
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=10)
+        self._loop.close()
+
+
+# Global instance (initialized on first use)
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_async_dlp_runner() -> AsyncDLPRunner:
+    """Get or create the process-wide async DLP runner"""
+    global _runner
+    if _runner is None:
+        with _runner_lock:
+            if _runner is None:
+                _runner = AsyncDLPRunner()
+                atexit.register(_runner.close)
+    return _runner
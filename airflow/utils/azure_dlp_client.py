@@ -1,17 +1,139 @@
 import os
 import logging
+import threading
+import time
+from collections import deque
 from typing import Dict, List, Optional
-from azure.core.credentials import AzureKeyCredential
-from azure.ai.textanalytics import TextAnalyticsClient
-from dotenv import load_dotenv
+import sys
 
-load_dotenv()
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The Azure SDK is imported when a client is created; DAG files import this module at parse time
+from config.azure_config import AZURE_AI_LANGUAGE_CONFIG
+from utils.pii_rules import normalize_column_name
 
 logger = logging.getLogger(__name__)
 
+try:
+    from utils.pii_cache import get_pii_cache
+except ImportError:
+    # Cache needs the database utilities; without them every lookup goes to the service
+    logger.warning('FN:azure_dlp_client_import PII_CACHE_AVAILABLE:{}'.format(False))
+    
+    def get_pii_cache():
+        return None
+
 # Azure AI Language (PII Detection) configuration
-AZURE_AI_LANGUAGE_ENDPOINT = os.getenv("AZURE_AI_LANGUAGE_ENDPOINT", "")
-AZURE_AI_LANGUAGE_KEY = os.getenv("AZURE_AI_LANGUAGE_KEY", "")
+AZURE_AI_LANGUAGE_ENDPOINT = AZURE_AI_LANGUAGE_CONFIG["endpoint"]
+AZURE_AI_LANGUAGE_KEY = AZURE_AI_LANGUAGE_CONFIG["key"]
+# Synchronous PII recognition accepts at most 5 documents per request
+AZURE_AI_LANGUAGE_MAX_BATCH_DOCS = int(os.getenv("AZURE_AI_LANGUAGE_MAX_BATCH_DOCS", "5"))
+# Part of the PII cache key: bump it to re-classify everything after a model change
+AZURE_AI_LANGUAGE_MODEL_VERSION = os.getenv("AZURE_AI_LANGUAGE_MODEL_VERSION", "latest")
+DEFAULT_LANGUAGE = "en"
+# Where a classification came from; "unclassified" means no answer was available (not configured or the call failed)
+DLP_SOURCE = "azure_dlp"
+UNCLASSIFIED_SOURCE = "unclassified"
+# Azure AI Language API has a limit of 5120 characters per document
+MAX_DOCUMENT_CHARS = 5120
+# Route lookups through the rate-limited async client (utils.azure_dlp_async) when aiohttp is installed
+AZURE_AI_LANGUAGE_ASYNC = os.getenv("AZURE_AI_LANGUAGE_ASYNC", "true").lower() == "true"
+
+
+class DLPMetrics:
+    """
+    Process-wide counters for Azure AI Language calls, shared by the sync and async
+    clients: requests, documents, throttled (429) responses, retries, failed requests
+    and latency percentiles over the most recent max_samples requests. Thread-safe.
+    """
+    
+    def __init__(self, max_samples: int = 2048):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=max_samples)
+        self.calls = 0
+        self.documents = 0
+        self.throttles = 0
+        self.retries = 0
+        self.errors = 0
+    
+    def record_call(self, latency_seconds: float, documents: int, error: bool = False):
+        with self._lock:
+            self.calls += 1
+            self.documents += documents
+            self._latencies.append(latency_seconds)
+            if error:
+                self.errors += 1
+    
+    def record_throttle(self):
+        with self._lock:
+            self.throttles += 1
+    
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+    
+    def snapshot(self) -> Dict:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            snapshot = {
+                "calls": self.calls,
+                "documents": self.documents,
+                "throttles": self.throttles,
+                "retries": self.retries,
+                "errors": self.errors,
+            }
+        for name, percentile in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99)):
+            index = min(len(latencies) - 1, int(percentile * len(latencies)))
+            snapshot["latency_{}_ms".format(name)] = round(latencies[index] * 1000, 1) if latencies else None
+        return snapshot
+
+
+_dlp_metrics = DLPMetrics()
+
+
+def get_dlp_metrics() -> DLPMetrics:
+    return _dlp_metrics
+
+
+def _empty_result() -> Dict:
+    return {
+        "pii_detected": False,
+        "pii_types": [],
+        "entities": []
+    }
+
+
+def _error_result() -> Dict:
+    # Same shape as a clean result, flagged so callers (the PII cache) don't keep it
+    result = _empty_result()
+    result["error"] = True
+    return result
+
+
+def _document_to_result(document_result) -> Dict:
+    # Extract PII entities
+    entities = []
+    pii_types = []
+    
+    for entity in document_result.entities:
+        entities.append({
+            "text": entity.text,
+            "category": entity.category,
+            "subcategory": entity.subcategory,
+            "confidence_score": entity.confidence_score,
+            "offset": entity.offset,
+            "length": entity.length
+        })
+        
+        # Add category to pii_types if not already present
+        category = entity.subcategory or entity.category
+        if category and category not in pii_types:
+            pii_types.append(category)
+    
+    return {
+        "pii_detected": len(entities) > 0,
+        "pii_types": pii_types,
+        "entities": entities
+    }
 
 
 class AzureDLPClient:
@@ -26,6 +148,9 @@ class AzureDLPClient:
             self.client = None
         else:
             try:
+                from azure.core.credentials import AzureKeyCredential
+                from azure.ai.textanalytics import TextAnalyticsClient
+                
                 # Remove trailing slash if present (TextAnalyticsClient expects no trailing slash)
                 endpoint_clean = self.endpoint.rstrip('/')
                 credential = AzureKeyCredential(self.key)
@@ -46,71 +171,68 @@ class AzureDLPClient:
         Returns:
             Dict with pii_detected (bool), pii_types (list), and confidence scores
         """
-        if not self.client or not text:
-            return {
-                "pii_detected": False,
-                "pii_types": [],
-                "entities": []
-            }
+        return self.detect_pii_in_texts([text], language=language)[0]
+    
+    def detect_pii_in_texts(self, texts: List[str], language: str = DEFAULT_LANGUAGE, batch_size: Optional[int] = None) -> List[Dict]:
+        """
+        Detect PII in many texts, packing them into multi-document requests of up to
+        batch_size documents (the service's per-call limit). Duplicate texts are sent
+        once. Results come back in the same order as texts.
         
-        try:
-            # Azure AI Language API has a limit of 5120 characters per document
-            # For column names, this should be fine, but we'll truncate if needed
-            text_to_analyze = text[:5120] if len(text) > 5120 else text
-            
-            # Call PII detection API
-            result = self.client.recognize_pii_entities([text_to_analyze], language=language)
-            
-            if not result or len(result) == 0:
-                return {
-                    "pii_detected": False,
-                    "pii_types": [],
-                    "entities": []
-                }
-            
-            document_result = result[0]
-            
-            # Check for errors
-            if document_result.is_error:
-                logger.warning('FN:detect_pii_in_text text_length:{} language:{} error:{}'.format(len(text_to_analyze), language, document_result.error))
-                return {
-                    "pii_detected": False,
-                    "pii_types": [],
-                    "entities": []
-                }
-            
-            # Extract PII entities
-            entities = []
-            pii_types = []
-            
-            for entity in document_result.entities:
-                entities.append({
-                    "text": entity.text,
-                    "category": entity.category,
-                    "subcategory": entity.subcategory,
-                    "confidence_score": entity.confidence_score,
-                    "offset": entity.offset,
-                    "length": entity.length
-                })
-                
-                # Add category to pii_types if not already present
-                category = entity.subcategory or entity.category
-                if category and category not in pii_types:
-                    pii_types.append(category)
-            
-            return {
-                "pii_detected": len(entities) > 0,
-                "pii_types": pii_types,
-                "entities": entities
-            }
+        Args:
+            texts: Texts to analyze
+            language: Language code (default: "en")
+            batch_size: Documents per request (default: AZURE_AI_LANGUAGE_MAX_BATCH_DOCS)
+        
+        Returns:
+            List of dicts with pii_detected (bool), pii_types (list), and entities;
+            texts whose request failed also carry error=True
+        """
+        if not self.client:
+            return [_empty_result() for _ in texts]
+        
+        batch_size = max(1, batch_size or AZURE_AI_LANGUAGE_MAX_BATCH_DOCS)
+        # For column names the limit should be fine, but we'll truncate if needed
+        unique_texts = list(dict.fromkeys(text[:MAX_DOCUMENT_CHARS] for text in texts if text))
+        results_by_text = {}
+        failed_texts = set()
+        
+        for start in range(0, len(unique_texts), batch_size):
+            chunk = unique_texts[start:start + batch_size]
+            documents = [{"id": str(i), "text": text, "language": language} for i, text in enumerate(chunk)]
+            started = time.perf_counter()
+            try:
+                # Call PII detection API
+                result = self.client.recognize_pii_entities(documents, model_version=AZURE_AI_LANGUAGE_MODEL_VERSION)
+                _dlp_metrics.record_call(time.perf_counter() - started, len(chunk))
+            except Exception as e:
+                _dlp_metrics.record_call(time.perf_counter() - started, len(chunk), error=True)
+                if getattr(e, "status_code", None) == 429:
+                    # The SDK retry policy already honoured Retry-After; this request ran out of retries
+                    _dlp_metrics.record_throttle()
+                logger.error('FN:detect_pii_in_texts document_count:{} language:{} error:{}'.format(len(chunk), language, str(e)))
+                failed_texts.update(chunk)
+                continue
             
-        except Exception as e:
-            logger.error('FN:detect_pii_in_text text_length:{} language:{} error:{}'.format(len(text) if text else 0, language, str(e)))
-            return {
-                "pii_detected": False,
-                "pii_types": [],
-                "entities": []
-            }
+            for document_result in result or []:
+                text = chunk[int(document_result.id)]
+                # Check for errors
+                if document_result.is_error:
+                    logger.warning('FN:detect_pii_in_texts text_length:{} language:{} error:{}'.format(len(text), language, document_result.error))
+                    failed_texts.add(text)
+                    continue
+                results_by_text[text] = _document_to_result(document_result)
+        
+        results = []
+        for text in texts:
+            key = text[:MAX_DOCUMENT_CHARS] if text else text
+            if key in results_by_text:
+                results.append(results_by_text[key])
+            elif key in failed_texts:
+                results.append(_error_result())
+            else:
+                results.append(_empty_result())
+        return results
     
     def detect_pii_in_column_name(self, column_name: str) -> Dict:
         """
@@ -135,20 +257,57 @@ class AzureDLPClient:
             "pii_detected": result["pii_detected"],
             "pii_types": result["pii_types"]
         }
+    
+    def detect_pii_in_column_names(self, column_names: List[str]) -> List[Dict]:
+        """
+        Batch form of detect_pii_in_column_name: all column names of a schema in
+        as few requests as the per-call document limit allows
+        
+        Args:
+            column_names: Column names to analyze
+        
+        Returns:
+            List of dicts with pii_detected (bool) and pii_types (list), one per column
+        """
+        return [{
+            "pii_detected": result["pii_detected"],
+            "pii_types": result["pii_types"]
+        } for result in self.detect_pii_in_texts(column_names)]
 
 
 # Global instance (initialized on first use)
 _dlp_client = None
+# Discovery workers call into the DLP client concurrently; guard lazy creation
+_dlp_client_lock = threading.Lock()
 
 
 def get_dlp_client() -> Optional[AzureDLPClient]:
     """Get or create the global Azure DLP client instance"""
     global _dlp_client
     if _dlp_client is None:
-        _dlp_client = AzureDLPClient()
+        with _dlp_client_lock:
+            if _dlp_client is None:
+                _dlp_client = AzureDLPClient()
     return _dlp_client
 
 
+_async_runner_unavailable = False
+
+
+def _detect_pii_in_texts(client: AzureDLPClient, texts: List[str]) -> List[Dict]:
+    # Prefer the shared async client: one rate limit and concurrency budget for every worker thread
+    global _async_runner_unavailable
+    if AZURE_AI_LANGUAGE_ASYNC and not _async_runner_unavailable:
+        try:
+            from utils.azure_dlp_async import get_async_dlp_runner
+        except ImportError as e:
+            logger.warning('FN:_detect_pii_in_texts async_available:{} error:{}'.format(False, str(e)))
+            _async_runner_unavailable = True
+        else:
+            return get_async_dlp_runner().detect_pii_in_texts(texts, language=DEFAULT_LANGUAGE)
+    return client.detect_pii_in_texts(texts, language=DEFAULT_LANGUAGE)
+
+
 def detect_pii_in_column(column_name: str) -> Dict:
     """
     Convenience function to detect PII in a column name using Azure DLP
@@ -159,10 +318,75 @@ def detect_pii_in_column(column_name: str) -> Dict:
     Returns:
         Dict with pii_detected (bool) and pii_types (list)
     """
+    return detect_pii_in_columns([column_name])[0]
+
+
+def detect_pii_in_columns(column_names: List[str]) -> List[Dict]:
+    """
+    Batch form of detect_pii_in_column. Names already classified (under the same
+    normalized name, language and model version) come from the PII cache; only the
+    rest go to Azure AI Language, one request per AZURE_AI_LANGUAGE_MAX_BATCH_DOCS names.
+    
+    Args:
+        column_names: Column names to analyze
+    
+    Returns:
+        List of dicts with pii_detected (bool), pii_types (list) and source
+        ("azure_dlp", or "unclassified" when the service is not configured or failed)
+    """
     client = get_dlp_client()
-    if not client:
-        return {
+    if not client or not client.client:
+        return [{
             "pii_detected": False,
-            "pii_types": []
-        }
-    return client.detect_pii_in_column_name(column_name)
+            "pii_types": [],
+            "source": UNCLASSIFIED_SOURCE
+        } for _ in column_names]
+    
+    cache = get_pii_cache()
+    if cache is None:
+        return [{
+            "pii_detected": result["pii_detected"],
+            "pii_types": result["pii_types"],
+            "source": UNCLASSIFIED_SOURCE if result.get("error") else DLP_SOURCE
+        } for result in _detect_pii_in_texts(client, column_names)]
+    
+    names = [name for name in dict.fromkeys(column_names) if name]
+    cached = cache.get_many(names, DEFAULT_LANGUAGE, AZURE_AI_LANGUAGE_MODEL_VERSION)
+    
+    # One service lookup per normalized name: customerId and customer_id share the answer
+    to_classify = {}
+    for name in names:
+        if name not in cached:
+            to_classify.setdefault(normalize_column_name(name), name)
+    
+    classified = {}
+    if to_classify:
+        representatives = list(to_classify.values())
+        results = _detect_pii_in_texts(client, representatives)
+        classified = {normalize_column_name(name): result for name, result in zip(representatives, results)}
+        # Failed lookups are answered "no PII" for now but never cached
+        cache.put_many({name: result for name, result in zip(representatives, results) if not result.get("error")},
+                       DEFAULT_LANGUAGE, AZURE_AI_LANGUAGE_MODEL_VERSION)
+    
+    output = []
+    for name in column_names:
+        result = cached.get(name) if name else None
+        if result is None and name:
+            result = classified.get(normalize_column_name(name))
+        output.append({
+            "pii_detected": bool(result and result.get("pii_detected")),
+            "pii_types": list(result.get("pii_types") or []) if result else [],
+            "source": DLP_SOURCE if result and not result.get("error") else UNCLASSIFIED_SOURCE
+        })
+    return output
+
+
+def get_dlp_metrics_snapshot() -> Dict:
+    """Calls, throttles, retries and latency percentiles of Azure AI Language requests in this process"""
+    return _dlp_metrics.snapshot()
+
+
+def get_pii_cache_stats() -> Dict:
+    """Hit/miss counters of the process-wide PII cache (empty when disabled)"""
+    cache = get_pii_cache()
+    return cache.stats() if cache else {}
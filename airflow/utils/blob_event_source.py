@@ -0,0 +1,340 @@
+import base64
+import json
+import logging
+import os
+import sys
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.scan_checkpoint import get_resume_token, save_checkpoint
+
+logger = logging.getLogger(__name__)
+
+BLOB_CREATED = "created"
+BLOB_DELETED = "deleted"
+
+_EVENT_TYPES = {
+    "Microsoft.Storage.BlobCreated": BLOB_CREATED,
+    "Microsoft.Storage.BlobDeleted": BLOB_DELETED,
+    # Change feed records use the Event Grid schema too; tier changes and
+    # property updates do not touch the schema, so they are ignored.
+}
+
+# Change feed tokens are persisted as a listing checkpoint under this pseudo-container
+CHANGEFEED_CHECKPOINT_CONTAINER = "$blobchangefeed"
+
+
+class BlobEvent:
+    """One blob-created or blob-deleted notification, normalised across event sources."""
+
+    __slots__ = (
+        "event_type", "account_name", "container_name", "blob_path", "etag", "size",
+        "content_type", "event_time", "event_id",
+    )
+
+    def __init__(self, event_type: str, account_name: str, container_name: str, blob_path: str, etag: Optional[str] = None,
+                 size: Optional[int] = None, content_type: Optional[str] = None, event_time: Optional[str] = None,
+                 event_id: Optional[str] = None):
+        self.event_type = event_type
+        self.account_name = account_name
+        self.container_name = container_name
+        self.blob_path = blob_path
+        self.etag = etag
+        self.size = size
+        self.content_type = content_type
+        self.event_time = event_time
+        self.event_id = event_id
+
+    def __repr__(self) -> str:
+        return 'BlobEvent({} {}/{}/{})'.format(self.event_type, self.account_name, self.container_name, self.blob_path)
+
+
+def _split_blob_url(url: str) -> Optional[Tuple[str, str, str]]:
+    # https://{account}.blob.core.windows.net/{container}/{path} (or .dfs. for ADLS Gen2)
+    if not url:
+        return None
+    parsed = urlparse(url)
+    account_name = parsed.hostname.split(".")[0] if parsed.hostname else ""
+    parts = unquote(parsed.path).lstrip("/").split("/", 1)
+    if not account_name or len(parts) < 2 or not parts[1]:
+        return None
+    return account_name, parts[0], parts[1]
+
+
+def _split_subject(topic: str, subject: str) -> Optional[Tuple[str, str, str]]:
+    # topic:   /subscriptions/.../providers/Microsoft.Storage/storageAccounts/{account}
+    # subject: /blobServices/default/containers/{container}/blobs/{path}
+    if not subject or "/containers/" not in subject or "/blobs/" not in subject:
+        return None
+    account_name = (topic or "").rstrip("/").split("/")[-1]
+    container_part, blob_path = subject.split("/containers/", 1)[1].split("/blobs/", 1)
+    if not account_name or not blob_path:
+        return None
+    return account_name, container_part, blob_path
+
+
+def parse_event_grid_event(event: Dict) -> List[BlobEvent]:
+    """
+    Convert one Event Grid (or CloudEvents 1.0) storage event into BlobEvents.
+    Returns an empty list for event types discovery does not care about, and two
+    events (delete + create) for a rename.
+    """
+    event_type = event.get("eventType") or event.get("type")
+    topic = event.get("topic") or event.get("source")
+    data = event.get("data") or {}
+    event_time = event.get("eventTime") or event.get("time")
+    event_id = event.get("id")
+    etag = (data.get("eTag") or data.get("etag") or "").strip('"') or None
+
+    if event_type == "Microsoft.Storage.BlobRenamed":
+        source = _split_blob_url(data.get("sourceUrl"))
+        destination = _split_blob_url(data.get("destinationUrl"))
+        events = []
+        if source:
+            events.append(BlobEvent(BLOB_DELETED, *source, event_time=event_time, event_id=event_id))
+        if destination:
+            events.append(BlobEvent(BLOB_CREATED, *destination, etag=etag, event_time=event_time, event_id=event_id))
+        return events
+
+    kind = _EVENT_TYPES.get(event_type)
+    if kind is None:
+        return []
+
+    location = _split_subject(topic, event.get("subject")) or _split_blob_url(data.get("url") or data.get("blobUrl"))
+    if location is None:
+        logger.warning('FN:parse_event_grid_event event_id:{} event_type:{} subject:{} unparseable:True'.format(event_id, event_type, event.get("subject")))
+        return []
+    # Directory markers from hierarchical namespaces carry no schema
+    if location[2].endswith("/"):
+        return []
+
+    return [BlobEvent(
+        kind, *location,
+        etag=etag,
+        size=data.get("contentLength"),
+        content_type=data.get("contentType"),
+        event_time=event_time,
+        event_id=event_id,
+    )]
+
+
+def decode_queue_message(content) -> List[Dict]:
+    # Event Grid queue delivery is JSON, base64-encoded unless the subscription disables it
+    if isinstance(content, bytes):
+        content = content.decode("utf-8")
+    try:
+        payload = json.loads(content)
+    except ValueError:
+        payload = json.loads(base64.b64decode(content).decode("utf-8"))
+    return payload if isinstance(payload, list) else [payload]
+
+
+def match_event_scope(event: BlobEvent, storage_accounts: List[Dict]) -> Optional[Tuple[Dict, str]]:
+    """Return (storage_config, folder_path) for an event inside a configured scan scope, else None."""
+    for storage_config in storage_accounts:
+        if storage_config["name"] != event.account_name or event.container_name not in storage_config["containers"]:
+            continue
+        file_extensions = storage_config.get("file_extensions")
+        if file_extensions and not any(event.blob_path.lower().endswith(ext.lower()) for ext in file_extensions):
+            return None
+        # Longest matching folder wins so rows get the same folder_path a listing would give them
+        folders = [f for f in storage_config.get("folders") or [""]]
+        matches = [f for f in folders if not f or event.blob_path.startswith(f.rstrip("/") + "/")]
+        if matches:
+            return storage_config, max(matches, key=len)
+    return None
+
+
+class QueueEventSource:
+    """
+    Event Grid subscription delivering to an Azure Storage Queue. Messages are deleted
+    on commit(), except those holding an event to retry: they stay on the queue and
+    are redelivered once their visibility timeout expires, up to max_deliveries times.
+    """
+
+    name = "queue"
+
+    def __init__(self, connection_string: str, queue_name: str, visibility_timeout: int = 300, max_deliveries: int = 5):
+        from azure.storage.queue import QueueClient
+
+        self.queue_client = QueueClient.from_connection_string(connection_string, queue_name)
+        self.visibility_timeout = visibility_timeout
+        self.max_deliveries = max_deliveries
+        self._received = []  # (message, events parsed from it)
+
+    def receive(self, max_events: int) -> List[BlobEvent]:
+        events = []
+        messages = self.queue_client.receive_messages(
+            messages_per_page=min(max_events, 32),
+            max_messages=max_events,
+            visibility_timeout=self.visibility_timeout,
+        )
+        for message in messages:
+            message_events = []
+            self._received.append((message, message_events))
+            try:
+                for payload in decode_queue_message(message.content):
+                    message_events.extend(parse_event_grid_event(payload))
+            except Exception as e:
+                # Unparseable messages are dropped on commit rather than redelivered forever
+                logger.warning('FN:QueueEventSource.receive message_id:{} error:{}'.format(message.id, str(e)))
+            events.extend(message_events)
+        return events
+
+    def commit(self, retry_events: Iterable[BlobEvent] = ()):
+        retry_ids = {id(event) for event in retry_events}
+        for message, message_events in self._received:
+            if any(id(event) in retry_ids for event in message_events):
+                if (message.dequeue_count or 0) < self.max_deliveries:
+                    continue
+                logger.error('FN:QueueEventSource.commit message_id:{} dequeue_count:{} dropped:max_deliveries'.format(message.id, message.dequeue_count))
+            try:
+                self.queue_client.delete_message(message)
+            except Exception as e:
+                # Redelivery is harmless: the dedup hashes turn a repeated event into a skip
+                logger.warning('FN:QueueEventSource.commit message_id:{} error:{}'.format(message.id, str(e)))
+        self._received = []
+
+    def close(self):
+        self.queue_client.close()
+
+
+def _hold_position(source, retry_events: Iterable[BlobEvent]) -> bool:
+    # Positional sources cannot ack part of a batch: keep the position so the whole batch is
+    # re-read (events already written come back as dedup skips), at most max_deliveries times
+    retry_events = list(retry_events)
+    if not retry_events:
+        source._attempts = 0
+        return False
+    source._attempts += 1
+    if source._attempts < source.max_deliveries:
+        logger.warning('FN:{}.commit retry_events:{} attempt:{} held:True'.format(type(source).__name__, len(retry_events), source._attempts))
+        return True
+    logger.error('FN:{}.commit retry_events:{} attempt:{} dropped:max_deliveries events:{}'.format(type(source).__name__, len(retry_events), source._attempts, retry_events))
+    source._attempts = 0
+    return False
+
+
+class ChangeFeedEventSource:
+    """
+    Blob change feed ($blobchangefeed). The continuation token is stored as a
+    listing checkpoint once the events before it have been written.
+    """
+
+    name = "changefeed"
+
+    def __init__(self, connection_string: str, account_name: str, batch_id: str, run_id: str, max_deliveries: int = 5):
+        from azure.storage.blob.changefeed import ChangeFeedClient
+
+        self.account_name = account_name
+        self.max_deliveries = max_deliveries
+        self._attempts = 0
+        self.batch_id = batch_id
+        self.run_id = run_id
+        self.client = ChangeFeedClient.from_connection_string(connection_string)
+        checkpoint = get_resume_token(account_name, CHANGEFEED_CHECKPOINT_CONTAINER, "")
+        self._token = checkpoint["continuation_token"] if checkpoint else None
+        self._pages_completed = checkpoint["pages_completed"] if checkpoint else 0
+        self._events_seen = checkpoint["blobs_listed"] if checkpoint else 0
+        self._pending_token = None
+        # Without a stored token, start from the first run instead of replaying the whole feed
+        self._start_time = datetime.utcnow()
+
+    def receive(self, max_events: int) -> List[BlobEvent]:
+        # After a held commit() this re-reads the same page
+        kwargs = {} if self._token else {"start_time": self._start_time}
+        pages = self.client.list_changes(results_per_page=max_events, **kwargs).by_page(continuation_token=self._token)
+        events = []
+        page = next(pages, None)
+        if page is not None:
+            for change in page:
+                events.extend(parse_event_grid_event(change))
+                self._events_seen += 1
+            self._pending_token = pages.continuation_token
+        return events
+
+    def commit(self, retry_events: Iterable[BlobEvent] = ()):
+        if not self._pending_token or self._pending_token == self._token:
+            return
+        if _hold_position(self, retry_events):
+            return
+        self._token = self._pending_token
+        self._pages_completed += 1
+        save_checkpoint(self.account_name, CHANGEFEED_CHECKPOINT_CONTAINER, "", self._token,
+                        self.batch_id, self.run_id, self._pages_completed, self._events_seen)
+
+    def close(self):
+        self.client.close()
+
+
+class FileEventSource:
+    """
+    Local stand-in for the queue: one Event Grid event (or event array) per line
+    of a JSONL file, with the committed byte offset kept in a "<file>.offset" sidecar.
+    """
+
+    name = "file"
+
+    def __init__(self, file_path: str, max_deliveries: int = 5):
+        self.file_path = file_path
+        self.max_deliveries = max_deliveries
+        self._attempts = 0
+        self.offset_path = file_path + ".offset"
+        self._offset = 0
+        if os.path.exists(self.offset_path):
+            with open(self.offset_path) as f:
+                self._offset = int(f.read().strip() or 0)
+        self._pending_offset = self._offset
+
+    def receive(self, max_events: int) -> List[BlobEvent]:
+        if not os.path.exists(self.file_path):
+            return []
+        events = []
+        lines_read = 0
+        with open(self.file_path, "rb") as f:
+            f.seek(self._pending_offset)
+            while lines_read < max_events:
+                line = f.readline()
+                # Stop at a partially written last line; it is picked up once complete
+                if not line or not line.endswith(b"\n"):
+                    break
+                self._pending_offset = f.tell()
+                lines_read += 1
+                if not line.strip():
+                    continue
+                try:
+                    for payload in decode_queue_message(line):
+                        events.extend(parse_event_grid_event(payload))
+                except Exception as e:
+                    logger.warning('FN:FileEventSource.receive file_path:{} offset:{} error:{}'.format(self.file_path, self._pending_offset, str(e)))
+        return events
+
+    def commit(self, retry_events: Iterable[BlobEvent] = ()):
+        if self._pending_offset == self._offset:
+            return
+        if _hold_position(self, retry_events):
+            # The next receive() re-reads the batch from the committed offset
+            self._pending_offset = self._offset
+            return
+        with open(self.offset_path, "w") as f:
+            f.write(str(self._pending_offset))
+        self._offset = self._pending_offset
+
+    def close(self):
+        pass
+
+
+def open_event_source(config: Dict, storage_accounts: List[Dict], batch_id: str = "", run_id: str = ""):
+    source = config.get("source", "queue")
+    max_deliveries = config.get("max_deliveries", 5)
+    if source == "queue":
+        return QueueEventSource(config["queue_connection_string"], config["queue_name"], config.get("visibility_timeout", 300), max_deliveries)
+    if source == "changefeed":
+        # The change feed is per storage account; event mode reads the first configured account
+        storage_config = storage_accounts[0]
+        return ChangeFeedEventSource(storage_config["connection_string"], storage_config["name"], batch_id, run_id, max_deliveries)
+    if source == "file":
+        return FileEventSource(config["file_path"], max_deliveries)
+    raise ValueError("Unknown event discovery source: {}".format(source))
@@ -0,0 +1,244 @@
+import codecs
+import csv
+import io
+import json
+import logging
+import zlib
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+PARQUET_MAGIC = b"PAR1"
+AVRO_MAGIC = b"Obj\x01"
+ORC_MAGIC = b"ORC"
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# Never inflate more than this from a compressed sample: the header is all we parse
+MAX_DECOMPRESSED_BYTES = 256 * 1024
+
+# Compression suffixes stripped before the extension is used as a format hint
+COMPRESSION_EXTENSIONS = {"gz": "gzip", "gzip": "gzip", "zst": "zstd", "zstd": "zstd"}
+# Extensions whose content is checked rather than trusted
+TEXT_FORMAT_HINTS = {"csv": "csv", "tsv": "csv", "txt": None, "json": "json", "jsonl": "json", "ndjson": "json"}
+CSV_DELIMITERS = ",;\t|"
+
+
+class SniffResult:
+    """
+    Outcome of sniffing a sample: the detected format (None if unknown), the
+    compression wrapping it (None if plain), the bytes to parse (decompressed
+    when needed) and format hints such as the CSV delimiter.
+    """
+
+    __slots__ = ("format", "compression", "content", "detected_by", "details")
+
+    def __init__(self, format: Optional[str], content: bytes, compression: Optional[str] = None,
+                 detected_by: str = "extension", details: Optional[dict] = None):
+        self.format = format
+        self.content = content
+        self.compression = compression
+        self.detected_by = detected_by  # "magic", "content", "extension" or "dataset"
+        self.details = details or {}
+
+    def __repr__(self) -> str:
+        return 'SniffResult(format={} compression={} detected_by={})'.format(self.format, self.compression, self.detected_by)
+
+
+def split_extension(file_name: str):
+    """Return (format extension, compression) for names like data.csv.gz."""
+    parts = file_name.lower().rsplit("/", 1)[-1].split(".")
+    if len(parts) < 2:
+        return "", None
+    compression = COMPRESSION_EXTENSIONS.get(parts[-1])
+    if compression:
+        return (parts[-2] if len(parts) > 2 else ""), compression
+    return parts[-1], None
+
+
+def decompress_head(data: bytes, compression: str, max_output: int = MAX_DECOMPRESSED_BYTES) -> Optional[bytes]:
+    """
+    Inflate the start of a (usually truncated) compressed sample. Only max_output
+    bytes are produced; a truncated stream simply yields what it could decode.
+    Returns None when the codec is unavailable or the data is corrupt.
+    """
+    try:
+        if compression == "gzip":
+            # wbits 16+MAX_WBITS: gzip header and trailer
+            return zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(data, max_output)
+        if compression == "zstd":
+            if not ZSTD_AVAILABLE:
+                logger.warning('FN:decompress_head compression:zstd ZSTD_AVAILABLE:{}'.format(False))
+                return None
+            # stream_reader stops at max_output instead of inflating the whole sample first
+            with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data)) as reader:
+                return reader.read(max_output)
+    except Exception as e:
+        logger.warning('FN:decompress_head compression:{} sample_bytes:{} error:{}'.format(compression, len(data), str(e)))
+    return None
+
+
+def detect_text_encoding(data: bytes) -> Tuple[Optional[str], bool]:
+    """
+    (encoding, has_bom) of a text sample, or (None, False) for binary data.
+    BOMs decide first; UTF-16 without a BOM is recognised from its NUL pattern;
+    otherwise UTF-8 (a multi-byte character cut off at the end of the sample is
+    fine), falling back to cp1252 for legacy exports.
+    """
+    if data.startswith(codecs.BOM_UTF8):
+        return "utf-8", True
+    if data.startswith(codecs.BOM_UTF16_LE):
+        return "utf-16-le", True
+    if data.startswith(codecs.BOM_UTF16_BE):
+        return "utf-16-be", True
+    head = data[:512]
+    if len(head) >= 4 and b"\x00" in head:
+        even_nuls = head[0::2].count(0)
+        odd_nuls = head[1::2].count(0)
+        if odd_nuls > len(head) // 4 and even_nuls == 0:
+            return "utf-16-le", False
+        if even_nuls > len(head) // 4 and odd_nuls == 0:
+            return "utf-16-be", False
+        return None, False
+    try:
+        data.decode("utf-8")
+        return "utf-8", False
+    except UnicodeDecodeError as e:
+        if e.start >= len(data) - 3 and e.reason == "unexpected end of data":
+            return "utf-8", False
+    return "cp1252", False
+
+
+def decode_text(data: bytes, encoding: str, has_bom: bool = False) -> str:
+    """Decode a (possibly truncated) sample, dropping the BOM and any partial trailing character."""
+    if has_bom:
+        data = data[len(codecs.BOM_UTF8):] if encoding == "utf-8" else data[2:]
+    return data.decode(encoding, errors="ignore")
+
+
+def _is_text(text: str) -> bool:
+    if not text:
+        return False
+    sample = text[:4096]
+    # Mostly printable
+    bad = sum(1 for ch in sample if ch == "\ufffd" or (ord(ch) < 32 and ch not in "\r\n\t\f"))
+    return bad <= max(2, len(sample) // 100)
+
+
+def first_record_end(text: str, quotechar: str = '"') -> int:
+    """
+    Index of the line break ending the first CSV record (newlines inside quoted
+    fields do not count), or -1 if the sample ends inside the first record.
+    """
+    in_quotes = False
+    for pos, ch in enumerate(text):
+        if ch == quotechar:
+            in_quotes = not in_quotes
+        elif ch in "\r\n" and not in_quotes:
+            return pos
+    return -1
+
+
+def _sniff_json(text: str, extension: str = "") -> Optional[str]:
+    stripped = text.lstrip()
+    if stripped.startswith("["):
+        return "json"
+    if not stripped.startswith("{"):
+        return None
+    if extension in ("jsonl", "ndjson"):
+        return "ndjson"
+    first_line, newline, rest = stripped.partition("\n")
+    if newline and rest.lstrip().startswith("{"):
+        try:
+            if isinstance(json.loads(first_line), dict):
+                return "ndjson"
+        except ValueError:
+            pass
+    return "json"
+
+
+def sniff_csv_dialect(text: str) -> Optional[Dict]:
+    """{"delimiter", "quotechar"} of a delimited-text sample, or None if it does not look delimited."""
+    lines = [line for line in text.splitlines()[:20] if line.strip()]
+    # The last line of a truncated sample is usually cut short
+    if len(lines) > 1 and not text.endswith(("\n", "\r")):
+        lines = lines[:-1]
+    if not lines:
+        return None
+    try:
+        dialect = csv.Sniffer().sniff("\n".join(lines), delimiters=CSV_DELIMITERS)
+        return {"delimiter": dialect.delimiter, "quotechar": dialect.quotechar or '"'}
+    except csv.Error:
+        # A lone header line: take the most frequent candidate that appears outside quotes
+        header = lines[0]
+        quotechar = "'" if header.startswith("'") else '"'
+        unquoted = "".join(part for i, part in enumerate(header.split(quotechar)) if i % 2 == 0)
+        counts = {d: unquoted.count(d) for d in CSV_DELIMITERS}
+        delimiter = max(counts, key=counts.get)
+        return {"delimiter": delimiter, "quotechar": quotechar} if counts[delimiter] else None
+
+
+def _sniff_magic(data: bytes) -> Optional[str]:
+    # Head magic, or the trailer magic of a footer-only sample (Parquet/ORC)
+    if data.startswith(PARQUET_MAGIC) or data.endswith(PARQUET_MAGIC):
+        return "parquet"
+    if data.startswith(AVRO_MAGIC):
+        return "avro"
+    if data.startswith(ORC_MAGIC) or (len(data) > 4 and data[-4:-1] == ORC_MAGIC):
+        return "orc"
+    return None
+
+
+def sniff_format(data: bytes, file_name: str = "") -> SniffResult:
+    """
+    Detect the format of a sample from its bytes, using the extension only as a
+    hint. Compressed samples (gzip, zstd) are partially inflated and sniffed again.
+    Works purely on the bytes already downloaded.
+    """
+    extension, extension_compression = split_extension(file_name)
+
+    compression = None
+    content = data or b""
+    if content.startswith(GZIP_MAGIC):
+        compression = "gzip"
+    elif content.startswith(ZSTD_MAGIC):
+        compression = "zstd"
+    if compression:
+        inflated = decompress_head(content, compression)
+        if inflated is None:
+            return SniffResult(None, b"", compression=compression, detected_by="magic")
+        content = inflated
+    elif extension_compression:
+        # Named .gz but not compressed: sniff the bytes as they are
+        logger.info('FN:sniff_format file_name:{} extension_compression:{} compressed:False'.format(file_name, extension_compression))
+
+    magic_format = _sniff_magic(content)
+    if magic_format:
+        return SniffResult(magic_format, content, compression=compression, detected_by="magic")
+
+    encoding, has_bom = detect_text_encoding(content)
+    text = decode_text(content, encoding, has_bom) if encoding else ""
+    if not _is_text(text):
+        # Binary we do not recognise: fall back to the extension (e.g. an Avro/ORC sample cut oddly)
+        hint = extension if extension in ("parquet", "avro", "orc") else None
+        return SniffResult(hint, content, compression=compression)
+
+    json_format = _sniff_json(text, extension)
+    if json_format:
+        # .json holding one object per line is NDJSON; .jsonl holding an array is still JSON
+        return SniffResult(json_format, content, compression=compression, detected_by="content")
+
+    dialect = sniff_csv_dialect(text)
+    if extension in ("csv", "tsv") or (dialect and TEXT_FORMAT_HINTS.get(extension) != "json"):
+        details = dialect or {"delimiter": "\t" if extension == "tsv" else ",", "quotechar": '"'}
+        details.update(encoding=encoding, has_bom=has_bom)
+        return SniffResult("csv", content, compression=compression,
+                           detected_by="content" if dialect else "extension", details=details)
+
+    return SniffResult(TEXT_FORMAT_HINTS.get(extension, extension or None), content, compression=compression)
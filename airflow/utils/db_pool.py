@@ -0,0 +1,250 @@
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+import pymysql
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.azure_config import DB_CONFIG, DB_POOL_CONFIG, DISCOVERY_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+def create_connection():
+    return pymysql.connect(
+        host=DB_CONFIG["host"],
+        port=DB_CONFIG["port"],
+        user=DB_CONFIG["user"],
+        password=DB_CONFIG["password"],
+        database=DB_CONFIG["database"],
+        cursorclass=pymysql.cursors.DictCursor,
+        charset='utf8mb4'
+    )
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+class PooledConnection:
+    """
+    A checked-out pool connection. Used exactly like the pymysql connection it wraps;
+    close() (or leaving a with-block) hands it back to the pool instead of closing it.
+    """
+
+    __slots__ = ("_pool", "_conn", "_created_at")
+
+    def __init__(self, pool: "ConnectionPool", conn, created_at: float):
+        self._pool = pool
+        self._conn = conn
+        self._created_at = created_at
+
+    def __getattr__(self, name):
+        if name in PooledConnection.__slots__:
+            raise AttributeError(name)
+        conn = self._conn
+        if conn is None:
+            raise pymysql.err.InterfaceError(0, "Connection already returned to the pool")
+        return getattr(conn, name)
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool._release(conn, self._created_at)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def __del__(self):
+        # A caller that never closed its connection must not shrink the pool for good
+        conn = getattr(self, "_conn", None)
+        if conn is not None:
+            self._conn = None
+            self._pool._discard(conn, leaked=True)
+
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe pool of pymysql connections, after the backend's DBUtils
+    PooledDB setup (blocking, ping on checkout, reset on return) plus max-age recycling
+    and counters. At most max_size connections are open; a checkout that finds none
+    idle and the pool full waits up to wait_timeout seconds, then raises
+    OperationalError 1040 (too many connections), which the retry_db_operation
+    decorators on the callers treat as retryable.
+
+    On checkout a connection older than max_age_seconds is replaced, and with ping
+    enabled a dead one (server restart, wait_timeout) is replaced before use. On
+    return it is rolled back, so no transaction or read snapshot outlives a checkout.
+    """
+
+    def __init__(self, creator: Callable = create_connection, max_size: int = 8, max_age_seconds: float = 1800.0,
+                 ping: bool = True, wait_timeout: float = 30.0):
+        self._creator = creator
+        self.max_size = max(1, max_size)
+        self.max_age_seconds = max_age_seconds
+        self.ping = ping
+        self.wait_timeout = wait_timeout
+        self._idle = deque()  # (connection, created_at), most recently returned last
+        self._size = 0  # open connections, idle and checked out
+        self._cond = threading.Condition()
+        self._closed = False
+        self._metrics = {
+            "checkouts": 0, "creates": 0, "waits": 0, "wait_ms": 0.0, "timeouts": 0,
+            "recycled": 0, "ping_failures": 0, "discarded": 0, "leaked": 0,
+        }
+
+    def _expired(self, created_at: float) -> bool:
+        return self.max_age_seconds > 0 and time.monotonic() - created_at >= self.max_age_seconds
+
+    def connection(self) -> PooledConnection:
+        started = time.monotonic()
+        waited = False
+        conn = None
+        created_at = None
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise pymysql.err.InterfaceError(0, "Connection pool is closed")
+                if self._idle:
+                    # LIFO: the warmest connection is the least likely to have timed out server-side
+                    conn, created_at = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                if not waited:
+                    self._metrics["waits"] += 1
+                    waited = True
+                remaining = self.wait_timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self._metrics["timeouts"] += 1
+                    raise pymysql.err.OperationalError(1040, "Connection pool exhausted ({} in use)".format(self._size))
+                self._cond.wait(remaining)
+            self._metrics["checkouts"] += 1
+            if waited:
+                self._metrics["wait_ms"] += (time.monotonic() - started) * 1000
+
+        if conn is not None and not self._usable(conn, created_at):
+            conn = None
+        if conn is None:
+            # The slot is already reserved; give it back if the connect fails
+            try:
+                conn = self._creator()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            created_at = time.monotonic()
+            with self._cond:
+                self._metrics["creates"] += 1
+        return PooledConnection(self, conn, created_at)
+
+    def _usable(self, conn, created_at: float) -> bool:
+        # Runs outside the lock; a rejected connection keeps its slot for the replacement
+        if self._expired(created_at):
+            _close_quietly(conn)
+            with self._cond:
+                self._metrics["recycled"] += 1
+            return False
+        if self.ping:
+            try:
+                conn.ping(reconnect=False)
+            except Exception as e:
+                _close_quietly(conn)
+                with self._cond:
+                    self._metrics["ping_failures"] += 1
+                logger.warning('FN:ConnectionPool._usable ping_failed:{}'.format(str(e)))
+                return False
+        return True
+
+    def _release(self, conn, created_at: float):
+        try:
+            # Same reset as PooledDB: uncommitted work and the read snapshot end here
+            conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+        with self._cond:
+            if not self._closed and not self._expired(created_at):
+                self._idle.append((conn, created_at))
+                self._cond.notify()
+                return
+            self._size -= 1
+            self._metrics["recycled"] += 1
+            self._cond.notify()
+        _close_quietly(conn)
+
+    def _discard(self, conn, leaked: bool = False):
+        _close_quietly(conn)
+        with self._cond:
+            self._size -= 1
+            self._metrics["leaked" if leaked else "discarded"] += 1
+            self._cond.notify()
+
+    def stats(self) -> Dict:
+        with self._cond:
+            stats = dict(self._metrics)
+            stats["wait_ms"] = round(stats["wait_ms"], 1)
+            stats["size"] = self._size
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = self._size - len(self._idle)
+            stats["max_size"] = self.max_size
+        return stats
+
+    def close(self):
+        """Close idle connections; checked-out ones are closed when they come back."""
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            _close_quietly(conn)
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+
+
+def get_connection_pool() -> ConnectionPool:
+    """
+    The process-wide pool, created on first use. A forked child (Airflow task runner)
+    gets a fresh pool: sockets inherited from the parent are never reused, nor closed,
+    since closing them would end the parent's sessions.
+    """
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            _pool = ConnectionPool(
+                max_size=DB_POOL_CONFIG.get("max_size", DISCOVERY_CONFIG.get("max_workers", 8) + 2),
+                max_age_seconds=DB_POOL_CONFIG.get("max_age_seconds", 1800.0),
+                ping=DB_POOL_CONFIG.get("ping", True),
+                wait_timeout=DB_POOL_CONFIG.get("wait_timeout", 30.0),
+            )
+            _pool_pid = pid
+            logger.info('FN:get_connection_pool pid:{} max_size:{} max_age_seconds:{} ping:{}'.format(
+                pid, _pool.max_size, _pool.max_age_seconds, _pool.ping))
+        return _pool
+
+
+def db_pool_stats() -> Dict:
+    # Counters of this process's pool (empty when pooling is disabled or nothing connected yet)
+    if _pool is None or _pool_pid != os.getpid():
+        return {}
+    return _pool.stats()
@@ -1,13 +1,16 @@
+import hashlib
+import json
 import pymysql
 import logging
-from typing import Dict, Optional, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
 import sys
 import os
 import time
 from functools import wraps
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from config.azure_config import DB_CONFIG
+from config.azure_config import AZURE_AI_LANGUAGE_CONFIG, DB_POOL_CONFIG, DISCOVERY_CONFIG
+from utils.db_pool import create_connection, get_connection_pool
 
 logger = logging.getLogger(__name__)
 
@@ -105,21 +108,25 @@ def retry_db_operation(max_retries: int = None, base_delay: float = 1.0, max_del
 
 @retry_db_operation(max_retries=None, base_delay=1.0, max_delay=60.0, max_total_time=3600.0)
 def get_db_connection():
-    return pymysql.connect(
-        host=DB_CONFIG["host"],
-        port=DB_CONFIG["port"],
-        user=DB_CONFIG["user"],
-        password=DB_CONFIG["password"],
-        database=DB_CONFIG["database"],
-        cursorclass=pymysql.cursors.DictCursor,
-        charset='utf8mb4'
-    )
+    # Pooled: close() hands the connection back to the process-wide pool (pool exhaustion is retried as 1040)
+    if DB_POOL_CONFIG.get("enabled", True):
+        return get_connection_pool().connection()
+    return create_connection()
+
+
+def storage_location_hash(storage_type: str, storage_identifier: str, container_name: Optional[str], storage_path: str) -> str:
+    # Same value as the generated data_discovery.storage_location_hash column (UNIQUE):
+    # a fixed-width point-lookup key, paths being far longer than an index prefix allows.
+    # The container is part of it: the same path in two containers of an account is two blobs
+    key = "\0".join([storage_type or "", storage_identifier or "", container_name or "", storage_path or ""])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
 
 
 @retry_db_operation(max_retries=None, base_delay=1.0, max_delay=60.0, max_total_time=3600.0)
 def check_file_exists(
     storage_type: str,
     storage_identifier: str,
+    container_name: Optional[str],
     storage_path: str
 ) -> Optional[Dict]:
     conn = None
@@ -127,24 +134,225 @@ def check_file_exists(
         conn = get_db_connection()
         with conn.cursor() as cursor:
             sql = """
-                SELECT id, file_hash, schema_hash
+                SELECT id, file_hash, schema_hash, is_active
                 FROM data_discovery
-                WHERE storage_type = %s
-                  AND storage_identifier = %s
-                  AND storage_path = %s
-                LIMIT 1
+                WHERE storage_location_hash = %s
             """
-            cursor.execute(sql, (storage_type, storage_identifier, storage_path))
+            cursor.execute(sql, (storage_location_hash(storage_type, storage_identifier, container_name, storage_path),))
             result = cursor.fetchone()
             return result
     except Exception as e:
-        logger.error('FN:check_file_exists storage_type:{} storage_identifier:{} storage_path:{} error:{}'.format(storage_type, storage_identifier, storage_path, str(e)))
+        logger.error('FN:check_file_exists storage_type:{} storage_identifier:{} container_name:{} storage_path:{} error:{}'.format(storage_type, storage_identifier, container_name, storage_path, str(e)))
+        raise
+    finally:
+        if conn:
+            conn.close()
+
+
+@retry_db_operation(max_retries=None, base_delay=1.0, max_delay=60.0, max_total_time=3600.0)
+def load_schema_json(discovery_id: int) -> Optional[Dict]:
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT schema_json FROM data_discovery WHERE id = %s", (discovery_id,))
+            result = cursor.fetchone()
+        if not result or not result.get("schema_json"):
+            return None
+        schema_json = result["schema_json"]
+        return json.loads(schema_json) if isinstance(schema_json, (str, bytes)) else schema_json
+    except Exception as e:
+        logger.error('FN:load_schema_json discovery_id:{} error:{}'.format(discovery_id, str(e)))
         raise
     finally:
         if conn:
             conn.close()
 
 
+class DedupIndex:
+    """
+    In-memory dedup index for one (storage_type, storage_identifier, container, folder prefix).
+    Loaded once per scan with a single streamed query and maps storage_path to
+    (id, file_hash, schema_hash, is_active, has_unclassified_columns), so per-blob
+    lookups need no DB round-trip.
+    
+    When the prefix holds more rows than max_entries the index is not materialised;
+    callers prefetch() paths in chunks instead and lookups use chunked IN (...) queries.
+    
+    With hash partitions (partition_count > 1) only the shard's own rows are kept, so
+    each shard of a folder holds its share of the index rather than all of it.
+    """
+    
+    # Rough per-entry overhead of the dict slot, key str and value tuple (CPython, 64-bit)
+    _ENTRY_OVERHEAD_BYTES = 8 * 3 + 49 + 64
+    
+    def __init__(self, storage_type: str, storage_identifier: str, container_name: Optional[str], folder_path: str = "",
+                 max_entries: Optional[int] = None, lookup_chunk_size: Optional[int] = None,
+                 partition: int = 0, partition_count: int = 1):
+        self.storage_type = storage_type
+        self.storage_identifier = storage_identifier
+        self.container_name = container_name
+        self.prefix = folder_path.rstrip("/") + "/" if folder_path else ""
+        self.partition = partition
+        self.partition_count = partition_count
+        self.max_entries = max_entries if max_entries is not None else DISCOVERY_CONFIG.get("dedup_index_max_entries", 500000)
+        self.lookup_chunk_size = lookup_chunk_size or DISCOVERY_CONFIG.get("dedup_lookup_chunk_size", 500)
+        self.in_memory = False
+        self.loaded = False
+        self._entries = {}
+        # Fallback mode: paths already resolved by prefetch(), whether or not a row exists
+        self._prefetched_paths = set()
+        self._memory_bytes = 0
+    
+    @classmethod
+    def for_lookups(cls, storage_type: str, storage_identifier: str, container_name: Optional[str], folder_path: str = "",
+                    lookup_chunk_size: Optional[int] = None) -> "DedupIndex":
+        """Index that never loads the prefix: every path is resolved by chunked IN (...) lookups (event-driven discovery)."""
+        index = cls(storage_type, storage_identifier, container_name, folder_path, lookup_chunk_size=lookup_chunk_size)
+        index.loaded = True
+        return index
+    
+    def _prefix_like(self) -> str:
+        escaped = self.prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return escaped + "%"
+    
+    @staticmethod
+    def _entry(row) -> Tuple:
+        return (row[0], row[1], row[2], bool(row[3]), bool(row[4]))
+    
+    def _estimate_entry_bytes(self, storage_path: str, entry: Tuple) -> int:
+        return self._ENTRY_OVERHEAD_BYTES + len(storage_path) + sum(len(v) for v in entry[1:3] if v)
+    
+    @retry_db_operation(max_retries=None, base_delay=1.0, max_delay=60.0, max_total_time=3600.0)
+    def load(self) -> "DedupIndex":
+        """Count rows under the prefix, then stream the shard's rows into memory if they fit."""
+        # Imported here: discovery_pipeline imports this module
+        from utils.discovery_pipeline import in_partition, partition_key
+        conn = None
+        try:
+            conn = get_db_connection()
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT COUNT(*) AS total
+                    FROM data_discovery
+                    WHERE storage_type = %s
+                      AND storage_identifier = %s
+                      AND storage_container = %s
+                      AND storage_path LIKE %s
+                """, (self.storage_type, self.storage_identifier, self.container_name, self._prefix_like()))
+                total = cursor.fetchone()["total"]
+            
+            # A shard expects its share of the prefix; the stream below stops if skewed datasets push it past max_entries
+            if total // self.partition_count > self.max_entries:
+                return self._use_chunked_lookups(total)
+            
+            entries = {}
+            memory_bytes = 0
+            # Unbuffered tuple cursor: rows are streamed instead of materialised as a list of dicts
+            with conn.cursor(pymysql.cursors.SSCursor) as cursor:
+                cursor.execute("""
+                    SELECT storage_path, id, file_hash, schema_hash, is_active, has_unclassified_columns
+                    FROM data_discovery
+                    WHERE storage_type = %s
+                      AND storage_identifier = %s
+                      AND storage_container = %s
+                      AND storage_path LIKE %s
+                """, (self.storage_type, self.storage_identifier, self.container_name, self._prefix_like()))
+                for row in cursor:
+                    if self.partition_count > 1 and not in_partition(partition_key(row[0]), self.partition, self.partition_count):
+                        continue
+                    if len(entries) >= self.max_entries:
+                        return self._use_chunked_lookups(total)
+                    entry = self._entry(row[1:])
+                    entries[row[0]] = entry
+                    memory_bytes += self._estimate_entry_bytes(row[0], entry)
+            
+            self._entries = entries
+            self._memory_bytes = memory_bytes
+            self.in_memory = True
+            self.loaded = True
+            logger.info('FN:DedupIndex.load storage_identifier:{} container_name:{} prefix:{} partition:{}/{} entries:{} memory_bytes:{}'.format(
+                self.storage_identifier, self.container_name, self.prefix, self.partition, self.partition_count, len(entries), self.memory_footprint_bytes()))
+            return self
+        except Exception as e:
+            logger.error('FN:DedupIndex.load storage_identifier:{} container_name:{} prefix:{} error:{}'.format(self.storage_identifier, self.container_name, self.prefix, str(e)))
+            raise
+        finally:
+            if conn:
+                conn.close()
+    
+    def _use_chunked_lookups(self, total: int) -> "DedupIndex":
+        self._entries = {}
+        self._memory_bytes = 0
+        self.in_memory = False
+        self.loaded = True
+        logger.warning('FN:DedupIndex.load storage_identifier:{} container_name:{} prefix:{} partition:{}/{} row_count:{} max_entries:{} mode:chunked_lookup'.format(
+            self.storage_identifier, self.container_name, self.prefix, self.partition, self.partition_count, total, self.max_entries))
+        return self
+    
+    @retry_db_operation(max_retries=None, base_delay=1.0, max_delay=60.0, max_total_time=3600.0)
+    def _lookup_chunk(self, storage_paths: List[str]) -> Dict[str, Tuple]:
+        conn = None
+        try:
+            conn = get_db_connection()
+            with conn.cursor(pymysql.cursors.Cursor) as cursor:
+                # Unique-key point lookups instead of a storage_path(200) prefix range
+                placeholders = ','.join(['%s'] * len(storage_paths))
+                sql = f"""
+                    SELECT storage_path, id, file_hash, schema_hash, is_active, has_unclassified_columns
+                    FROM data_discovery
+                    WHERE storage_location_hash IN ({placeholders})
+                """
+                cursor.execute(sql, [storage_location_hash(self.storage_type, self.storage_identifier, self.container_name, path)
+                                     for path in storage_paths])
+                return {row[0]: self._entry(row[1:]) for row in cursor.fetchall()}
+        except Exception as e:
+            logger.error('FN:DedupIndex._lookup_chunk storage_identifier:{} path_count:{} error:{}'.format(self.storage_identifier, len(storage_paths), str(e)))
+            raise
+        finally:
+            if conn:
+                conn.close()
+    
+    def prefetch(self, storage_paths: Iterable[str]):
+        """Resolve a batch of paths with chunked IN (...) lookups (no-op when held in memory)."""
+        if not self.loaded:
+            self.load()
+        if self.in_memory:
+            return
+        pending = [p for p in storage_paths if p not in self._prefetched_paths]
+        for start in range(0, len(pending), self.lookup_chunk_size):
+            chunk = pending[start:start + self.lookup_chunk_size]
+            found = self._lookup_chunk(chunk)
+            self._entries.update(found)
+            self._prefetched_paths.update(chunk)
+    
+    def get(self, storage_path: str) -> Optional[Dict]:
+        """Return the existing record for a path as {id, file_hash, schema_hash, is_active, has_unclassified_columns}, or None."""
+        if not self.loaded:
+            self.load()
+        
+        if self.in_memory:
+            entry = self._entries.get(storage_path)
+        else:
+            if storage_path not in self._prefetched_paths:
+                self.prefetch([storage_path])
+            # Each path is resolved once per scan, so drop it to keep the fallback cache bounded
+            self._prefetched_paths.discard(storage_path)
+            entry = self._entries.pop(storage_path, None)
+        
+        if entry is None:
+            return None
+        return {"id": entry[0], "file_hash": entry[1], "schema_hash": entry[2], "is_active": entry[3],
+                "has_unclassified_columns": entry[4]}
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def memory_footprint_bytes(self) -> int:
+        """Approximate memory held by the index (dict table plus keys and value tuples)."""
+        return sys.getsizeof(self._entries) + self._memory_bytes
+
+
 def compare_hashes(existing_record: Dict, new_file_hash: str, new_schema_hash: str) -> Tuple[bool, bool]:
     existing_file_hash = existing_record.get("file_hash")
     existing_schema_hash = existing_record.get("schema_hash")
@@ -155,13 +363,31 @@ def compare_hashes(existing_record: Dict, new_file_hash: str, new_schema_hash: s
     return file_changed, schema_changed
 
 
+def is_unchanged(existing_record: Optional[Dict], file_hash: str) -> bool:
+    """True when the stored change fingerprint matches: nothing to sample, extract or write."""
+    return bool(existing_record) and existing_record.get("file_hash") == file_hash
+
+
+def needs_reclassification(existing_record: Optional[Dict], dlp_configured: Optional[bool] = None) -> bool:
+    """
+    True for a stored row with columns no classifier answered for (DLP throttled, failed
+    or not configured when it was written) while a DLP endpoint is configured. Such a row
+    is sampled again despite a matching fingerprint, or it would stay unclassified forever.
+    """
+    if dlp_configured is None:
+        dlp_configured = AZURE_AI_LANGUAGE_CONFIG["enabled"]
+    return bool(dlp_configured) and bool(existing_record) and bool(existing_record.get("has_unclassified_columns"))
+
+
 def should_update_or_insert(existing_record: Optional[Dict], new_file_hash: str, new_schema_hash: str) -> Tuple[bool, bool]:
     """
     Determine if we should insert/update a record.
-    Returns: (should_insert_or_update, schema_changed)
-    - Only update full record if schema actually changed, not for metadata-only updates
+    Returns: (should_write, schema_changed)
     - For new records, always insert
-    - For existing records with only file_hash change, just update last_checked_at (not full record)
+    - Schema changed: update the full record
+    - Only the file changed (fingerprint differs, same schema): refresh file_metadata and
+      storage_metadata so the stored fingerprint matches next time
+    - Nothing changed: no write at all
     """
     if not existing_record:
         return True, False
@@ -173,10 +399,10 @@ def should_update_or_insert(existing_record: Optional[Dict], new_file_hash: str,
         logger.info('FN:should_update_or_insert schema_changed:{} existing_record_id:{}'.format(schema_changed, existing_record.get('id')))
         return True, True
     
-    # File hash changed but schema didn't - don't update full record, just update last_checked_at
+    # File changed but schema didn't - refresh the file metadata (and stored fingerprint) only
     if file_changed:
         logger.info('FN:should_update_or_insert file_changed:{} schema_changed:{} existing_record_id:{}'.format(file_changed, schema_changed, existing_record.get('id')))
-        return False, False
+        return True, False
     
     logger.info('FN:should_update_or_insert file_changed:{} schema_changed:{} existing_record_id:{}'.format(file_changed, schema_changed, existing_record.get('id')))
     return False, False
@@ -0,0 +1,154 @@
+import hashlib
+import logging
+from datetime import datetime
+from typing import Iterable, List, Optional
+import pymysql
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.azure_config import DISCOVERY_CONFIG
+from utils.deduplication import get_db_connection, retry_db_operation
+from utils.discovery_pipeline import in_partition, partition_key
+
+logger = logging.getLogger(__name__)
+
+
+def _path_fingerprint(storage_path: str) -> int:
+    # 8 bytes per listed path instead of the path itself; a collision can only hide a deletion for one run
+    return int.from_bytes(hashlib.blake2b(storage_path.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class DeletionSweep:
+    """
+    Mark-and-sweep reconciliation of blobs deleted from storage for one listing scope
+    (account, container and folder prefix).
+
+    mark() records every path the walk listed (after grouping, so a Delta table or
+    partitioned dataset is marked at its root). Once the whole prefix has been walked
+    in one run, sweep() streams the container's active rows under the prefix and marks those that
+    were not listed as deleted (is_active = FALSE, deleted_at = NOW()) in batched
+    UPDATEs by id. Rows discovered or checked after the walk started are left alone,
+    since the listing may have passed their position before they existed. That walk
+    start is taken by begin() from the database clock, the one discovered_at and
+    last_checked_at are written with. With hash partitions only the shard's own rows
+    are swept.
+    """
+
+    def __init__(self, storage_type: str, storage_identifier: str, container_name: Optional[str], folder_path: str = "",
+                 partition: int = 0, partition_count: int = 1, batch_rows: Optional[int] = None):
+        self.storage_type = storage_type
+        self.storage_identifier = storage_identifier
+        self.container_name = container_name
+        self.prefix = folder_path.rstrip("/") + "/" if folder_path else ""
+        self.partition = partition
+        self.partition_count = partition_count
+        self.batch_rows = batch_rows or DISCOVERY_CONFIG.get("sweep_batch_rows", 1000)
+        self._seen = set()
+        self.walk_started_at: Optional[datetime] = None
+        self.rows_checked = 0
+        self.rows_deleted = 0
+
+    @retry_db_operation(max_retries=None, base_delay=1.0, max_delay=60.0, max_total_time=3600.0)
+    def begin(self) -> datetime:
+        """Record the walk start as the database's NOW(); call it before the listing starts."""
+        conn = None
+        try:
+            conn = get_db_connection()
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT NOW() AS walk_started_at")
+                self.walk_started_at = cursor.fetchone()["walk_started_at"]
+            return self.walk_started_at
+        except Exception as e:
+            logger.error('FN:DeletionSweep.begin storage_identifier:{} container_name:{} prefix:{} error:{}'.format(self.storage_identifier, self.container_name, self.prefix, str(e)))
+            raise
+        finally:
+            if conn:
+                conn.close()
+
+    def mark(self, storage_paths: Iterable[str]):
+        self._seen.update(_path_fingerprint(path) for path in storage_paths)
+
+    @property
+    def marked(self) -> int:
+        return len(self._seen)
+
+    def _prefix_like(self) -> str:
+        escaped = self.prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return escaped + "%"
+
+    @retry_db_operation(max_retries=None, base_delay=1.0, max_delay=60.0, max_total_time=3600.0)
+    def _unlisted_ids(self, walk_started_at: datetime) -> List[int]:
+        conn = None
+        try:
+            conn = get_db_connection()
+            ids = []
+            checked = 0
+            # Unbuffered tuple cursor: active rows are streamed, only the unlisted ids are kept
+            with conn.cursor(pymysql.cursors.SSCursor) as cursor:
+                cursor.execute("""
+                    SELECT id, storage_path
+                    FROM data_discovery
+                    WHERE storage_type = %s
+                      AND storage_identifier = %s
+                      AND storage_container = %s
+                      AND storage_path LIKE %s
+                      AND is_active = TRUE
+                      AND discovered_at < %s
+                      AND (last_checked_at IS NULL OR last_checked_at < %s)
+                """, (self.storage_type, self.storage_identifier, self.container_name, self._prefix_like(), walk_started_at, walk_started_at))
+                for discovery_id, storage_path in cursor:
+                    if self.partition_count > 1 and not in_partition(partition_key(storage_path), self.partition, self.partition_count):
+                        continue
+                    checked += 1
+                    if _path_fingerprint(storage_path) not in self._seen:
+                        ids.append(discovery_id)
+            self.rows_checked = checked
+            return ids
+        except Exception as e:
+            logger.error('FN:DeletionSweep._unlisted_ids storage_identifier:{} container_name:{} prefix:{} error:{}'.format(self.storage_identifier, self.container_name, self.prefix, str(e)))
+            raise
+        finally:
+            if conn:
+                conn.close()
+
+    @retry_db_operation(max_retries=None, base_delay=1.0, max_delay=60.0, max_total_time=3600.0)
+    def _mark_deleted(self, ids: List[int]) -> int:
+        conn = None
+        try:
+            conn = get_db_connection()
+            with conn.cursor() as cursor:
+                placeholders = ','.join(['%s'] * len(ids))
+                cursor.execute(f"""
+                    UPDATE data_discovery
+                    SET is_active = FALSE,
+                        deleted_at = NOW()
+                    WHERE id IN ({placeholders})
+                      AND is_active = TRUE
+                """, ids)
+                updated = cursor.rowcount
+            conn.commit()
+            return updated
+        except Exception as e:
+            if conn:
+                conn.rollback()
+            logger.error('FN:DeletionSweep._mark_deleted storage_identifier:{} id_count:{} error:{}'.format(self.storage_identifier, len(ids), str(e)))
+            raise
+        finally:
+            if conn:
+                conn.close()
+
+    def sweep(self) -> int:
+        """Mark active rows under the prefix that the walk did not list as deleted. Returns the row count."""
+        if self.walk_started_at is None:
+            raise RuntimeError("DeletionSweep.sweep() called without begin()")
+        if not self._seen:
+            # An empty listing is more often a permissions or configuration problem than an emptied prefix
+            logger.warning('FN:DeletionSweep.sweep storage_identifier:{} container_name:{} prefix:{} marked:0 swept:False'.format(self.storage_identifier, self.container_name, self.prefix))
+            return 0
+        ids = self._unlisted_ids(self.walk_started_at)
+        for start in range(0, len(ids), self.batch_rows):
+            self.rows_deleted += self._mark_deleted(ids[start:start + self.batch_rows])
+        logger.info('FN:DeletionSweep.sweep storage_identifier:{} container_name:{} prefix:{} partition:{}/{} marked:{} rows_checked:{} rows_deleted:{}'.format(
+            self.storage_identifier, self.container_name, self.prefix, self.partition, self.partition_count, self.marked, self.rows_checked, self.rows_deleted))
+        return self.rows_deleted
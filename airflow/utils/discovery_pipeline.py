@@ -0,0 +1,759 @@
+import io
+import json
+import logging
+import re
+import zlib
+from collections import Counter, deque
+from concurrent.futures import Executor
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.azure_config import DISCOVERY_CONFIG, get_storage_location_json
+from utils.format_headers import delta_commit_scanned, find_delta_metadata, orc_tail_length
+from utils.metadata_extractor import (
+    carry_forward_classification,
+    compute_change_fingerprint,
+    extract_file_metadata,
+    generate_schema_hash,
+    has_unclassified_columns,
+    header_sample_complete,
+)
+from utils.deduplication import DedupIndex, is_unchanged, load_schema_json, needs_reclassification, should_update_or_insert
+
+logger = logging.getLogger(__name__)
+
+
+def bounded_ordered_map(executor: Executor, func: Callable, items: Iterable, max_in_flight: int) -> Iterator[Tuple[object, Optional[object], Optional[Exception]]]:
+    """
+    Run func over items on the executor, keeping at most max_in_flight calls pending.
+    Yields (item, result, error) tuples in submission order so progress logging
+    and DB writes stay ordered even though the work itself runs concurrently.
+    """
+    max_in_flight = max(1, max_in_flight)
+    pending = deque()
+
+    def _drain_one():
+        item, future = pending.popleft()
+        try:
+            return item, future.result(), None
+        except Exception as e:
+            return item, None, e
+
+    for item in items:
+        pending.append((item, executor.submit(func, item)))
+        if len(pending) >= max_in_flight:
+            yield _drain_one()
+
+    while pending:
+        yield _drain_one()
+
+
+def prefetch_in_chunks(dedup_index: DedupIndex, blobs: Iterable[Dict], chunk_size: Optional[int] = None) -> Iterator[Dict]:
+    """
+    Pass blobs through unchanged, resolving their dedup records a chunk at a time.
+    Only does work when the index fell back to chunked IN (...) lookups.
+    """
+    chunk_size = chunk_size or dedup_index.lookup_chunk_size
+    chunk: List[Dict] = []
+    for blob_info in blobs:
+        chunk.append(blob_info)
+        if len(chunk) >= chunk_size:
+            dedup_index.prefetch([b["full_path"] for b in chunk])
+            yield from chunk
+            chunk = []
+    if chunk:
+        dedup_index.prefetch([b["full_path"] for b in chunk])
+        yield from chunk
+
+
+def in_partition(blob_path: str, partition: int, partition_count: int) -> bool:
+    # Stable across processes and workers, unlike hash() with per-process randomisation
+    return zlib.crc32(blob_path.encode("utf-8")) % partition_count == partition
+
+
+DELTA_LOG_DIR = "_delta_log"
+_DELTA_COMMIT_RE = re.compile(r"^(\d{20})\.json$")
+_DELTA_CHECKPOINT_RE = re.compile(r"^(\d{20})\.checkpoint\.parquet$")
+_HIVE_SEGMENT_RE = re.compile(r"^[^=_.][^=]*=[^=]*$")
+# Distinct partition values tracked per key; past this only min/max keep moving
+MAX_TRACKED_PARTITION_VALUES = 10000
+
+
+def delta_table_root(blob_path: str) -> Optional[str]:
+    """Table root of a blob inside a Delta log (sales/orders/_delta_log/...json -> sales/orders), else None."""
+    index = blob_path.find("/" + DELTA_LOG_DIR + "/")
+    return blob_path[:index] if index > 0 else None
+
+
+def hive_partitioning(blob_path: str) -> Optional[Tuple[str, List[Tuple[str, str]]]]:
+    """
+    (dataset root, [(key, value), ...]) for a file under Hive-style partition folders
+    (sales/orders/dt=2024-01-01/region=eu/part-0.parquet -> sales/orders, [(dt, ...), (region, eu)]),
+    or None when the path has no partition folder directly under a dataset root.
+    """
+    segments = blob_path.split("/")[:-1]
+    for index, segment in enumerate(segments):
+        if _HIVE_SEGMENT_RE.match(segment):
+            if index == 0:
+                return None
+            partitions = []
+            for partition in segments[index:]:
+                if not _HIVE_SEGMENT_RE.match(partition):
+                    break
+                key, value = partition.split("=", 1)
+                partitions.append((key, value))
+            return "/".join(segments[:index]), partitions
+    return None
+
+
+def partition_key(blob_path: str) -> str:
+    # Shard key hashed by in_partition: the Delta table root for a blob under _delta_log/, else the
+    # dataset root for a blob under Hive-style partition folders, else the blob path itself. A table's
+    # whole log and every partition of a dataset land in one shard; Delta data files directly under
+    # the table root keep their own path and are dropped by the shard that lists them (DeltaTableGrouper
+    # probes for the log)
+    root = delta_table_root(blob_path)
+    if root is None:
+        partitioning = hive_partitioning(blob_path)
+        root = partitioning[0] if partitioning else None
+    return root or blob_path
+
+
+def build_delta_dataset(table_root: str, latest_log_blob: Dict) -> Dict:
+    """
+    Dataset record for a Delta table: one row at the table root, fingerprinted by the
+    newest log entry, so it changes exactly when a new commit lands.
+    """
+    return {
+        "name": table_root.split("/")[-1],
+        "full_path": table_root,
+        "size": latest_log_blob.get("size", 0),
+        "etag": latest_log_blob.get("etag", ""),
+        "created_at": latest_log_blob.get("created_at"),
+        "last_modified": latest_log_blob.get("last_modified"),
+        "content_type": "application/x-delta-table",
+        "blob_type": latest_log_blob.get("blob_type", "Block blob"),
+        "access_tier": latest_log_blob.get("access_tier"),
+        "metadata": {"delta_log_latest": latest_log_blob["name"]},
+        "dataset_format": "delta",
+    }
+
+
+class DeltaTableGrouper:
+    """
+    Collapses Delta tables in a listing into one dataset each. Blobs under a table's
+    _delta_log/ become a single record for the table root (see build_delta_dataset);
+    data files under a known table root are dropped. Spark part files listed before
+    their table's log (e.g. an upper-case partition folder sorts ahead of _delta_log)
+    are resolved with one cached prefix probe per folder.
+
+    The listing is lexicographic, so a table is emitted once the listing has moved
+    past its _delta_log/ prefix (listed_through); flush() emits whatever is left at the end.
+    Grouper state is not checkpointed: callers only save a listing checkpoint while
+    pending is 0, so a resumed walk re-lists any dataset that was still open.
+    """
+
+    __slots__ = ("blob_client", "container_name", "_roots", "_pending", "members_skipped", "probes")
+
+    def __init__(self, blob_client, container_name: str):
+        self.blob_client = blob_client
+        self.container_name = container_name
+        self._roots: Dict[str, bool] = {}  # folder -> is a Delta table root
+        self._pending: Dict[str, Dict] = {}  # table root -> newest log blob seen so far
+        self.members_skipped = 0
+        self.probes = 0
+
+    @staticmethod
+    def _folders_of(blob_path: str) -> List[str]:
+        # Deepest first
+        parts = blob_path.split("/")[:-1]
+        return ["/".join(parts[:depth]) for depth in range(len(parts), 0, -1)]
+
+    def _probe(self, folder: str) -> bool:
+        return self.blob_client.prefix_exists(self.container_name, folder + "/" + DELTA_LOG_DIR + "/")
+
+    def prime(self, blob_paths: Iterable[str], executor: Executor, max_in_flight: int) -> int:
+        """
+        Probe the uncached folders of many part files concurrently, so the
+        table_root_of() calls that follow answer from the cache. A failed probe is
+        left uncached (table_root_of retries it). Returns the number of probes.
+        """
+        folders: Dict[str, None] = {}  # insertion-ordered set
+        for blob_path in blob_paths:
+            if not blob_path.rsplit("/", 1)[-1].startswith("part-"):
+                continue
+            candidates = self._folders_of(blob_path)
+            if any(self._roots.get(folder) for folder in candidates):
+                continue
+            folders.update((folder, None) for folder in candidates if folder not in self._roots)
+        for folder, is_root, error in bounded_ordered_map(executor, self._probe, list(folders), max_in_flight):
+            self.probes += 1
+            if error is None:
+                self._roots[folder] = is_root
+            else:
+                logger.warning('FN:DeltaTableGrouper.prime container_name:{} folder:{} error:{}'.format(self.container_name, folder, str(error)))
+        return len(folders)
+
+    def table_root_of(self, blob_path: str) -> Optional[str]:
+        """Root of the Delta table a data file belongs to, or None."""
+        folders = self._folders_of(blob_path)
+        for folder in folders:
+            if self._roots.get(folder):
+                return folder
+        if not blob_path.rsplit("/", 1)[-1].startswith("part-"):
+            return None
+        for folder in folders:
+            if folder not in self._roots:
+                self.probes += 1
+                self._roots[folder] = self._probe(folder)
+                if self._roots[folder]:
+                    return folder
+        return None
+
+    def group(self, page: List[Dict], listed_through: Optional[str] = None) -> List[Dict]:
+        grouped = []
+        for blob_info in page:
+            blob_path = blob_info["full_path"]
+            root = delta_table_root(blob_path)
+            if root is not None:
+                self._roots[root] = True
+                latest = self._pending.get(root)
+                if latest is None or _delta_log_order(blob_info) > _delta_log_order(latest):
+                    self._pending[root] = blob_info
+                continue
+            if self.table_root_of(blob_path) is not None:
+                self.members_skipped += 1
+                continue
+            grouped.append(blob_info)
+
+        # listed_through: last path of the raw listing page, when page was already filtered/grouped
+        last_path = listed_through or (page[-1]["full_path"] if page else None)
+        for root in list(self._pending):
+            if last_path is not None and not last_path.startswith(root + "/" + DELTA_LOG_DIR + "/"):
+                grouped.append(build_delta_dataset(root, self._pending.pop(root)))
+        return grouped
+
+    @property
+    def pending(self) -> int:
+        # Tables seen but not emitted yet; a listing checkpoint taken now would lose them
+        return len(self._pending)
+
+    def flush(self) -> List[Dict]:
+        datasets = [build_delta_dataset(root, latest) for root, latest in self._pending.items()]
+        self._pending.clear()
+        return datasets
+
+
+def _delta_log_order(blob_info: Dict) -> Tuple[bool, str]:
+    # Commits (00000000000000000012.json) decide; checkpoints and .crc files only if there are none
+    return bool(_DELTA_COMMIT_RE.match(blob_info["name"])), blob_info["name"]
+
+
+class _PartitionedDataset:
+    __slots__ = ("root", "files", "total_bytes", "newest", "keys", "values", "partitions", "formats", "skipped")
+
+    def __init__(self, root: str):
+        self.root = root
+        self.files = 0
+        self.total_bytes = 0
+        self.newest = None
+        self.keys: List[str] = []
+        self.values: Dict[str, Dict] = {}  # key -> {"seen": set, "distinct", "min", "max"}
+        self.partitions = set()
+        self.formats = Counter()
+        self.skipped = 0
+
+    def add(self, blob_info: Dict, partitions: List[Tuple[str, str]]):
+        self.files += 1
+        self.total_bytes += blob_info.get("size", 0) or 0
+        last_modified = blob_info.get("last_modified")
+        if self.newest is None or (last_modified is not None and (self.newest.get("last_modified") is None or last_modified > self.newest["last_modified"])):
+            self.newest = blob_info
+        name = blob_info["name"]
+        self.formats[name.rsplit(".", 1)[-1].lower() if "." in name else ""] += 1
+        if len(self.partitions) < MAX_TRACKED_PARTITION_VALUES:
+            self.partitions.add(tuple(partitions))
+        for key, value in partitions:
+            stats = self.values.get(key)
+            if stats is None:
+                self.keys.append(key)
+                stats = self.values[key] = {"seen": set(), "min": value, "max": value}
+            if len(stats["seen"]) < MAX_TRACKED_PARTITION_VALUES:
+                stats["seen"].add(value)
+            stats["min"] = min(stats["min"], value)
+            stats["max"] = max(stats["max"], value)
+
+    def to_blob_info(self) -> Dict:
+        """
+        Dataset record for the whole partitioned folder. The newest file is the representative
+        whose schema stands for the dataset; the fingerprint (newest etag/last_modified, total
+        size) changes when files are added, rewritten or removed.
+        """
+        newest = self.newest
+        return {
+            "name": self.root.split("/")[-1],
+            "full_path": self.root,
+            "size": self.total_bytes,
+            "etag": newest.get("etag", ""),
+            "created_at": newest.get("created_at"),
+            "last_modified": newest.get("last_modified"),
+            "content_type": newest.get("content_type", "application/octet-stream"),
+            "blob_type": newest.get("blob_type", "Block blob"),
+            "access_tier": newest.get("access_tier"),
+            "metadata": {},
+            "representative": newest,
+            "partitioning": {
+                "style": "hive",
+                "keys": list(self.keys),
+                "partition_count": len(self.partitions),
+                "file_count": self.files,
+                "total_bytes": self.total_bytes,
+                "formats": dict(self.formats),
+                "values": {
+                    key: {"distinct": len(stats["seen"]), "min": stats["min"], "max": stats["max"]}
+                    for key, stats in self.values.items()
+                },
+                "representative": newest["full_path"],
+            },
+        }
+
+
+class PartitionedDatasetGrouper:
+    """
+    Collapses Hive-style partitioned folders (.../dt=2024-01-01/part-0001.parquet) into
+    one dataset per root: one data_discovery row, one schema read (from the newest
+    file, see _PartitionedDataset.to_blob_info) and one DLP pass instead of one per
+    part file. The other files share that schema and are never read. Hidden files
+    inside partitions (_SUCCESS, .crc) are ignored like Hive/Spark readers do.
+
+    Like DeltaTableGrouper, a dataset is emitted once the listing has moved past
+    its root, with flush() for the end of the listing.
+    """
+
+    __slots__ = ("_pending", "files_grouped")
+
+    def __init__(self):
+        self._pending: Dict[str, _PartitionedDataset] = {}
+        self.files_grouped = 0
+
+    def group(self, page: List[Dict], listed_through: Optional[str] = None) -> List[Dict]:
+        grouped = []
+        for blob_info in page:
+            partitioning = hive_partitioning(blob_info["full_path"]) if not blob_info.get("dataset_format") else None
+            if partitioning is None:
+                grouped.append(blob_info)
+                continue
+            root, partitions = partitioning
+            dataset = self._pending.get(root)
+            if dataset is None:
+                dataset = self._pending[root] = _PartitionedDataset(root)
+            if blob_info["name"].startswith(("_", ".")):
+                dataset.skipped += 1
+                continue
+            dataset.add(blob_info, partitions)
+            self.files_grouped += 1
+
+        last_path = listed_through or (page[-1]["full_path"] if page else None)
+        for root in list(self._pending):
+            if last_path is not None and not last_path.startswith(root + "/"):
+                grouped.extend(self._emit(root))
+        return grouped
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def flush(self) -> List[Dict]:
+        datasets = []
+        for root in list(self._pending):
+            datasets.extend(self._emit(root))
+        return datasets
+
+    def _emit(self, root: str) -> List[Dict]:
+        dataset = self._pending.pop(root)
+        if dataset.newest is None:
+            return []
+        logger.info('FN:PartitionedDatasetGrouper dataset_root:{} files:{} partitions:{} keys:{}'.format(root, dataset.files, len(dataset.partitions), dataset.keys))
+        return [dataset.to_blob_info()]
+
+
+def list_partitioned_dataset(blob_client, container_name: str, root: str) -> Optional[Dict]:
+    """Dataset record for one partitioned folder from a listing of just that folder (event-driven path); None if it is empty."""
+    grouper = PartitionedDatasetGrouper()
+    for records, _ in blob_client.iter_blob_pages(container_name, root):
+        grouper.group(records)
+    return next((dataset for dataset in grouper.flush() if dataset["full_path"] == root), None)
+
+
+def shard_scope(folder_path: str, partition: int = 0, partition_count: int = 1) -> str:
+    """Checkpoint/watermark scope for a shard: the folder itself, or folder#partition/count for a hash partition."""
+    if partition_count <= 1:
+        return folder_path
+    return "{}#{}/{}".format(folder_path, partition, partition_count)
+
+
+def sample_blob(blob_client, container_name: str, blob_info: Dict) -> Optional[bytes]:
+    # Get ONLY headers/column names - NO data rows (banking compliance)
+    # CSV/JSON: First 1KB (just headers/keys - NO data), grown in doubling ranges only
+    # while the CSV header line / first JSON object is unfinished, up to sample_max_bytes
+    # Parquet: Footer only (schema metadata is at the end - column names only), located
+    # from the listing size so the common case is a single ranged read
+    # ORC: footer + postscript only, located the same way
+    # Delta: the table's metaData action, see sample_delta_log
+    # Partitioned datasets: the representative file only
+    if blob_info.get("dataset_format") == "delta":
+        return sample_delta_log(blob_client, container_name, blob_info)
+    blob_info = blob_info.get("representative") or blob_info
+    blob_path = blob_info["full_path"]
+    file_extension = blob_info["name"].split(".")[-1].lower() if "." in blob_info["name"] else ""
+
+    try:
+        if file_extension == "orc":
+            file_sample = blob_client.get_blob_suffix(
+                container_name, blob_path, orc_tail_length,
+                file_size=blob_info.get("size"),
+                initial_bytes=DISCOVERY_CONFIG.get("parquet_footer_initial_bytes", 8192),
+                max_bytes=DISCOVERY_CONFIG.get("parquet_footer_max_bytes", 16 * 1024 * 1024),
+            )
+        elif file_extension == "parquet":
+            file_sample = blob_client.get_parquet_footer(
+                container_name, blob_path,
+                file_size=blob_info.get("size"),
+                initial_bytes=DISCOVERY_CONFIG.get("parquet_footer_initial_bytes", 8192),
+                max_footer_bytes=DISCOVERY_CONFIG.get("parquet_footer_max_bytes", 16 * 1024 * 1024),
+            )
+        else:
+            file_sample = blob_client.get_blob_sample(
+                container_name, blob_path,
+                max_bytes=DISCOVERY_CONFIG.get("sample_initial_bytes", 1024),
+                is_complete=lambda sample: header_sample_complete(sample, blob_info["name"]),
+                max_total_bytes=DISCOVERY_CONFIG.get("sample_max_bytes", 64 * 1024),
+                file_size=blob_info.get("size"),
+            )
+            if len(file_sample) >= DISCOVERY_CONFIG.get("sample_max_bytes", 64 * 1024) and not header_sample_complete(file_sample, blob_info["name"]):
+                logger.warning('FN:sample_blob blob_path:{} sample_bytes:{} header_truncated:True'.format(blob_path, len(file_sample)))
+        logger.info('FN:sample_blob blob_path:{} file_extension:{} sample_bytes:{}'.format(blob_path, file_extension, len(file_sample)))
+        return file_sample
+    except Exception as e:
+        # Re-raised: the caller marks the blob failed instead of storing an empty schema
+        logger.warning('FN:sample_blob blob_path:{} error:{}'.format(blob_path, str(e)))
+        raise
+
+
+def sample_delta_log(blob_client, container_name: str, blob_info: Dict) -> Optional[bytes]:
+    """
+    The current metaData action of a Delta table, as one JSON line. Commits newer than
+    the last checkpoint are read newest first, each only until its metaData action or
+    its first add/remove (writers put metaData ahead of file actions); failing that the
+    checkpoint's metaData row is read, then older commits. No data files are touched.
+    """
+    table_root = blob_info["full_path"]
+    try:
+        log_blobs = list(blob_client.list_blobs(container_name, table_root + "/" + DELTA_LOG_DIR))
+        commits = sorted((b for b in log_blobs if _DELTA_COMMIT_RE.match(b["name"])), key=lambda b: b["name"], reverse=True)
+        checkpoints = sorted((b for b in log_blobs if _DELTA_CHECKPOINT_RE.match(b["name"])), key=lambda b: b["name"])
+        checkpoint = checkpoints[-1] if checkpoints else None
+        checkpoint_version = int(checkpoint["name"][:20]) if checkpoint else -1
+
+        newer = [b for b in commits if int(b["name"][:20]) > checkpoint_version]
+        older = [b for b in commits if int(b["name"][:20]) <= checkpoint_version]
+        for commit in newer:
+            metadata = _read_delta_commit_metadata(blob_client, container_name, commit)
+            if metadata is not None:
+                return _delta_sample(metadata, commits[0]["name"] if commits else None)
+        if checkpoint is not None:
+            metadata = _read_delta_checkpoint_metadata(blob_client, container_name, checkpoint)
+            if metadata is not None:
+                return _delta_sample(metadata, commits[0]["name"] if commits else checkpoint["name"])
+        for commit in older:
+            metadata = _read_delta_commit_metadata(blob_client, container_name, commit)
+            if metadata is not None:
+                return _delta_sample(metadata, commits[0]["name"])
+        logger.warning('FN:sample_delta_log table_root:{} commits:{} checkpoint:{} metadata_found:False'.format(table_root, len(commits), checkpoint["name"] if checkpoint else None))
+        return None
+    except Exception as e:
+        logger.warning('FN:sample_delta_log table_root:{} error:{}'.format(table_root, str(e)))
+        raise
+
+
+def _delta_sample(metadata: Dict, latest_commit: Optional[str]) -> bytes:
+    logger.info('FN:sample_delta_log table_id:{} latest_commit:{}'.format(metadata.get("id"), latest_commit))
+    return json.dumps({"metaData": metadata}, default=str).encode("utf-8")
+
+
+def _read_delta_commit_metadata(blob_client, container_name: str, commit: Dict) -> Optional[Dict]:
+    sample = blob_client.get_blob_sample(
+        container_name, commit["full_path"],
+        max_bytes=DISCOVERY_CONFIG.get("sample_initial_bytes", 1024),
+        is_complete=delta_commit_scanned,
+        max_total_bytes=DISCOVERY_CONFIG.get("delta_log_max_bytes", 4 * 1024 * 1024),
+        file_size=commit.get("size"),
+    )
+    return find_delta_metadata(sample)
+
+
+def _read_delta_checkpoint_metadata(blob_client, container_name: str, checkpoint: Dict) -> Optional[Dict]:
+    # Checkpoints are Parquet with one row per action; only the metaData column is decoded
+    max_bytes = DISCOVERY_CONFIG.get("delta_log_max_bytes", 4 * 1024 * 1024)
+    if checkpoint.get("size", 0) > max_bytes:
+        logger.warning('FN:_read_delta_checkpoint_metadata checkpoint:{} size:{} max_bytes:{}'.format(checkpoint["full_path"], checkpoint.get("size"), max_bytes))
+        return None
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(io.BytesIO(blob_client.get_blob_content(container_name, checkpoint["full_path"])), columns=["metaData"])
+    for row in table.column("metaData").to_pylist():
+        if row:
+            return row
+    return None
+
+
+def build_minimal_metadata(blob_info: Dict, file_hash: str) -> Dict:
+    # No sample available, create minimal metadata from the listing properties only
+    schema_hash = generate_schema_hash({})
+    etag = (blob_info.get("etag") or "").strip('"')
+    dataset_format = blob_info.get("dataset_format")
+    sample_name = (blob_info.get("representative") or blob_info)["name"]
+    file_metadata = {
+        "basic": {
+            "name": blob_info["name"],
+            "extension": "." + sample_name.split(".")[-1] if "." in sample_name and not dataset_format else "",
+            "format": dataset_format or (sample_name.split(".")[-1].lower() if "." in sample_name else "unknown"),
+            "size_bytes": blob_info.get("size", 0),
+            "content_type": blob_info.get("content_type", "application/octet-stream"),
+            "mime_type": blob_info.get("content_type", "application/octet-stream")
+        },
+        "hash": {
+            "algorithm": "shake128_etag_composite",
+            "value": file_hash,
+            "computed_at": datetime.utcnow().isoformat() + "Z",
+            "source": "etag_composite"
+        },
+        "timestamps": {
+            "created_at": blob_info["created_at"].isoformat() if blob_info.get("created_at") else None,
+            "last_modified": blob_info["last_modified"].isoformat() if blob_info.get("last_modified") else None
+        }
+    }
+    if blob_info.get("partitioning"):
+        file_metadata["partitioning"] = blob_info["partitioning"]
+    return {
+        "file_metadata": file_metadata,
+        "schema_json": {},
+        "schema_hash": schema_hash,
+        "file_hash": file_hash,
+        "storage_metadata": {
+            "azure": {
+                "type": blob_info.get("blob_type", "Block blob"),
+                "etag": etag,
+                "access_tier": blob_info.get("access_tier"),
+                "creation_time": blob_info["created_at"].isoformat() if blob_info.get("created_at") else None,
+                "last_modified": blob_info["last_modified"].isoformat() if blob_info.get("last_modified") else None,
+                "lease_status": blob_info.get("lease_status"),
+                "content_encoding": blob_info.get("content_encoding"),
+                "content_language": blob_info.get("content_language"),
+                "cache_control": blob_info.get("cache_control"),
+                "metadata": blob_info.get("metadata", {})
+            }
+        }
+    }
+
+
+def fingerprint_blob(dedup_index: DedupIndex, blob_info: Dict) -> Dict:
+    """
+    Listing-only half of change detection: the blob's change fingerprint and its
+    existing record. "unchanged" is True when the stored fingerprint matches, in
+    which case there is nothing to sample, extract or write. A matching row that was
+    marked deleted is "reactivate" instead: no sample either, but the row is touched
+    back to active. A matching row still holding unclassified columns is "reclassify"
+    while a DLP endpoint is configured: it is sampled again so a DLP outage at first
+    sight does not leave it unclassified. No blob reads.
+    """
+    blob_path = blob_info["full_path"]
+    existing_record = dedup_index.get(blob_path)
+
+    # ETag + size + last_modified from the listing - no download needed
+    file_hash = compute_change_fingerprint(blob_info)
+    unchanged = is_unchanged(existing_record, file_hash)
+    reactivate = unchanged and existing_record.get("is_active") is False
+    reclassify = unchanged and needs_reclassification(existing_record)
+
+    return {
+        "blob_info": blob_info,
+        "blob_path": blob_path,
+        "existing_record": existing_record,
+        "file_hash": file_hash,
+        "unchanged": unchanged and not reactivate and not reclassify,
+        "reactivate": reactivate,
+        "reclassify": reclassify,
+    }
+
+
+def select_changed_blobs(dedup_index: DedupIndex, blobs: Iterable[Dict]) -> Tuple[List[Dict], int]:
+    """
+    Phase one of discovery, run on the scanning thread: fingerprint a page of listed
+    blobs against the dedup index. Returns (changed, unchanged_count) where changed
+    holds the fingerprint_blob() results of new and changed blobs (and of unchanged
+    ones to reactivate), the only ones that go on to phase two (sample_and_extract).
+    """
+    changed = []
+    unchanged_count = 0
+    for blob_info in prefetch_in_chunks(dedup_index, blobs):
+        fingerprinted = fingerprint_blob(dedup_index, blob_info)
+        if fingerprinted["unchanged"]:
+            unchanged_count += 1
+        else:
+            changed.append(fingerprinted)
+    return changed, unchanged_count
+
+
+def sample_and_extract(blob_client, container_name: str, fingerprinted: Dict,
+                       data_source_type: Optional[str] = None) -> Dict:
+    """
+    Phase two of discovery for one new or changed blob: ranged sample download and
+    schema extraction (including the per-column DLP calls), then the comparison with
+    the existing record. data_source_type selects the local PII rules. Columns the
+    DLP call left unclassified keep the stored row's classification. A failed sample
+    read raises, so the caller can mark the blob failed rather than store an empty
+    schema under its current fingerprint. Safe to run on a worker thread; it never
+    writes to the database.
+    """
+    if fingerprinted.get("reactivate") and not fingerprinted.get("reclassify"):
+        return _without_sample(fingerprinted)
+
+    blob_info = fingerprinted["blob_info"]
+    existing_record = fingerprinted["existing_record"]
+    file_hash = fingerprinted["file_hash"]
+
+    file_sample = sample_blob(blob_client, container_name, blob_info)
+
+    # Extract schema from sample if available; a failed read has already raised, so the
+    # minimal record is only for blobs that genuinely yield no sample (empty, no Delta metaData)
+    if file_sample:
+        metadata = extract_file_metadata(blob_info, file_sample, data_source_type)
+        schema_hash = metadata.get("schema_hash", generate_schema_hash({}))
+    else:
+        metadata = build_minimal_metadata(blob_info, file_hash)
+        schema_hash = metadata["schema_hash"]
+
+    # A throttled or failed DLP call must not replace a known classification with "no PII"
+    if existing_record and has_unclassified_columns(metadata.get("schema_json")):
+        if carry_forward_classification(metadata["schema_json"], load_schema_json(existing_record["id"])):
+            schema_hash = metadata["schema_hash"] = generate_schema_hash(metadata["schema_json"])
+
+    # Ensure file_hash is set
+    if "file_hash" not in metadata:
+        metadata["file_hash"] = file_hash
+
+    should_update, schema_changed = should_update_or_insert(existing_record, file_hash, schema_hash)
+
+    return {
+        "blob_info": blob_info,
+        "blob_path": fingerprinted["blob_path"],
+        "existing_record": existing_record,
+        "metadata": metadata,
+        "file_hash": file_hash,
+        "schema_hash": schema_hash,
+        "should_update": should_update,
+        "schema_changed": schema_changed,
+        # Re-sampled for classification only and nothing to write: a deleted row still comes back
+        "reactivate": fingerprinted.get("reactivate", False) and not should_update,
+    }
+
+
+def prepare_blob(blob_client, dedup_index: DedupIndex, container_name: str, blob_info: Dict,
+                 data_source_type: Optional[str] = None) -> Dict:
+    """
+    Both phases for a single blob whose listing properties were only just fetched
+    (event-driven discovery): an unchanged blob is returned without any download or
+    extraction, anything else goes through sample_and_extract.
+    """
+    fingerprinted = fingerprint_blob(dedup_index, blob_info)
+    if not fingerprinted["unchanged"]:
+        return sample_and_extract(blob_client, container_name, fingerprinted, data_source_type)
+    return _without_sample(fingerprinted)
+
+
+def _without_sample(fingerprinted: Dict) -> Dict:
+    # Prepared result for a fingerprint match: nothing was read, at most the row is reactivated
+    return {
+        "blob_info": fingerprinted["blob_info"],
+        "blob_path": fingerprinted["blob_path"],
+        "existing_record": fingerprinted["existing_record"],
+        "metadata": None,
+        "file_hash": fingerprinted["file_hash"],
+        "schema_hash": fingerprinted["existing_record"].get("schema_hash"),
+        "should_update": False,
+        "schema_changed": False,
+        "reactivate": fingerprinted.get("reactivate", False),
+    }
+
+
+def build_discovery_info(batch_id: str, batch_started_at: datetime, source_type: str, source_name: str, run_id: str,
+                         container_name: str, folder_path: str) -> Dict:
+    return {
+        "batch": {
+            "id": batch_id,
+            "started_at": batch_started_at.isoformat() + "Z"
+        },
+        "source": {
+            "type": source_type,
+            "name": source_name,
+            "run_id": run_id
+        },
+        "scan": {
+            "container": container_name,
+            "folder": folder_path
+        }
+    }
+
+
+def queue_discovery_write(writer, prepared: Dict, storage_config: Dict, container_name: str, folder_path: str,
+                          discovery_info: Dict) -> Tuple[str, List[Dict]]:
+    """
+    Hand a prepared blob to the batch writer. Returns (action, written) where action is
+    "insert", "update" (schema changed), "refresh" (file changed, same schema),
+    "reactivate" (unchanged, but marked deleted) or "skip" (unchanged), and written
+    holds any new discoveries flushed by this call.
+    """
+    blob_path = prepared["blob_path"]
+    existing_record = prepared["existing_record"]
+    should_update = prepared["should_update"]
+    schema_changed = prepared["schema_changed"]
+    metadata = prepared["metadata"]
+    schema_hash = prepared["schema_hash"]
+
+    if prepared.get("reactivate"):
+        # Listed again with the same fingerprint after being marked deleted: back to active, nothing else changes
+        return "reactivate", writer.add_touch(existing_record["id"], blob_path, container_name)
+
+    if not should_update and not existing_record:
+        # This shouldn't happen, but handle it
+        logger.warning('FN:queue_discovery_write blob_path:{} should_update:{} existing_record:{}'.format(blob_path, should_update, bool(existing_record)))
+        return "skip", []
+
+    # Skip if nothing changed (same change fingerprint): no DB write at all
+    if not should_update and existing_record:
+        return "skip", []
+
+    storage_location = get_storage_location_json(
+        account_name=storage_config["name"],
+        container=container_name,
+        blob_path=blob_path
+    )
+    environment = storage_config.get("environment", "prod")
+    env_type = storage_config.get("env_type", "production")
+    data_source_type = storage_config.get("data_source_type", "unknown")
+
+    # Buffered write: flushed as multi-row statements every N rows / T seconds
+    if existing_record and schema_changed:
+        # Schema changed - update full record
+        return "update", writer.add_update(existing_record["id"], storage_location, metadata, schema_hash, discovery_info,
+                                           environment, env_type, data_source_type, folder_path)
+    if existing_record:
+        # Only the file changed, not the schema - refresh file metadata and the stored fingerprint
+        return "refresh", writer.add_refresh(existing_record["id"], metadata, blob_path, container_name)
+    # New record - insert
+    return "insert", writer.add_insert(storage_location, metadata, schema_hash, discovery_info,
+                                       environment, env_type, data_source_type, folder_path)
@@ -0,0 +1,332 @@
+import json
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.azure_config import DISCOVERY_CONFIG
+from utils.deduplication import get_db_connection, retry_db_operation, storage_location_hash
+
+logger = logging.getLogger(__name__)
+
+# Columns written for a full data_discovery row (new discoveries and schema changes)
+_ROW_COLUMNS = (
+    "storage_location", "file_metadata", "schema_json", "schema_hash",
+    "environment", "env_type", "data_source_type", "folder_path",
+    "storage_metadata", "storage_data_metadata", "discovery_info", "created_by",
+)
+
+# A row that already exists (same id, or same storage location via the UNIQUE storage_location_hash)
+# keeps its review state and discovered_at; only what discovery owns is overwritten.
+# The inserted row is referenced through a row alias (MySQL 8.0.19+) rather than the deprecated VALUES(col)
+_ON_DUPLICATE_KEY_UPDATE = """
+            AS new
+            ON DUPLICATE KEY UPDATE
+                file_metadata = new.file_metadata,
+                schema_json = new.schema_json,
+                schema_hash = new.schema_hash,
+                storage_metadata = new.storage_metadata,
+                discovery_info = new.discovery_info,
+                is_active = TRUE,
+                deleted_at = NULL,
+                last_checked_at = NOW(),
+                updated_at = NOW()
+"""
+
+
+class DiscoveryBatchWriter:
+    """
+    Buffers data_discovery writes and flushes them every flush_rows rows or
+    flush_interval seconds, one transaction per flush:
+    - new rows: one multi-row INSERT ... ON DUPLICATE KEY UPDATE on the unique storage_location_hash
+      (a row inserted meanwhile by a parallel scanner is updated, never duplicated), ids resolved
+      afterwards by the same hash
+    - schema changes: one multi-row INSERT ... ON DUPLICATE KEY UPDATE keyed on id
+    - file changed, same schema: one UPDATE ... SET file_metadata = CASE id ... WHERE id IN (...)
+    - touch-ups: UPDATE ... SET last_checked_at = NOW() WHERE id IN (...)
+    (updates, refreshes and touch-ups reactivate a row previously marked deleted)
+    - deletions: UPDATE ... SET is_active = FALSE, deleted_at = NOW() WHERE storage_location_hash IN (...)
+
+    Every add/flush returns the new discoveries written by that flush
+    ({id, file_name, storage_path}) so callers can keep feeding notifications; an
+    insert that lands on an existing row is written but not returned.
+    Rows that could not be written even one per transaction are kept for take_failed():
+    the caller must not treat them as committed (no checkpoint past them, no ack).
+    Not thread-safe: use it from the single writer thread.
+    """
+
+    def __init__(self, created_by: str = "airflow", flush_rows: Optional[int] = None, flush_interval: Optional[float] = None):
+        self.created_by = created_by
+        self.flush_rows = flush_rows or DISCOVERY_CONFIG.get("write_batch_rows", 200)
+        self.flush_interval = flush_interval if flush_interval is not None else DISCOVERY_CONFIG.get("write_batch_seconds", 5.0)
+        self._inserts: List[Dict] = []
+        self._updates: List[Dict] = []
+        self._refreshes: List[Dict] = []
+        self._touches: List[Dict] = []
+        self._deletes: List[Dict] = []
+        self._failed: List[Dict] = []
+        self._last_flush = time.monotonic()
+        self.flush_count = 0
+        self.rows_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Don't mask the original error with a flush failure
+        if exc_type is None:
+            self.flush()
+        return False
+
+    @property
+    def pending(self) -> int:
+        return len(self._inserts) + len(self._updates) + len(self._refreshes) + len(self._touches) + len(self._deletes)
+
+    def _row(self, storage_location: Dict, metadata: Dict, schema_hash: str, discovery_info: Dict,
+             environment: Optional[str], env_type: Optional[str], data_source_type: Optional[str], folder_path: Optional[str]) -> Dict:
+        file_metadata = metadata.get("file_metadata") or {}
+        return {
+            "storage_type": storage_location.get("type"),
+            "storage_identifier": storage_location.get("connection", {}).get("account_name"),
+            "container_name": storage_location.get("container", {}).get("name"),
+            "storage_path": storage_location.get("path"),
+            "file_name": file_metadata.get("basic", {}).get("name"),
+            "values": (
+                json.dumps(storage_location),
+                json.dumps(file_metadata),
+                json.dumps(metadata.get("schema_json", {})),
+                schema_hash,
+                environment,
+                env_type,
+                data_source_type,
+                folder_path,
+                json.dumps(metadata.get("storage_metadata", {})),
+                json.dumps({}),
+                json.dumps(discovery_info),
+                self.created_by,
+            ),
+        }
+
+    def add_insert(self, storage_location: Dict, metadata: Dict, schema_hash: str, discovery_info: Dict,
+                   environment: Optional[str], env_type: Optional[str], data_source_type: Optional[str], folder_path: Optional[str]) -> List[Dict]:
+        self._inserts.append(self._row(storage_location, metadata, schema_hash, discovery_info, environment, env_type, data_source_type, folder_path))
+        return self.maybe_flush()
+
+    def add_update(self, discovery_id: int, storage_location: Dict, metadata: Dict, schema_hash: str, discovery_info: Dict,
+                   environment: Optional[str], env_type: Optional[str], data_source_type: Optional[str], folder_path: Optional[str]) -> List[Dict]:
+        row = self._row(storage_location, metadata, schema_hash, discovery_info, environment, env_type, data_source_type, folder_path)
+        row["id"] = discovery_id
+        self._updates.append(row)
+        return self.maybe_flush()
+
+    def add_refresh(self, discovery_id: int, metadata: Dict, storage_path: Optional[str] = None,
+                    container_name: Optional[str] = None) -> List[Dict]:
+        # The file changed but its schema did not: new fingerprint and file/storage metadata, schema untouched
+        self._refreshes.append({
+            "id": discovery_id,
+            "storage_path": storage_path,
+            "container_name": container_name,
+            "file_metadata": json.dumps(metadata.get("file_metadata") or {}),
+            "storage_metadata": json.dumps(metadata.get("storage_metadata", {})),
+        })
+        return self.maybe_flush()
+
+    def add_touch(self, discovery_id: int, storage_path: Optional[str] = None, container_name: Optional[str] = None) -> List[Dict]:
+        self._touches.append({"id": discovery_id, "storage_path": storage_path, "container_name": container_name})
+        return self.maybe_flush()
+
+    def add_delete(self, storage_type: str, storage_identifier: str, container_name: Optional[str], storage_path: str) -> List[Dict]:
+        self._deletes.append({"storage_type": storage_type, "storage_identifier": storage_identifier,
+                              "container_name": container_name, "storage_path": storage_path})
+        return self.maybe_flush()
+    
+    def maybe_flush(self) -> List[Dict]:
+        if self.pending >= self.flush_rows or (self.pending and time.monotonic() - self._last_flush >= self.flush_interval):
+            return self.flush()
+        return []
+
+    def flush(self) -> List[Dict]:
+        if not self.pending:
+            self._last_flush = time.monotonic()
+            return []
+
+        inserts, updates, refreshes, touches, deletes = self._inserts, self._updates, self._refreshes, self._touches, self._deletes
+        self._inserts, self._updates, self._refreshes, self._touches, self._deletes = [], [], [], [], []
+        self._last_flush = time.monotonic()
+
+        failed = []
+        try:
+            written = retry_db_operation(max_retries=None, base_delay=1.0, max_delay=60.0, max_total_time=3600.0)(self._write)(inserts, updates, refreshes, touches, deletes)
+        except Exception as e:
+            # One bad row must not cost the whole batch: retry each item in its own transaction
+            logger.error('FN:DiscoveryBatchWriter.flush inserts:{} updates:{} refreshes:{} touches:{} deletes:{} error:{} fallback:per_row'.format(len(inserts), len(updates), len(refreshes), len(touches), len(deletes), str(e)))
+            written, failed = self._write_individually(inserts, updates, refreshes, touches, deletes)
+            self._failed.extend(failed)
+
+        self.flush_count += 1
+        self.rows_written += len(inserts) + len(updates) + len(refreshes) + len(touches) + len(deletes) - len(failed)
+        logger.info('FN:DiscoveryBatchWriter.flush flush_count:{} inserts:{} updates:{} refreshes:{} touches:{} deletes:{} new_discoveries:{} failed:{}'.format(self.flush_count, len(inserts), len(updates), len(refreshes), len(touches), len(deletes), len(written), len(failed)))
+        return written
+
+    def take_failed(self) -> List[Dict]:
+        # Rows given up on since the last call; each still carries its container_name and storage_path
+        failed, self._failed = self._failed, []
+        return failed
+
+    def _write_individually(self, inserts: List[Dict], updates: List[Dict], refreshes: List[Dict], touches: List[Dict], deletes: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+        written = []
+        failed = []
+        kinds = (inserts, updates, refreshes, touches, deletes)
+        batches = []
+        for position, rows in enumerate(kinds):
+            for row in rows:
+                batch = [[] for _ in kinds]
+                batch[position] = [row]
+                batches.append(batch)
+        for batch in batches:
+            try:
+                written.extend(retry_db_operation(max_retries=None, base_delay=1.0, max_delay=60.0, max_total_time=3600.0)(self._write)(*batch))
+            except Exception as e:
+                row = next(rows for rows in batch if rows)[0]
+                logger.error('FN:DiscoveryBatchWriter._write_individually storage_path:{} error:{}'.format(row.get("storage_path"), str(e)))
+                failed.append(row)
+        return written, failed
+
+    def _write(self, inserts: List[Dict], updates: List[Dict], refreshes: List[Dict], touches: List[Dict], deletes: List[Dict]) -> List[Dict]:
+        conn = None
+        try:
+            conn = get_db_connection()
+            written = []
+            with conn.cursor() as cursor:
+                if inserts:
+                    written.extend(self._insert_rows(cursor, inserts))
+                if updates:
+                    written.extend(self._upsert_rows(cursor, updates))
+                if refreshes:
+                    self._refresh_rows(cursor, refreshes)
+                if touches:
+                    self._touch_rows(cursor, touches)
+                if deletes:
+                    self._delete_rows(cursor, deletes)
+            conn.commit()
+            return written
+        except Exception as e:
+            if conn:
+                conn.rollback()
+            logger.error('FN:DiscoveryBatchWriter._write inserts:{} updates:{} refreshes:{} touches:{} deletes:{} error:{}'.format(len(inserts), len(updates), len(refreshes), len(touches), len(deletes), str(e)))
+            raise
+        finally:
+            if conn:
+                conn.close()
+
+    @staticmethod
+    def _values_sql(row_count: int, leading_columns: int = 0) -> str:
+        # discovered_at/status/approval_status/visibility are fixed for rows written by discovery
+        row_sql = "({}%s, %s, %s, %s, NOW(), 'pending', 'pending_review', TRUE, TRUE, %s, %s, %s, %s, %s, %s, %s, %s)".format("%s, " * leading_columns)
+        return ",\n".join([row_sql] * row_count)
+
+    def _insert_rows(self, cursor, rows: List[Dict]) -> List[Dict]:
+        # A row that already exists (written by a parallel scanner, or missed by the dedup index)
+        # only takes the ON DUPLICATE KEY UPDATE branch and is not a new discovery. Not a locking
+        # read: gap locks would deadlock concurrent first loads, and a row inserted between this
+        # SELECT and the INSERT costs at most one duplicate notification
+        existing = self._resolve_ids(cursor, rows)
+        sql = """
+            INSERT INTO data_discovery (
+                storage_location, file_metadata, schema_json, schema_hash,
+                discovered_at, status, approval_status, is_visible, is_active,
+                environment, env_type, data_source_type, folder_path,
+                storage_metadata, storage_data_metadata, discovery_info,
+                created_by
+            ) VALUES
+        """ + self._values_sql(len(rows)) + _ON_DUPLICATE_KEY_UPDATE
+        cursor.execute(sql, [v for row in rows for v in row["values"]])
+
+        # Auto-increment ids of a multi-row insert are not guaranteed to be consecutive (and
+        # duplicates keep their old id), so resolve them by storage location in the same transaction
+        ids = self._resolve_ids(cursor, rows)
+        written = []
+        for row in rows:
+            key = (row["storage_type"], row["storage_identifier"], row["container_name"], row["storage_path"])
+            if key in existing:
+                continue
+            discovery_id = ids.get(key)
+            written.append({
+                "id": discovery_id,
+                "file_name": row["file_name"],
+                "storage_path": row["storage_path"],
+            })
+        return written
+
+    @staticmethod
+    def _resolve_ids(cursor, rows: List[Dict]) -> Dict:
+        keys = {storage_location_hash(row["storage_type"], row["storage_identifier"], row["container_name"], row["storage_path"]):
+                (row["storage_type"], row["storage_identifier"], row["container_name"], row["storage_path"]) for row in rows}
+        placeholders = ','.join(['%s'] * len(keys))
+        cursor.execute(f"""
+            SELECT id, storage_location_hash
+            FROM data_discovery
+            WHERE storage_location_hash IN ({placeholders})
+        """, list(keys))
+        return {keys[result["storage_location_hash"]]: result["id"] for result in cursor.fetchall()}
+
+    def _upsert_rows(self, cursor, rows: List[Dict]) -> List[Dict]:
+        sql = """
+            INSERT INTO data_discovery (
+                id, storage_location, file_metadata, schema_json, schema_hash,
+                discovered_at, status, approval_status, is_visible, is_active,
+                environment, env_type, data_source_type, folder_path,
+                storage_metadata, storage_data_metadata, discovery_info,
+                created_by
+            ) VALUES
+        """ + self._values_sql(len(rows), leading_columns=1) + _ON_DUPLICATE_KEY_UPDATE
+        cursor.execute(sql, [v for row in rows for v in (row["id"],) + row["values"]])
+        return [{
+            "id": row["id"],
+            "file_name": row["file_name"],
+            "storage_path": row["storage_path"],
+        } for row in rows]
+
+    @staticmethod
+    def _refresh_rows(cursor, rows: List[Dict]):
+        # Schema columns are left alone; file_hash is generated from file_metadata
+        ids = [row["id"] for row in rows]
+        cases = " ".join(["WHEN %s THEN %s"] * len(rows))
+        placeholders = ','.join(['%s'] * len(ids))
+        cursor.execute(f"""
+            UPDATE data_discovery
+            SET file_metadata = CASE id {cases} END,
+                storage_metadata = CASE id {cases} END,
+                last_checked_at = NOW(),
+                updated_at = NOW(),
+                is_active = TRUE,
+                deleted_at = NULL
+            WHERE id IN ({placeholders})
+        """, [v for row in rows for v in (row["id"], row["file_metadata"])]
+             + [v for row in rows for v in (row["id"], row["storage_metadata"])] + ids)
+
+    @staticmethod
+    def _touch_rows(cursor, rows: List[Dict]):
+        ids = [row["id"] for row in rows]
+        placeholders = ','.join(['%s'] * len(ids))
+        cursor.execute(f"""
+            UPDATE data_discovery
+            SET last_checked_at = NOW(),
+                is_active = TRUE,
+                deleted_at = NULL
+            WHERE id IN ({placeholders})
+        """, ids)
+
+    @staticmethod
+    def _delete_rows(cursor, rows: List[Dict]):
+        hashes = [storage_location_hash(row["storage_type"], row["storage_identifier"], row["container_name"], row["storage_path"]) for row in rows]
+        placeholders = ','.join(['%s'] * len(hashes))
+        cursor.execute(f"""
+            UPDATE data_discovery
+            SET is_active = FALSE,
+                deleted_at = NOW()
+            WHERE storage_location_hash IN ({placeholders})
+              AND is_active = TRUE
+        """, hashes)
@@ -6,26 +6,14 @@ import os
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from typing import List, Dict
-import pymysql
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from config.azure_config import DB_CONFIG, DISCOVERY_CONFIG
+from config.azure_config import DISCOVERY_CONFIG
+from utils.deduplication import get_db_connection
 
 logger = logging.getLogger(__name__)
 
 
-def get_db_connection():
-    return pymysql.connect(
-        host=DB_CONFIG["host"],
-        port=DB_CONFIG["port"],
-        user=DB_CONFIG["user"],
-        password=DB_CONFIG["password"],
-        database=DB_CONFIG["database"],
-        cursorclass=pymysql.cursors.DictCursor,
-        charset='utf8mb4'
-    )
-
-
 def get_new_discoveries() -> List[Dict]:
     conn = None
     try:
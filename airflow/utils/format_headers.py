@@ -0,0 +1,328 @@
+import json
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+AVRO_MAGIC = b"Obj\x01"
+AVRO_SYNC_SIZE = 16
+ORC_MAGIC = b"ORC"
+
+ORC_COMPRESSION = {0: "none", 1: "zlib", 2: "snappy", 3: "lzo", 4: "lz4", 5: "zstd"}
+ORC_KINDS = {
+    0: "boolean", 1: "tinyint", 2: "smallint", 3: "int", 4: "bigint", 5: "float", 6: "double",
+    7: "string", 8: "binary", 9: "timestamp", 10: "array", 11: "map", 12: "struct", 13: "uniontype",
+    14: "decimal", 15: "date", 16: "varchar", 17: "char", 18: "timestamp with local time zone",
+}
+
+
+class TruncatedError(Exception):
+    """The sample ends before the structure being decoded."""
+
+
+def read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    result, shift = 0, 0
+    while True:
+        if pos >= len(data):
+            raise TruncatedError()
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _read_zigzag(data: bytes, pos: int) -> Tuple[int, int]:
+    value, pos = read_varint(data, pos)
+    return (value >> 1) ^ -(value & 1), pos
+
+
+def _read_avro_bytes(data: bytes, pos: int) -> Tuple[bytes, int]:
+    length, pos = _read_zigzag(data, pos)
+    if length < 0:
+        raise ValueError("negative Avro length")
+    if pos + length > len(data):
+        raise TruncatedError()
+    return data[pos:pos + length], pos + length
+
+
+def parse_avro_header(data: bytes) -> Optional[Dict]:
+    """
+    Decode the Avro object container header: magic, the file metadata map
+    (avro.schema, avro.codec, ...) and the sync marker. Returns
+    {"metadata": {key: bytes}, "header_length": n}, None when the sample ends
+    inside the header, and raises ValueError for data that is not Avro.
+    """
+    if not data.startswith(AVRO_MAGIC):
+        if len(data) < len(AVRO_MAGIC) and AVRO_MAGIC.startswith(data):
+            return None
+        raise ValueError("not an Avro object container")
+    metadata = {}
+    pos = len(AVRO_MAGIC)
+    try:
+        while True:
+            count, pos = _read_zigzag(data, pos)
+            if count == 0:
+                break
+            if count < 0:
+                # Negative block count: the block's byte size follows
+                count = -count
+                _, pos = _read_zigzag(data, pos)
+            for _ in range(count):
+                key, pos = _read_avro_bytes(data, pos)
+                value, pos = _read_avro_bytes(data, pos)
+                metadata[key.decode("utf-8", errors="replace")] = value
+        if pos + AVRO_SYNC_SIZE > len(data):
+            return None
+    except TruncatedError:
+        return None
+    return {"metadata": metadata, "header_length": pos + AVRO_SYNC_SIZE}
+
+
+def avro_type_name(avro_type) -> Tuple[str, bool]:
+    """(type string, nullable) for an Avro schema type."""
+    if isinstance(avro_type, list):
+        branches = [branch for branch in avro_type if branch != "null"]
+        nullable = len(branches) < len(avro_type)
+        if len(branches) == 1:
+            return avro_type_name(branches[0])[0], nullable
+        return "union<{}>".format(",".join(avro_type_name(branch)[0] for branch in branches)), nullable
+    if isinstance(avro_type, dict):
+        logical = avro_type.get("logicalType")
+        if logical == "decimal":
+            return "decimal({},{})".format(avro_type.get("precision"), avro_type.get("scale", 0)), False
+        if logical:
+            return logical, False
+        kind = avro_type.get("type")
+        if kind == "record":
+            fields = ",".join("{}:{}".format(f["name"], avro_type_name(f["type"])[0]) for f in avro_type.get("fields", []))
+            return "struct<{}>".format(fields), False
+        if kind == "array":
+            return "array<{}>".format(avro_type_name(avro_type.get("items"))[0]), False
+        if kind == "map":
+            return "map<string,{}>".format(avro_type_name(avro_type.get("values"))[0]), False
+        if kind in ("enum", "fixed"):
+            return kind, False
+        return avro_type_name(kind)
+    return str(avro_type), avro_type == "null"
+
+
+def parse_protobuf(data: bytes) -> Dict[int, List]:
+    """Minimal protobuf decoder: {field_number: [values]} with varints as ints and length-delimited fields as bytes."""
+    fields: Dict[int, List] = {}
+    pos = 0
+    while pos < len(data):
+        key, pos = read_varint(data, pos)
+        field_number, wire_type = key >> 3, key & 0x7
+        if wire_type == 0:
+            value, pos = read_varint(data, pos)
+        elif wire_type == 1:
+            value, pos = data[pos:pos + 8], pos + 8
+        elif wire_type == 2:
+            length, pos = read_varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        elif wire_type == 5:
+            value, pos = data[pos:pos + 4], pos + 4
+        else:
+            raise ValueError("unsupported protobuf wire type {}".format(wire_type))
+        if pos > len(data):
+            raise TruncatedError()
+        fields.setdefault(field_number, []).append(value)
+    return fields
+
+
+def _repeated_varints(values: List) -> List[int]:
+    # Repeated uint32 fields may be packed (one length-delimited blob) or not
+    result = []
+    for value in values:
+        if isinstance(value, bytes):
+            pos = 0
+            while pos < len(value):
+                item, pos = read_varint(value, pos)
+                result.append(item)
+        else:
+            result.append(value)
+    return result
+
+
+def _orc_postscript(tail: bytes) -> Dict[int, List]:
+    if len(tail) < 2:
+        raise TruncatedError()
+    ps_length = tail[-1]
+    if len(tail) < ps_length + 1:
+        raise TruncatedError()
+    postscript = parse_protobuf(tail[-1 - ps_length:-1])
+    if postscript.get(8000, [b""])[0] != ORC_MAGIC:
+        raise ValueError("ORC postscript magic missing")
+    return postscript
+
+
+def orc_tail_length(tail: bytes) -> Optional[int]:
+    """Bytes from the end of an ORC file that hold the footer, postscript and its length byte; None if not ORC."""
+    try:
+        postscript = _orc_postscript(tail)
+    except (TruncatedError, ValueError):
+        return None
+    return 1 + tail[-1] + postscript.get(1, [0])[0]
+
+
+def snappy_decompress(data: bytes) -> bytes:
+    """Raw (unframed) Snappy block decoder; footers are small enough for pure Python."""
+    length, pos = read_varint(data, 0)
+    output = bytearray()
+    while pos < len(data):
+        tag = data[pos]
+        pos += 1
+        element = tag & 0x3
+        if element == 0:
+            # Literal; lengths above 60 are stored in the next 1-4 bytes
+            literal = tag >> 2
+            if literal >= 60:
+                extra = literal - 59
+                literal = int.from_bytes(data[pos:pos + extra], "little")
+                pos += extra
+            literal += 1
+            output += data[pos:pos + literal]
+            pos += literal
+            continue
+        if element == 1:
+            copy_length = ((tag >> 2) & 0x7) + 4
+            offset = ((tag >> 5) << 8) | data[pos]
+            pos += 1
+        else:
+            copy_length = (tag >> 2) + 1
+            width = 2 if element == 2 else 4
+            offset = int.from_bytes(data[pos:pos + width], "little")
+            pos += width
+        if offset <= 0 or offset > len(output):
+            raise ValueError("invalid Snappy copy offset")
+        # Copies may overlap what they produce, so go byte by byte when they do
+        start = len(output) - offset
+        if copy_length <= offset:
+            output += output[start:start + copy_length]
+        else:
+            for i in range(copy_length):
+                output.append(output[start + i])
+    if len(output) != length:
+        raise ValueError("Snappy length mismatch")
+    return bytes(output)
+
+
+def _decompress_orc(data: bytes, compression: str) -> bytes:
+    if compression == "none":
+        return data
+    # Compressed streams are chunks with a 3-byte little-endian header: length << 1 | is_original
+    output = []
+    pos = 0
+    while pos + 3 <= len(data):
+        header = int.from_bytes(data[pos:pos + 3], "little")
+        pos += 3
+        length, original = header >> 1, header & 1
+        chunk = data[pos:pos + length]
+        pos += length
+        if original:
+            output.append(chunk)
+        elif compression == "zlib":
+            output.append(zlib.decompress(chunk, -zlib.MAX_WBITS))
+        elif compression == "snappy":
+            output.append(snappy_decompress(chunk))
+        elif compression == "zstd" and ZSTD_AVAILABLE:
+            output.append(zstandard.ZstdDecompressor().decompressobj().decompress(chunk))
+        else:
+            raise ValueError("unsupported ORC compression {}".format(compression))
+    return b"".join(output)
+
+
+def _orc_type_name(types: List[Dict[int, List]], type_id: int) -> str:
+    orc_type = types[type_id]
+    kind = ORC_KINDS.get(orc_type.get(1, [0])[0], "unknown")
+    subtypes = _repeated_varints(orc_type.get(2, []))
+    if kind == "struct":
+        names = [name.decode("utf-8", errors="replace") for name in orc_type.get(3, [])]
+        return "struct<{}>".format(",".join("{}:{}".format(n, _orc_type_name(types, t)) for n, t in zip(names, subtypes)))
+    if kind in ("array", "uniontype"):
+        return "{}<{}>".format(kind, ",".join(_orc_type_name(types, t) for t in subtypes))
+    if kind == "map":
+        return "map<{}>".format(",".join(_orc_type_name(types, t) for t in subtypes))
+    if kind == "decimal":
+        return "decimal({},{})".format(orc_type.get(5, [38])[0], orc_type.get(6, [10])[0])
+    if kind in ("varchar", "char") and 4 in orc_type:
+        return "{}({})".format(kind, orc_type[4][0])
+    return kind
+
+
+def parse_orc_tail(tail: bytes) -> Dict:
+    """
+    Decode the ORC file tail (footer + postscript) into {"columns", "num_rows",
+    "compression", "stripes", "version"}. Footers written with ZLIB or SNAPPY are
+    decompressed here, ZSTD when zstandard is installed; LZO/LZ4 are not supported.
+    """
+    postscript = _orc_postscript(tail)
+    ps_length = tail[-1]
+    footer_length = postscript.get(1, [0])[0]
+    compression = ORC_COMPRESSION.get(postscript.get(2, [0])[0], "unknown")
+    footer_end = len(tail) - 1 - ps_length
+    if footer_end - footer_length < 0:
+        raise TruncatedError()
+    footer = parse_protobuf(_decompress_orc(tail[footer_end - footer_length:footer_end], compression))
+
+    types = [parse_protobuf(raw) for raw in footer.get(4, [])]
+    columns = []
+    if types:
+        root = types[0]
+        names = [name.decode("utf-8", errors="replace") for name in root.get(3, [])]
+        for name, type_id in zip(names, _repeated_varints(root.get(2, []))):
+            columns.append({"name": name, "type": _orc_type_name(types, type_id), "nullable": True})
+    version = _repeated_varints(postscript.get(4, []))
+    return {
+        "columns": columns,
+        "num_rows": footer.get(6, [None])[0],
+        "compression": compression,
+        "stripes": len(footer.get(3, [])),
+        "version": ".".join(str(v) for v in version) if version else None,
+    }
+
+
+def delta_type_name(delta_type) -> str:
+    """Type string for a Delta (Spark) schema type."""
+    if isinstance(delta_type, str):
+        return delta_type
+    kind = delta_type.get("type")
+    if kind == "struct":
+        return "struct<{}>".format(",".join("{}:{}".format(f["name"], delta_type_name(f["type"])) for f in delta_type.get("fields", [])))
+    if kind == "array":
+        return "array<{}>".format(delta_type_name(delta_type.get("elementType")))
+    if kind == "map":
+        return "map<{},{}>".format(delta_type_name(delta_type.get("keyType")), delta_type_name(delta_type.get("valueType")))
+    return str(kind)
+
+
+def find_delta_metadata(commit: bytes) -> Optional[Dict]:
+    """The metaData action of a Delta commit (NDJSON of actions), or None if the commit has none."""
+    for line in commit.split(b"\n"):
+        if b'"metaData"' not in line:
+            continue
+        try:
+            action = json.loads(line)
+        except ValueError:
+            # Last line of a truncated read
+            continue
+        if isinstance(action, dict) and isinstance(action.get("metaData"), dict):
+            return action["metaData"]
+    return None
+
+
+def delta_commit_scanned(sample: bytes) -> bool:
+    """
+    Whether a head sample of a Delta commit settles the metaData question: it holds the
+    metaData action, or a complete add/remove/cdc line (file actions follow metaData).
+    """
+    if find_delta_metadata(sample) is not None:
+        return True
+    complete_lines = sample.split(b"\n")[:-1]
+    return any(line.lstrip().startswith((b'{"add"', b'{"remove"', b'{"cdc"')) for line in complete_lines)
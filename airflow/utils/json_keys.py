@@ -0,0 +1,166 @@
+import codecs
+import json
+from typing import List, Optional
+
+_WHITESPACE = " \t\r\n\ufeff"
+_OPEN = {"{": "}", "[": "]"}
+
+
+class TopLevelKeyScanner:
+    """
+    Incremental scanner for the top-level keys of the first JSON object in a stream:
+    a single object, the first element of an array of objects, or the first line of
+    NDJSON. Bytes are fed as they arrive (a truncated sample, then further ranges);
+    values are skipped without being parsed, and scanning stops at the end of the
+    first object so the rest of the file is never needed.
+
+    After each feed(): keys holds the keys seen so far, complete is True once the
+    first object is closed (or the document turned out not to hold one), and
+    structure is "object", "array" or None while still unknown.
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._buf = ""
+        self._pos = 0
+        self._state = "start"
+        self.keys: List[str] = []
+        self.structure: Optional[str] = None
+        self.complete = False
+        self.error: Optional[str] = None
+        # True when the first array element is not an object (array of scalars)
+        self.scalar_items = False
+
+    def feed(self, data: bytes) -> bool:
+        if self.complete:
+            return True
+        self._buf += self._decoder.decode(data)
+        self._run()
+        # Drop what has been consumed; tokens that are still incomplete start at _pos
+        self._buf = self._buf[self._pos:]
+        self._pos = 0
+        return self.complete
+
+    def _finish(self, error: Optional[str] = None):
+        self.complete = True
+        self.error = error
+
+    def _skip_whitespace(self) -> bool:
+        buf, pos = self._buf, self._pos
+        while pos < len(buf) and buf[pos] in _WHITESPACE:
+            pos += 1
+        self._pos = pos
+        return pos < len(buf)
+
+    def _string_end(self, start: int) -> int:
+        # Index just past the closing quote of the string opening at start, or -1 if truncated
+        buf, pos = self._buf, start + 1
+        while pos < len(buf):
+            ch = buf[pos]
+            if ch == "\\":
+                pos += 2
+                continue
+            if ch == '"':
+                return pos + 1
+            pos += 1
+        return -1
+
+    def _value_end(self, start: int) -> int:
+        # Index just past the value starting at start, or -1 if the buffer ends first
+        buf = self._buf
+        ch = buf[start]
+        if ch == '"':
+            return self._string_end(start)
+        if ch in _OPEN:
+            depth, pos = 0, start
+            while pos < len(buf):
+                ch = buf[pos]
+                if ch == '"':
+                    pos = self._string_end(pos)
+                    if pos < 0:
+                        return -1
+                    continue
+                if ch in "{[":
+                    depth += 1
+                elif ch in "}]":
+                    depth -= 1
+                    if depth == 0:
+                        return pos + 1
+                pos += 1
+            return -1
+        # Number / true / false / null: ends at the next delimiter
+        pos = start
+        while pos < len(buf) and buf[pos] not in ",}]" and buf[pos] not in _WHITESPACE:
+            pos += 1
+        return pos if pos < len(buf) else -1
+
+    def _run(self):
+        while not self.complete:
+            if not self._skip_whitespace():
+                return
+            ch = self._buf[self._pos]
+            state = self._state
+
+            if state == "start":
+                if ch == "{":
+                    self.structure = "object"
+                    self._state = "key_or_end"
+                elif ch == "[":
+                    self.structure = "array"
+                    self._state = "first_item"
+                else:
+                    return self._finish("not a JSON object or array")
+                self._pos += 1
+
+            elif state == "first_item":
+                if ch == "{":
+                    self._state = "key_or_end"
+                    self._pos += 1
+                else:
+                    # Empty array or an array of scalars: there are no keys to find
+                    self.scalar_items = ch != "]"
+                    return self._finish()
+
+            elif state == "key_or_end":
+                if ch == "}":
+                    return self._finish()
+                if ch != '"':
+                    return self._finish("expected a key at offset {}".format(self._pos))
+                end = self._string_end(self._pos)
+                if end < 0:
+                    return
+                try:
+                    key = json.loads(self._buf[self._pos:end])
+                except ValueError:
+                    key = self._buf[self._pos + 1:end - 1]
+                self.keys.append(key)
+                self._pos = end
+                self._state = "colon"
+
+            elif state == "colon":
+                if ch != ":":
+                    return self._finish("expected ':' at offset {}".format(self._pos))
+                self._pos += 1
+                self._state = "value"
+
+            elif state == "value":
+                end = self._value_end(self._pos)
+                if end < 0:
+                    return
+                self._pos = end
+                self._state = "after_value"
+
+            elif state == "after_value":
+                if ch == ",":
+                    self._pos += 1
+                    self._state = "key_or_end"
+                elif ch == "}":
+                    return self._finish()
+                else:
+                    return self._finish("expected ',' or '}}' at offset {}".format(self._pos))
+
+
+def scan_top_level_keys(data: bytes) -> TopLevelKeyScanner:
+    scanner = TopLevelKeyScanner()
+    scanner.feed(data)
+    return scanner
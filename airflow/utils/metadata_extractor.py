@@ -2,23 +2,51 @@ import hashlib
 import json
 import logging
 from typing import Dict, Optional, List
-import pyarrow.parquet as pq
 import io
 import csv
 from collections import Counter
 
+from utils.content_sniffer import SniffResult, decode_text, first_record_end, sniff_format
+from utils.format_headers import (
+    avro_type_name,
+    delta_type_name,
+    find_delta_metadata,
+    parse_avro_header,
+    parse_orc_tail,
+)
+from utils.json_keys import scan_top_level_keys
+from utils.pii_rules import get_rule_classifier
+
 logger = logging.getLogger(__name__)
 
-# Import Azure DLP client for PII detection
-try:
-    from utils.azure_dlp_client import detect_pii_in_column
-    AZURE_DLP_AVAILABLE = True
-except ImportError:
-    logger.warning('FN:metadata_extractor_import AZURE_DLP_AVAILABLE:{}'.format(False))
-    AZURE_DLP_AVAILABLE = False
-    
-    def detect_pii_in_column(column_name: str) -> Dict:
-        return {"pii_detected": False, "pii_types": []}
+# pyarrow and the Azure DLP client are imported on first use, not at module load:
+# DAG files import this module, and every DAG parse and task start would pay for them
+_dlp_client_module = None
+AZURE_DLP_AVAILABLE = None  # Unknown until the first PII lookup
+
+
+def _get_dlp_client_module():
+    global _dlp_client_module, AZURE_DLP_AVAILABLE
+    if AZURE_DLP_AVAILABLE is None:
+        try:
+            from utils import azure_dlp_client
+            _dlp_client_module = azure_dlp_client
+            AZURE_DLP_AVAILABLE = True
+        except ImportError:
+            logger.warning('FN:metadata_extractor_import AZURE_DLP_AVAILABLE:{}'.format(False))
+            AZURE_DLP_AVAILABLE = False
+    return _dlp_client_module
+
+
+def detect_pii_in_column(column_name: str) -> Dict:
+    return detect_pii_in_columns([column_name])[0]
+
+
+def detect_pii_in_columns(column_names: List[str]) -> List[Dict]:
+    dlp_client_module = _get_dlp_client_module()
+    if dlp_client_module is None:
+        return [{"pii_detected": False, "pii_types": [], "source": "unclassified"} for _ in column_names]
+    return dlp_client_module.detect_pii_in_columns(column_names)
 
 
 def generate_file_hash(file_content: bytes) -> str:
@@ -27,10 +55,83 @@ def generate_file_hash(file_content: bytes) -> str:
     return hash_obj.hexdigest(16)  # 16 bytes = 128 bits
 
 
-def extract_parquet_schema(file_content: bytes) -> Dict:
-    # Extract Parquet schema from file content. Parquet metadata is at the end of the file
-    # We need the tail of the file (last 8KB) which contains the schema metadata
+def compute_change_fingerprint(blob_info: Dict) -> str:
+    """
+    Canonical change fingerprint of a blob (or grouped dataset): SHAKE128 over the
+    listing's ETag, size and last_modified. It is what file_metadata.hash.value (and so
+    the file_hash column) stores and what the next scan compares against, so every
+    writer must use this function; no download is needed to compute it.
+    """
+    file_size = blob_info.get("size", 0)
+    etag = (blob_info.get("etag") or "").strip('"')
+    last_modified = blob_info.get("last_modified")
+    composite_string = f"{etag}_{file_size}_{last_modified.isoformat() if last_modified else ''}"
+    return generate_file_hash(composite_string.encode('utf-8'))
+
+
+class ParsedSchema:
+    """
+    Result of parsing one file sample, before PII tagging. Every consumer in
+    extract_file_metadata (schema_json, schema_hash, format_specific) derives from
+    the same object, so a sample is parsed once and each column name goes to DLP once.
+    """
+    
+    __slots__ = ("columns", "attributes", "format_details", "tag_pii", "_schema_json")
+    
+    def __init__(self, columns: Optional[List[Dict]] = None, attributes: Optional[Dict] = None,
+                 format_details: Optional[Dict] = None, tag_pii: bool = True):
+        self.columns = columns or []  # [{"name", "type", "nullable"}]
+        self.attributes = attributes or {}  # Extra schema_json keys (num_rows, delimiter, ...)
+        self.format_details = format_details or {}  # file_metadata.format_specific.<format>
+        self.tag_pii = tag_pii
+        self._schema_json = None
+    
+    def to_schema_json(self, data_source_type: Optional[str] = None) -> Dict:
+        if self._schema_json is None:
+            columns = tag_pii_columns(self.columns, data_source_type) if self.tag_pii else [
+                dict(column, pii_detected=False, pii_types=None) for column in self.columns
+            ]
+            self._schema_json = {"columns": columns, "num_columns": len(columns)}
+            self._schema_json.update(self.attributes)
+        return self._schema_json
+
+
+def tag_pii_columns(columns: List[Dict], data_source_type: Optional[str] = None) -> List[Dict]:
+    # Obvious names are decided by the local rules for this data_source_type;
+    # only the ambiguous ones go to Azure DLP (multi-document requests, cached)
+    names = [column["name"] for column in columns]
+    classifier = get_rule_classifier(data_source_type)
+    pii_results = classifier.classify_many(names) if classifier else [None] * len(names)
+    
+    ambiguous = [i for i, result in enumerate(pii_results) if result is None]
+    if ambiguous:
+        for i, result in zip(ambiguous, detect_pii_in_columns([names[i] for i in ambiguous])):
+            pii_results[i] = result
+    
+    tagged = []
+    for column, pii_result in zip(columns, pii_results):
+        column_data = dict(column)
+        
+        # Add PII detection results if available
+        if pii_result.get("pii_detected"):
+            column_data["pii_detected"] = True
+            column_data["pii_types"] = pii_result.get("pii_types", [])
+        else:
+            column_data["pii_detected"] = False
+            column_data["pii_types"] = None
+        # "rules", "azure_dlp" or "unclassified" (no classifier could answer)
+        column_data["pii_source"] = pii_result.get("source", "unclassified")
+        
+        tagged.append(column_data)
+    return tagged
+
+
+def parse_parquet_schema(file_content: bytes) -> ParsedSchema:
+    # Parquet metadata is at the end of the file
+    # We need the footer (FileMetaData + length + PAR1) which contains the schema metadata
     # This function should receive the tail bytes, not the head
+    import pyarrow.parquet as pq
+    
     try:
         parquet_file = pq.ParquetFile(io.BytesIO(file_content))
         schema = parquet_file.schema_arrow
@@ -38,66 +139,120 @@ def extract_parquet_schema(file_content: bytes) -> Dict:
         columns = []
         for i in range(len(schema)):
             field = schema.field(i)
-            # Detect PII using Azure DLP
-            pii_result = detect_pii_in_column(field.name)
-            
-            column_data = {
+            columns.append({
                 "name": field.name,
                 "type": str(field.type),
                 "nullable": field.nullable
-            }
-            
-            # Add PII detection results if available
-            if AZURE_DLP_AVAILABLE and pii_result.get("pii_detected"):
-                column_data["pii_detected"] = True
-                column_data["pii_types"] = pii_result.get("pii_types", [])
-            else:
-                column_data["pii_detected"] = False
-                column_data["pii_types"] = None
-            
-            columns.append(column_data)
-        
-        schema_dict = {
-            "columns": columns,
-            "num_columns": len(columns),
-        }
+            })
         
+        attributes = {}
+        format_details = {"row_groups": 0, "compression": "unknown", "schema_version": "1.0"}
         try:
             metadata = parquet_file.metadata
             if metadata and hasattr(metadata, 'num_rows'):
-                schema_dict["num_rows"] = metadata.num_rows
-        except:
-            pass
+                attributes["num_rows"] = metadata.num_rows
+            if metadata:
+                format_details["row_groups"] = metadata.num_row_groups
+                format_details["compression"] = _parquet_compression(metadata)
+                format_details["created_by"] = metadata.created_by
+                format_details["schema_version"] = metadata.format_version
+        except Exception as e:
+            logger.warning('FN:parse_parquet_schema file_content_size:{} metadata_error:{}'.format(len(file_content), str(e)))
         
-        return schema_dict
+        return ParsedSchema(columns, attributes, format_details)
         
     except Exception as e:
-        logger.warning('FN:extract_parquet_schema file_content_size:{} error:{}'.format(len(file_content) if file_content else 0, str(e)))
-        return {"columns": [], "num_columns": 0}
+        logger.warning('FN:parse_parquet_schema file_content_size:{} error:{}'.format(len(file_content) if file_content else 0, str(e)))
+        return ParsedSchema()
+
+
+def _parquet_compression(metadata) -> str:
+    # Codecs of the first row group's column chunks; per-column codecs are all reported
+    codecs = set()
+    if metadata.num_row_groups:
+        row_group = metadata.row_group(0)
+        for col in range(row_group.num_columns):
+            codecs.add(row_group.column(col).compression)
+    if not codecs:
+        return "unknown"
+    return ",".join(sorted(codecs)).lower()
+
+
+def extract_parquet_schema(file_content: bytes) -> Dict:
+    return parse_parquet_schema(file_content).to_schema_json()
+
+
+def _hashed_column(column: Dict) -> Dict:
+    # pii_source records how a column was classified, not the schema itself; an unclassified
+    # column (DLP not configured, throttled or failed) has no PII answer to hash either
+    excluded = ("pii_source", "pii_detected", "pii_types") if column.get("pii_source") == "unclassified" else ("pii_source",)
+    return {key: value for key, value in column.items() if key not in excluded}
 
 
 def generate_schema_hash(schema_json: Dict) -> str:
+    if isinstance(schema_json.get("columns"), list):
+        schema_json = dict(schema_json, columns=[
+            _hashed_column(column) if isinstance(column, dict) else column
+            for column in schema_json["columns"]
+        ])
     schema_str = json.dumps(schema_json, sort_keys=True)
     hash_obj = hashlib.shake_128(schema_str.encode())
     return hash_obj.hexdigest(16)  # 16 bytes = 128 bits
 
 
-def extract_csv_schema(file_content: bytes, sample_size: int = 0) -> Dict:
+def carry_forward_classification(schema_json: Dict, previous_schema_json: Optional[Dict]) -> bool:
+    """
+    Give unclassified columns the PII answer stored for the same column name in the
+    previous schema, so a throttled or failed DLP call does not replace a known
+    classification with "no PII". Returns True when any column was filled in.
+    """
+    columns = schema_json.get("columns") if isinstance(schema_json, dict) else None
+    previous_columns = previous_schema_json.get("columns") if isinstance(previous_schema_json, dict) else None
+    if not isinstance(columns, list) or not isinstance(previous_columns, list):
+        return False
+    previous = {
+        column.get("name"): column for column in previous_columns
+        if isinstance(column, dict) and column.get("pii_source") not in (None, "unclassified")
+    }
+    carried = False
+    for column in columns:
+        if not isinstance(column, dict) or column.get("pii_source") != "unclassified":
+            continue
+        known = previous.get(column.get("name"))
+        if known is None:
+            continue
+        column["pii_detected"] = known.get("pii_detected", False)
+        column["pii_types"] = known.get("pii_types")
+        column["pii_source"] = known["pii_source"]
+        carried = True
+    return carried
+
+
+def has_unclassified_columns(schema_json: Optional[Dict]) -> bool:
+    columns = schema_json.get("columns") if isinstance(schema_json, dict) else None
+    return isinstance(columns, list) and any(isinstance(column, dict) and column.get("pii_source") == "unclassified" for column in columns)
+
+
+def parse_csv_schema(file_content: bytes, sample_size: int = 0, delimiter: str = ",", quotechar: str = '"',
+                     encoding: str = "utf-8", has_bom: bool = False) -> ParsedSchema:
     # Extract CSV schema from headers ONLY - no data rows downloaded
     # For banking/financial data: We only extract column names, never actual data
+    # delimiter/quotechar/encoding come from the content sniffer
+    format_details = {"delimiter": delimiter, "has_header": True, "encoding": encoding, "quotechar": quotechar, "bom": has_bom}
     try:
-        content_str = file_content.decode('utf-8', errors='ignore')
-        lines = content_str.split('\n')
+        content_str = decode_text(file_content, encoding, has_bom)
         
-        if not lines:
-            return {"columns": [], "num_columns": 0}
+        # ONLY read the first record (headers) - NO data rows; quoted headers may span lines
+        end = first_record_end(content_str, quotechar)
+        header_record = content_str if end < 0 else content_str[:end]
+        if not header_record.strip():
+            return ParsedSchema(format_details=format_details)
         
-        # ONLY read first line (headers) - NO data rows
-        reader = csv.reader([lines[0]])  # Only header line
+        reader = csv.reader(io.StringIO(header_record), delimiter=delimiter, quotechar=quotechar)
         headers = next(reader, None)
         
         if not headers:
-            return {"columns": [], "num_columns": 0}
+            return ParsedSchema(format_details=format_details)
         
         columns = []
         
@@ -106,36 +261,26 @@ def extract_csv_schema(file_content: bytes, sample_size: int = 0) -> Dict:
             if not header:
                 header = f"column_{i+1}"
             
-            # Detect PII using Azure DLP
-            pii_result = detect_pii_in_column(header)
-            
-            column_data = {
+            columns.append({
                 "name": header,
                 "type": "string",  # Default type since we don't have data samples
                 "nullable": True
-            }
-            
-            # Add PII detection results if available
-            if AZURE_DLP_AVAILABLE and pii_result.get("pii_detected"):
-                column_data["pii_detected"] = True
-                column_data["pii_types"] = pii_result.get("pii_types", [])
-            else:
-                column_data["pii_detected"] = False
-                column_data["pii_types"] = None
-            
-            columns.append(column_data)
+            })
         
-        return {
-            "columns": columns,
-            "num_columns": len(columns),
+        attributes = {
             "num_rows": None,  # Don't know row count - we only have headers
             "has_header": True,
-            "delimiter": ","
+            "delimiter": delimiter
         }
+        return ParsedSchema(columns, attributes, format_details)
         
     except Exception as e:
-        logger.warning('FN:extract_csv_schema file_content_size:{} sample_size:{} error:{}'.format(len(file_content) if file_content else 0, sample_size, str(e)))
-        return {"columns": [], "num_columns": 0}
+        logger.warning('FN:parse_csv_schema file_content_size:{} sample_size:{} error:{}'.format(len(file_content) if file_content else 0, sample_size, str(e)))
+        return ParsedSchema(format_details=format_details)
+
+
+def extract_csv_schema(file_content: bytes, sample_size: int = 0) -> Dict:
+    return parse_csv_schema(file_content, sample_size).to_schema_json()
 
 
 def infer_column_type(values: List[str]) -> str:
@@ -195,83 +340,198 @@ def infer_column_type(values: List[str]) -> str:
         return "string"
 
 
-def extract_json_schema(file_content: bytes) -> Dict:
+def parse_json_schema(file_content: bytes) -> ParsedSchema:
     try:
         content_str = file_content.decode('utf-8', errors='ignore').strip()
         
         if not content_str:
-            return {"columns": [], "num_columns": 0}
+            return ParsedSchema(format_details={"format": "unknown"})
         
         try:
             data = json.loads(content_str)
         except json.JSONDecodeError:
-            return {"columns": [], "num_columns": 0, "error": "Invalid JSON"}
+            # Usually a sample cut off mid-document: take the keys of the first object from the prefix
+            return _parse_json_prefix(file_content, "json")
         
         columns = []
+        tag_pii = True
         
         if isinstance(data, dict):
             # Single object - just get keys (column names), NO values processed
-            for key in data.keys():
-                # Detect PII using Azure DLP
-                pii_result = detect_pii_in_column(str(key))
-                
-                column_data = {
-                    "name": str(key),
-                    "type": "string",  # Default type since we don't process values
-                    "nullable": True
-                }
-                
-                # Add PII detection results if available
-                if AZURE_DLP_AVAILABLE and pii_result.get("pii_detected"):
-                    column_data["pii_detected"] = True
-                    column_data["pii_types"] = pii_result.get("pii_types", [])
-                else:
-                    column_data["pii_detected"] = False
-                    column_data["pii_types"] = None
-                
-                columns.append(column_data)
-        elif isinstance(data, list) and len(data) > 0:
-            first_item = data[0]
-            if isinstance(first_item, dict):
-                # Extract columns from first item keys ONLY - NO value processing
-                for key in first_item.keys():
-                    # Detect PII using Azure DLP
-                    pii_result = detect_pii_in_column(str(key))
-                    
-                    column_data = {
-                        "name": str(key),
-                        "type": "string",  # Default type since we don't process values
-                        "nullable": True
-                    }
-                    
-                    # Add PII detection results if available
-                    if AZURE_DLP_AVAILABLE and pii_result.get("pii_detected"):
-                        column_data["pii_detected"] = True
-                        column_data["pii_types"] = pii_result.get("pii_types", [])
-                    else:
-                        column_data["pii_detected"] = False
-                        column_data["pii_types"] = None
-                    
-                    columns.append(column_data)
-            else:
-                columns.append({
-                    "name": "value",
-                    "type": "string",
-                    "nullable": True,
-                    "pii_detected": False,
-                    "pii_types": None
-                })
-        
-        return {
-            "columns": columns,
-            "num_columns": len(columns),
-            "structure": "object" if isinstance(data, dict) else "array",
+            keys = data.keys()
+        elif isinstance(data, list) and len(data) > 0 and isinstance(data[0], dict):
+            # Extract columns from first item keys ONLY - NO value processing
+            keys = data[0].keys()
+        else:
+            keys = []
+        
+        for key in keys:
+            columns.append({
+                "name": str(key),
+                "type": "string",  # Default type since we don't process values
+                "nullable": True
+            })
+        
+        if isinstance(data, list) and len(data) > 0 and not isinstance(data[0], dict):
+            # Array of scalars: a single synthetic column, nothing to send to DLP
+            columns.append({"name": "value", "type": "string", "nullable": True})
+            tag_pii = False
+        
+        structure = "object" if isinstance(data, dict) else "array"
+        attributes = {
+            "structure": structure,
             "num_items": len(data) if isinstance(data, list) else None
         }
+        return ParsedSchema(columns, attributes, {"format": structure}, tag_pii=tag_pii)
+        
+    except Exception as e:
+        logger.warning('FN:parse_json_schema file_content_size:{} error:{}'.format(len(file_content) if file_content else 0, str(e)))
+        return ParsedSchema(format_details={"format": "unknown"})
+
+
+def extract_json_schema(file_content: bytes) -> Dict:
+    return parse_json_schema(file_content).to_schema_json()
+
+
+def _parse_json_prefix(file_content: bytes, json_format: str) -> ParsedSchema:
+    # Top-level keys of the first object, read from a truncated sample without parsing values
+    scanner = scan_top_level_keys(file_content)
+    if scanner.error or (not scanner.keys and not scanner.complete):
+        return ParsedSchema(attributes={"error": "Invalid JSON"}, format_details={"format": "unknown" if json_format == "json" else json_format})
+    
+    columns = [{"name": str(key), "type": "string", "nullable": True} for key in scanner.keys]
+    tag_pii = True
+    if scanner.scalar_items:
+        # Array of scalars: a single synthetic column, nothing to send to DLP
+        columns = [{"name": "value", "type": "string", "nullable": True}]
+        tag_pii = False
+    
+    structure = "ndjson" if json_format == "ndjson" else scanner.structure
+    attributes = {"structure": structure, "num_items": None}
+    if not scanner.complete:
+        # The sample cap was reached inside the first object; more keys may follow
+        attributes["keys_truncated"] = True
+    return ParsedSchema(columns, attributes, {"format": structure}, tag_pii=tag_pii)
+
+
+def header_sample_complete(file_content: bytes, file_name: str = "") -> bool:
+    """
+    Whether a head sample already holds everything the schema needs; get_blob_sample
+    keeps extending the sample with growing ranged reads until this is True.
+    JSON/NDJSON need the first object closed, CSV the first line break after the header,
+    Avro the end of the file header.
+    """
+    sniffed = sniff_format(file_content, file_name)
+    if sniffed.format in ("json", "ndjson"):
+        return scan_top_level_keys(sniffed.content).complete
+    if sniffed.format == "csv":
+        details = sniffed.details
+        text = decode_text(sniffed.content, details.get("encoding") or "utf-8", details.get("has_bom", False))
+        return first_record_end(text, details.get("quotechar", '"')) >= 0
+    if sniffed.format == "avro":
+        # The whole header (metadata map + sync marker), which holds the writer schema
+        try:
+            return parse_avro_header(sniffed.content) is not None
+        except ValueError:
+            return True
+    return True
+
+
+def parse_ndjson_schema(file_content: bytes) -> ParsedSchema:
+    # One JSON object per line: the keys of the first complete line are the columns
+    try:
+        content_str = file_content.decode('utf-8', errors='ignore').lstrip('\ufeff')
+        first_line = next((line.strip() for line in content_str.split('\n') if line.strip()), "")
+        
+        try:
+            data = json.loads(first_line) if first_line else None
+        except json.JSONDecodeError:
+            return _parse_json_prefix(file_content, "ndjson")
+        
+        if not isinstance(data, dict):
+            return ParsedSchema(format_details={"format": "ndjson"})
+        
+        columns = [{"name": str(key), "type": "string", "nullable": True} for key in data.keys()]
+        return ParsedSchema(columns, {"structure": "ndjson", "num_items": None}, {"format": "ndjson"})
+        
+    except Exception as e:
+        logger.warning('FN:parse_ndjson_schema file_content_size:{} error:{}'.format(len(file_content) if file_content else 0, str(e)))
+        return ParsedSchema(format_details={"format": "ndjson"})
+
+
+def parse_avro_schema(file_content: bytes) -> ParsedSchema:
+    # Avro object containers carry the writer schema as JSON in the file header;
+    # file_content is the head sample, no data blocks are decoded
+    try:
+        header = parse_avro_header(file_content)
+        if header is None:
+            logger.warning('FN:parse_avro_schema file_content_size:{} header_truncated:True'.format(len(file_content)))
+            return ParsedSchema(format_details={"codec": "unknown", "header_truncated": True})
+        
+        metadata = header["metadata"]
+        schema = json.loads(metadata.get("avro.schema", b"null").decode("utf-8"))
+        format_details = {
+            "codec": metadata.get("avro.codec", b"null").decode("utf-8", errors="replace"),
+            "header_bytes": header["header_length"],
+        }
+        if isinstance(schema, dict) and schema.get("type") == "record":
+            name = schema.get("name")
+            format_details["record_name"] = "{}.{}".format(schema["namespace"], name) if schema.get("namespace") else name
+            columns = []
+            for field in schema.get("fields", []):
+                type_name, nullable = avro_type_name(field.get("type"))
+                columns.append({"name": field["name"], "type": type_name, "nullable": nullable})
+            return ParsedSchema(columns, {}, format_details)
+        
+        # Top-level non-record schema: a single synthetic column, nothing to send to DLP
+        type_name, nullable = avro_type_name(schema)
+        return ParsedSchema([{"name": "value", "type": type_name, "nullable": nullable}], {}, format_details, tag_pii=False)
+    
+    except Exception as e:
+        logger.warning('FN:parse_avro_schema file_content_size:{} error:{}'.format(len(file_content) if file_content else 0, str(e)))
+        return ParsedSchema()
+
+
+def parse_orc_schema(file_content: bytes) -> ParsedSchema:
+    # ORC keeps its schema in the file footer; file_content is the footer + postscript
+    # suffix from AzureBlobClient.get_blob_suffix, not the head
+    try:
+        tail = parse_orc_tail(file_content)
+        format_details = {
+            "compression": tail["compression"],
+            "stripes": tail["stripes"],
+            "file_version": tail["version"],
+        }
+        return ParsedSchema(tail["columns"], {"num_rows": tail["num_rows"]}, format_details)
+    except Exception as e:
+        logger.warning('FN:parse_orc_schema file_content_size:{} error:{}'.format(len(file_content) if file_content else 0, str(e)))
+        return ParsedSchema()
+
+
+def parse_delta_schema(file_content: bytes) -> ParsedSchema:
+    # file_content is the table's current metaData action (see discovery_pipeline.sample_delta_log);
+    # schemaString is the Spark StructType JSON of the whole table
+    try:
+        metadata = find_delta_metadata(file_content)
+        if metadata is None:
+            return ParsedSchema(format_details={"metadata_found": False})
         
+        schema = json.loads(metadata.get("schemaString") or "{}")
+        columns = [
+            {"name": field["name"], "type": delta_type_name(field["type"]), "nullable": field.get("nullable", True)}
+            for field in schema.get("fields", [])
+        ]
+        partition_columns = list(metadata.get("partitionColumns") or [])
+        format_details = {
+            "table_id": metadata.get("id"),
+            "provider": (metadata.get("format") or {}).get("provider", "parquet"),
+            "partition_columns": partition_columns,
+        }
+        return ParsedSchema(columns, {"partition_columns": partition_columns}, format_details)
+    
     except Exception as e:
-        logger.warning('FN:extract_json_schema file_content_size:{} error:{}'.format(len(file_content) if file_content else 0, str(e)))
-        return {"columns": [], "num_columns": 0}
+        logger.warning('FN:parse_delta_schema file_content_size:{} error:{}'.format(len(file_content) if file_content else 0, str(e)))
+        return ParsedSchema()
 
 
 def infer_json_type(value) -> str:
@@ -295,18 +555,47 @@ def infer_json_type(value) -> str:
         return "string"
 
 
-def extract_file_metadata(blob_info: Dict, file_content: Optional[bytes] = None) -> Dict:
+_SCHEMA_PARSERS = {
+    "parquet": parse_parquet_schema,
+    "csv": parse_csv_schema,
+    "json": parse_json_schema,
+    "ndjson": parse_ndjson_schema,
+    "avro": parse_avro_schema,
+    "orc": parse_orc_schema,
+    "delta": parse_delta_schema,
+}
+
+# format_specific written when a format has no sample to parse
+_DEFAULT_FORMAT_DETAILS = {
+    "csv": {"delimiter": ",", "has_header": True, "encoding": "utf-8"},
+    "json": {"format": "unknown"},
+}
+
+
+def extract_file_metadata(blob_info: Dict, file_content: Optional[bytes] = None, data_source_type: Optional[str] = None) -> Dict:
     from datetime import datetime
     
     file_name = blob_info["name"]
-    file_extension = "." + file_name.split(".")[-1] if "." in file_name else ""
+    # A partitioned dataset is described by its representative file's name and content
+    sample_name = (blob_info.get("representative") or blob_info)["name"]
+    file_extension = "." + sample_name.split(".")[-1] if "." in sample_name else ""
     file_format = file_extension[1:].lower() if file_extension else "unknown"
     
-    file_hash = None
-    if file_content:
-        file_hash = generate_file_hash(file_content)
+    # The bytes decide the format (gzip'd CSV, extensionless exports, .json holding NDJSON);
+    # the extension is only a hint. Compressed samples are inflated just far enough for the header.
+    # Datasets made of many blobs (Delta tables) say what their sample is.
+    dataset_format = blob_info.get("dataset_format")
+    if dataset_format:
+        file_extension = ""
+        file_format = dataset_format
+        sniffed = SniffResult(dataset_format, file_content, detected_by="dataset") if file_content else None
     else:
-        file_hash = generate_file_hash(b"")
+        sniffed = sniff_format(file_content, sample_name) if file_content else None
+    if sniffed is not None and sniffed.format:
+        file_format = sniffed.format
+    
+    # The listing fingerprint, not a hash of the sample: it must match what the next scan computes
+    file_hash = compute_change_fingerprint(blob_info)
     
     file_metadata = {
         "basic": {
@@ -318,68 +607,51 @@ def extract_file_metadata(blob_info: Dict, file_content: Optional[bytes] = None)
             "mime_type": blob_info.get("content_type", "application/octet-stream")
         },
         "hash": {
-            "algorithm": "shake128",
+            "algorithm": "shake128_etag_composite",
             "value": file_hash,
-            "computed_at": datetime.utcnow().isoformat() + "Z"
+            "computed_at": datetime.utcnow().isoformat() + "Z",
+            "source": "etag_composite"
         },
         "timestamps": {
             "created_at": blob_info["created_at"].isoformat() if blob_info.get("created_at") else None,
             "last_modified": blob_info["last_modified"].isoformat() if blob_info.get("last_modified") else None
         }
     }
+    if blob_info.get("partitioning"):
+        # Dataset-level facts; deliberately outside schema_json so new partitions keep the schema hash
+        file_metadata["partitioning"] = blob_info["partitioning"]
     
-    format_specific = {}
-    if file_format == "parquet" and file_content:
+    # Parse the sample once; schema_json, schema_hash and format_specific all come from it
+    parsed = None
+    parser = _SCHEMA_PARSERS.get(file_format)
+    if sniffed is not None and sniffed.compression:
+        file_metadata["basic"]["compression"] = sniffed.compression
+    if parser and file_content and sniffed is not None and sniffed.content:
         try:
-            parquet_schema = extract_parquet_schema(file_content)
-            format_specific["parquet"] = {
-                "row_groups": parquet_schema.get("num_rows", 0),
-                "compression": "unknown",
-                "schema_version": "1.0"
-            }
+            parsed = parser(sniffed.content, **sniffed.details)
         except Exception as e:
             logger.warning('FN:extract_file_metadata file_name:{} file_format:{} error:{}'.format(file_name, file_format, str(e)))
-    elif file_format == "csv":
-        format_specific["csv"] = {
-            "delimiter": ",",
-            "has_header": True,
-            "encoding": "utf-8"
-        }
-    elif file_format == "json":
-        format_specific["json"] = {
-            "format": "unknown"
-        }
     
-    if format_specific:
-        file_metadata["format_specific"] = format_specific
+    if parsed is not None and parsed.format_details:
+        file_metadata["format_specific"] = {file_format: parsed.format_details}
+    elif file_format in _DEFAULT_FORMAT_DETAILS:
+        file_metadata["format_specific"] = {file_format: dict(_DEFAULT_FORMAT_DETAILS[file_format])}
     
     schema_json = None
     schema_hash = None
     
-    if file_format == "parquet" and file_content:
-        try:
-            schema_json = extract_parquet_schema(file_content)
-            schema_hash = generate_schema_hash(schema_json)
-        except Exception as e:
-            logger.warning('FN:extract_file_metadata file_name:{} file_format:{} error:{}'.format(file_name, file_format, str(e)))
-            schema_json = {}
-            schema_hash = hashlib.shake_128(b"").hexdigest(16)  # 16 bytes = 128 bits
-    elif file_format == "csv" and file_content:
+    if parsed is not None:
         try:
-            schema_json = extract_csv_schema(file_content)
-            schema_hash = generate_schema_hash(schema_json)
-        except Exception as e:
-            logger.warning('FN:extract_file_metadata file_name:{} file_format:{} error:{}'.format(file_name, file_format, str(e)))
-            schema_json = {}
-            schema_hash = hashlib.shake_128(b"").hexdigest(16)  # 16 bytes = 128 bits
-    elif file_format == "json" and file_content:
-        try:
-            schema_json = extract_json_schema(file_content)
+            schema_json = parsed.to_schema_json(data_source_type)
             schema_hash = generate_schema_hash(schema_json)
         except Exception as e:
             logger.warning('FN:extract_file_metadata file_name:{} file_format:{} error:{}'.format(file_name, file_format, str(e)))
             schema_json = {}
             schema_hash = hashlib.shake_128(b"").hexdigest(16)  # 16 bytes = 128 bits
+    elif parser and file_content:
+        # Parser raised: keep the previous empty-schema fallback
+        schema_json = {}
+        schema_hash = hashlib.shake_128(b"").hexdigest(16)  # 16 bytes = 128 bits
     else:
         schema_json = {}
         schema_hash = hashlib.shake_128(json.dumps({}).encode()).hexdigest(16)  # 16 bytes = 128 bits
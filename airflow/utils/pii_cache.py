@@ -0,0 +1,197 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.azure_config import PII_CACHE_CONFIG
+from utils.deduplication import get_db_connection
+from utils.pii_rules import normalize_column_name
+
+logger = logging.getLogger(__name__)
+
+
+def get_cache_key(column_name: str, language: str, model_version: str) -> str:
+    key = "\0".join([normalize_column_name(column_name), language, model_version])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class PIIClassificationCache:
+    """
+    Two-tier cache of column-name PII classifications, in front of Azure AI Language.
+    Tier 1 is a bounded in-process LRU; tier 2 is the shared pii_classification_cache
+    MySQL table, so every worker benefits from names any worker has classified.
+    Both tiers expire entries after ttl_seconds.
+
+    Tier 2 failures are logged and treated as misses: the cache never fails discovery.
+    Thread-safe.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, ttl_seconds: Optional[float] = None, persistent: Optional[bool] = None):
+        self.max_entries = max_entries or PII_CACHE_CONFIG.get("max_entries", 10000)
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else PII_CACHE_CONFIG.get("ttl_hours", 720) * 3600
+        self.persistent = persistent if persistent is not None else PII_CACHE_CONFIG.get("persistent", True)
+        self._entries: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stores = 0
+        self.memory_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "persistent_hits": self.persistent_hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "memory_entries": len(self._entries),
+            }
+
+    def _get_memory(self, key: str) -> Optional[Dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            self.expired += 1
+            return None
+        self._entries.move_to_end(key)
+        return result
+
+    def _put_memory(self, key: str, result: Dict, expires_at: float):
+        self._entries[key] = (expires_at, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get_many(self, column_names: Iterable[str], language: str, model_version: str) -> Dict[str, Dict]:
+        """Return {column_name: {pii_detected, pii_types}} for every name found in either tier."""
+        keys = {name: get_cache_key(name, language, model_version) for name in column_names}
+        found = {}
+        with self._lock:
+            for name, key in keys.items():
+                result = self._get_memory(key)
+                if result is not None:
+                    found[name] = result
+                    self.memory_hits += 1
+
+        missing = {key: name for name, key in keys.items() if name not in found}
+        if missing and self.persistent:
+            rows = self._load_persistent(list(missing))
+            with self._lock:
+                for key, (result, expires_at) in rows.items():
+                    self._put_memory(key, result, expires_at)
+                    found[missing[key]] = result
+                    self.persistent_hits += 1
+
+        with self._lock:
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, results: Dict[str, Dict], language: str, model_version: str):
+        """Store fresh classifications ({column_name: {pii_detected, pii_types}}) in both tiers."""
+        if not results:
+            return
+        expires_at = time.time() + self.ttl_seconds
+        entries = {}
+        for name, result in results.items():
+            entries[get_cache_key(name, language, model_version)] = (name, {
+                "pii_detected": bool(result.get("pii_detected")),
+                "pii_types": list(result.get("pii_types") or []),
+            })
+        with self._lock:
+            for key, (name, result) in entries.items():
+                self._put_memory(key, result, expires_at)
+            self._stores += 1
+            purge = self._stores % 100 == 0
+        if self.persistent:
+            self._store_persistent(entries, language, model_version, purge)
+
+    def _load_persistent(self, keys: List[str]) -> Dict[str, Tuple[Dict, float]]:
+        conn = None
+        try:
+            conn = get_db_connection()
+            with conn.cursor() as cursor:
+                placeholders = ','.join(['%s'] * len(keys))
+                cursor.execute(f"""
+                    SELECT cache_key, pii_detected, pii_types,
+                           TIMESTAMPDIFF(SECOND, UTC_TIMESTAMP(), expires_at) AS ttl_remaining
+                    FROM pii_classification_cache
+                    WHERE cache_key IN ({placeholders})
+                      AND expires_at > UTC_TIMESTAMP()
+                """, keys)
+                now = time.time()
+                rows = {}
+                for row in cursor.fetchall():
+                    pii_types = row["pii_types"]
+                    if isinstance(pii_types, str):
+                        pii_types = json.loads(pii_types)
+                    rows[row["cache_key"]] = (
+                        {"pii_detected": bool(row["pii_detected"]), "pii_types": pii_types or []},
+                        now + min(row["ttl_remaining"], self.ttl_seconds),
+                    )
+                return rows
+        except Exception as e:
+            logger.warning('FN:PIIClassificationCache._load_persistent key_count:{} error:{}'.format(len(keys), str(e)))
+            return {}
+        finally:
+            if conn:
+                conn.close()
+
+    def _store_persistent(self, entries: Dict[str, Tuple[str, Dict]], language: str, model_version: str, purge: bool):
+        conn = None
+        try:
+            conn = get_db_connection()
+            with conn.cursor() as cursor:
+                row_sql = "(%s, %s, %s, %s, %s, %s, UTC_TIMESTAMP() + INTERVAL %s SECOND)"
+                params = []
+                for key, (name, result) in entries.items():
+                    params.extend([key, name[:512], language, model_version, result["pii_detected"],
+                                   json.dumps(result["pii_types"]), int(self.ttl_seconds)])
+                cursor.execute("""
+                    INSERT INTO pii_classification_cache (
+                        cache_key, column_name, language, model_version, pii_detected, pii_types, expires_at
+                    ) VALUES
+                """ + ",\n".join([row_sql] * len(entries)) + """
+                    AS new
+                    ON DUPLICATE KEY UPDATE
+                        pii_detected = new.pii_detected,
+                        pii_types = new.pii_types,
+                        expires_at = new.expires_at
+                """, params)
+                if purge:
+                    # TTL eviction for the shared tier, a bounded slice at a time
+                    cursor.execute("DELETE FROM pii_classification_cache WHERE expires_at <= UTC_TIMESTAMP() LIMIT 1000")
+            conn.commit()
+        except Exception as e:
+            if conn:
+                conn.rollback()
+            logger.warning('FN:PIIClassificationCache._store_persistent entry_count:{} error:{}'.format(len(entries), str(e)))
+        finally:
+            if conn:
+                conn.close()
+
+
+# Global instance (initialized on first use)
+_pii_cache = None
+_pii_cache_lock = threading.Lock()
+
+
+def get_pii_cache() -> Optional[PIIClassificationCache]:
+    """Get or create the process-wide PII cache (None when disabled)"""
+    global _pii_cache
+    if not PII_CACHE_CONFIG.get("enabled", True):
+        return None
+    if _pii_cache is None:
+        with _pii_cache_lock:
+            if _pii_cache is None:
+                _pii_cache = PIIClassificationCache()
+    return _pii_cache
@@ -0,0 +1,197 @@
+import json
+import logging
+import os
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+RULES_SOURCE = "rules"
+
+# Column-name phrases (as normalized token sequences) that are PII on their own.
+# Categories follow Azure AI Language entity names where one exists.
+DEFAULT_PII_PHRASES = {
+    "Email": ["email", "e mail", "email address", "mail address"],
+    "PhoneNumber": ["phone", "phone number", "phone no", "mobile", "mobile number", "telephone", "cell phone", "fax", "fax number"],
+    "USSocialSecurityNumber": ["ssn", "social security", "social security number"],
+    "InternationalBankingAccountNumber": ["iban"],
+    "SWIFTCode": ["swift", "swift code", "bic"],
+    "ABARoutingNumber": ["routing number", "aba number"],
+    "BankAccountNumber": ["account number", "bank account", "bank account number"],
+    "CreditCardNumber": ["credit card", "credit card number", "card number", "card no", "cc number"],
+    "Person": ["first name", "last name", "full name", "surname", "given name", "middle name", "maiden name", "customer name"],
+    "DateOfBirth": ["dob", "date of birth", "birth date", "birthdate", "birthday"],
+    "Address": ["address", "street", "street address", "postal code", "zip code", "zipcode", "postcode", "address line"],
+    "IPAddress": ["ip address", "ip addr", "ipv4", "ipv6"],
+    "DriversLicenseNumber": ["driver license", "drivers license", "driving licence", "driving license"],
+    "PassportNumber": ["passport", "passport number", "passport no"],
+    "TaxIdentificationNumber": ["tax id", "tin", "taxpayer id", "itin"],
+}
+
+# Tokens that never make a column name PII; a name made only of these (and numbers) is decided locally
+DEFAULT_NON_PII_TOKENS = [
+    "id", "key", "uuid", "guid", "pk", "fk",
+    "amount", "amt", "total", "sum", "count", "cnt", "qty", "quantity", "price", "cost", "fee", "rate",
+    "balance", "currency", "status", "type", "code", "category", "flag", "is", "has",
+    "created", "updated", "modified", "deleted", "inserted", "loaded", "processed", "at", "on",
+    "date", "time", "timestamp", "ts", "dt", "year", "month", "day", "hour", "minute", "week", "quarter",
+    "version", "ver", "seq", "sequence", "index", "idx", "number", "num", "no",
+    "transaction", "txn", "order", "product", "item", "sku", "batch", "source", "target", "value",
+    "score", "percent", "pct", "ratio", "level", "tier", "limit", "min", "max", "avg", "mean",
+    "net", "gross", "tax", "discount", "channel", "description", "desc", "unit", "units", "start", "end",
+]
+
+# Tokens that change what a PII phrase refers to: is_email_verified, address_type, phone_type and
+# email_count hold a flag, a category or a count, not the value; email_sent_at, address_updated_at,
+# email_template_id and mobile_app_version hold a timestamp, a reference or a version about it.
+# A phrase match next to one of these is ambiguous (left to the service) rather than decided as PII
+DEFAULT_MODIFIER_TOKENS = [
+    "is", "has", "type", "count", "cnt", "flag", "verified", "valid", "validated", "confirmed",
+    "status", "format", "length", "len", "enabled", "consent", "opt",
+    "at", "on", "date", "time", "timestamp", "ts", "dt", "id", "key", "uuid", "version", "ver",
+    "template", "app", "sent", "received", "created", "updated", "modified", "deleted",
+]
+
+# Extra rules per data_source_type, merged over the defaults
+DEFAULT_SOURCE_RULES = {
+    "credit_card": {
+        "pii": {
+            "CreditCardNumber": ["pan", "masked pan", "primary account number"],
+            "CreditCardSecurityCode": ["cvv", "cvv2", "cvc", "cvc2", "security code"],
+            "CreditCardExpiry": ["expiry", "expiry date", "expiration date", "exp date"],
+            "Person": ["cardholder", "card holder", "cardholder name", "card holder name"],
+        },
+        "non_pii": ["mcc", "merchant", "authorization", "auth", "interchange", "settlement", "chargeback", "terminal", "acquirer", "issuer"],
+    },
+}
+
+
+def normalize_column_name(column_name: str) -> str:
+    # customerId, Customer-ID and customer_id all normalize to customer_id
+    name = re.sub(r"([a-z0-9])([A-Z])", r"\1_\2", column_name.strip())
+    normalized = re.sub(r"[\W_]+", "_", name).strip("_").lower()
+    return normalized or column_name.strip().lower()
+
+
+def tokenize_column_name(column_name: str) -> List[str]:
+    return [token for token in normalize_column_name(column_name).split("_") if token]
+
+
+class PIIRuleClassifier:
+    """
+    Local column-name classifier run ahead of Azure AI Language.
+
+    Names are tokenized (camelCase, snake_case, kebab-case...) and matched against a
+    token trie of PII phrases; "first name" also matches the compound token "firstname".
+    A phrase match decides the column as PII unless a modifier token outside the
+    matched phrase (is, has, type, count, flag, verified...) says the column describes
+    the value rather than holding it; a name made only of non-PII tokens is decided
+    as not PII, and anything else is ambiguous (classify() returns None).
+    """
+
+    _END = "$"
+
+    def __init__(self, pii_phrases: Dict[str, List[str]], non_pii_tokens: Iterable[str],
+                 modifier_tokens: Iterable[str] = DEFAULT_MODIFIER_TOKENS):
+        self._trie: Dict = {}
+        for category, phrases in pii_phrases.items():
+            for phrase in phrases:
+                tokens = tokenize_column_name(phrase)
+                if not tokens:
+                    continue
+                self._add(tokens, category)
+                if len(tokens) > 1:
+                    self._add(["".join(tokens)], category)
+        self.non_pii_tokens = frozenset(token.lower() for token in non_pii_tokens)
+        self.modifier_tokens = frozenset(token.lower() for token in modifier_tokens)
+
+    def _add(self, tokens: List[str], category: str):
+        node = self._trie
+        for token in tokens:
+            node = node.setdefault(token, {})
+        node.setdefault(self._END, set()).add(category)
+
+    def _match(self, tokens: List[str]) -> Tuple[List[str], set]:
+        matches = []
+        for start in range(len(tokens)):
+            node = self._trie
+            for end in range(start, len(tokens)):
+                node = node.get(tokens[end])
+                if node is None:
+                    break
+                if self._END in node:
+                    matches.append((start, end + 1, node[self._END]))
+        # Longest phrases win: "ip address" is IPAddress, not also Address
+        categories = []
+        matched = set()  # token positions covered by a matched phrase
+        for start, end, found in matches:
+            if any(s <= start and end <= e and (e - s) > (end - start) for s, e, _ in matches):
+                continue
+            matched.update(range(start, end))
+            for category in sorted(found):
+                if category not in categories:
+                    categories.append(category)
+        return categories, matched
+
+    def classify(self, column_name: str) -> Optional[Dict]:
+        tokens = tokenize_column_name(column_name or "")
+        if not tokens:
+            return None
+        categories, matched = self._match(tokens)
+        if categories:
+            if any(token in self.modifier_tokens for position, token in enumerate(tokens) if position not in matched):
+                return None
+            return {"pii_detected": True, "pii_types": categories, "source": RULES_SOURCE}
+        if all(token in self.non_pii_tokens or token.isdigit() for token in tokens):
+            return {"pii_detected": False, "pii_types": [], "source": RULES_SOURCE}
+        return None
+
+    def classify_many(self, column_names: List[str]) -> List[Optional[Dict]]:
+        return [self.classify(name) for name in column_names]
+
+
+def _load_rules_file(path: str) -> Dict:
+    # {"default": {"pii": {"Category": ["phrase", ...]}, "non_pii": [...], "modifiers": [...]}, "<data_source_type>": {...}}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except Exception as e:
+        logger.error('FN:_load_rules_file path:{} error:{}'.format(path, str(e)))
+        return {}
+
+
+def _merge_rules(pii_phrases: Dict[str, List[str]], non_pii_tokens: List[str], modifier_tokens: List[str],
+                 rules: Optional[Dict]) -> Tuple[Dict[str, List[str]], List[str], List[str]]:
+    if not rules:
+        return pii_phrases, non_pii_tokens, modifier_tokens
+    merged = {category: list(phrases) for category, phrases in pii_phrases.items()}
+    for category, phrases in (rules.get("pii") or {}).items():
+        merged.setdefault(category, []).extend(phrases)
+    return (merged, list(non_pii_tokens) + list(rules.get("non_pii") or []),
+            list(modifier_tokens) + list(rules.get("modifiers") or []))
+
+
+_classifiers: Dict[str, PIIRuleClassifier] = {}
+_classifiers_lock = threading.Lock()
+
+
+def get_rule_classifier(data_source_type: Optional[str] = None) -> Optional[PIIRuleClassifier]:
+    """Compiled classifier for a data_source_type (built once per process); None when rules are disabled."""
+    if os.getenv("PII_RULES_ENABLED", "true").lower() != "true":
+        return None
+    key = data_source_type or "default"
+    classifier = _classifiers.get(key)
+    if classifier is None:
+        with _classifiers_lock:
+            classifier = _classifiers.get(key)
+            if classifier is None:
+                custom = _load_rules_file(os.environ["PII_RULES_FILE"]) if os.getenv("PII_RULES_FILE") else {}
+                rules = DEFAULT_PII_PHRASES, DEFAULT_NON_PII_TOKENS, DEFAULT_MODIFIER_TOKENS
+                rules = _merge_rules(*rules, custom.get("default"))
+                if data_source_type:
+                    rules = _merge_rules(*rules, DEFAULT_SOURCE_RULES.get(data_source_type))
+                    rules = _merge_rules(*rules, custom.get(data_source_type))
+                classifier = PIIRuleClassifier(*rules)
+                _classifiers[key] = classifier
+    return classifier
@@ -0,0 +1,149 @@
+import hashlib
+import logging
+from typing import Dict, Optional
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.deduplication import get_db_connection, retry_db_operation
+
+logger = logging.getLogger(__name__)
+
+
+def get_scope_key(account_name: str, container_name: str, folder_path: str, storage_type: str = "azure_blob") -> str:
+    # Fixed-width key for one listing scope; folder paths can be longer than an index prefix allows
+    scope = "\0".join([storage_type, account_name, container_name, folder_path or ""])
+    return hashlib.sha256(scope.encode("utf-8")).hexdigest()
+
+
+@retry_db_operation(max_retries=None, base_delay=1.0, max_delay=60.0, max_total_time=3600.0)
+def load_checkpoint(account_name: str, container_name: str, folder_path: str) -> Optional[Dict]:
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT continuation_token, batch_id, run_id, status, pages_completed, blobs_listed,
+                       walk_started_at, min_failed_last_modified, max_seen_last_modified, max_seen_etag,
+                       completed_at, updated_at
+                FROM discovery_scan_checkpoint
+                WHERE scope_key = %s
+            """, (get_scope_key(account_name, container_name, folder_path),))
+            return cursor.fetchone()
+    except Exception as e:
+        logger.error('FN:load_checkpoint account_name:{} container_name:{} folder_path:{} error:{}'.format(account_name, container_name, folder_path, str(e)))
+        raise
+    finally:
+        if conn:
+            conn.close()
+
+
+@retry_db_operation(max_retries=None, base_delay=1.0, max_delay=60.0, max_total_time=3600.0)
+def save_checkpoint(account_name: str, container_name: str, folder_path: str, continuation_token: Optional[str],
+                    batch_id: str, run_id: str, pages_completed: int, blobs_listed: int, scan_state: Optional[Dict] = None):
+    """
+    Record the continuation token of the next page to list. Call it only after the
+    writes for every page before that token have been committed. scan_state is the
+    incremental filter's IncrementalScanFilter.checkpoint_state(), restored on resume.
+    """
+    scan_state = scan_state or {}
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO discovery_scan_checkpoint (
+                    scope_key, storage_type, account_name, container_name, folder_path,
+                    continuation_token, batch_id, run_id, status, pages_completed, blobs_listed,
+                    walk_started_at, min_failed_last_modified, max_seen_last_modified, max_seen_etag
+                ) VALUES (
+                    %s, 'azure_blob', %s, %s, %s,
+                    %s, %s, %s, 'in_progress', %s, %s,
+                    UTC_TIMESTAMP(), %s, %s, %s
+                ) AS new
+                ON DUPLICATE KEY UPDATE
+                    walk_started_at = IF(status = 'in_progress', walk_started_at, UTC_TIMESTAMP()),
+                    completed_at = IF(status = 'in_progress', completed_at, NULL),
+                    continuation_token = new.continuation_token,
+                    batch_id = new.batch_id,
+                    run_id = new.run_id,
+                    status = 'in_progress',
+                    pages_completed = new.pages_completed,
+                    blobs_listed = new.blobs_listed,
+                    min_failed_last_modified = new.min_failed_last_modified,
+                    max_seen_last_modified = new.max_seen_last_modified,
+                    max_seen_etag = new.max_seen_etag
+            """, (
+                get_scope_key(account_name, container_name, folder_path),
+                account_name, container_name, folder_path or "",
+                continuation_token, batch_id, run_id, pages_completed, blobs_listed,
+                scan_state.get("min_failed_last_modified"), scan_state.get("max_seen_last_modified"), scan_state.get("max_seen_etag"),
+            ))
+            conn.commit()
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        logger.error('FN:save_checkpoint account_name:{} container_name:{} folder_path:{} error:{}'.format(account_name, container_name, folder_path, str(e)))
+        raise
+    finally:
+        if conn:
+            conn.close()
+
+
+@retry_db_operation(max_retries=None, base_delay=1.0, max_delay=60.0, max_total_time=3600.0)
+def complete_checkpoint(account_name: str, container_name: str, folder_path: str, batch_id: str, run_id: str,
+                        pages_completed: int, blobs_listed: int):
+    # Walk finished: the next run starts a fresh listing
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO discovery_scan_checkpoint (
+                    scope_key, storage_type, account_name, container_name, folder_path,
+                    continuation_token, batch_id, run_id, status, pages_completed, blobs_listed,
+                    walk_started_at, completed_at
+                ) VALUES (
+                    %s, 'azure_blob', %s, %s, %s,
+                    NULL, %s, %s, 'completed', %s, %s,
+                    UTC_TIMESTAMP(), UTC_TIMESTAMP()
+                ) AS new
+                ON DUPLICATE KEY UPDATE
+                    continuation_token = NULL,
+                    batch_id = new.batch_id,
+                    run_id = new.run_id,
+                    status = 'completed',
+                    pages_completed = new.pages_completed,
+                    blobs_listed = new.blobs_listed,
+                    min_failed_last_modified = NULL,
+                    max_seen_last_modified = NULL,
+                    max_seen_etag = NULL,
+                    completed_at = UTC_TIMESTAMP()
+            """, (
+                get_scope_key(account_name, container_name, folder_path),
+                account_name, container_name, folder_path or "",
+                batch_id, run_id, pages_completed, blobs_listed,
+            ))
+            conn.commit()
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        logger.error('FN:complete_checkpoint account_name:{} container_name:{} folder_path:{} error:{}'.format(account_name, container_name, folder_path, str(e)))
+        raise
+    finally:
+        if conn:
+            conn.close()
+
+
+def get_resume_token(account_name: str, container_name: str, folder_path: str, full_rescan: bool = False) -> Optional[Dict]:
+    """
+    Return the in-progress checkpoint to resume from, or None to start a fresh walk.
+    A full re-walk of an interrupted listing only happens when explicitly requested.
+    """
+    checkpoint = load_checkpoint(account_name, container_name, folder_path)
+    if not checkpoint or checkpoint.get("status") != "in_progress" or not checkpoint.get("continuation_token"):
+        return None
+    if full_rescan:
+        logger.info('FN:get_resume_token account_name:{} container_name:{} folder_path:{} discarded_batch_id:{} full_rescan:{}'.format(account_name, container_name, folder_path, checkpoint.get("batch_id"), full_rescan))
+        return None
+    return checkpoint
@@ -0,0 +1,195 @@
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config.azure_config import DISCOVERY_CONFIG
+from utils.deduplication import get_db_connection, retry_db_operation
+from utils.scan_checkpoint import get_scope_key
+
+logger = logging.getLogger(__name__)
+
+
+def _as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    # MySQL DATETIME columns come back naive; everything here is stored as UTC
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def _to_db(value: Optional[datetime]) -> Optional[datetime]:
+    if value is None:
+        return None
+    return _as_utc(value).replace(tzinfo=None)
+
+
+@retry_db_operation(max_retries=None, base_delay=1.0, max_delay=60.0, max_total_time=3600.0)
+def load_watermark(account_name: str, container_name: str, folder_path: str) -> Optional[Dict]:
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT watermark_last_modified, watermark_etag, last_full_scan_at
+                FROM discovery_scan_watermark
+                WHERE scope_key = %s
+            """, (get_scope_key(account_name, container_name, folder_path),))
+            return cursor.fetchone()
+    except Exception as e:
+        logger.error('FN:load_watermark account_name:{} container_name:{} folder_path:{} error:{}'.format(account_name, container_name, folder_path, str(e)))
+        raise
+    finally:
+        if conn:
+            conn.close()
+
+
+@retry_db_operation(max_retries=None, base_delay=1.0, max_delay=60.0, max_total_time=3600.0)
+def save_watermark(account_name: str, container_name: str, folder_path: str, last_modified: Optional[datetime],
+                   etag: Optional[str], full_scan: bool):
+    conn = None
+    try:
+        conn = get_db_connection()
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO discovery_scan_watermark (
+                    scope_key, storage_type, account_name, container_name, folder_path,
+                    watermark_last_modified, watermark_etag, last_full_scan_at
+                ) VALUES (
+                    %s, 'azure_blob', %s, %s, %s,
+                    %s, %s, IF(%s, UTC_TIMESTAMP(), NULL)
+                ) AS new
+                ON DUPLICATE KEY UPDATE
+                    watermark_last_modified = new.watermark_last_modified,
+                    watermark_etag = new.watermark_etag,
+                    last_full_scan_at = IF(%s, UTC_TIMESTAMP(), last_full_scan_at)
+            """, (
+                get_scope_key(account_name, container_name, folder_path),
+                account_name, container_name, folder_path or "",
+                _to_db(last_modified), etag, full_scan, full_scan,
+            ))
+            conn.commit()
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        logger.error('FN:save_watermark account_name:{} container_name:{} folder_path:{} error:{}'.format(account_name, container_name, folder_path, str(e)))
+        raise
+    finally:
+        if conn:
+            conn.close()
+
+
+class IncrementalScanFilter:
+    """
+    Decides which listed blobs need sampling/extraction in an incremental walk.
+    Blobs at or below the stored last_modified watermark (same ETag) are skipped
+    outright; a full reconciliation pass processes everything.
+
+    The next watermark is capped at the walk start time minus a clock-skew margin,
+    so blobs modified while the walk was in progress are picked up by the next run,
+    and it never moves past a blob whose processing failed. That state is saved with
+    each listing checkpoint (checkpoint_state) and restored when a walk resumes.
+
+    Grouped datasets (Delta tables, partitioned folders) are always candidates: their
+    last_modified is the newest member's, which does not move when files are removed.
+    The dataset fingerprint comparison that follows still skips unchanged ones.
+    """
+
+    def __init__(self, watermark: Optional[Dict], full_pass: bool, walk_started_at: datetime, resume_state: Optional[Dict] = None):
+        watermark = watermark or {}
+        resume_state = resume_state or {}
+        self.full_pass = full_pass
+        self.walk_started_at = _as_utc(walk_started_at)
+        self.watermark_last_modified = _as_utc(watermark.get("watermark_last_modified"))
+        self.watermark_etag = watermark.get("watermark_etag")
+        self._max_seen: Optional[Tuple[datetime, str]] = None
+        if resume_state.get("max_seen_last_modified") is not None:
+            self._max_seen = (_as_utc(resume_state["max_seen_last_modified"]), resume_state.get("max_seen_etag") or "")
+        self._min_failed: Optional[datetime] = _as_utc(resume_state.get("min_failed_last_modified"))
+        self.candidates = 0
+        self.skipped = 0
+
+    def is_candidate(self, blob_info: Dict) -> bool:
+        last_modified = _as_utc(blob_info.get("last_modified"))
+        etag = (blob_info.get("etag") or "").strip('"')
+        if last_modified is not None and (self._max_seen is None or last_modified > self._max_seen[0]):
+            self._max_seen = (last_modified, etag)
+
+        if self.full_pass or self.watermark_last_modified is None or last_modified is None:
+            candidate = True
+        elif blob_info.get("dataset_format") or blob_info.get("partitioning") is not None:
+            candidate = True
+        elif last_modified > self.watermark_last_modified:
+            candidate = True
+        else:
+            candidate = last_modified == self.watermark_last_modified and etag != self.watermark_etag
+
+        if candidate:
+            self.candidates += 1
+        else:
+            self.skipped += 1
+        return candidate
+
+    def mark_failed(self, blob_info: Dict):
+        last_modified = _as_utc(blob_info.get("last_modified"))
+        if last_modified is not None and (self._min_failed is None or last_modified < self._min_failed):
+            self._min_failed = last_modified
+
+    def checkpoint_state(self) -> Dict:
+        # Columns of discovery_scan_checkpoint, as naive UTC
+        return {
+            "min_failed_last_modified": _to_db(self._min_failed),
+            "max_seen_last_modified": _to_db(self._max_seen[0]) if self._max_seen else None,
+            "max_seen_etag": self._max_seen[1] if self._max_seen else None,
+        }
+
+    def next_watermark(self) -> Tuple[Optional[datetime], Optional[str]]:
+        skew = timedelta(seconds=DISCOVERY_CONFIG.get("watermark_skew_seconds", 300))
+        last_modified, etag = self.watermark_last_modified, self.watermark_etag
+        if self._max_seen is not None:
+            candidate, candidate_etag = self._max_seen
+            cap = self.walk_started_at - skew
+            if candidate > cap:
+                candidate, candidate_etag = cap, None
+            if self._min_failed is not None and candidate >= self._min_failed:
+                # Keep the failed blob above the watermark so the next run retries it
+                candidate, candidate_etag = self._min_failed - timedelta(microseconds=1), None
+            if last_modified is None or candidate > last_modified or self.full_pass:
+                last_modified, etag = candidate, candidate_etag
+        return last_modified, etag
+
+
+def start_incremental_scan(account_name: str, container_name: str, folder_path: str,
+                           walk_started_at: datetime, full_rescan: bool = False,
+                           checkpoint: Optional[Dict] = None) -> IncrementalScanFilter:
+    """
+    Load the prefix watermark and decide between an incremental walk and a full
+    reconciliation pass (scan_mode=full, explicit full_rescan, no watermark yet, or
+    the last full pass is older than full_reconcile_hours). checkpoint is the listing
+    checkpoint being resumed, if any; its saved filter state is restored.
+    """
+    watermark = load_watermark(account_name, container_name, folder_path)
+    reconcile_after = timedelta(hours=DISCOVERY_CONFIG.get("full_reconcile_hours", 24))
+    last_full_scan_at = _as_utc(watermark.get("last_full_scan_at")) if watermark else None
+
+    full_pass = (
+        DISCOVERY_CONFIG.get("scan_mode", "incremental") != "incremental"
+        or full_rescan
+        or last_full_scan_at is None
+        or datetime.now(timezone.utc) - last_full_scan_at >= reconcile_after
+    )
+    logger.info('FN:start_incremental_scan account_name:{} container_name:{} folder_path:{} full_pass:{} watermark:{} last_full_scan_at:{}'.format(
+        account_name, container_name, folder_path, full_pass,
+        watermark.get("watermark_last_modified") if watermark else None, last_full_scan_at))
+    return IncrementalScanFilter(watermark, full_pass, walk_started_at, resume_state=checkpoint)
+
+
+def finish_incremental_scan(account_name: str, container_name: str, folder_path: str, scan_filter: IncrementalScanFilter):
+    # Only called once the whole prefix has been walked and its writes committed
+    last_modified, etag = scan_filter.next_watermark()
+    save_watermark(account_name, container_name, folder_path, last_modified, etag, scan_filter.full_pass)
+    logger.info('FN:finish_incremental_scan account_name:{} container_name:{} folder_path:{} full_pass:{} candidates:{} skipped:{} watermark:{}'.format(
+        account_name, container_name, folder_path, scan_filter.full_pass, scan_filter.candidates, scan_filter.skipped, last_modified))
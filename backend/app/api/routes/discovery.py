@@ -1,11 +1,16 @@
 from flask import Blueprint, request, jsonify
 from app.services.discovery_service import DiscoveryService
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 
 discovery_bp = Blueprint('discovery', __name__, url_prefix='/api/discovery')
 
+# Outcome of the latest manual trigger in this process, reported by GET /trigger
+_last_trigger = {'status': 'idle'}
+_last_trigger_lock = threading.Lock()
+
 
 @discovery_bp.route('', methods=['GET'])
 def get_discoveries():
@@ -157,7 +162,6 @@ def trigger_discovery():
     try:
         import os
         import sys
-        import threading
         
         # Get the project root directory (parent of backend)
         project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -171,21 +175,31 @@ def trigger_discovery():
         from dotenv import load_dotenv
         load_dotenv(os.path.join(airflow_path, '.env'))
         
-        from config.azure_config import AZURE_STORAGE_ACCOUNTS, DB_CONFIG, get_storage_location_json
+        from config.azure_config import AZURE_STORAGE_ACCOUNTS, DISCOVERY_CONFIG
         from utils.azure_blob_client import AzureBlobClient
-        from utils.metadata_extractor import extract_file_metadata, generate_file_hash, generate_schema_hash
-        from utils.deduplication import check_file_exists, should_update_or_insert
-        import pymysql
-        import json
+        from utils.deduplication import DedupIndex
+        from utils.discovery_pipeline import (
+            DeltaTableGrouper,
+            PartitionedDatasetGrouper,
+            build_discovery_info,
+            prefetch_in_chunks,
+            prepare_blob,
+            queue_discovery_write,
+        )
+        from utils.discovery_writer import DiscoveryBatchWriter
         from datetime import datetime
         
+        batch_start_time = datetime.utcnow()
+        discovery_batch_id = f"batch_{int(batch_start_time.timestamp())}"
+        run_id = f"manual_{int(batch_start_time.timestamp())}"
+        
         def run_discovery():
             """Run discovery in background thread"""
+            all_new_discoveries = []
+            # Blobs that could not be sampled and rows the writer gave up on: neither was written
+            failed = []
             try:
-                batch_start_time = datetime.utcnow()
-                discovery_batch_id = f"batch_{int(batch_start_time.timestamp())}"
-                run_id = f"manual_{int(batch_start_time.timestamp())}"
-                all_new_discoveries = []
+                writer = DiscoveryBatchWriter(created_by='api_trigger')
                 
                 for storage_config in AZURE_STORAGE_ACCOUNTS:
                     account_name = storage_config["name"]
@@ -194,8 +208,6 @@ def trigger_discovery():
                     folders = storage_config.get("folders", [""])
                     if not folders or folders == [""]:
                         folders = [""]
-                    environment = storage_config.get("environment", "prod")
-                    env_type = storage_config.get("env_type", "production")
                     data_source_type = storage_config.get("data_source_type", "unknown")
                     file_extensions = storage_config.get("file_extensions")
                     
@@ -205,199 +217,40 @@ def trigger_discovery():
                         for container_name in containers:
                             for folder_path in folders:
                                 try:
-                                    blobs = blob_client.list_blobs(
+                                    # Loaded on first use: one streamed dedup query per prefix instead of one SELECT per blob
+                                    dedup_index = DedupIndex("azure_blob", account_name, container_name, folder_path)
+                                    discovery_info = build_discovery_info(discovery_batch_id, batch_start_time, "manual_trigger", "api_trigger",
+                                                                          run_id, container_name, folder_path)
+                                    
+                                    # Same grouping as the DAGs: one row per Delta table / partitioned dataset, not per part file
+                                    groupers = []
+                                    if DISCOVERY_CONFIG.get("group_delta_tables", True):
+                                        groupers.append(DeltaTableGrouper(blob_client, container_name))
+                                    if DISCOVERY_CONFIG.get("group_partitioned_datasets", True):
+                                        groupers.append(PartitionedDatasetGrouper())
+                                    
+                                    for page, next_token in blob_client.iter_blob_pages(
                                         container_name=container_name,
                                         folder_path=folder_path,
                                         file_extensions=file_extensions
-                                    )
-                                    
-                                    for blob_info in blobs:
-                                        try:
-                                            blob_path = blob_info["full_path"]
-                                            
-                                            # Check if exists
-                                            conn = pymysql.connect(
-                                                host=DB_CONFIG["host"],
-                                                port=DB_CONFIG["port"],
-                                                user=DB_CONFIG["user"],
-                                                password=DB_CONFIG["password"],
-                                                database=DB_CONFIG["database"],
-                                                cursorclass=pymysql.cursors.DictCursor
-                                            )
-                                            try:
-                                                with conn.cursor() as cursor:
-                                                    cursor.execute("""
-                                                        SELECT id, file_hash, schema_hash 
-                                                        FROM data_discovery 
-                                                        WHERE storage_type = %s 
-                                                        AND storage_identifier = %s 
-                                                        AND storage_path = %s
-                                                        LIMIT 1
-                                                    """, ("azure_blob", account_name, blob_path))
-                                                    existing_record = cursor.fetchone()
-                                            finally:
-                                                conn.close()
-                                            
-                                            # Generate file hash
-                                            file_size = blob_info.get("size", 0)
-                                            etag = blob_info.get("etag", "").strip('"')
-                                            last_modified = blob_info.get("last_modified")
-                                            composite_string = f"{etag}_{file_size}_{last_modified.isoformat() if last_modified else ''}"
-                                            file_hash = generate_file_hash(composite_string.encode('utf-8'))
-                                            
-                                            # Get file sample
-                                            file_sample = None
-                                            file_extension = blob_info["name"].split(".")[-1].lower() if "." in blob_info["name"] else ""
-                                            
+                                    ):
+                                        listed_through = page[-1]["full_path"] if page else None
+                                        for grouper in groupers:
+                                            page = grouper.group(page, listed_through)
+                                            if next_token is None:
+                                                page.extend(grouper.flush())
+                                        
+                                        for blob_info in prefetch_in_chunks(dedup_index, page):
                                             try:
-                                                if file_extension == "parquet":
-                                                    file_sample = blob_client.get_blob_tail(container_name, blob_path, max_bytes=8192)
-                                                else:
-                                                    file_sample = blob_client.get_blob_sample(container_name, blob_path, max_bytes=1024)
-                                            except Exception:
-                                                pass
-                                            
-                                            # Extract metadata
-                                            if file_sample:
-                                                metadata = extract_file_metadata(blob_info, file_sample)
-                                                schema_hash = metadata.get("schema_hash", generate_schema_hash({}))
-                                            else:
-                                                schema_hash = generate_schema_hash({})
-                                                metadata = {
-                                                    "file_metadata": {
-                                                        "basic": {
-                                                            "name": blob_info["name"],
-                                                            "extension": "." + blob_info["name"].split(".")[-1] if "." in blob_info["name"] else "",
-                                                            "format": file_extension,
-                                                            "size_bytes": file_size,
-                                                            "content_type": blob_info.get("content_type", "application/octet-stream"),
-                                                            "mime_type": blob_info.get("content_type", "application/octet-stream")
-                                                        },
-                                                        "hash": {
-                                                            "algorithm": "shake128_etag_composite",
-                                                            "value": file_hash,
-                                                            "computed_at": datetime.utcnow().isoformat() + "Z",
-                                                            "source": "etag_composite"
-                                                        },
-                                                        "timestamps": {
-                                                            "created_at": blob_info["created_at"].isoformat() if blob_info.get("created_at") else None,
-                                                            "last_modified": blob_info["last_modified"].isoformat() if blob_info.get("last_modified") else None
-                                                        }
-                                                    },
-                                                    "schema_json": {},
-                                                    "schema_hash": schema_hash,
-                                                    "file_hash": file_hash
-                                                }
-                                            
-                                            if "file_hash" not in metadata:
-                                                metadata["file_hash"] = file_hash
-                                            
-                                            file_metadata = metadata.get("file_metadata")
-                                            
-                                            should_update, schema_changed = should_update_or_insert(existing_record, file_hash, schema_hash)
-                                            
-                                            if not should_update and existing_record:
+                                                # Unchanged (same change fingerprint): no download, no write
+                                                prepared = prepare_blob(blob_client, dedup_index, container_name, blob_info, data_source_type)
+                                                action, written = queue_discovery_write(writer, prepared, storage_config, container_name, folder_path, discovery_info)
+                                                all_new_discoveries.extend(written)
+                                            except Exception as e:
+                                                logger.warning(f'FN:trigger_discovery blob error: {str(e)}')
+                                                failed.append({'container_name': container_name, 'storage_path': blob_info.get('full_path'),
+                                                               'error': str(e)})
                                                 continue
-                                            
-                                            storage_location = get_storage_location_json(
-                                                account_name=account_name,
-                                                container=container_name,
-                                                blob_path=blob_path
-                                            )
-                                            
-                                            discovery_info = {
-                                                "batch": {
-                                                    "id": discovery_batch_id,
-                                                    "started_at": batch_start_time.isoformat() + "Z"
-                                                },
-                                                "source": {
-                                                    "type": "manual_trigger",
-                                                    "name": "api_trigger",
-                                                    "run_id": run_id
-                                                },
-                                                "scan": {
-                                                    "container": container_name,
-                                                    "folder": folder_path
-                                                }
-                                            }
-                                            
-                                            # Insert/Update database
-                                            conn = pymysql.connect(
-                                                host=DB_CONFIG["host"],
-                                                port=DB_CONFIG["port"],
-                                                user=DB_CONFIG["user"],
-                                                password=DB_CONFIG["password"],
-                                                database=DB_CONFIG["database"],
-                                                cursorclass=pymysql.cursors.DictCursor
-                                            )
-                                            try:
-                                                with conn.cursor() as cursor:
-                                                    if existing_record:
-                                                        if schema_changed:
-                                                            cursor.execute("""
-                                                                UPDATE data_discovery
-                                                                SET file_metadata = %s,
-                                                                    schema_json = %s,
-                                                                    schema_hash = %s,
-                                                                    storage_metadata = %s,
-                                                                    discovery_info = %s,
-                                                                    last_checked_at = NOW(),
-                                                                    updated_at = NOW()
-                                                                WHERE id = %s
-                                                            """, (
-                                                                json.dumps(file_metadata),
-                                                                json.dumps(metadata.get("schema_json", {})),
-                                                                schema_hash,
-                                                                json.dumps(metadata.get("storage_metadata", {})),
-                                                                json.dumps(discovery_info),
-                                                                existing_record["id"]
-                                                            ))
-                                                        else:
-                                                            cursor.execute("""
-                                                                UPDATE data_discovery
-                                                                SET last_checked_at = NOW()
-                                                                WHERE id = %s
-                                                            """, (existing_record["id"],))
-                                                    else:
-                                                        cursor.execute("""
-                                                            INSERT INTO data_discovery (
-                                                                storage_location, file_metadata, schema_json, schema_hash,
-                                                                discovered_at, status, approval_status, is_visible, is_active,
-                                                                environment, env_type, data_source_type, folder_path,
-                                                                storage_metadata, storage_data_metadata, discovery_info,
-                                                                created_by
-                                                            ) VALUES (
-                                                                %s, %s, %s, %s,
-                                                                NOW(), 'pending', 'pending_review', TRUE, TRUE,
-                                                                %s, %s, %s, %s, %s, %s, %s, 'api_trigger'
-                                                            )
-                                                        """, (
-                                                            json.dumps(storage_location),
-                                                            json.dumps(file_metadata),
-                                                            json.dumps(metadata.get("schema_json", {})),
-                                                            schema_hash,
-                                                            environment,
-                                                            env_type,
-                                                            data_source_type,
-                                                            folder_path,
-                                                            json.dumps(metadata.get("storage_metadata", {})),
-                                                            json.dumps({}),
-                                                            json.dumps(discovery_info),
-                                                        ))
-                                                        discovery_id = cursor.lastrowid
-                                                        all_new_discoveries.append({
-                                                            "id": discovery_id,
-                                                            "file_name": file_metadata["basic"]["name"],
-                                                            "storage_path": blob_path,
-                                                        })
-                                                    
-                                                    conn.commit()
-                                            finally:
-                                                conn.close()
-                                        
-                                        except Exception as e:
-                                            logger.warning(f'FN:trigger_discovery blob error: {str(e)}')
-                                            continue
                                 
                                 except Exception as e:
                                     logger.warning(f'FN:trigger_discovery folder error: {str(e)}')
@@ -407,10 +260,32 @@ def trigger_discovery():
                         logger.warning(f'FN:trigger_discovery account error: {str(e)}')
                         continue
                 
-                logger.info(f'FN:trigger_discovery completed new_discoveries: {len(all_new_discoveries)}')
+                all_new_discoveries.extend(writer.flush())
+                for row in writer.take_failed():
+                    failed.append({'container_name': row.get('container_name'), 'storage_path': row.get('storage_path'),
+                                   'error': 'write failed'})
+                logger.info(f'FN:trigger_discovery completed new_discoveries: {len(all_new_discoveries)} failed: {len(failed)}')
+                status = 'completed'
                 
             except Exception as e:
                 logger.error(f'FN:trigger_discovery thread error: {str(e)}')
+                status = 'error'
+            
+            with _last_trigger_lock:
+                _last_trigger.clear()
+                _last_trigger.update({
+                    'run_id': run_id,
+                    'status': status,
+                    'started_at': batch_start_time.isoformat() + 'Z',
+                    'completed_at': datetime.utcnow().isoformat() + 'Z',
+                    'new_discoveries': len(all_new_discoveries),
+                    'failed': len(failed),
+                    'failed_rows': failed
+                })
+        
+        with _last_trigger_lock:
+            _last_trigger.clear()
+            _last_trigger.update({'run_id': run_id, 'status': 'running', 'started_at': batch_start_time.isoformat() + 'Z'})
         
         # Run discovery in background thread
         thread = threading.Thread(target=run_discovery, daemon=True)
@@ -418,9 +293,20 @@ def trigger_discovery():
         
         return jsonify({
             'message': 'Discovery triggered successfully',
-            'status': 'running'
+            'status': 'running',
+            'run_id': run_id
         }), 202  # 202 Accepted - request accepted but processing not complete
         
     except Exception as e:
         logger.error('FN:trigger_discovery error:{}'.format(str(e)))
         return jsonify({'error': str(e)}), 500
+
+
+@discovery_bp.route('/trigger', methods=['GET'])
+def get_trigger_status():
+    """
+    Status of the latest manual discovery run, including the blobs and rows that
+    failed (not written; the next run retries them)
+    """
+    with _last_trigger_lock:
+        return jsonify(dict(_last_trigger)), 200
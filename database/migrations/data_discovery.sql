@@ -12,8 +12,16 @@ CREATE TABLE IF NOT EXISTS data_discovery (
             JSON_UNQUOTE(JSON_EXTRACT(storage_location, '$.identifier'))
         )
     ) STORED,
+    storage_container VARCHAR(255) GENERATED ALWAYS AS (JSON_UNQUOTE(JSON_EXTRACT(storage_location, '$.container.name'))) STORED,
+    -- SHA-256 of storage_type, storage_identifier, storage_container and storage_path joined by NUL
+    -- (utils.deduplication.storage_location_hash); the same path in two containers is two rows
+    storage_location_hash CHAR(64) GENERATED ALWAYS AS (
+        SHA2(CONCAT_WS(CHAR(0 USING utf8mb4), COALESCE(storage_type, ''), COALESCE(storage_identifier, ''),
+                       COALESCE(storage_container, ''), COALESCE(storage_path, '')), 256)
+    ) STORED,
     
     INDEX idx_storage_location (storage_type, storage_identifier, storage_path(200)),
+    UNIQUE INDEX uq_storage_location_hash (storage_location_hash),
     
     file_metadata JSON NOT NULL,
     
@@ -25,6 +33,11 @@ CREATE TABLE IF NOT EXISTS data_discovery (
     schema_json JSON,
     schema_hash VARCHAR(64) NOT NULL,
     schema_version VARCHAR(50),
+    -- TRUE while any column has pii_source "unclassified" (no classifier answered when the row was
+    -- written); DedupIndex loads it so such rows are sampled again once a DLP endpoint is configured
+    has_unclassified_columns BOOLEAN GENERATED ALWAYS AS (
+        COALESCE(JSON_CONTAINS(JSON_EXTRACT(schema_json, '$.columns[*].pii_source'), '"unclassified"'), FALSE)
+    ) STORED,
     
     discovered_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
     last_checked_at DATETIME,
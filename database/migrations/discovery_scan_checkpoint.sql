@@ -0,0 +1,36 @@
+CREATE TABLE IF NOT EXISTS discovery_scan_checkpoint (
+    id BIGINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+    
+    -- SHA-256 of (storage_type, account_name, container_name, folder_path), computed by the DAG
+    scope_key CHAR(64) NOT NULL,
+    storage_type VARCHAR(50) NOT NULL,
+    account_name VARCHAR(255) NOT NULL,
+    container_name VARCHAR(255) NOT NULL,
+    folder_path VARCHAR(1000) NOT NULL DEFAULT '',
+    
+    -- Listing continuation token of the next page to process (NULL = start from the beginning)
+    continuation_token TEXT,
+    batch_id VARCHAR(100),
+    run_id VARCHAR(250),
+    status VARCHAR(20) NOT NULL DEFAULT 'in_progress',
+    pages_completed INT NOT NULL DEFAULT 0,
+    blobs_listed BIGINT NOT NULL DEFAULT 0,
+    
+    walk_started_at DATETIME,  -- UTC, comparable with blob last_modified
+    
+    -- Incremental scan filter state of the in-progress walk (UTC), so a resumed walk keeps
+    -- the watermark below blobs that failed before the checkpoint
+    min_failed_last_modified DATETIME(6),
+    max_seen_last_modified DATETIME(6),
+    max_seen_etag VARCHAR(255),
+    
+    completed_at DATETIME,
+    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    
+    UNIQUE INDEX uq_scope_key (scope_key),
+    INDEX idx_status (status),
+    
+    CONSTRAINT chk_checkpoint_status CHECK (status IN ('in_progress', 'completed'))
+    
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
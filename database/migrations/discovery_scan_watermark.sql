@@ -0,0 +1,21 @@
+CREATE TABLE IF NOT EXISTS discovery_scan_watermark (
+    id BIGINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+    
+    -- SHA-256 of (storage_type, account_name, container_name, folder_path), same key as discovery_scan_checkpoint
+    scope_key CHAR(64) NOT NULL,
+    storage_type VARCHAR(50) NOT NULL,
+    account_name VARCHAR(255) NOT NULL,
+    container_name VARCHAR(255) NOT NULL,
+    folder_path VARCHAR(1000) NOT NULL DEFAULT '',
+    
+    -- Every blob under the prefix with last_modified <= watermark has been processed at its current version (UTC)
+    watermark_last_modified DATETIME(6),
+    watermark_etag VARCHAR(255),
+    last_full_scan_at DATETIME,
+    
+    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    
+    UNIQUE INDEX uq_scope_key (scope_key)
+    
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
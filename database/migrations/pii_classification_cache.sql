@@ -0,0 +1,21 @@
+CREATE TABLE IF NOT EXISTS pii_classification_cache (
+    id BIGINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+    
+    -- SHA-256 of (normalized column name, language, model version)
+    cache_key CHAR(64) NOT NULL,
+    column_name VARCHAR(512) NOT NULL,
+    language VARCHAR(16) NOT NULL,
+    model_version VARCHAR(64) NOT NULL,
+    
+    pii_detected BOOLEAN NOT NULL DEFAULT FALSE,
+    pii_types JSON,
+    
+    -- UTC; rows past expires_at are ignored and purged
+    expires_at DATETIME NOT NULL,
+    created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    
+    UNIQUE INDEX uq_cache_key (cache_key),
+    INDEX idx_expires_at (expires_at)
+    
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
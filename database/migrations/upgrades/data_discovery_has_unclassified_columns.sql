@@ -0,0 +1,9 @@
+-- Upgrade for data_discovery tables created before has_unclassified_columns existed.
+-- New installs get the column from data_discovery.sql; the docker init does not run this directory.
+-- Rows written during a DLP outage are flagged as soon as the column is added, so the next
+-- scan with a DLP endpoint configured samples and classifies them again.
+
+ALTER TABLE data_discovery
+    ADD COLUMN has_unclassified_columns BOOLEAN GENERATED ALWAYS AS (
+        COALESCE(JSON_CONTAINS(JSON_EXTRACT(schema_json, '$.columns[*].pii_source'), '"unclassified"'), FALSE)
+    ) STORED AFTER schema_version;
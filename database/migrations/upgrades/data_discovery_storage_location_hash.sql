@@ -0,0 +1,26 @@
+-- Upgrade for data_discovery tables created before storage_location_hash existed.
+-- New installs get the columns from data_discovery.sql; the docker init does not run this directory.
+-- Adds the container column and the fixed-width location key (type, account, container, path),
+-- removes duplicate rows for the same location in the same container (the newest row wins, as
+-- the writer already assumed), then makes the key UNIQUE. Rows that share a path but live in
+-- different containers have different keys and are all kept.
+
+ALTER TABLE data_discovery
+    ADD COLUMN storage_container VARCHAR(255) GENERATED ALWAYS AS (
+        JSON_UNQUOTE(JSON_EXTRACT(storage_location, '$.container.name'))
+    ) STORED AFTER storage_identifier,
+    ADD COLUMN storage_location_hash CHAR(64) GENERATED ALWAYS AS (
+        SHA2(CONCAT_WS(CHAR(0 USING utf8mb4), COALESCE(storage_type, ''), COALESCE(storage_identifier, ''),
+                       COALESCE(storage_container, ''), COALESCE(storage_path, '')), 256)
+    ) STORED AFTER storage_container,
+    ADD INDEX idx_storage_location_hash (storage_location_hash);
+
+DELETE older
+FROM data_discovery older
+JOIN data_discovery newer
+  ON newer.storage_location_hash = older.storage_location_hash
+ AND newer.id > older.id;
+
+ALTER TABLE data_discovery
+    DROP INDEX idx_storage_location_hash,
+    ADD UNIQUE INDEX uq_storage_location_hash (storage_location_hash);